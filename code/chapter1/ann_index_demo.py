@@ -0,0 +1,409 @@
+# 近似最近邻（ANN）索引示例：IVF-PQ（基于 NumPy）
+# 当检索版 search 工具的文档块达到百万级时，逐条计算余弦相似度（rag_search_demo.py 中的暴力检索）会变慢。
+# 本示例实现一个 IVF-PQ 索引：
+# - IVF：先用 k-means 把向量分到 nlist 个桶，查询时只扫描离查询最近的 nprobe 个桶
+# - PQ：把每个向量的残差切成 m 段，每段用 1 字节码本编号表示（64维 float32 的 256 字节 -> 16 字节）
+# - rerank：对 PQ 粗排的候选用原始向量精排，进一步提高召回
+# 索引可以保存到磁盘并以内存映射方式打开，支持并发查询和增量插入。
+# 最后的基准测试在合成的 100 万条向量上比较召回率、QPS 和内存，与精确检索对照
+
+# 导入必要的库
+from concurrent.futures import ThreadPoolExecutor  # 用于并发查询
+from pathlib import Path  # 用于索引文件路径
+from typing import NamedTuple  # 用于定义索引快照
+import json  # 用于读写索引元数据
+import numpy as np  # 用于向量计算
+import os  # 用于访问环境变量和替换文件
+import re  # 用于识别旧版本的索引文件
+import shutil  # 用于清理临时目录
+import tempfile  # 用于创建临时目录
+import threading  # 用于保护增量插入
+import time  # 用于计时
+
+try:
+    import resource  # 用于统计进程内存（仅 Unix）
+except ImportError:
+    resource = None
+
+# 保存到磁盘的数组
+ARRAYS = ("centroids", "codebooks", "offsets", "ids", "codes", "raw")
+
+
+def _array_file(path: Path, name: str, generation: int) -> Path:
+    """某一代索引中数组的文件路径（第 0 代为早期不带代号的 name.npy）"""
+    return path / (f"{name}.{generation}.npy" if generation else f"{name}.npy")
+
+
+def nearest_centroids(data: np.ndarray, centroids: np.ndarray, chunk: int = 32768) -> np.ndarray:
+    """
+    分块计算每个向量最近的中心（L2距离）
+
+    参数：
+    - data: 形状为 (n, d) 的向量
+    - centroids: 形状为 (k, d) 的中心
+    - chunk: 每次处理的向量数，控制临时内存
+
+    返回值：
+    - np.ndarray类型，形状为 (n,) 的中心编号
+    """
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    result = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        block = np.asarray(data[start:start + chunk], dtype=np.float32)
+        # |x - c|^2 = |x|^2 - 2x·c + |c|^2，|x|^2 对比较无影响
+        result[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return result
+
+
+def kmeans(data: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    简单的 k-means（Lloyd 算法），空簇用随机样本重新初始化
+
+    返回值：
+    - np.ndarray类型，形状为 (k, d) 的中心
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = nearest_centroids(data, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+class Segments(NamedTuple):
+    """索引数据的不可变快照：查询读取一个快照，插入和合并时整体替换"""
+    offsets: np.ndarray  # 主段桶边界：offsets[c]:offsets[c+1] 是第 c 个桶的范围
+    ids: np.ndarray  # 主段向量ID（按桶排序）
+    codes: np.ndarray  # 主段 PQ 编码（按桶排序）
+    raw: np.ndarray  # 主段原始向量（按ID存放），用于精排
+    delta: dict  # 增量段：桶编号 -> (ids, codes)
+    delta_raw: np.ndarray  # 增量段原始向量（按ID存放，ID从 len(raw) 开始）
+
+
+class IVFPQIndex:
+    """
+    IVF-PQ 近似最近邻索引（L2距离；向量归一化后与余弦相似度排序一致）
+
+    数据分为两部分：
+    - 主段：按桶排序的 PQ 编码，保存到磁盘后可内存映射打开
+    - 增量段：保存后新插入的向量，按桶存放在内存中；compact() / save() 时合并进主段
+    查询只读取当前的 Segments 快照，写入方在锁内构造新快照后整体替换，因此查询无需加锁
+    """
+
+    def __init__(self, centroids: np.ndarray, codebooks: np.ndarray):
+        """
+        参数：
+        - centroids: 形状为 (nlist, d) 的 IVF 中心
+        - codebooks: 形状为 (m, 256, d/m) 的 PQ 码本
+        """
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.nlist, self.dim = centroids.shape
+        self.m = codebooks.shape[0]
+        self.dsub = self.dim // self.m
+        self._codebooks_t = codebooks.transpose(0, 2, 1).copy()  # (m, dsub, 256)，用于批量计算距离表
+        self._codebook_norms = (codebooks ** 2).sum(axis=-1)  # (m, 256)
+        empty_raw = np.zeros((0, self.dim), dtype=np.float32)
+        self._segments = Segments(
+            np.zeros(self.nlist + 1, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros((0, self.m), dtype=np.uint8), empty_raw, {}, empty_raw,
+        )
+        self._lock = threading.Lock()  # 只用于串行化写入
+
+    @classmethod
+    def train(cls, sample: np.ndarray, nlist: int = 1024, m: int = 16, iters: int = 10) -> "IVFPQIndex":
+        """
+        在样本上训练 IVF 中心和 PQ 码本，返回空索引
+
+        参数：
+        - sample: 训练样本，建议为 nlist 的 30~100 倍
+        - nlist: 桶数量
+        - m: PQ 分段数，必须整除向量维度
+        - iters: k-means 迭代次数
+        """
+        sample = np.asarray(sample, dtype=np.float32)
+        d = sample.shape[1]
+        if d % m:
+            raise ValueError(f"向量维度 {d} 不能被 PQ 分段数 {m} 整除")
+        centroids = kmeans(sample, nlist, iters)
+        residuals = sample - centroids[nearest_centroids(sample, centroids)]
+        dsub = d // m
+        codebooks = np.stack([
+            kmeans(residuals[:, j * dsub:(j + 1) * dsub], 256, iters, seed=j) for j in range(m)
+        ])
+        return cls(centroids, codebooks)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: int = 1024, m: int = 16, sample_size: int = 65536) -> "IVFPQIndex":
+        """训练并加入全部向量（分块处理，适合内存映射的大数组）"""
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))])
+        index = cls.train(sample, nlist, m)
+        for start in range(0, len(vectors), 262144):
+            index.add(vectors[start:start + 262144])
+        index.compact()
+        return index
+
+    def _encode(self, vectors: np.ndarray, lists: np.ndarray) -> np.ndarray:
+        """计算残差的 PQ 编码"""
+        residuals = vectors - self.centroids[lists]
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = nearest_centroids(residuals[:, j * self.dsub:(j + 1) * self.dsub], self.codebooks[j])
+        return codes
+
+    def __len__(self) -> int:
+        return len(self._segments.raw) + len(self._segments.delta_raw)
+
+    def add(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        增量插入向量（插入后立即可查）
+
+        参数：
+        - vectors: 形状为 (n, d) 的向量
+
+        返回值：
+        - np.ndarray类型，新向量的ID
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        lists = nearest_centroids(vectors, self.centroids)
+        codes = self._encode(vectors, lists)  # 编码在锁外进行
+        order = np.argsort(lists, kind="stable")
+        bounds = np.searchsorted(lists[order], np.arange(self.nlist + 1))
+        with self._lock:
+            seg = self._segments
+            ids = np.arange(len(self), len(self) + len(vectors))
+            delta = dict(seg.delta)  # 只复制字典，旧快照中的数组保持不变
+            for c in np.flatnonzero(np.diff(bounds)):
+                rows = order[bounds[c]:bounds[c + 1]]
+                old_ids, old_codes = delta.get(c, (ids[:0], codes[:0]))
+                delta[c] = (np.concatenate([old_ids, ids[rows]]), np.concatenate([old_codes, codes[rows]]))
+            self._segments = seg._replace(delta=delta, delta_raw=np.concatenate([seg.delta_raw, vectors]))
+        return ids
+
+    def compact(self) -> None:
+        """把增量段合并进主段（按桶重新排序）"""
+        with self._lock:
+            seg = self._segments
+            lists = np.concatenate([np.repeat(np.arange(self.nlist), np.diff(seg.offsets))] + [
+                np.full(len(ids), c) for c, (ids, _) in seg.delta.items()
+            ])
+            order = np.argsort(lists, kind="stable")
+            self._segments = Segments(
+                offsets=np.searchsorted(lists[order], np.arange(self.nlist + 1)).astype(np.int64),
+                ids=np.concatenate([seg.ids] + [ids for ids, _ in seg.delta.values()])[order],
+                codes=np.concatenate([seg.codes] + [codes for _, codes in seg.delta.values()])[order],
+                raw=np.concatenate([seg.raw, seg.delta_raw]),
+                delta={},
+                delta_raw=seg.delta_raw[:0],
+            )
+
+    def save(self, path: Path) -> None:
+        """
+        合并增量段并保存到目录（每个数组一个 .npy 文件，可内存映射打开）
+
+        数组写入带新代号的文件（raw.2.npy 等），最后原子地替换 meta.json 切换到新的一代，再删除旧文件：
+        已经内存映射打开旧文件的读取方不受影响（文件不会被原地改写），任何时刻崩溃也不会混用两代数组
+        """
+        self.compact()
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta_file = path / "meta.json"
+        old = json.loads(meta_file.read_text()).get("generation", 0) if meta_file.exists() else None
+        generation = 1 if old is None else old + 1
+        seg = self._segments
+        arrays = {"centroids": self.centroids, "codebooks": self.codebooks, "offsets": seg.offsets,
+                  "ids": seg.ids, "codes": seg.codes, "raw": seg.raw}
+        for name, array in arrays.items():
+            np.save(_array_file(path, name, generation), array)
+        meta = {"format": "ivfpq-v1", "nlist": self.nlist, "m": self.m, "dim": self.dim, "generation": generation}
+        tmp = path / "meta.json.tmp"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, meta_file)
+        # 删除其他代的文件（包括之前中途崩溃留下的）；Windows 上仍被映射的文件删除失败时留到下次保存
+        pattern = re.compile(rf"({'|'.join(ARRAYS)})(\.\d+)?\.npy")
+        current = {_array_file(path, name, generation).name for name in ARRAYS}
+        for file in path.iterdir():
+            if pattern.fullmatch(file.name) and file.name not in current:
+                try:
+                    file.unlink()
+                except OSError:
+                    pass
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "IVFPQIndex":
+        """从目录加载索引；mmap=True 时大数组按需从磁盘读取，多进程可共享页缓存"""
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        if meta.get("format") != "ivfpq-v1":
+            raise ValueError(f"不支持的索引格式: {meta.get('format')}")
+        mode = "r" if mmap else None
+        generation = meta.get("generation", 0)
+
+        def load_array(name, mmap_mode=mode):
+            array = np.load(_array_file(path, name, generation), mmap_mode=mmap_mode)
+            # 转为普通 ndarray 视图（仍然映射同一块内存），避免 np.memmap 切片的额外开销
+            return array.view(np.ndarray) if isinstance(array, np.memmap) else array
+
+        index = cls(load_array("centroids", None), load_array("codebooks", None))
+        raw = load_array("raw")
+        index._segments = Segments(load_array("offsets", None), load_array("ids"), load_array("codes"), raw, {}, raw[:0])
+        return index
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int = 16, rerank: int = 0) -> tuple[np.ndarray, np.ndarray]:
+        """
+        近似检索
+
+        参数：
+        - query: 形状为 (d,) 的查询向量
+        - k: 返回结果数量
+        - nprobe: 扫描的桶数量（越大召回越高、越慢）
+        - rerank: 用原始向量精排的候选数量，0 表示不精排（越大召回越高、越慢）
+
+        返回值：
+        - (ids, distances)：按距离升序
+        """
+        query = np.asarray(query, dtype=np.float32)
+        seg = self._segments  # 读取快照，不受并发插入和合并影响
+        nprobe = min(nprobe, self.nlist)
+        probes = np.argpartition(((self.centroids - query) ** 2).sum(axis=1), nprobe - 1)[:nprobe]
+
+        # 每个桶的距离表：tables[p, j, c] = |残差的第j段 - 码本j的第c个中心|^2
+        # 展开为 |r|^2 - 2r·c + |c|^2，用矩阵乘法代替逐元素相减
+        residuals = (query - self.centroids[probes]).reshape(nprobe, self.m, 1, self.dsub)
+        tables = (residuals ** 2).sum(axis=-1) - 2 * (residuals @ self._codebooks_t)[:, :, 0] + self._codebook_norms
+
+        cand_ids, cand_codes, cand_probe = [], [], []
+        for p, c in enumerate(probes):
+            parts = [(seg.ids[seg.offsets[c]:seg.offsets[c + 1]], seg.codes[seg.offsets[c]:seg.offsets[c + 1]])]
+            if c in seg.delta:
+                parts.append(seg.delta[c])
+            for ids, codes in parts:
+                cand_ids.append(ids)
+                cand_codes.append(codes)
+                cand_probe.append(np.full(len(ids), p))
+        ids = np.concatenate(cand_ids)
+        if len(ids) == 0:
+            return ids, np.zeros(0, dtype=np.float32)
+        codes = np.concatenate(cand_codes)
+        probe_of = np.concatenate(cand_probe)
+        # 在展平的距离表中查找：下标 = (桶序号 * m + 段序号) * 256 + 编码
+        flat = (probe_of[:, None] * self.m + np.arange(self.m)) * 256 + codes
+        distances = tables.ravel().take(flat).sum(axis=1)
+
+        keep = min(max(k, rerank), len(ids))
+        top = np.argpartition(distances, keep - 1)[:keep]
+        ids, distances = ids[top], distances[top]
+        if rerank:
+            in_main = ids < len(seg.raw)
+            vectors = np.empty((len(ids), self.dim), dtype=np.float32)
+            vectors[in_main] = seg.raw[ids[in_main]]
+            vectors[~in_main] = seg.delta_raw[ids[~in_main] - len(seg.raw)]
+            distances = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return ids[order], distances[order]
+
+    def memory_bytes(self) -> int:
+        """索引本身（不含原始向量）占用的字节数"""
+        seg = self._segments
+        return sum(a.nbytes for a in (self.centroids, self.codebooks, seg.offsets, seg.ids, seg.codes))
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int = 10, chunk: int = 131072) -> np.ndarray:
+    """
+    精确检索（分块矩阵乘法），作为召回率的标准答案
+
+    返回值：
+    - np.ndarray类型，形状为 (len(queries), k) 的ID
+    """
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk])
+        scores = queries @ block.T  # 归一化向量：内积越大越近
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_ids = np.concatenate([best_ids, top + start], axis=1)
+        best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        keep = np.argsort(-best_scores, axis=1)[:, :k]
+        best_ids = np.take_along_axis(best_ids, keep, axis=1)
+        best_scores = np.take_along_axis(best_scores, keep, axis=1)
+    return best_ids
+
+
+def synthetic_vectors(path: Path, n: int, dim: int, clusters: int = 2000, seed: int = 0) -> np.ndarray:
+    """
+    生成带聚类结构的归一化向量，分块写入内存映射文件（避免一次性占用大量内存）
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(n, dim))
+    for start in range(0, n, 262144):
+        size = min(262144, n - start)
+        block = centers[rng.integers(0, clusters, size)] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+        vectors[start:start + size] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    vectors.flush()
+    return np.load(path, mmap_mode="r")
+
+
+# 运行基准测试
+if __name__ == "__main__":
+    n = int(os.getenv("ANN_BENCH_N", "1000000"))  # 向量数量，可以通过环境变量调小
+    dim, k = 64, 10
+    work_dir = Path(tempfile.mkdtemp(prefix="ann_demo_"))
+    try:
+        print(f"=== 生成 {n} 条 {dim} 维合成向量 ===")
+        vectors = synthetic_vectors(work_dir / "vectors.npy", n, dim)
+        rng = np.random.default_rng(1)
+        queries = np.asarray(vectors[rng.choice(n, 200, replace=False)]) + 0.05 * rng.standard_normal((200, dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        print("\n=== 构建索引 ===")
+        nlist = max(16, int(np.sqrt(n)))
+        start = time.perf_counter()
+        index = IVFPQIndex.build(vectors, nlist=nlist, m=16)
+        print(f"nlist={nlist}, m=16, 构建耗时 {time.perf_counter() - start:.1f}s")
+        index.save(work_dir / "index")
+        index = IVFPQIndex.load(work_dir / "index")  # 内存映射打开
+        print(f"原始向量 {vectors.nbytes / 2**20:.0f} MB, 索引(不含原始向量) {index.memory_bytes() / 2**20:.1f} MB")
+
+        print("\n=== 精确检索（标准答案）===")
+        truth = exact_search(vectors, queries, k)
+        start = time.perf_counter()
+        for q in queries[:20]:
+            exact_search(vectors, q[None], k)
+        exact_qps = 20 / (time.perf_counter() - start)
+        print(f"精确检索 QPS: {exact_qps:.1f}")
+
+        print("\n=== 召回率与速度的权衡 ===")
+        print(f"{'nprobe':>6} {'rerank':>6} {'recall@10':>10} {'QPS':>8}")
+        for nprobe, rerank in [(4, 0), (4, 100), (16, 0), (16, 100), (64, 400)]:
+            hits = 0
+            start = time.perf_counter()
+            for q, expected in zip(queries, truth):
+                ids, _ = index.search(q, k=k, nprobe=nprobe, rerank=rerank)
+                hits += len(set(ids.tolist()) & set(expected.tolist()))
+            qps = len(queries) / (time.perf_counter() - start)
+            print(f"{nprobe:>6} {rerank:>6} {hits / truth.size:>10.3f} {qps:>8.0f}")
+
+        print("\n=== 并发查询 + 增量插入 ===")
+        new_vectors = np.asarray(vectors[:1000]) + 0.01
+        new_vectors /= np.linalg.norm(new_vectors, axis=1, keepdims=True)
+
+        def reader(q):
+            return index.search(q, k=k, nprobe=16, rerank=100)[0]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(reader, q) for q in queries]
+            new_ids = index.add(new_vectors)
+            results = [f.result() for f in futures]
+        found, _ = index.search(new_vectors[0], k=1, nprobe=16, rerank=100)
+        print(f"插入 {len(new_ids)} 条，查询 {len(results)} 次；新向量自检索命中: {found[0] == new_ids[0]}")
+        if resource is not None:
+            print(f"进程峰值内存: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
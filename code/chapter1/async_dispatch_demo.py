@@ -0,0 +1,467 @@
+# 异步工具与中间件示例（自动分派）
+# 本示例演示如何让工具和 wrap_model_call / wrap_tool_call 中间件同时支持 invoke 和 ainvoke：
+# - 异步函数：在 ainvoke 中直接 await；在 invoke 中用 asyncio.run 执行（调用方线程已有运行中的事件循环时，改在桥接线程中执行）
+# - 同步函数：在 ainvoke 中放到有界的线程池里执行，不阻塞事件循环
+# - chapter1 现有工具（search / get_weather / divide / get_recommendation）的异步版本
+# 最后的基准测试比较 1000 个并发智能体运行时的事件循环延迟和吞吐量
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware, ModelRequest  # 中间件相关
+from langchain.tools import tool  # 用于定义工具
+from langchain_core.language_models import BaseChatModel  # 聊天模型基类，用于实现离线假模型
+from langchain_core.messages import AIMessage, ToolMessage  # 消息类型
+from langchain_core.outputs import ChatGeneration, ChatResult  # 模型输出类型
+from langchain_core.tools import BaseTool, StructuredTool  # 结构化工具
+from concurrent.futures import ThreadPoolExecutor  # 有界线程池
+from typing import Any, Callable  # 用于类型提示
+import asyncio  # 用于异步调用
+import contextvars  # 用于在线程间传递上下文
+import functools  # 用于包装函数
+import inspect  # 用于判断函数是否为协程函数
+import threading  # 用于按需创建共享线程池
+import time  # 用于计时
+import uuid  # 用于生成工具调用ID
+import weakref  # 用于在中间件被回收时关闭线程池
+
+# 共享线程池的大小：
+# - tool：同步工具在 ainvoke 中使用的有界线程池（工具之间不会互相等待，因此可以共享）
+# - bridge：同步路径中执行协程的桥接线程池（调用方线程已有运行中的事件循环时，协程在这里的新事件循环中执行）
+SHARED_EXECUTOR_WORKERS = {"tool": 64, "bridge": 8}
+_shared_executors: dict[str, ThreadPoolExecutor] = {}
+_shared_executors_lock = threading.Lock()
+
+
+def shared_executor(name: str) -> ThreadPoolExecutor:
+    """
+    获取共享线程池（第一次使用时创建，导入模块不会启动线程）
+
+    参数：
+    - name: "tool" 或 "bridge"
+
+    返回值：
+    - ThreadPoolExecutor类型，线程名前缀为 agent-<name>
+    """
+    executor = _shared_executors.get(name)
+    if executor is None:
+        with _shared_executors_lock:
+            executor = _shared_executors.get(name)
+            if executor is None:
+                executor = _shared_executors[name] = ThreadPoolExecutor(
+                    max_workers=SHARED_EXECUTOR_WORKERS[name], thread_name_prefix=f"agent-{name}")
+    return executor
+
+
+async def run_in_executor(executor: ThreadPoolExecutor, func: Callable, *args, **kwargs) -> Any:
+    """
+    在指定线程池中执行同步函数，并保留当前上下文（回调、追踪等依赖 contextvars）
+
+    参数：
+    - executor: 线程池
+    - func: 同步函数
+    - args / kwargs: 函数参数
+
+    返回值：
+    - 函数的返回值
+    """
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+def run_sync(coro) -> Any:
+    """
+    在同步代码中执行协程并返回结果
+
+    当前线程没有运行中的事件循环时直接 asyncio.run；否则（例如在异步代码里调用了 agent.invoke）
+    asyncio.run 会报错，改为在桥接线程的新事件循环中执行并等待结果
+
+    参数：
+    - coro: 协程对象
+
+    返回值：
+    - 协程的返回值
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    ctx = contextvars.copy_context()
+    return shared_executor("bridge").submit(ctx.run, asyncio.run, coro).result()
+
+
+def dual_tool(func: Callable, name: str | None = None) -> StructuredTool:
+    """
+    定义同时支持同步和异步调用的工具
+
+    - 异步函数：ainvoke 中直接 await；invoke 中用 run_sync 执行
+    - 同步函数：invoke 中直接调用；ainvoke 中放到共享线程池执行
+
+    参数：
+    - func: 工具函数（同步或异步），文档字符串作为工具描述
+    - name: 工具名，默认为函数名
+
+    返回值：
+    - StructuredTool类型，工具
+    """
+    name = name or func.__name__
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        def sync_func(*args, **kwargs):
+            return run_sync(func(*args, **kwargs))
+
+        return StructuredTool.from_function(func=sync_func, coroutine=func, name=name)
+
+    @functools.wraps(func)
+    async def async_func(*args, **kwargs):
+        return await run_in_executor(shared_executor("tool"), func, *args, **kwargs)
+
+    return StructuredTool.from_function(func=func, coroutine=async_func, name=name)
+
+
+def async_variant(t: BaseTool) -> StructuredTool:
+    """
+    为现有的纯计算同步工具生成异步版本：ainvoke 中直接在事件循环上执行，不经过线程池
+
+    只适用于不做阻塞IO、耗时很短的工具；会阻塞的同步工具请用 dual_tool（放到共享线程池执行）
+
+    参数：
+    - t: 由 @tool 定义的同步工具
+
+    返回值：
+    - StructuredTool类型，名称、描述和参数模式不变，同时提供 func 和 coroutine
+    """
+    async def coroutine(**kwargs):
+        return t.func(**kwargs)
+
+    return StructuredTool(name=t.name, description=t.description, args_schema=t.args_schema,
+                          func=t.func, coroutine=coroutine, return_direct=t.return_direct)
+
+
+def _dual_middleware(func: Callable, hook: str, max_workers: int) -> AgentMiddleware:
+    """
+    根据函数类型生成同时实现 hook 和 a+hook 的中间件
+
+    同步函数在异步路径中运行在该中间件独占的线程池里：函数内部同步调用 handler 时，
+    真正的 handler 协程被提交回事件循环执行。每个中间件使用独立线程池，
+    外层中间件的线程只会等待内层，不会因为线程池耗尽而互相死锁。
+    线程池在第一次异步调用时创建，中间件的 close() 或中间件被回收时关闭
+
+    参数：
+    - func: 中间件函数，签名为 (request, handler)
+    - hook: "wrap_model_call" 或 "wrap_tool_call"
+    - max_workers: 同步函数在异步路径中使用的线程数上限
+
+    返回值：
+    - AgentMiddleware类型，中间件实例
+    """
+    if inspect.iscoroutinefunction(func):
+        async def async_hook(self, request, handler):
+            return await func(request, handler)
+
+        def sync_hook(self, request, handler):
+            async def async_handler(req):
+                return handler(req)
+
+            return run_sync(func(request, async_handler))
+
+        def close(self) -> None:
+            """异步函数不使用线程池，无需关闭"""
+
+        middleware_cls = type(func.__name__, (AgentMiddleware,), {hook: sync_hook, f"a{hook}": async_hook, "close": close})
+        return middleware_cls()
+
+    def sync_hook(self, request, handler):
+        return func(request, handler)
+
+    async def async_hook(self, request, handler):
+        loop = asyncio.get_running_loop()
+
+        def sync_handler(req):
+            # 在工作线程中同步等待事件循环上的 handler
+            return asyncio.run_coroutine_threadsafe(handler(req), loop).result()
+
+        return await run_in_executor(self.executor, func, request, sync_handler)
+
+    def executor(self) -> ThreadPoolExecutor:
+        """中间件独占的线程池（按需创建）"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"agent-{func.__name__}")
+            self._finalizer = weakref.finalize(self, self._executor.shutdown, wait=False)
+        return self._executor
+
+    def close(self) -> None:
+        """关闭线程池（之后的异步调用会重新创建）"""
+        if self._executor is not None:
+            self._finalizer()
+            self._executor = None
+
+    middleware_cls = type(func.__name__, (AgentMiddleware,), {
+        hook: sync_hook, f"a{hook}": async_hook, "executor": property(executor), "close": close,
+        "_executor": None,
+    })
+    return middleware_cls()
+
+
+def dual_wrap_model_call(func: Callable = None, *, max_workers: int = 32):
+    """与 @wrap_model_call 用法相同，但生成的中间件同时支持 invoke 和 ainvoke"""
+    if func is None:
+        return functools.partial(dual_wrap_model_call, max_workers=max_workers)
+    return _dual_middleware(func, "wrap_model_call", max_workers)
+
+
+def dual_wrap_tool_call(func: Callable = None, *, max_workers: int = 32):
+    """与 @wrap_tool_call 用法相同，但生成的中间件同时支持 invoke 和 ainvoke"""
+    if func is None:
+        return functools.partial(dual_wrap_tool_call, max_workers=max_workers)
+    return _dual_middleware(func, "wrap_tool_call", max_workers)
+
+
+# 定义工具
+# 同步天气工具：模拟20ms的阻塞IO（例如同步的HTTP客户端）
+def get_weather(location: str) -> str:
+    """
+    获取位置的天气信息
+
+    参数：
+    - location: str类型，位置名称
+
+    返回值：
+    - str类型，天气信息
+    """
+    time.sleep(0.02)
+    return f"{location} 的天气：晴朗，25°C"
+
+
+# 错误示范：在协程里直接调用阻塞IO（例如同步的HTTP客户端），会阻塞整个事件循环
+async def blocking_get_weather(location: str) -> str:
+    """
+    获取位置的天气信息
+
+    参数：
+    - location: str类型，位置名称
+
+    返回值：
+    - str类型，天气信息
+    """
+    time.sleep(0.02)
+    return f"{location} 的天气：晴朗，25°C"
+
+
+# 异步天气工具：同样的20ms IO，但不阻塞事件循环
+async def aget_weather(location: str) -> str:
+    """
+    获取位置的天气信息
+
+    参数：
+    - location: str类型，位置名称
+
+    返回值：
+    - str类型，天气信息
+    """
+    await asyncio.sleep(0.02)
+    return f"{location} 的天气：晴朗，25°C"
+
+
+# chapter1 现有工具的异步版本
+# 搜索工具（与 tools_demo.py 相同）
+@tool
+def search(query: str) -> str:
+    """
+    搜索信息
+
+    参数：
+    - query: str类型，搜索查询词
+
+    返回值：
+    - str类型，搜索结果
+    """
+    return f"结果：{query}"
+
+
+# 天气工具（与 tools_demo.py 相同；本模块的 get_weather 是上面模拟阻塞IO的版本，因此换一个变量名）
+@tool("get_weather")
+def chapter1_get_weather(location: str) -> str:
+    """
+    获取位置的天气信息
+
+    参数：
+    - location: str类型，位置名称
+
+    返回值：
+    - str类型，天气信息
+    """
+    return f"{location} 的天气：晴朗，72°F"
+
+
+# 除法工具（与 tool_error_handling.py 相同）
+@tool
+def divide(a: int, b: int) -> str:
+    """
+    执行除法运算
+
+    参数：
+    - a: int类型，被除数
+    - b: int类型，除数
+
+    返回值：
+    - str类型，除法结果
+    """
+    return str(a / b)
+
+
+# 推荐工具（与 state_middleware_demo.py 相同）
+@tool
+def get_recommendation(topic: str) -> str:
+    """
+    获取推荐信息
+
+    参数：
+    - topic: str类型，推荐主题
+
+    返回值：
+    - str类型，推荐信息
+    """
+    return f"关于 {topic} 的推荐：这是为您精心挑选的内容。"
+
+
+# 这些工具都是纯计算，ainvoke 中直接在事件循环上执行（不经过线程池）
+CHAPTER1_ASYNC_TOOLS = [async_variant(t) for t in (search, chapter1_get_weather, divide, get_recommendation)]
+
+
+# 定义中间件
+# 同步错误处理中间件（与 tool_error_handling.py 相同的逻辑，去掉了打印）
+def handle_tool_errors(request, handler):
+    """使用自定义消息处理工具执行错误"""
+    try:
+        return handler(request)
+    except Exception as e:
+        return ToolMessage(content=f"工具错误：请检查您的输入并重试。({str(e)})", tool_call_id=request.tool_call["id"])
+
+
+# 异步错误处理中间件
+async def ahandle_tool_errors(request, handler):
+    """使用自定义消息处理工具执行错误"""
+    try:
+        return await handler(request)
+    except Exception as e:
+        return ToolMessage(content=f"工具错误：请检查您的输入并重试。({str(e)})", tool_call_id=request.tool_call["id"])
+
+
+# 异步模型选择中间件（与 dynamic_model_demo.py 类似：这里只是原样使用当前模型）
+async def select_model(request: ModelRequest, handler):
+    """根据对话长度选择模型"""
+    return await handler(request)
+
+
+class WeatherFakeModel(BaseChatModel):
+    """
+    离线假模型：第一次调用返回天气工具调用，收到工具结果后返回最终回答
+    """
+
+    tool_name: str = "get_weather"
+
+    @property
+    def _llm_type(self) -> str:
+        return "weather-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            message = AIMessage(content=f"查询完成：{last.content}")
+        else:
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": self.tool_name, "args": {"location": "北京"}, "id": f"call_{uuid.uuid4().hex[:8]}"}],
+            )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # 纯CPU计算，直接在事件循环上执行，避免默认实现把它放进线程池
+        return self._generate(messages, stop, **kwargs)
+
+
+async def run_concurrently(agent, n: int) -> tuple[float, float, float]:
+    """
+    并发执行 n 次 ainvoke，同时监测事件循环延迟
+
+    监测协程每 5ms 醒来一次，记录实际醒来时间比预期晚了多少；
+    事件循环被阻塞（例如协程里调用了阻塞IO）时延迟会明显增大
+
+    参数：
+    - agent: 智能体
+    - n: 并发运行数量
+
+    返回值：
+    - (吞吐量 次/秒, 事件循环延迟中位数 毫秒, 事件循环延迟p99 毫秒)
+    """
+    lags = []
+    done = asyncio.Event()
+
+    async def monitor():
+        interval = 0.005
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start - interval)
+
+    monitor_task = asyncio.create_task(monitor())
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        agent.ainvoke({"messages": [{"role": "user", "content": "北京的天气怎么样？"}]}) for _ in range(n)
+    ])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await monitor_task
+    assert all(r["messages"][-1].content.startswith("查询完成") for r in results)
+    lags.sort()
+    return n / elapsed, lags[len(lags) // 2] * 1000, lags[int(len(lags) * 0.99)] * 1000
+
+
+# 运行基准测试
+if __name__ == "__main__":
+    print("=== 测试1：同一个智能体同时支持 invoke 和 ainvoke ===")
+    dual_tool_call = dual_wrap_tool_call(handle_tool_errors)
+    agent = create_agent(
+        WeatherFakeModel(),
+        tools=[dual_tool(get_weather)],
+        middleware=[dual_wrap_model_call(select_model), dual_tool_call],
+    )
+    print("invoke:", agent.invoke({"messages": [{"role": "user", "content": "北京的天气怎么样？"}]})["messages"][-1].content)
+    print("ainvoke:", asyncio.run(agent.ainvoke({"messages": [{"role": "user", "content": "北京的天气怎么样？"}]}))["messages"][-1].content)
+
+    async def invoke_inside_loop():
+        # 在已有事件循环的线程里调用同步的 invoke：异步中间件和异步工具在桥接线程中执行
+        async_agent = create_agent(WeatherFakeModel(tool_name="aget_weather"), tools=[dual_tool(aget_weather)],
+                                   middleware=[dual_wrap_model_call(select_model)])
+        return async_agent.invoke({"messages": [{"role": "user", "content": "北京的天气怎么样？"}]})
+
+    print("事件循环内调用 invoke:", asyncio.run(invoke_inside_loop())["messages"][-1].content)
+    dual_tool_call.close()
+
+    print("\n=== 测试2：chapter1 现有工具的异步版本 ===")
+    for t, args in zip(CHAPTER1_ASYNC_TOOLS, [{"query": "奥运会"}, {"location": "北京"}, {"a": 10, "b": 2}, {"topic": "电影"}]):
+        print(f"{t.name}: invoke -> {t.invoke(args)}；ainvoke -> {asyncio.run(t.ainvoke(args))}")
+
+    print("\n=== 测试3：1000 个并发运行 ===")
+    # 第一行是对照：协程里直接做阻塞IO，每次工具调用都让整个事件循环停顿 20ms。
+    # 其余方案不阻塞事件循环，剩下的延迟来自 1000 个智能体本身在事件循环上的CPU开销（单核时尤其明显）
+    scenarios = {
+        "协程中直接阻塞（错误示范）": ([dual_tool(blocking_get_weather, name="get_weather")], []),
+        "同步工具（默认线程池）": ([tool(get_weather)], []),
+        "同步工具（共享有界线程池）": ([dual_tool(get_weather)], []),
+        "异步工具": ([dual_tool(aget_weather)], []),
+        "异步工具 + 同步中间件（桥接）": ([dual_tool(aget_weather)], [dual_wrap_tool_call(handle_tool_errors)]),
+        "异步工具 + 异步中间件": ([dual_tool(aget_weather)], [dual_wrap_tool_call(ahandle_tool_errors)]),
+    }
+    print(f"{'场景':<24} {'吞吐量(次/秒)':>14} {'循环延迟中位数(ms)':>18} {'循环延迟p99(ms)':>16}")
+    for label, (tools, middleware) in scenarios.items():
+        tool_name = tools[0].name
+        agent = create_agent(WeatherFakeModel(tool_name=tool_name), tools=tools, middleware=middleware)
+        throughput, p50, p99 = asyncio.run(run_concurrently(agent, 1000))
+        print(f"{label:<24} {throughput:>14.0f} {p50:>18.1f} {p99:>16.1f}")
+        for m in middleware:
+            m.close()
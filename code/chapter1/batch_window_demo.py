@@ -0,0 +1,309 @@
+# 批量窗口合并示例
+# 离线批处理（例如从几千段文本中提取 ContactInfo 联系信息）会同时发出大量很短的模型调用，
+# 每次调用都要单独排队、单独等待首字节。本示例在模型外面加一层批量调度：
+# - BatchScheduler：在时间窗口（max_wait）或数量上限（max_batch）内收集相同配置的模型调用，一次性交给执行器
+# - BatchingChatModel：智能体使用的聊天模型，把调用交给调度器，结果按顺序路由回各自等待的智能体
+# - 两种执行器：pipelined 在共享连接上并发发送；ProviderBatch 调用服务商的批量接口（一次请求处理整批）
+#   （pipelined 只作对照：上游的并发上限不变，它的吞吐量反而低于逐条请求，p95 更高；收益来自批量接口）
+# 最后比较不同窗口大小下的吞吐量和增加的延迟
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.structured_output import ToolStrategy  # 用于结构化输出
+from langchain_core.language_models import BaseChatModel  # 聊天模型基类
+from langchain_core.outputs import ChatGeneration, ChatResult  # 模型输出类型
+from langchain_core.utils.function_calling import convert_to_openai_tool  # 用于计算批次键
+from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+from contact_schema import ContactInfo  # 联系信息模型（与 structured_output_tool.py 相同）
+from transport_replay_demo import FakeDeepSeekUpstream  # 模拟的 DeepSeek 接口
+from typing import Any, Awaitable, Callable  # 用于类型提示
+import asyncio  # 用于调度
+import httpx  # 用于发送批量请求
+import json  # 用于计算批次键
+import random  # 用于生成测试数据
+import statistics  # 用于统计
+import time  # 用于计时
+
+
+class BatchScheduler:
+    """
+    批量调度器：相同键的调用在窗口内合并为一批，交给执行器处理
+
+    窗口从一批中的第一个调用开始计时，到 max_wait 秒或凑满 max_batch 个调用时提交；
+    执行器返回与输入等长的结果列表，其中的异常只影响对应的调用
+
+    注意：调度器绑定在一个事件循环上（计时器和 Future 都属于该循环），不是线程安全的，
+    只能在同一个事件循环中调用 submit；原来的循环仍在运行且有未完成的批次时，从其他事件循环提交会抛出 RuntimeError
+    """
+
+    def __init__(self, execute: Callable[[Any, list], Awaitable[list]], max_batch: int = 32, max_wait: float = 0.01):
+        """
+        参数：
+        - execute: 执行器，execute(key, items) -> 结果列表
+        - max_batch: 每批最多的调用数
+        - max_wait: 第一个调用最多等待多少秒
+        """
+        self.execute = execute
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: dict[Any, list[tuple[Any, asyncio.Future]]] = {}
+        self._timers: dict[Any, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()  # 保持对执行中批次的引用
+        self._loop: asyncio.AbstractEventLoop | None = None  # 当前绑定的事件循环
+        self.batch_sizes: list[int] = []
+
+    async def submit(self, key, item):
+        """提交一个调用并等待它的结果"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            if self._loop is not None and not self._loop.is_closed() and (self._pending or self._tasks):
+                raise RuntimeError("BatchScheduler 只能在一个事件循环中使用：另一个事件循环中还有未完成的批次")
+            # 原来的循环空闲或已关闭（例如多次 asyncio.run）：丢弃已关闭循环中残留的批次，绑定到当前循环
+            self._pending.clear()
+            self._timers.clear()
+            self._tasks.clear()
+            self._loop = loop
+        future = loop.create_future()
+        bucket = self._pending.setdefault(key, [])
+        bucket.append((item, future))
+        if len(bucket) >= self.max_batch:
+            self._flush(key)
+        elif len(bucket) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key) -> None:
+        bucket = self._pending.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if bucket:
+            self.batch_sizes.append(len(bucket))
+            task = asyncio.create_task(self._run(key, bucket))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, bucket: list) -> None:
+        try:
+            results = await self.execute(key, [item for item, _ in bucket])
+        except Exception as e:
+            results = [e] * len(bucket)
+        for (_, future), result in zip(bucket, results):
+            if future.done():  # 调用方已取消
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class BatchingChatModel(BaseChatModel):
+    """
+    批量模型：异步调用经由 BatchScheduler 合并后执行，同步调用直接转发给 inner 模型
+
+    批次键由 inner 模型、绑定的工具和调用参数（stop 等）决定，只有配置相同的调用才会合并到同一批；
+    执行器对每个调用使用它自己的模型和参数
+    """
+
+    inner: Any  # 实际执行请求的模型（例如 ChatDeepSeek）
+    scheduler: Any  # BatchScheduler
+    tools: list[dict] = []  # 绑定的工具（OpenAI格式）
+    tool_kwargs: dict = {}  # bind_tools 的其余参数（例如 tool_choice）
+
+    @property
+    def _llm_type(self) -> str:
+        return "batching"
+
+    def bind_tools(self, tools, **kwargs) -> "BatchingChatModel":
+        return self.model_copy(update={"tools": [convert_to_openai_tool(t) for t in tools], "tool_kwargs": kwargs})
+
+    def bound(self):
+        """绑定了工具的 inner 模型"""
+        return self.inner.bind_tools(self.tools, **self.tool_kwargs) if self.tools else self.inner
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self.bound().invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = json.dumps([id(self.inner), self.tools, self.tool_kwargs, stop, kwargs], sort_keys=True, default=str)
+        return await self.scheduler.submit(key, (self, messages, stop, kwargs))
+
+
+async def pipelined(key, items: list) -> list:
+    """
+    执行器：整批请求在 inner 模型的共享连接池上并发发送
+
+    没有收益，只作对照：上游请求数不变，仍受服务商的并发上限约束，窗口只是额外的等待；
+    基准测试中吞吐量低于逐条请求（约 93 对 109 条/秒），p95 也更高
+    """
+    messages = await asyncio.gather(*[model.bound().ainvoke(msgs, stop=stop, **kwargs) for model, msgs, stop, kwargs in items],
+                                    return_exceptions=True)
+    return [m if isinstance(m, BaseException) else ChatResult(generations=[ChatGeneration(message=m)])
+            for m in messages]
+
+
+class ProviderBatch:
+    """
+    执行器：把整批请求体放进一次批量接口请求，再把每个响应解析为 ChatResult
+
+    请求体和响应解析都复用 ChatDeepSeek 自身的逻辑，因此与逐条调用得到的消息完全相同
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str):
+        self.client = client
+        self.url = url
+
+    @staticmethod
+    def _prepare(model, messages, stop, kwargs) -> tuple[Any, dict]:
+        """返回 (实际的 ChatDeepSeek, 请求体)：合并 bind_tools 绑定的参数和本次调用的 stop / 其他参数"""
+        bound = model.bound()
+        inner, bound_kwargs = (bound.bound, bound.kwargs) if model.tools else (bound, {})
+        return inner, inner._get_request_payload(messages, stop=stop, **{**bound_kwargs, **kwargs})
+
+    async def __call__(self, key, items: list) -> list:
+        prepared = [self._prepare(*item) for item in items]
+        response = await self.client.post(self.url, json={"requests": [payload for _, payload in prepared]})
+        response.raise_for_status()
+        results = []
+        for (inner, _), item in zip(prepared, response.json()["responses"]):
+            if "error" in item:
+                results.append(RuntimeError(item["error"]))
+            else:
+                results.append(inner._create_chat_result(item))
+        return results
+
+
+class BatchUpstream:
+    """
+    模拟服务商：同时最多处理 max_concurrent 个请求，每个请求有固定的排队/首字节延迟；
+    批量接口 /batch 一次请求处理整批，每条只增加很少的处理时间
+    """
+
+    def __init__(self, ttfb: float = 0.05, per_item: float = 0.0005, max_concurrent: int = 8):
+        self.ttfb = ttfb
+        self.per_item = per_item
+        self.max_concurrent = max_concurrent
+        self.rules = FakeDeepSeekUpstream(ttfb=0, chunk_interval=0)
+        self.requests = 0
+        self._semaphore = None
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.requests += 1
+        async with self._semaphore:
+            if request.url.path.endswith("/batch"):
+                bodies = json.loads(request.content)["requests"]
+                await asyncio.sleep(self.ttfb + self.per_item * len(bodies))
+                responses = [self.rules(httpx.Request("POST", request.url, json=body)).json() for body in bodies]
+                return httpx.Response(200, json={"responses": responses})
+            await asyncio.sleep(self.ttfb)
+            return self.rules(request)
+
+
+def make_contacts(n: int, seed: int = 0) -> list[dict]:
+    """生成 n 条随机联系信息"""
+    rng = random.Random(seed)
+    first = ["John", "Jane", "Li", "Wang", "Anna", "Omar", "Sara", "Ken"]
+    last = ["Doe", "Smith", "Lei", "Fang", "Berg", "Haddad", "Kim", "Sato"]
+    contacts = []
+    for i in range(n):
+        name = f"{rng.choice(first)} {rng.choice(last)}"
+        email = f"{name.split()[0].lower()}{i}@example.com"
+        phone = f"{rng.randint(200, 999)}-{rng.randint(200, 999)}-{rng.randint(1000, 9999)}"
+        contacts.append({"name": name, "email": email, "phone": phone})
+    return contacts
+
+
+async def run_extraction(model, contacts: list[dict], in_flight: int = 256, rate: float | None = None) -> dict:
+    """
+    用 ContactInfo 智能体并发提取全部联系信息
+
+    参数：
+    - in_flight: 同时运行的智能体数上限
+    - rate: 每秒到达的文本数；None 表示全部文本一开始就到达
+
+    返回值：
+    - dict类型，包含吞吐量、每次运行的延迟分布和准确率
+    """
+    agent = create_agent(model, tools=[], response_format=ToolStrategy(ContactInfo))
+    semaphore = asyncio.Semaphore(in_flight)
+    latencies, correct = [], 0
+
+    async def one(i: int, contact: dict) -> None:
+        nonlocal correct
+        if rate:
+            await asyncio.sleep(i / rate)
+        async with semaphore:
+            question = f"从以下内容提取联系信息：{contact['name']}, {contact['email']}, {contact['phone']}"
+            start = time.perf_counter()
+            result = await agent.ainvoke({"messages": [{"role": "user", "content": question}]})
+            latencies.append((time.perf_counter() - start) * 1000)
+            correct += result["structured_response"].model_dump() == contact
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i, c) for i, c in enumerate(contacts)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "throughput": len(contacts) / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "accuracy": correct / len(contacts),
+    }
+
+
+def deepseek(upstream: BatchUpstream) -> tuple[ChatDeepSeek, httpx.AsyncClient]:
+    """创建连接到模拟服务商的 ChatDeepSeek 和共享的异步客户端"""
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream), base_url="https://api.deepseek.com")
+    return ChatDeepSeek(model="deepseek-chat", api_key="mock", max_retries=0, http_async_client=client), client
+
+
+# 比较不同窗口大小下的吞吐量和延迟
+if __name__ == "__main__":
+    contacts = make_contacts(400)
+    rows = []
+
+    def report(label: str, stats: dict, upstream: BatchUpstream, scheduler: BatchScheduler | None = None) -> None:
+        batch = f"{statistics.mean(scheduler.batch_sizes):.1f}" if scheduler else "1.0"
+        rows.append(f"{label:<24} {stats['throughput']:>8.0f} {stats['p50']:>9.1f} {stats['p95']:>9.1f} "
+                    f"{batch:>8} {upstream.requests:>8} {stats['accuracy']:>7.0%}")
+
+    print(f"=== 测试1：逐条请求（服务商最多同时处理 8 个请求，{len(contacts)} 条文本）===")
+    upstream = BatchUpstream()
+    model, _ = deepseek(upstream)
+    report("逐条请求", asyncio.run(run_extraction(model, contacts)), upstream)
+    print(rows[-1])
+
+    print("\n=== 测试2：窗口合并 + 共享连接并发发送 ===")
+    for max_wait in (0.002, 0.01):
+        upstream = BatchUpstream()
+        model, _ = deepseek(upstream)
+        scheduler = BatchScheduler(pipelined, max_batch=64, max_wait=max_wait)
+        stats = asyncio.run(run_extraction(BatchingChatModel(inner=model, scheduler=scheduler), contacts))
+        report(f"并发发送 窗口{max_wait * 1000:g}ms", stats, upstream, scheduler)
+        print(rows[-1])
+
+    print("\n=== 测试3：窗口合并 + 批量接口 ===")
+    for max_wait in (0.002, 0.01, 0.05):
+        upstream = BatchUpstream()
+        model, client = deepseek(upstream)
+        scheduler = BatchScheduler(ProviderBatch(client, "/batch"), max_batch=64, max_wait=max_wait)
+        stats = asyncio.run(run_extraction(BatchingChatModel(inner=model, scheduler=scheduler), contacts))
+        report(f"批量接口 窗口{max_wait * 1000:g}ms", stats, upstream, scheduler)
+        print(rows[-1])
+
+    print("\n=== 测试4：文本以每秒 100 条匀速到达时，窗口大小对批量和延迟的影响 ===")
+    for max_wait in (0.002, 0.01, 0.05, 0.1):
+        upstream = BatchUpstream()
+        model, client = deepseek(upstream)
+        scheduler = BatchScheduler(ProviderBatch(client, "/batch"), max_batch=64, max_wait=max_wait)
+        stats = asyncio.run(run_extraction(BatchingChatModel(inner=model, scheduler=scheduler), contacts[:200], rate=100))
+        report(f"匀速到达 窗口{max_wait * 1000:g}ms", stats, upstream, scheduler)
+        print(rows[-1])
+
+    print("\n=== 汇总 ===")
+    print(f"{'方式':<24} {'条/秒':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'平均批量':>8} {'上游请求':>8} {'准确率':>7}")
+    for row in rows:
+        print(row)
@@ -0,0 +1,335 @@
+# 分级模型级联示例
+# dynamic_model_demo.py 只按消息数量在 deepseek-chat 和 deepseek-reasoner 之间切换，不检查回答质量。
+# 本示例实现级联模式：每次模型调用先交给最便宜的模型（本地模型），对回答打置信度分，
+# 只有置信度不够时才升级到下一级（deepseek-chat，再到 deepseek-reasoner）：
+# - SchemaValidator：结构化输出能否通过更严格的校验模型
+# - ArgumentGrounding：工具调用的参数是否都能在用户问题中找到依据
+# - LogprobConfidence：回答的平均 token 概率（需要模型返回 logprobs）
+# - CascadeMiddleware：按级别调用模型，统计每一级的调用次数、升级比例、延迟和费用
+# 评测完全离线：先用模拟的 DeepSeek 接口录制各级模型的回复，再用 eval_runner_demo.py 的回放模型评测
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse  # 中间件基类
+from langchain.agents.structured_output import ToolStrategy  # 用于结构化输出
+from langchain_core.messages import AIMessage, HumanMessage  # 消息类型
+from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+from pydantic import BaseModel, Field, ValidationError  # 用于严格校验
+from typing import Any, NamedTuple  # 用于类型提示
+from contact_schema import ContactInfo  # 联系信息模型（与 structured_output_tool.py 相同）
+from eval_runner_demo import CASES, EvalRunner, RecordingChatModel, ReplayChatModel, print_summary  # 评测工具
+from local_model_demo import RuleBackend, create_local_model, divide, get_weather, search  # 本地模型和工具
+from transport_replay_demo import FakeDeepSeekUpstream  # 模拟的 DeepSeek 接口
+import asyncio  # 用于异步回放
+import httpx  # 用于挂载模拟接口
+import json  # 用于修改模拟响应
+import math  # 用于计算概率
+import re  # 用于抽取参数
+import threading  # 用于保护统计
+import time  # 用于计时
+
+
+class Tier(NamedTuple):
+    """级联中的一级模型"""
+    name: str  # 名称
+    model: Any  # 聊天模型
+    input_price: float = 0.0  # 每百万输入 token 的价格（美元）
+    output_price: float = 0.0  # 每百万输出 token 的价格（美元）
+
+
+def _question(request: ModelRequest) -> str:
+    return next((str(m.content) for m in reversed(request.messages) if isinstance(m, HumanMessage)), "")
+
+
+def _tool_calls(response: ModelResponse) -> list[dict]:
+    return [c for m in response.result if isinstance(m, AIMessage) for c in m.tool_calls]
+
+
+class SchemaValidator:
+    """结构化输出置信度：能通过严格校验模型为 1，否则为 0；没有结构化输出时不打分"""
+
+    def __init__(self, schema: type[BaseModel], strict: type[BaseModel]):
+        self.schema = schema
+        self.strict = strict
+
+    def __call__(self, request: ModelRequest, response: ModelResponse) -> float | None:
+        value = response.structured_response
+        if value is None:
+            # 结构化输出工具调用未能生成结果（例如参数校验失败）
+            calls = [c for c in _tool_calls(response) if c["name"] == self.schema.__name__]
+            if not calls:
+                return None
+            value = calls[0]["args"]
+        try:
+            self.strict.model_validate(value, from_attributes=True)
+            return 1.0
+        except ValidationError:
+            return 0.0
+
+
+class ArgumentGrounding:
+    """工具调用置信度：每个参数都能在用户问题中找到（字符串为子串，数字出现在问题中）时为 1，否则为 0"""
+
+    def __call__(self, request: ModelRequest, response: ModelResponse) -> float | None:
+        calls = _tool_calls(response)
+        if not calls:
+            return None
+        question = _question(request)
+        numbers = {float(n) for n in re.findall(r"-?\d+(?:\.\d+)?", question)}
+        for call in calls:
+            for value in call["args"].values():
+                if isinstance(value, bool):
+                    continue
+                if isinstance(value, (int, float)):
+                    if float(value) not in numbers:
+                        return 0.0
+                elif not str(value).strip() or str(value) not in question:
+                    return 0.0
+        return 1.0
+
+
+class LogprobConfidence:
+    """回答的平均 token 概率（exp(平均 logprob)）；模型没有返回 logprobs 时不打分"""
+
+    def __call__(self, request: ModelRequest, response: ModelResponse) -> float | None:
+        for message in response.result:
+            content = ((message.response_metadata or {}).get("logprobs") or {}).get("content")
+            if content:
+                return math.exp(sum(t["logprob"] for t in content) / len(content))
+        return None
+
+
+class CascadeMiddleware(AgentMiddleware):
+    """
+    级联中间件：按级别调用模型，置信度（所有打分器中的最低分）低于阈值时升级到下一级
+    """
+
+    def __init__(self, tiers: list[Tier], scorers: list | None = None, threshold: float = 0.7):
+        """
+        参数：
+        - tiers: 从便宜到昂贵排列的模型
+        - scorers: 置信度打分器，返回 0~1 或 None（不适用）；都不适用时视为可信
+        - threshold: 接受回答的最低置信度；最后一级的回答总是被接受
+        """
+        super().__init__()
+        self.tiers = tiers
+        self.scorers = scorers if scorers is not None else [ArgumentGrounding(), LogprobConfidence()]
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """清空统计"""
+        self.stats = {tier.name: {"calls": 0, "accepted": 0, "escalated": 0, "errors": 0, "latency": 0.0,
+                                  "input_tokens": 0, "output_tokens": 0, "cost": 0.0} for tier in self.tiers}
+
+    def confidence(self, request: ModelRequest, response: ModelResponse) -> float:
+        scores = [s for s in (scorer(request, response) for scorer in self.scorers) if s is not None]
+        return min(scores, default=1.0)
+
+    def _record(self, tier: Tier, response: ModelResponse | None, latency: float, outcome: str) -> None:
+        usage = {}
+        if response is not None:
+            for message in response.result:
+                if isinstance(message, AIMessage) and message.usage_metadata:
+                    usage = message.usage_metadata
+        with self._lock:
+            stats = self.stats[tier.name]
+            stats["calls"] += 1
+            stats[outcome] += 1
+            stats["latency"] += latency
+            stats["input_tokens"] += usage.get("input_tokens", 0)
+            stats["output_tokens"] += usage.get("output_tokens", 0)
+            stats["cost"] += (usage.get("input_tokens", 0) * tier.input_price
+                              + usage.get("output_tokens", 0) * tier.output_price) / 1e6
+
+    def _judge(self, index: int, tier: Tier, request: ModelRequest, response, error, start: float) -> bool:
+        """记录本级结果，返回是否接受"""
+        last = index == len(self.tiers) - 1
+        if error is not None:
+            self._record(tier, None, time.perf_counter() - start, "errors")
+            if last:
+                raise error
+            return False
+        accepted = last or self.confidence(request, response) >= self.threshold
+        self._record(tier, response, time.perf_counter() - start, "accepted" if accepted else "escalated")
+        return accepted
+
+    def wrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        for index, tier in enumerate(self.tiers):
+            start, response, error = time.perf_counter(), None, None
+            try:
+                response = handler(request.override(model=tier.model))
+            except Exception as e:
+                error = e
+            if self._judge(index, tier, request, response, error, start):
+                return response
+
+    async def awrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        for index, tier in enumerate(self.tiers):
+            start, response, error = time.perf_counter(), None, None
+            try:
+                response = await handler(request.override(model=tier.model))
+            except Exception as e:
+                error = e
+            if self._judge(index, tier, request, response, error, start):
+                return response
+
+    def report(self) -> None:
+        """打印每一级的调用次数、升级比例、平均延迟和费用"""
+        print(f"  {'级别':<20} {'调用':>6} {'接受':>6} {'升级比例':>8} {'平均延迟(ms)':>12} {'输入/输出token':>16} {'费用($)':>10}")
+        for name, s in self.stats.items():
+            calls = s["calls"] or 1
+            print(f"  {name:<20} {s['calls']:>6} {s['accepted']:>6} {s['escalated'] / calls:>8.0%} "
+                  f"{s['latency'] / calls * 1000:>12.1f} {s['input_tokens']:>8}/{s['output_tokens']:<7} {s['cost']:>10.6f}")
+
+
+# 严格的联系信息校验：电话至少包含 7 位数字，邮箱必须包含 @
+class StrictContactInfo(BaseModel):
+    name: str = Field(min_length=1)
+    email: str = Field(pattern=r"^[^@\s]+@[^@\s]+\.\w+$")
+    phone: str = Field(pattern=r"^(?:\D*\d){7,}\D*$")
+
+
+_NUMERALS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+
+
+def _chinese_number(text: str) -> str:
+    """把 0~99 的中文数字转换为阿拉伯数字，例如 二十五 -> 25"""
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return str(_NUMERALS.get(tens, 1) * 10 + _NUMERALS.get(ones, 0))
+    return str(_NUMERALS[text])
+
+
+class ExpertBackend(RuleBackend):
+    """
+    模拟更强的模型：支持更多电话格式；numerals=True 时还能理解中文数字
+    """
+
+    _EXTRACTORS = {**RuleBackend._EXTRACTORS, "phone": re.compile(r"\+?\(?\d[\d\s().-]{5,}\d")}
+
+    def __init__(self, numerals: bool = False):
+        self.numerals = numerals
+
+    def understands(self, text: str) -> bool:
+        """该模型是否“有把握”：不支持中文数字时，遇到中文数字的计算题没有把握"""
+        return self.numerals or not re.search(r"[零一二两三四五六七八九十]+\s*[除乘加减]", text)
+
+    def _arguments(self, question: str, parameters: dict) -> dict:
+        if self.numerals:
+            question = re.sub(r"[零一二两三四五六七八九十]+", lambda m: _chinese_number(m.group(0)), question)
+        return super()._arguments(question, parameters)
+
+
+class ExpertUpstream(FakeDeepSeekUpstream):
+    """使用 ExpertBackend 的模拟 DeepSeek 接口，请求 logprobs 时按模型是否“有把握”返回 token 概率"""
+
+    def __init__(self, backend: ExpertBackend, ttfb: float):
+        super().__init__(ttfb=ttfb, chunk_interval=0)
+        self.rules = backend
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        response = super().__call__(request)
+        body = json.loads(request.content)
+        if not body.get("logprobs") or body.get("stream"):
+            return response
+        question = next((str(m.get("content")) for m in reversed(body["messages"]) if m["role"] == "user"), "")
+        logprob = -0.05 if self.rules.understands(question) else -1.2
+        payload = json.loads(response.read())
+        payload["choices"][0]["logprobs"] = {"content": [{"token": "x", "logprob": logprob, "bytes": None, "top_logprobs": []}] * 8}
+        return httpx.Response(200, json=payload)
+
+
+class TimedReplayChatModel(ReplayChatModel):
+    """按录制时测得的平均延迟回放，使离线评测的延迟与真实各级模型相近"""
+
+    delay: float = 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.delay)
+        return super()._generate(messages, stop, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return super()._generate(messages, stop, **kwargs)
+
+
+def build_agents(middleware: CascadeMiddleware) -> dict:
+    """与 eval_runner_demo.build_agents 相同的两个智能体，模型由级联中间件选择"""
+    model = middleware.tiers[0].model
+    return {
+        "tools": create_agent(model, tools=[search, get_weather, divide], middleware=[middleware]),
+        "ContactInfo": create_agent(model, tools=[search], response_format=ToolStrategy(ContactInfo),
+                                    middleware=[middleware]),
+    }
+
+
+# 除 eval_runner_demo.py 的用例外，再加入本地模型处理不好的用例
+HARD_CASES = [
+    {"id": "contact-intl", "agent": "ContactInfo", "schema": "ContactInfo",
+     "question": "从以下内容提取联系信息：Li Lei, li.lei@example.cn, +86 138-0013-8000",
+     "expected_structured": {"name": "Li Lei", "email": "li.lei@example.cn", "phone": "+86 138-0013-8000"}},
+    {"id": "contact-dots", "agent": "ContactInfo", "schema": "ContactInfo",
+     "question": "从以下内容提取联系信息：Anna Berg, anna@example.se, 555.987.6543",
+     "expected_structured": {"name": "Anna Berg", "email": "anna@example.se", "phone": "555.987.6543"}},
+    {"id": "divide-chinese", "agent": "tools", "question": "计算 七 除以 二",
+     "expected_tools": ["divide"], "expected_answer": "3.5"},
+    {"id": "divide-chinese-2", "agent": "tools", "question": "计算 二十 除以 八",
+     "expected_tools": ["divide"], "expected_answer": "2.5"},
+]
+
+# 各级模型的价格：名称 -> (每百万输入 token 价格, 每百万输出 token 价格)
+PRICES = {"deepseek-chat": (0.27, 1.10), "deepseek-reasoner": (0.55, 2.19)}
+# 各级模型的模拟接口：名称 -> (首字节延迟, 后端)
+UPSTREAMS = {"deepseek-chat": (0.3, ExpertBackend(numerals=False)), "deepseek-reasoner": (1.0, ExpertBackend(numerals=True))}
+SCORERS = [SchemaValidator(ContactInfo, StrictContactInfo), ArgumentGrounding(), LogprobConfidence()]
+CONFIGS = {"只用本地模型": ["local"], "只用 deepseek-reasoner": ["deepseek-reasoner"],
+           "级联": ["local", "deepseek-chat", "deepseek-reasoner"]}
+
+
+def make_tiers(models: dict, names: list[str]) -> list[Tier]:
+    return [Tier(name, models[name], *PRICES.get(name, (0.0, 0.0))) for name in names]
+
+
+# 运行级联评测
+if __name__ == "__main__":
+    cases = CASES + HARD_CASES
+
+    print("=== 步骤1：通过模拟的 DeepSeek 接口录制各级模型的回复 ===")
+    live = {"local": RecordingChatModel(inner=create_local_model(), recordings={})}
+    for name, (ttfb, backend) in UPSTREAMS.items():
+        client = httpx.Client(transport=httpx.MockTransport(ExpertUpstream(backend, ttfb)))
+        deepseek = ChatDeepSeek(model=name, api_key="mock", logprobs=True, max_retries=0, http_client=client)
+        live[name] = RecordingChatModel(inner=deepseek, recordings={})
+    # pydantic 会复制传入的字典，录制结果要从模型实例上取
+    recordings = {name: model.recordings for name, model in live.items()}
+    latency = {}
+    for label, names in CONFIGS.items():
+        middleware = CascadeMiddleware(make_tiers(live, names), SCORERS)
+        agents = build_agents(middleware)
+        for case in cases:
+            try:
+                agents[case["agent"]].invoke({"messages": [{"role": "user", "content": case["question"]}]})
+            except Exception as e:
+                # 例如本地模型把中文数字抽取成 0 导致除零；回放评测时同样会失败并计入未通过
+                print(f"[{label}] {case['id']} 运行失败: {type(e).__name__}: {e}")
+        for name, s in middleware.stats.items():
+            latency.setdefault(name, []).append(s["latency"] / max(s["calls"], 1))
+    delays = {name: sum(values) / len(values) for name, values in latency.items()}
+    print("录制条数: " + "，".join(f"{name} {len(r)}" for name, r in recordings.items()))
+    print("平均延迟: " + "，".join(f"{name} {d * 1000:.0f}ms" for name, d in delays.items()))
+
+    print("\n=== 步骤2：离线回放评测 ===")
+    replay = {name: TimedReplayChatModel(recordings=r, delay=delays[name]) for name, r in recordings.items()}
+    for label, names in CONFIGS.items():
+        middleware = CascadeMiddleware(make_tiers(replay, names), SCORERS)
+        start = time.perf_counter()
+        report = EvalRunner(build_agents(middleware), max_concurrency=4).run(cases, build=label)
+        elapsed = time.perf_counter() - start
+        print()
+        print_summary(report)
+        middleware.report()
+        total = sum(s["cost"] for s in middleware.stats.values())
+        failed = [case_id for case_id, r in report["cases"].items() if not r["passed"]]
+        print(f"  总费用 ${total:.6f}，总耗时 {elapsed:.1f}s，未通过: {failed or '无'}")
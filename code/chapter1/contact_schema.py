@@ -0,0 +1,13 @@
+# 联系信息模型（字段与 structured_output_tool.py、middleware_demo.py 中各自定义的 ContactInfo 相同）
+# 那两个入门示例为了自成一体保留自己的定义；新增的示例（序列化、评测、级联等）统一从这里导入：
+# 序列化时按“模块:类名”注册和还原模型，这些示例之间传递的结构化输出必须是同一个类
+
+# 导入必要的库
+from pydantic import BaseModel  # 用于定义结构化输出模型
+
+
+class ContactInfo(BaseModel):
+    """联系信息模型"""
+    name: str  # 姓名
+    email: str  # 邮箱
+    phone: str  # 电话
@@ -0,0 +1,276 @@
+# 用户上下文读穿缓存示例
+# 本示例演示如何让智能体自己加载用户偏好，而不是每次调用都由调用方传入 user_preferences / user_role：
+# - PreferenceStore：模拟数据库，每次查询有固定的往返延迟
+# - UserContextProvider：有界 LRU + TTL 缓存，支持显式失效；并发的缓存未命中会合并成一次批量查询
+# - UserContextMiddleware：在 before_agent 中按 context 里的 user_id 把偏好写入状态
+# 最后的基准测试比较有无缓存时的数据库往返次数和请求延迟
+
+# 导入必要的库
+from langchain.agents import create_agent, AgentState  # 用于创建智能体和状态
+from langchain.agents.middleware import AgentMiddleware, dynamic_prompt, ModelRequest  # 中间件相关
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # 离线假模型，便于压测
+from langchain_core.messages import AIMessage  # 用于构造假模型的回复
+from collections import OrderedDict  # 用于实现LRU
+from concurrent.futures import Future, ThreadPoolExecutor  # 用于并发请求
+from typing import Any, TypedDict  # 用于类型提示
+import itertools  # 用于让假模型循环回复
+import statistics  # 用于统计延迟
+import threading  # 用于线程同步
+import time  # 用于计时
+
+
+# 定义上下文类型：调用方只需要传 user_id
+class Context(TypedDict):
+    user_id: str  # 用户ID
+
+
+# 定义自定义状态（与 state_schema_demo.py 相同）
+class CustomState(AgentState):
+    """自定义智能体状态"""
+    user_preferences: dict  # 用户偏好设置
+
+
+class PreferenceStore:
+    """
+    模拟的用户偏好数据库：单次查询和批量查询的往返延迟相同
+    """
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency  # 每次往返的延迟（秒）
+        self.round_trips = 0  # 往返次数
+        self._lock = threading.Lock()
+        self._rows = {
+            f"user{i}": {"user_role": "expert" if i % 2 else "beginner", "style": "technical", "verbosity": "detailed"}
+            for i in range(100)
+        }
+
+    def get_many(self, user_ids: list[str]) -> dict[str, dict]:
+        """批量查询用户偏好"""
+        with self._lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+        return {uid: dict(self._rows.get(uid, {})) for uid in user_ids}
+
+    def put(self, user_id: str, preferences: dict) -> None:
+        """写入用户偏好"""
+        with self._lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+        self._rows[user_id] = dict(preferences)
+
+
+class UserContextProvider:
+    """
+    用户上下文的读穿缓存
+
+    - 命中：直接返回缓存（有界 LRU，条目超过 TTL 后视为过期）
+    - 未命中：在 batch_window 时间内到达的所有未命中合并为一次 get_many；
+      同一用户正在加载时，后来的请求等待同一个结果
+    """
+
+    def __init__(self, store: PreferenceStore, max_size: int = 1024, ttl: float = 300.0, batch_window: float = 0.002):
+        """
+        参数：
+        - store: 底层存储
+        - max_size: 缓存条目上限
+        - ttl: 缓存有效期（秒）
+        - batch_window: 合并未命中请求的时间窗口（秒）
+        """
+        self.store = store
+        self.max_size = max_size
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()  # user_id -> (过期时间, 偏好)
+        self._pending: dict[str, Future] = {}  # 正在加载的 user_id -> Future
+        self._batch: list[str] | None = None  # 当前窗口内等待批量加载的 user_id
+        self._stale: set[str] = set()  # 加载过程中被失效的 user_id，加载结果不写入缓存
+
+    def get(self, user_id: str) -> dict:
+        """
+        读取用户上下文（读穿）
+
+        参数：
+        - user_id: 用户ID
+
+        返回值：
+        - dict类型，用户偏好（只读，请勿修改）
+        """
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(user_id)  # 最近使用
+                return entry[1]
+            future = self._pending.get(user_id)
+            if future is None:
+                future = Future()
+                self._pending[user_id] = future
+                leader = self._batch is None
+                if leader:
+                    self._batch = []
+                self._batch.append(user_id)
+            else:
+                leader = False
+
+        if leader:
+            self._load_batch()
+        return future.result()
+
+    def _load_batch(self) -> None:
+        """等待一个时间窗口收集未命中，然后一次性查询"""
+        time.sleep(self.batch_window)
+        with self._lock:
+            user_ids, self._batch = self._batch, None
+        rows, error = {}, None
+        try:
+            rows = self.store.get_many(user_ids)
+        except BaseException as e:
+            error = e
+            if not isinstance(e, Exception):
+                raise  # KeyboardInterrupt 等：唤醒等待的请求后继续向上抛出
+        finally:
+            # 无论查询是否成功，都要完成本批次的所有 Future，否则等待同一用户的请求会一直阻塞
+            self._resolve(user_ids, rows, error)
+
+    def _resolve(self, user_ids: list[str], rows: dict[str, dict], error: BaseException | None) -> None:
+        """完成一个批次的 Future：查询失败时全部设置异常，存储中缺少的用户单独设置 KeyError"""
+        with self._lock:
+            expires = time.monotonic() + self.ttl
+            for uid in user_ids:
+                future = self._pending.pop(uid)
+                stale = uid in self._stale
+                self._stale.discard(uid)
+                if error is not None:
+                    future.set_exception(error)
+                elif uid not in rows:
+                    future.set_exception(KeyError(f"存储中没有用户 {uid} 的偏好"))
+                else:
+                    if not stale:  # 加载过程中被失效的结果可能是旧数据，不缓存
+                        self._cache[uid] = (expires, rows[uid])
+                        self._cache.move_to_end(uid)
+                    future.set_result(rows[uid])
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)  # 淘汰最久未使用的条目
+
+    def invalidate(self, user_id: str) -> None:
+        """显式失效某个用户的缓存"""
+        with self._lock:
+            self._cache.pop(user_id, None)
+            if user_id in self._pending:
+                self._stale.add(user_id)
+
+    def update(self, user_id: str, preferences: dict) -> None:
+        """写入存储并使缓存失效，下次读取时重新加载"""
+        self.store.put(user_id, preferences)
+        self.invalidate(user_id)
+
+
+class UserContextMiddleware(AgentMiddleware):
+    """
+    在智能体开始时按 context["user_id"] 加载用户偏好并写入状态，
+    后续中间件和工具直接从 state["user_preferences"] 读取
+
+    传入了 user_id 时以提供者的数据为准：每次运行都重新读取（缓存命中时几乎没有开销），
+    这样 invalidate/update 之后，检查点中已有偏好的会话也能拿到新值；没有 user_id 时保留状态中的偏好
+    """
+
+    state_schema = CustomState  # 指定状态模式
+
+    def __init__(self, provider):
+        super().__init__()
+        self.provider = provider
+
+    def before_agent(self, state: CustomState, runtime) -> dict[str, Any] | None:
+        user_id = (runtime.context or {}).get("user_id")
+        if user_id is None:
+            return None  # 没有 user_id，使用调用方传入（或检查点中）的偏好
+        preferences = self.provider.get(user_id)
+        if preferences == state.get("user_preferences"):
+            return None  # 没有变化，不写状态
+        return {"user_preferences": preferences}
+
+
+class UncachedProvider:
+    """不带缓存的对照实现：每次都查询数据库"""
+
+    def __init__(self, store: PreferenceStore):
+        self.store = store
+
+    def get(self, user_id: str) -> dict:
+        return self.store.get_many([user_id])[user_id]
+
+
+# 动态提示中间件：从状态中的偏好读取用户角色（与 dynamic_prompt_demo.py 的逻辑相同）
+@dynamic_prompt
+def user_role_prompt(request: ModelRequest) -> str:
+    """根据用户角色生成系统提示"""
+    user_role = request.state.get("user_preferences", {}).get("user_role", "user")
+    if user_role == "expert":
+        return "你是一个有帮助的助手。请提供详细的技术响应。"
+    elif user_role == "beginner":
+        return "你是一个有帮助的助手。请简单解释概念，避免使用行话。"
+    return "你是一个有帮助的助手。"
+
+
+def build_agent(provider):
+    """创建使用指定上下文提供者的智能体"""
+    model = GenericFakeChatModel(messages=itertools.cycle([AIMessage(content="机器学习是让计算机从数据中学习规律的方法。")]))
+    return create_agent(
+        model=model,  # 离线假模型
+        tools=[],  # 暂时为空工具列表
+        middleware=[UserContextMiddleware(provider), user_role_prompt],  # 先加载偏好，再生成提示
+        context_schema=Context  # 传入上下文模式
+    )
+
+
+def run_burst(agent, store: PreferenceStore, requests: int = 400, users: int = 20,
+              workers: int = 32) -> tuple[int, float, float, float]:
+    """
+    并发发送一批请求（requests 个请求分布在 users 个用户上）
+
+    注意 p99：32 个线程共享 GIL，缓存命中后请求几乎全是 CPU 计算，尾延迟主要来自线程排队调度，
+    最慢的请求是缓存预热之后的命中而不是未命中；无缓存时每个请求有一次往返在 sleep 中释放 GIL，
+    排队反而更少。因此在 CPU 核数少的机器上，读穿缓存的 p99 可能与无缓存持平甚至更高，
+    缓存的收益体现在往返次数、平均延迟和 p50 上；想降低尾延迟应减少并发线程数，而不是调整缓存
+
+    返回值：
+    - (数据库往返次数, 平均延迟ms, p50延迟ms, p99延迟ms)
+    """
+    store.round_trips = 0
+
+    def one(i):
+        start = time.perf_counter()
+        agent.invoke(
+            {"messages": [{"role": "user", "content": "解释机器学习的原理"}]},
+            context={"user_id": f"user{i % users}"},
+        )
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = sorted(pool.map(one, range(requests)))
+    return (store.round_trips, statistics.mean(latencies), latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.99) - 1])
+
+
+# 测试读穿缓存
+if __name__ == "__main__":
+    store = PreferenceStore()
+    provider = UserContextProvider(store, max_size=1000, ttl=60)
+
+    print("=== 测试1：按 user_id 自动加载偏好 ===")
+    agent = build_agent(provider)
+    result = agent.invoke({"messages": [{"role": "user", "content": "推荐一些书籍"}]}, context={"user_id": "user1"})
+    print(f"加载到的用户偏好: {result['user_preferences']}")
+
+    print("\n=== 测试2：显式失效 ===")
+    provider.update("user1", {"user_role": "beginner", "style": "casual"})
+    result = agent.invoke({"messages": [{"role": "user", "content": "推荐一些书籍"}]}, context={"user_id": "user1"})
+    print(f"更新后的用户偏好: {result['user_preferences']}")
+
+    print("\n=== 测试3：400个请求 / 20个用户 / 32并发 ===")
+    # p99 受线程调度影响较大，见 run_burst 的说明
+    print(f"{'方案':<12} {'数据库往返':>10} {'平均延迟(ms)':>14} {'p50延迟(ms)':>12} {'p99延迟(ms)':>12}")
+    trips, mean, p50, p99 = run_burst(build_agent(UncachedProvider(store)), store)
+    print(f"{'无缓存':<12} {trips:>10} {mean:>14.1f} {p50:>12.1f} {p99:>12.1f}")
+    trips, mean, p50, p99 = run_burst(build_agent(UserContextProvider(store)), store)
+    print(f"{'读穿缓存':<12} {trips:>10} {mean:>14.1f} {p50:>12.1f} {p99:>12.1f}")
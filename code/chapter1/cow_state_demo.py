@@ -0,0 +1,325 @@
+# 写时复制（Copy-on-Write）智能体状态示例
+# 本示例演示如何避免每一步都复制整个状态：
+# - 默认的 add_messages 合并函数每一步都会复制并重新转换整个消息列表，历史越长越慢
+# - MessageLog：只追加的消息日志，新版本与旧版本共享已有消息（结构共享），追加只需 O(新消息数)
+# - FrozenDict：只读字典，更新时生成共享旧数据的新版本，中间件读取时无需复制；
+#   user_preferences 与普通状态一样整体替换，写入的字典直接包装、不复制
+# 注意：两者都是只读的，原地修改状态的写法不再可用：
+# - state["messages"].append(m) 会抛出 AttributeError，改为返回 {"messages": [m]}
+# - state["user_preferences"][k] = v 会抛出 TypeError，改为返回 {"user_preferences": state["user_preferences"].update({k: v})}
+# - 使用检查点时传入 CowSerializer，例如 InMemorySaver(serde=CowSerializer())
+# 最后的基准测试比较历史增长到 10k 条消息时每一步的内存分配和耗时；
+# 在带检查点的多轮对话中，每轮读写整个历史的检查点开销占主导，两种状态的差距只剩合并函数省下的部分
+
+# 导入必要的库
+from langchain.agents import create_agent, AgentState  # 用于创建智能体和状态
+from langchain.agents.middleware import AgentMiddleware  # 智能体中间件基类
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # 离线假模型，便于压测
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage, convert_to_messages, message_chunk_to_message  # 消息相关
+from langgraph.checkpoint.memory import InMemorySaver  # 内存检查点，用于多轮对话
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer  # 检查点默认的序列化器
+from langgraph.graph.message import add_messages  # 默认的消息合并函数
+from collections.abc import Mapping, Sequence  # 只读容器的抽象基类
+from typing import Annotated, Any  # 用于类型提示
+import itertools  # 用于让假模型循环回复
+import time  # 用于计时
+import tracemalloc  # 用于统计内存分配
+import uuid  # 用于生成消息ID
+
+
+class MessageLog(Sequence):
+    """
+    只追加的持久化消息列表
+
+    多个版本共享同一个底层存储，每个版本只记录自己的长度：
+    - 在最新版本上追加时，直接写入共享存储并返回更长的新版本，旧版本看到的内容不变
+    - 在旧版本上追加（出现分叉）时才复制一次前缀
+
+    没有 append 等修改方法：state["messages"].append(m) 会抛出 AttributeError，
+    节点和中间件应返回 {"messages": [m]}，由合并函数追加
+    """
+
+    __slots__ = ("_store", "_ids", "_len")
+
+    def __init__(self, messages=(), _store=None, _ids=None, _len=None):
+        if _store is None:
+            _store, _ids = [], {}
+            for m in messages:
+                _ids[m.id] = len(_store)
+                _store.append(m)
+            _len = len(_store)
+        self._store = _store  # 共享的底层消息存储（只追加）
+        self._ids = _ids  # 共享的 消息ID -> 下标 索引
+        self._len = _len  # 本版本可见的消息数量
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._store[: self._len][index]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("MessageLog index out of range")
+        return self._store[index]
+
+    def __iter__(self):
+        return itertools.islice(self._store, self._len)
+
+    def __repr__(self) -> str:
+        return f"MessageLog(len={self._len})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def index_of(self, message_id: str) -> int | None:
+        """按消息ID查找下标（只在本版本可见范围内）"""
+        index = self._ids.get(message_id)
+        return index if index is not None and index < self._len else None
+
+    def extend(self, messages: list) -> "MessageLog":
+        """
+        追加消息，返回新版本（不修改当前版本）
+
+        参数：
+        - messages: 要追加的消息列表
+
+        返回值：
+        - MessageLog类型，新版本
+        """
+        if self._len == len(self._store):
+            store, ids = self._store, self._ids
+        else:
+            # 分叉：当前版本不是最新版本，复制一次前缀
+            store = self._store[: self._len]
+            ids = {m.id: i for i, m in enumerate(store)}
+        for m in messages:
+            ids[m.id] = len(store)
+            store.append(m)
+        return MessageLog(_store=store, _ids=ids, _len=len(store))
+
+
+def append_messages(left: Sequence | None, right) -> MessageLog:
+    """
+    写时复制版本的消息合并函数，语义与 add_messages 一致
+
+    常见情况（追加新消息）只做 O(新消息数) 的工作；遇到删除或按ID替换消息时回退到 add_messages
+
+    参数：
+    - left: 已有的消息（MessageLog或普通列表）
+    - right: 新的消息（单条或列表）
+
+    返回值：
+    - MessageLog类型，合并后的新版本
+    """
+    if not isinstance(left, MessageLog):
+        left = list(left or [])
+        if all(isinstance(m, BaseMessage) and m.id is not None for m in left):
+            left = MessageLog(left)  # 例如从检查点读回的历史，已经是合并过的消息
+        else:
+            left = MessageLog(add_messages([], left))
+    if not isinstance(right, list):
+        right = [right]
+    right = [message_chunk_to_message(m) for m in convert_to_messages(right)]
+
+    seen = set()
+    for m in right:
+        if m.id is None:
+            m.id = str(uuid.uuid4())
+        if isinstance(m, RemoveMessage) or m.id in seen or left.index_of(m.id) is not None:
+            # 删除或替换已有消息：需要修改历史，回退到完整合并
+            return MessageLog(add_messages(list(left), right))
+        seen.add(m.id)
+    return left.extend(right)
+
+
+class FrozenDict(Mapping):
+    """
+    只读字典：读取时直接访问底层数据，更新时生成新版本，旧版本保持不变
+
+    更新通过“覆盖层”实现，层数超过上限时才压平成一个新字典
+
+    不支持赋值：state["user_preferences"][k] = v 会抛出 TypeError，
+    应返回 {"user_preferences": state["user_preferences"].update({k: v})}
+    注意 update 返回新版本，与 dict.update 原地修改不同
+    """
+
+    __slots__ = ("_data", "_parent", "_depth")
+    _MAX_DEPTH = 8  # 覆盖层上限，防止查找链过长
+
+    def __init__(self, data=None, _parent=None):
+        self._data = dict(data or {})  # 本层的键值
+        self._parent = _parent  # 下一层（共享，不复制）
+        self._depth = 0 if _parent is None else _parent._depth + 1
+        if self._depth > self._MAX_DEPTH:
+            self._data, self._parent, self._depth = {**dict(_parent), **self._data}, None, 0
+
+    def __getitem__(self, key):
+        node = self
+        while node is not None:
+            if key in node._data:
+                return node._data[key]
+            node = node._parent
+        raise KeyError(key)
+
+    def __iter__(self):
+        seen = set()
+        node = self
+        while node is not None:
+            for key in node._data:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+            node = node._parent
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"FrozenDict({dict(self)!r})"
+
+    def update(self, changes: Mapping) -> "FrozenDict":
+        """返回应用了修改的新版本"""
+        return FrozenDict(changes, _parent=self) if changes else self
+
+    @classmethod
+    def wrap(cls, data: Mapping | None) -> "FrozenDict":
+        """包装已有的字典而不复制（调用方之后不应再修改它）"""
+        if isinstance(data, FrozenDict):
+            return data
+        frozen = cls.__new__(cls)
+        frozen._data, frozen._parent, frozen._depth = data if data is not None else {}, None, 0
+        return frozen
+
+
+def replace_dict(left: Mapping | None, right: Mapping | None) -> FrozenDict:
+    """
+    字典字段的合并函数：与普通 dict 字段相同，新值整体替换旧值（写入时没有的键即被删除），
+    新值直接包装为 FrozenDict，不复制
+
+    要在旧值基础上修改几个键，写入 state["user_preferences"].update({...})，新版本与旧版本共享数据
+
+    参数：
+    - left: 已有的字典（不使用）
+    - right: 新的字典
+
+    返回值：
+    - FrozenDict类型，新值
+    """
+    return FrozenDict.wrap(right)
+
+
+class CowSerializer(JsonPlusSerializer):
+    """
+    检查点序列化器：MessageLog 和 FrozenDict 按普通列表和字典保存
+
+    默认的序列化器不认识这两个类型；读回的普通列表和字典在下一次写入时由合并函数重新包装
+    """
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if isinstance(obj, MessageLog):
+            obj = list(obj)
+        elif isinstance(obj, FrozenDict):
+            obj = dict(obj)
+        return super().dumps_typed(obj)
+
+
+# 定义自定义状态
+# 与 state_schema_demo.py 中的 CustomState 字段相同，但 messages 和 user_preferences 使用写时复制的合并函数
+class CowState(AgentState):
+    """写时复制的智能体状态"""
+    messages: Annotated[MessageLog, append_messages]  # 只追加的消息日志
+    user_preferences: Annotated[FrozenDict, replace_dict]  # 用户偏好设置（只读，整体替换；未写入时为空的 FrozenDict）
+
+
+# 普通状态，作为对照
+class CustomState(AgentState):
+    """自定义智能体状态"""
+    user_preferences: dict  # 用户偏好设置
+
+
+class PreferenceReader(AgentMiddleware):
+    """读取状态但不复制：与 state_middleware_demo.py 的 CustomMiddleware 类似，去掉了打印"""
+
+    def before_model(self, state, runtime) -> dict[str, Any] | None:
+        preferences = state.get("user_preferences", {})  # FrozenDict 直接读取，无需复制
+        self.last_style = preferences.get("style")
+        self.last_message = state["messages"][-1]  # MessageLog 按下标读取，无需复制
+        return None
+
+
+def reducer_step_cost(reducer, history: int, steps: int = 50) -> tuple[float, float]:
+    """
+    测量在 history 条历史消息上每追加一条消息的耗时和内存分配
+
+    参数：
+    - reducer: 消息合并函数
+    - history: 历史消息数量
+    - steps: 测量的步数
+
+    返回值：
+    - (每步耗时微秒, 合并过程中新分配内存的峰值KB)
+    """
+    state = reducer([], [HumanMessage(content=f"消息{i}", id=f"m{i}") for i in range(history)])
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(steps):
+        state = reducer(state, [AIMessage(content=f"回复{i}", id=f"r{i}")])
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(state) == history + steps
+    return elapsed / steps * 1e6, peak / 1024
+
+
+def agent_step_latency(state_schema, history: int, runs: int = 20) -> float:
+    """
+    测量智能体在已有 history 条消息的对话上继续一轮的耗时
+
+    历史只在预热时写入一次检查点，之后每轮只发送一条新消息，与真实的多轮对话一致；
+    每轮的耗时包含检查点读写整个历史的开销，两种状态都要付出这部分开销
+
+    返回值：
+    - float类型，平均耗时（毫秒）
+    """
+    model = GenericFakeChatModel(messages=(AIMessage(content="为您推荐：《三体》。") for _ in itertools.count()))
+    agent = create_agent(model, tools=[], state_schema=state_schema, middleware=[PreferenceReader()],
+                         checkpointer=InMemorySaver(serde=CowSerializer()))
+    config = {"configurable": {"thread_id": f"history-{history}"}}
+    messages = [HumanMessage(content=f"消息{i}", id=f"m{i}") for i in range(history)]
+    agent.invoke({"messages": messages, "user_preferences": {"style": "technical", "verbosity": "detailed"}},
+                 config)  # 写入历史并预热
+    start = time.perf_counter()
+    for i in range(runs):
+        result = agent.invoke({"messages": [HumanMessage(content=f"继续推荐{i}")]}, config)
+    elapsed = time.perf_counter() - start
+    assert len(result["messages"]) == history + 1 + 2 * runs
+    assert result["messages"][-1].content == "为您推荐：《三体》。"
+    return elapsed / runs * 1000
+
+
+# 运行基准测试
+if __name__ == "__main__":
+    print("=== 测试1：结构共享 ===")
+    v1 = append_messages([], [HumanMessage(content="推荐一些书籍")])
+    v2 = append_messages(v1, [AIMessage(content="为您推荐：《三体》。")])
+    print(f"v1: {len(v1)} 条, v2: {len(v2)} 条, 共享底层存储: {v1._store is v2._store}")
+    prefs = replace_dict(None, {"style": "technical"})
+    prefs2 = replace_dict(prefs, prefs.update({"verbosity": "detailed"}))
+    prefs3 = replace_dict(prefs2, {"verbosity": "brief"})  # 整体替换：style 被删除
+    print(f"旧偏好: {dict(prefs)}, 新偏好: {dict(prefs2)}, 替换后: {dict(prefs3)}")
+
+    print("\n=== 测试2：合并函数每步开销 ===")
+    print(f"{'历史消息数':>10} {'add_messages(耗时/峰值内存)':>24} {'append_messages(耗时/峰值内存)':>24}")
+    for history in (100, 1_000, 10_000):
+        base_us, base_kb = reducer_step_cost(add_messages, history)
+        cow_us, cow_kb = reducer_step_cost(append_messages, history)
+        print(f"{history:>10} {base_us:>10.0f}µs {base_kb:>8.1f}KB {cow_us:>10.1f}µs {cow_kb:>8.1f}KB")
+
+    print("\n=== 测试3：智能体单步耗时 ===")
+    print(f"{'历史消息数':>10} {'普通状态(ms)':>14} {'写时复制(ms)':>14}")
+    for history in (100, 1_000, 10_000):
+        plain = agent_step_latency(CustomState, history)
+        cow = agent_step_latency(CowState, history)
+        print(f"{history:>10} {plain:>14.2f} {cow:>14.2f}")
@@ -5,6 +5,7 @@
 from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
 from langchain.agents import create_agent  # 用于创建智能体
 from langchain.agents.middleware import wrap_model_call, ModelRequest, ModelResponse  # 用于创建中间件
+from lazy_logging_demo import configure_demo, get_logger  # 惰性日志
 from dotenv import load_dotenv  # 用于加载环境变量
 import os  # 用于访问环境变量
 
@@ -17,6 +18,8 @@ if not api_key:
     print("错误：DEEPSEEK_API_KEY 环境变量未设置")
     exit(1)  # 如果API密钥未设置，退出程序
 
+log = get_logger("dynamic_model_demo")
+
 # 创建模型实例
 basic_model = ChatDeepSeek(
     model="deepseek-chat",  # 模型名称
@@ -44,17 +47,17 @@ def dynamic_model_selection(request: ModelRequest, handler) -> ModelResponse:
     """
     # 获取当前对话中的消息数量，用于判断对话复杂性
     message_count = len(request.state["messages"])
-    print(f"当前对话消息数量: {message_count}")
+    log.debug("model.messages", "当前对话消息数量: {count}", count=message_count)
 
     # 根据消息数量选择不同的模型处理方式
     if message_count > 10:
         # 对较长的对话，使用推理模型
         model = advanced_model
-        print("使用高级模型处理: deepseek-reasoner")
+        log.info("model.select", "使用高级模型处理: {model}", model="deepseek-reasoner")
     else:
         # 对较短的对话，使用基础模型
         model = basic_model
-        print("使用基础模型处理: deepseek-chat")
+        log.info("model.select", "使用基础模型处理: {model}", model="deepseek-chat")
 
     # 将选择的模型设置到请求中
     request.model = model
@@ -71,6 +74,7 @@ agent = create_agent(
 
 # 测试智能体
 if __name__ == "__main__":
+    configure_demo()  # 日志输出到 stdout，与 print 的顺序一致
     print("=== 测试1：基本对话（消息数量少）===")
     # 测试基本对话（消息数量少）
     result = agent.invoke(
@@ -0,0 +1,453 @@
+# 评测与回归检测示例（离线回放）
+# react_cycle_demo.py、structured_output_tool.py 等示例靠肉眼检查打印结果。
+# 本示例实现一个评测运行器：
+# - RecordingChatModel：包装任意聊天模型（例如 ChatDeepSeek），把每个请求和回复录制下来
+# - ReplayChatModel：按规范化后的请求查找录制的回复，完全离线、结果确定
+# - EvalRunner：以有界并发执行数据集中的用例，评分工具调用是否正确、结构化输出是否有效、
+#   结构化输出是否与期望一致（每个用例指定自己的 schema 和评分函数）、回答是否匹配，
+#   并统计每个构建的延迟和 token 分布
+# - compare_to_baseline：与保存的基线对比，出现回归时返回非零退出码
+# 回放时找不到录制（例如改动了工具集合，请求已经不同）的用例按失败计分，同时单独列出，提示需要重新录制
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware  # 中间件基类
+from langchain.agents.structured_output import ToolStrategy  # 用于结构化输出
+from langchain_core.language_models import BaseChatModel  # 聊天模型基类
+from langchain_core.messages import AIMessage, BaseMessage, message_to_dict, messages_from_dict  # 消息及序列化
+from langchain_core.outputs import ChatGeneration, ChatResult  # 模型输出类型
+from langchain_core.utils.function_calling import convert_to_openai_tool  # 工具 -> JSON Schema
+from pydantic import BaseModel, ValidationError  # 用于校验结构化输出
+from pathlib import Path  # 用于数据集路径
+from typing import Any, Callable  # 用于类型提示
+import asyncio  # 用于并发执行用例
+import hashlib  # 用于生成请求键
+import json  # 用于读写数据集和结果
+import statistics  # 用于统计分布
+import sys  # 用于返回退出码
+import tempfile  # 用于创建临时目录
+import time  # 用于计时
+
+from contact_schema import ContactInfo  # 联系信息模型（与 structured_output_tool.py 相同）
+from local_model_demo import create_local_model, divide, get_weather, search  # 离线模型和示例工具
+
+
+def request_key(messages: list[BaseMessage], tools: list[dict]) -> str:
+    """
+    计算规范化请求的键：只保留影响模型输出的内容（消息类型、文本、工具调用名称和参数、可用工具），
+    忽略每次运行都会变化的消息ID和工具调用ID
+
+    参数：
+    - messages: 发给模型的消息
+    - tools: 绑定的工具（OpenAI格式）
+
+    返回值：
+    - str类型，请求键
+    """
+    canonical = {
+        "messages": [
+            [m.type, m.content, [[c["name"], c["args"]] for c in getattr(m, "tool_calls", [])]]
+            for m in messages
+        ],
+        "tools": sorted(t["function"]["name"] for t in tools),
+    }
+    text = json.dumps(canonical, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class RecordingChatModel(BaseChatModel):
+    """
+    录制模型：把请求转发给 inner 模型，并以规范化请求为键保存回复
+    """
+
+    inner: Any  # 被录制的模型（例如 ChatDeepSeek）
+    recordings: dict  # 请求键 -> 序列化的回复消息（多个绑定实例共享同一个字典）
+    tools: list[dict] = []  # 绑定的工具（OpenAI格式），用于计算请求键
+    bound: Any = None  # inner.bind_tools(...) 的结果
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def bind_tools(self, tools, **kwargs) -> "RecordingChatModel":
+        return self.model_copy(update={
+            "tools": [convert_to_openai_tool(t) for t in tools],
+            "bound": self.inner.bind_tools(tools, **kwargs),
+        })
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = (self.bound or self.inner).invoke(messages, stop=stop, **kwargs)
+        self.recordings[request_key(messages, self.tools)] = message_to_dict(message)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class ReplayMissError(KeyError):
+    """回放时找不到请求对应的录制（智能体发出了录制时没有见过的请求）"""
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    回放模型：按规范化请求返回录制的回复，不访问网络
+    """
+
+    recordings: dict  # 请求键 -> 序列化的回复消息
+    tools: list[dict] = []  # 绑定的工具（OpenAI格式）
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def bind_tools(self, tools, **kwargs) -> "ReplayChatModel":
+        return self.model_copy(update={"tools": [convert_to_openai_tool(t) for t in tools]})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = request_key(messages, self.tools)
+        if key not in self.recordings:
+            raise ReplayMissError(f"回放中没有该请求的录制：{key}")
+        message = messages_from_dict([self.recordings[key]])[0]
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # 只是查字典，直接在事件循环上执行
+        return self._generate(messages, stop, **kwargs)
+
+
+# 结构化输出用例可用的 schema：用例的 schema 字段写名称（cases.jsonl 中只能保存名称）
+SCHEMAS: dict[str, type[BaseModel]] = {"ContactInfo": ContactInfo}
+
+
+def exact_match(response: dict, expected: dict) -> bool:
+    """所有字段完全相同"""
+    return response == expected
+
+
+def field_match(response: dict, expected: dict) -> bool:
+    """只比较期望中给出的字段，忽略首尾空白和大小写"""
+    return all(str(response.get(k, "")).strip().lower() == str(v).strip().lower() for k, v in expected.items())
+
+
+# 结构化输出的评分函数：用例的 scorer 字段写名称，省略时为 exact
+SCORERS: dict[str, Callable[[dict, dict], bool]] = {"exact": exact_match, "fields": field_match}
+
+# 评测用例：agent 指定使用哪个智能体（结构化输出智能体以 schema 名称命名），
+# schema / scorer 指定结构化输出的模型和评分函数，expected_* 为评分标准（省略表示不检查该项）
+CASES = [
+    {"id": "weather-beijing", "agent": "tools", "question": "北京的天气怎么样？",
+     "expected_tools": ["get_weather"], "expected_answer": "北京"},
+    {"id": "weather-shanghai", "agent": "tools", "question": "上海今天天气如何",
+     "expected_tools": ["get_weather"], "expected_answer": "上海"},
+    {"id": "divide", "agent": "tools", "question": "计算 10 除以 2",
+     "expected_tools": ["divide"], "expected_answer": "5.0"},
+    {"id": "divide-large", "agent": "tools", "question": "计算 1000 除以 8",
+     "expected_tools": ["divide"], "expected_answer": "125.0"},
+    {"id": "search-olympics", "agent": "tools", "question": "搜索2024年奥运会在哪里举行",
+     "expected_tools": ["search"], "expected_answer": "奥运会"},
+    {"id": "greeting", "agent": "tools", "question": "你好",
+     "expected_tools": [], "expected_answer": "你好"},
+    {"id": "contact-john", "agent": "ContactInfo", "schema": "ContactInfo",
+     "question": "从以下内容提取联系信息：John Doe, john@example.com, (555) 123-4567",
+     "expected_structured": {"name": "John Doe", "email": "john@example.com", "phone": "(555) 123-4567"}},
+    {"id": "contact-jane", "agent": "ContactInfo", "schema": "ContactInfo", "scorer": "fields",
+     "question": "从以下内容提取联系信息：Jane Smith, jane.smith@example.org, 555-987-6543",
+     "expected_structured": {"name": "jane smith", "email": "jane.smith@example.org"}},
+]
+
+
+def build_agents(model, tools=None, middleware=(), schemas: dict[str, type[BaseModel]] = SCHEMAS) -> dict:
+    """
+    创建评测用到的智能体
+
+    参数：
+    - model: 聊天模型（录制时为 RecordingChatModel，评测时为 ReplayChatModel）
+    - tools: 工具列表，默认为 search / get_weather / divide
+    - middleware: 附加的中间件
+    - schemas: 结构化输出 schema，每个 schema 对应一个同名的智能体
+
+    返回值：
+    - dict类型，智能体名称 -> 智能体
+    """
+    agents = {"tools": create_agent(model, tools=tools or [search, get_weather, divide], middleware=list(middleware))}
+    for name, schema in schemas.items():
+        agents[name] = create_agent(model, tools=[search], response_format=ToolStrategy(schema),
+                                    middleware=list(middleware))
+    return agents
+
+
+def record_dataset(cases: list[dict], model: BaseChatModel, path: Path) -> None:
+    """
+    用真实模型（或本地模型）运行用例并录制回复，保存为数据集目录：cases.jsonl + recordings.json
+    """
+    recorder = RecordingChatModel(inner=model, recordings={})
+    agents = build_agents(recorder)
+    for case in cases:
+        agents[case["agent"]].invoke({"messages": [{"role": "user", "content": case["question"]}]})
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / "cases.jsonl", "w", encoding="utf-8") as f:
+        for case in cases:
+            f.write(json.dumps(case, ensure_ascii=False) + "\n")
+    (path / "recordings.json").write_text(json.dumps(recorder.recordings, ensure_ascii=False), encoding="utf-8")
+
+
+def load_dataset(path: Path) -> tuple[list[dict], dict]:
+    """读取数据集目录，返回 (用例列表, 录制的回复)"""
+    with open(path / "cases.jsonl", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    return cases, json.loads((path / "recordings.json").read_text(encoding="utf-8"))
+
+
+# 检查项 -> 用例中对应的字段（字段存在时才检查）
+CHECKS = {"tool_calls": "expected_tools", "structured_valid": "schema", "structured_match": "expected_structured",
+          "answer": "expected_answer"}
+
+
+def score_case(case: dict, result: dict, schemas: dict[str, type[BaseModel]] = SCHEMAS,
+               scorers: dict[str, Callable[[dict, dict], bool]] = SCORERS) -> dict:
+    """
+    为单个用例评分
+
+    参数：
+    - case: 用例
+    - result: 智能体的运行结果
+    - schemas: schema 名称 -> 模型，结构化输出按用例的 schema 校验
+    - scorers: 评分函数名称 -> 函数，结构化输出按用例的 scorer（默认 exact）与期望比较
+
+    返回值：
+    - dict类型，每个检查项为 True / False，未设置期望的检查项为 None
+    """
+    messages = result["messages"]
+    called = [c["name"] for m in messages if isinstance(m, AIMessage) for c in m.tool_calls]
+    scores = dict.fromkeys(CHECKS)
+    if "expected_tools" in case:
+        # 结构化输出工具不算普通工具调用
+        structured_tools = {schema.__name__ for schema in schemas.values()}
+        called_tools = [name for name in called if name not in structured_tools]
+        scores["tool_calls"] = called_tools == case["expected_tools"]
+    if "schema" in case:
+        try:
+            schema = schemas[case["schema"]]
+            response = schema.model_validate(result.get("structured_response"), from_attributes=True).model_dump()
+            scores["structured_valid"] = True
+        except ValidationError:
+            response = None
+            scores["structured_valid"] = False
+        if "expected_structured" in case:
+            scorer = scorers[case.get("scorer", "exact")]
+            scores["structured_match"] = response is not None and scorer(response, case["expected_structured"])
+    if "expected_answer" in case:
+        scores["answer"] = case["expected_answer"] in str(messages[-1].content)
+    return scores
+
+
+def _distribution(values: list[float]) -> dict:
+    """计算均值、p50、p95"""
+    if not values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0}
+    ordered = sorted(values)
+    return {
+        "mean": statistics.mean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+class EvalRunner:
+    """
+    评测运行器：以有界并发执行用例，汇总评分和延迟/token分布
+    """
+
+    def __init__(self, agents: dict, max_concurrency: int = 8, repeat: int = 1,
+                 schemas: dict[str, type[BaseModel]] = SCHEMAS, scorers: dict[str, Callable] = SCORERS):
+        """
+        参数：
+        - agents: 智能体名称 -> 智能体
+        - max_concurrency: 同时运行的用例数上限
+        - repeat: 每个用例重复运行的次数（用于得到更稳定的延迟分布）
+        - schemas / scorers: 结构化输出用例可引用的 schema 和评分函数
+        """
+        self.agents = agents
+        self.max_concurrency = max_concurrency
+        self.repeat = repeat
+        self.schemas = schemas
+        self.scorers = scorers
+
+    async def _run_case(self, case: dict, semaphore: asyncio.Semaphore) -> dict:
+        latencies, tokens = [], []
+        for _ in range(self.repeat):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    result = await self.agents[case["agent"]].ainvoke(
+                        {"messages": [{"role": "user", "content": case["question"]}]}
+                    )
+                except Exception as e:
+                    # 运行失败或录制中没有这个请求（无法确认行为没变）时，所有设置了期望的检查项都记为失败
+                    scores = {check: False if field in case else None for check, field in CHECKS.items()}
+                    if isinstance(e, ReplayMissError):
+                        return {**scores, "passed": False, "replay_miss": e.args[0]}
+                    return {**scores, "passed": False, "error": f"{type(e).__name__}: {e}"}
+                latencies.append((time.perf_counter() - start) * 1000)
+            tokens.append(sum((m.usage_metadata or {}).get("total_tokens", 0)
+                              for m in result["messages"] if isinstance(m, AIMessage)))
+        scores = score_case(case, result, self.schemas, self.scorers)
+        return {
+            **scores,
+            "passed": all(v is not False for v in scores.values()),
+            "latency_ms": statistics.mean(latencies),
+            "tokens": statistics.mean(tokens),
+        }
+
+    async def arun(self, cases: list[dict], build: str) -> dict:
+        """
+        运行全部用例
+
+        参数：
+        - cases: 用例列表
+        - build: 构建名称（例如 git 提交号）
+
+        返回值：
+        - dict类型，包含每个用例的结果和汇总指标
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*[self._run_case(case, semaphore) for case in cases])
+        per_case = {case["id"]: result for case, result in zip(cases, results)}
+
+        def rate(check):
+            values = [r[check] for r in results if r.get(check) is not None]
+            return sum(values) / len(values) if values else None
+
+        ok = [r for r in results if "latency_ms" in r]
+        return {
+            "build": build,
+            "cases": per_case,
+            "summary": {
+                "pass_rate": rate("passed"),
+                "tool_call_accuracy": rate("tool_calls"),
+                "structured_validity": rate("structured_valid"),
+                "structured_match": rate("structured_match"),
+                "answer_match": rate("answer"),
+                "errors": sum("error" in r for r in results),
+                "replay_misses": sum("replay_miss" in r for r in results),
+                "latency_ms": _distribution([r["latency_ms"] for r in ok]),
+                "tokens": _distribution([r["tokens"] for r in ok]),
+            },
+        }
+
+    def run(self, cases: list[dict], build: str) -> dict:
+        return asyncio.run(self.arun(cases, build))
+
+
+def compare_to_baseline(current: dict, baseline: dict, latency_tolerance: float = 0.5,
+                        latency_floor_ms: float = 5.0, token_tolerance: float = 0.1) -> list[str]:
+    """
+    与基线对比，返回回归列表（为空表示没有回归）
+    回放缺失的用例按失败计入通过率和逐用例对比（见 replay_misses）；延迟和 token 只在两次都成功运行的用例上比较
+
+    参数：
+    - current / baseline: EvalRunner.run 的结果
+    - latency_tolerance: p95 延迟允许的相对增幅
+    - latency_floor_ms: 延迟增幅小于该值时忽略（避免毫秒级抖动误报）
+    - token_tolerance: 平均 token 允许的相对增幅
+    """
+    regressions = []
+    now, before = current["summary"], baseline["summary"]
+    for metric in ("pass_rate", "tool_call_accuracy", "structured_validity", "structured_match", "answer_match"):
+        if now[metric] is not None and before[metric] is not None and now[metric] < before[metric]:
+            regressions.append(f"{metric}: {before[metric]:.0%} -> {now[metric]:.0%}")
+    if now["errors"] > before["errors"]:
+        regressions.append(f"errors: {before['errors']} -> {now['errors']}")
+    common = [case_id for case_id, result in current["cases"].items()
+              if "latency_ms" in result and "latency_ms" in baseline["cases"].get(case_id, {})]
+
+    def distribution(report, metric):
+        return _distribution([report["cases"][case_id][metric] for case_id in common])
+
+    old_p95, new_p95 = distribution(baseline, "latency_ms")["p95"], distribution(current, "latency_ms")["p95"]
+    if new_p95 > old_p95 * (1 + latency_tolerance) and new_p95 - old_p95 > latency_floor_ms:
+        regressions.append(f"latency p95: {old_p95:.1f} ms -> {new_p95:.1f} ms")
+    old_tokens, new_tokens = distribution(baseline, "tokens")["mean"], distribution(current, "tokens")["mean"]
+    if new_tokens > old_tokens * (1 + token_tolerance):
+        regressions.append(f"tokens mean: {old_tokens:.0f} -> {new_tokens:.0f}")
+    for case_id, result in current["cases"].items():
+        previous = baseline["cases"].get(case_id)
+        if previous and previous["passed"] and result["passed"] is False:
+            if "replay_miss" in result:
+                reason = result["replay_miss"]
+            else:
+                reason = result.get("error") or ", ".join(k for k in CHECKS if result[k] is False)
+            regressions.append(f"case {case_id}: {reason}")
+    return regressions
+
+
+def replay_misses(report: dict) -> list[str]:
+    """返回回放时找不到录制的用例：这些用例的请求变了，已按失败计分，重新录制后才能确认是否真的回归"""
+    return [f"case {case_id}: {result['replay_miss']}" for case_id, result in report["cases"].items()
+            if "replay_miss" in result]
+
+
+def print_summary(report: dict) -> None:
+    """打印汇总指标"""
+    s = report["summary"]
+
+    def fmt(value):
+        return "-" if value is None else f"{value:.0%}"
+
+    print(f"[{report['build']}] 通过率 {fmt(s['pass_rate'])} | 工具调用 {fmt(s['tool_call_accuracy'])} | "
+          f"结构化输出 有效 {fmt(s['structured_validity'])} 一致 {fmt(s['structured_match'])} | "
+          f"回答匹配 {fmt(s['answer_match'])} | 错误 {s['errors']} | 回放缺失 {s['replay_misses']}")
+    print(f"  延迟(ms) mean {s['latency_ms']['mean']:.1f} p50 {s['latency_ms']['p50']:.1f} p95 {s['latency_ms']['p95']:.1f} | "
+          f"token mean {s['tokens']['mean']:.0f} p95 {s['tokens']['p95']:.0f}")
+
+
+class SlowModelMiddleware(AgentMiddleware):
+    """模拟一次引入了额外延迟的改动：每次模型调用前等待 delay 秒"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def wrap_model_call(self, request, handler: Callable):
+        time.sleep(self.delay)
+        return handler(request)
+
+    async def awrap_model_call(self, request, handler: Callable):
+        await asyncio.sleep(self.delay)
+        return await handler(request)
+
+
+# 运行评测
+if __name__ == "__main__":
+    work_dir = Path(tempfile.mkdtemp(prefix="eval_demo_"))
+    dataset_dir = work_dir / "dataset"
+    baseline_path = work_dir / "baseline.json"
+
+    print("=== 步骤1：录制数据集 ===")
+    # 这里用本地模型录制；换成 ChatDeepSeek 即可录制真实回复，之后的评测仍然完全离线
+    record_dataset(CASES, create_local_model(), dataset_dir)
+    cases, recordings = load_dataset(dataset_dir)
+    print(f"{len(cases)} 个用例，{len(recordings)} 条录制的模型回复")
+
+    print("\n=== 步骤2：评测基线构建并保存 ===")
+    replay_model = ReplayChatModel(recordings=recordings)
+    baseline = EvalRunner(build_agents(replay_model), max_concurrency=4, repeat=5).run(cases, build="v1")
+    print_summary(baseline)
+    baseline_path.write_text(json.dumps(baseline, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"基线已保存: {baseline_path}")
+
+    print("\n=== 步骤3：评测未改动的构建（应无回归）===")
+    current = EvalRunner(build_agents(replay_model), max_concurrency=4, repeat=5).run(cases, build="v1.1")
+    print_summary(current)
+    print(f"回归: {compare_to_baseline(current, baseline) or '无'}")
+
+    print("\n=== 步骤4：评测有问题的构建（漏注册 divide 工具 + 每次模型调用多 20ms）===")
+    # 工具集合变了，发给模型的请求也变了：工具类用例在回放中找不到录制，按失败计分并提示需要重新录制
+    agents = build_agents(replay_model, tools=[search, get_weather], middleware=[SlowModelMiddleware(0.02)])
+    current = EvalRunner(agents, max_concurrency=4, repeat=5).run(cases, build="v2")
+    print_summary(current)
+    regressions = compare_to_baseline(current, json.loads(baseline_path.read_text(encoding="utf-8")))
+    misses = replay_misses(current)
+    for line in regressions:
+        print(f"  回归: {line}")
+    for line in misses:
+        print(f"  回放缺失（需要重新录制）: {line}")
+    # 退出码：1 有回归（包括基线通过、现在回放缺失的用例）；2 没有回归但有新用例无法评测；0 通过
+    sys.exit(1 if regressions else 2 if misses else 0)
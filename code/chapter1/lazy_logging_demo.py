@@ -0,0 +1,299 @@
+# 惰性结构化日志示例
+# chapter1 中的中间件在热路径上直接 print：dynamic_model_selection 每次模型调用都打印，
+# handle_tool_errors 打印每个异常，CustomMiddleware.before_model 每一步都打印用户偏好。
+# 在压测中，同步写 stdout 会出现在性能剖析结果里。本模块提供一个很薄的日志层：
+# - 关闭时（默认）每次调用只做一次属性检查就返回，不格式化字符串、不创建日志记录
+# - 开启时按事件类型采样（每 N 条保留 1 条），消息和字段到真正写出时才格式化
+# - 日志记录经由队列交给后台线程写出，调用方不等待 I/O
+# 通过环境变量 AGENT_LOG=INFO（或 DEBUG 等，AGENT_LOG=1 等同于 INFO）开启，AGENT_LOG_JSON=1 输出 JSON 行
+
+# 导入必要的库
+from logging.handlers import QueueHandler, QueueListener  # 用于异步写日志
+from typing import Any, TextIO  # 用于类型提示
+import atexit  # 用于退出时写完剩余日志
+import json  # 用于输出 JSON 行
+import logging  # 标准日志库
+import os  # 用于读取环境变量
+import queue  # 日志队列
+import sys  # 用于默认输出流
+import warnings  # 用于提示无法识别的 AGENT_LOG
+
+
+class LazyMessage:
+    """惰性消息：只有在 str() 时才用字段填充模板；字段值可以是无参函数，同样到写出时才调用"""
+
+    __slots__ = ("template", "fields")
+
+    def __init__(self, template: str, fields: dict):
+        self.template = template
+        self.fields = fields
+
+    def resolved(self) -> dict:
+        return {k: v() if callable(v) else v for k, v in self.fields.items()}
+
+    def __str__(self) -> str:
+        return self.template.format(**self.resolved()) if self.fields else self.template
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    把日志记录原样放入队列
+
+    标准库的 QueueHandler.prepare 会在调用方线程里格式化消息，这里改为交给后台线程格式化；
+    字段只应包含不会再被修改的值（或返回这些值的函数）
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON：时间、级别、日志器、事件类型、字段和消息"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.msg
+        fields = message.resolved() if isinstance(message, LazyMessage) else {}
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name,
+                 "event": getattr(record, "event", None), **fields, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AgentLogger:
+    """
+    智能体日志器：debug/info/warning/error(event, template, **fields)
+
+    参数：
+    - event: 事件类型，例如 "model.select"，用于采样和结构化输出
+    - template: str.format 风格的消息模板，例如 "使用{tier}模型处理: {model}"
+    - fields: 模板字段，同时作为结构化字段输出
+    """
+
+    __slots__ = ("_logger", "level", "_counters")
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(f"agent.{name}")
+        self._counters: dict[str, int] = {}
+        self.level = _config["level"]
+
+    @property
+    def enabled(self) -> bool:
+        return self.level is not None
+
+    def log(self, level: int, event: str, template: str = "", exc_info=None, **fields) -> None:
+        if self.level is None or level < self.level:
+            return
+        every = _config["sample"].get(event)
+        if every:
+            count = self._counters[event] = self._counters.get(event, 0) + 1
+            if count % every:
+                return
+        # 直接创建日志记录，跳过 Logger.log 中逐帧查找调用位置（findCaller）的开销
+        record = self._logger.makeRecord(self._logger.name, level, "", 0, LazyMessage(template, fields), (),
+                                         sys.exc_info() if exc_info is True else exc_info, extra={"event": event})
+        self._logger.handle(record)
+
+    def debug(self, event: str, template: str = "", **fields) -> None:
+        if self.level is not None and self.level <= logging.DEBUG:
+            self.log(logging.DEBUG, event, template, **fields)
+
+    def info(self, event: str, template: str = "", **fields) -> None:
+        if self.level is not None and self.level <= logging.INFO:
+            self.log(logging.INFO, event, template, **fields)
+
+    def warning(self, event: str, template: str = "", **fields) -> None:
+        if self.level is not None and self.level <= logging.WARNING:
+            self.log(logging.WARNING, event, template, **fields)
+
+    def error(self, event: str, template: str = "", **fields) -> None:
+        if self.level is not None:
+            self.log(logging.ERROR, event, template, **fields)
+
+
+# 当前配置：level 为 None 表示关闭；sample 为 事件类型 -> 每 N 条保留 1 条
+_config: dict[str, Any] = {"level": None, "sample": {}, "listener": None}
+_loggers: dict[str, AgentLogger] = {}
+_DEFAULT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(event)s] %(message)s"
+
+
+def parse_level(level: int | str | None) -> int | None:
+    """
+    把日志级别转换为整数，None / "" / "OFF" / "NONE" 表示关闭
+
+    参数：
+    - level: 整数级别或级别名称（不区分大小写，例如 "info"）
+
+    返回值：
+    - int类型的级别，关闭时为None；名称无法识别时抛出 ValueError
+    """
+    if level is None or isinstance(level, int):
+        return level
+    name = level.strip().upper()
+    if name in ("", "OFF", "NONE"):
+        return None
+    levels = logging.getLevelNamesMapping()
+    if name not in levels:
+        raise ValueError(f"未知的日志级别: {level!r}，可选值: {', '.join(levels)} 或 OFF")
+    return levels[name]
+
+
+def _level_from_env(value: str) -> int | None:
+    """
+    解析环境变量 AGENT_LOG：级别名称按名称处理，1/true/yes/on 表示 INFO；
+    其他无法识别的值给出警告并按 INFO 处理，不在导入时抛出异常
+    """
+    if value.strip().lower() in ("1", "true", "yes", "on"):
+        return logging.INFO
+    try:
+        return parse_level(value)
+    except ValueError as e:
+        warnings.warn(f"AGENT_LOG: {e}，按 INFO 处理", stacklevel=2)
+        return logging.INFO
+
+
+def get_logger(name: str) -> AgentLogger:
+    """获取（或创建）指定名称的日志器，同名日志器共享采样计数；调用 configure 之前日志关闭，不影响热路径"""
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = AgentLogger(name)
+    return logger
+
+
+def configure(level: int | str | None = "INFO", stream: TextIO | None = None, sample: dict[str, int] | None = None,
+              json_lines: bool = False, fmt: str = _DEFAULT_FORMAT, queued: bool = True) -> None:
+    """
+    开启、调整或关闭日志
+
+    参数：
+    - level: 日志级别（例如 "INFO"），None 表示关闭；名称无法识别时抛出 ValueError
+    - stream: 输出流，默认为 sys.stderr
+    - sample: 事件类型 -> 每 N 条保留 1 条，例如 {"model.select": 100}
+    - json_lines: 是否输出 JSON 行
+    - fmt: 文本格式（json_lines 为 False 时使用），例如 "%(message)s" 只输出消息
+    - queued: 是否经由队列在后台线程写出；为 False 时在调用方线程同步写出，与 print 的先后顺序一致
+    """
+    level = parse_level(level)
+    shutdown()
+    base = logging.getLogger("agent")
+    base.handlers.clear()
+    base.propagate = False
+    _config["level"] = level
+    _config["sample"] = dict(sample or {})
+    for logger in _loggers.values():
+        logger.level = level
+        logger._counters.clear()
+    if level is None:
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(fmt))
+    base.setLevel(level)
+    if not queued:
+        base.addHandler(handler)
+        return
+    records = queue.SimpleQueue()
+    base.addHandler(LazyQueueHandler(records))
+    _config["listener"] = QueueListener(records, handler)
+    _config["listener"].start()
+
+
+def configure_demo() -> None:
+    """
+    示例脚本使用：把日志以纯消息格式同步输出到 stdout，与 print 的输出内容和顺序一致；
+    设置了 AGENT_LOG 环境变量时保留按环境变量的配置
+    """
+    if not os.getenv("AGENT_LOG"):
+        configure("DEBUG", stream=sys.stdout, fmt="%(message)s", queued=False)
+
+
+def shutdown() -> None:
+    """写完队列中剩余的日志并停止后台线程"""
+    listener = _config["listener"]
+    if listener is not None:
+        _config["listener"] = None
+        listener.stop()
+
+
+atexit.register(shutdown)
+if os.getenv("AGENT_LOG"):
+    configure(_level_from_env(os.environ["AGENT_LOG"]), json_lines=os.getenv("AGENT_LOG_JSON") == "1")
+
+
+# 比较 print 与惰性日志的开销
+if __name__ == "__main__":
+    from langchain.agents import create_agent  # 用于创建智能体
+    from langchain.agents.middleware import wrap_model_call  # 用于创建中间件
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # 离线假模型
+    from langchain_core.messages import AIMessage  # 用于构造假模型的回复
+    import contextlib  # 用于重定向 stdout
+    import io  # 用于展示日志输出
+    import itertools  # 用于让假模型循环回复
+    import tempfile  # 用于模拟终端输出
+    import time  # 用于计时
+
+    log = get_logger("benchmark")
+
+    def per_call(func, n: int) -> float:
+        """返回每次调用的纳秒数"""
+        start = time.perf_counter()
+        for i in range(n):
+            func(i)
+        return (time.perf_counter() - start) / n * 1e9
+
+    # 行缓冲的文件，写入行为与终端上的 stdout 相同
+    sink = tempfile.TemporaryFile("w", buffering=1, encoding="utf-8")
+    prefs = {"style": "technical", "verbosity": "detailed"}
+
+    print("=== 测试1：单次调用的开销 ===")
+    n = 200_000
+    cost = per_call(lambda i: None, n)
+    print(f"{'空函数（循环本身的开销）':<32} {cost:>8.0f} ns/次")
+    with contextlib.redirect_stdout(sink):
+        cost = per_call(lambda i: print(f"用户偏好: {prefs}"), n)
+    print(f"{'print（行缓冲文件）':<32} {cost:>8.0f} ns/次")
+    for label, level, sample in [("日志关闭", None, None), ("日志开启，每100条保留1条", "INFO", {"prefs": 100}),
+                                 ("日志开启，全部写出", "INFO", None)]:
+        configure(level, stream=sink, sample=sample)
+        cost = per_call(lambda i: log.info("prefs", "用户偏好: {prefs}", prefs=prefs), n)
+        shutdown()  # 等后台线程写完再测下一项
+        print(f"{label:<32} {cost:>8.0f} ns/次")
+
+    print("\n=== 测试2：智能体吞吐量（每次模型调用记录一条日志）===")
+
+    @wrap_model_call
+    def print_selection(request, handler):
+        print(f"当前对话消息数量: {len(request.state['messages'])}")
+        return handler(request)
+
+    @wrap_model_call
+    def log_selection(request, handler):
+        log.info("model.select", "当前对话消息数量: {count}", count=len(request.state["messages"]))
+        return handler(request)
+
+    def throughput(middleware, n: int = 2000) -> float:
+        model = GenericFakeChatModel(messages=itertools.cycle([AIMessage(content="好的")]))
+        agent = create_agent(model, tools=[], middleware=[middleware])
+        inputs = {"messages": [{"role": "user", "content": "你好"}]}
+        start = time.perf_counter()
+        for _ in range(n):
+            agent.invoke(inputs)
+        return n / (time.perf_counter() - start)
+
+    with contextlib.redirect_stdout(sink):
+        rate = throughput(print_selection)
+    print(f"{'print（行缓冲文件）':<32} {rate:>8.0f} 次/秒")
+    for label, level, sample in [("日志关闭", None, None), ("日志开启，每100条保留1条", "INFO", {"model.select": 100}),
+                                 ("日志开启，全部写出", "INFO", None)]:
+        configure(level, stream=sink, sample=sample)
+        rate = throughput(log_selection)
+        shutdown()
+        print(f"{label:<32} {rate:>8.0f} 次/秒")
+
+    print("\n=== 测试3：JSON 行输出（model.select 每2条保留1条）===")
+    buffer = io.StringIO()
+    configure("INFO", stream=buffer, json_lines=True, sample={"model.select": 2})
+    for count in range(1, 5):
+        log.info("model.select", "使用{tier}模型处理: {model}", tier="基础", model="deepseek-chat", count=count)
+    get_logger("tools").error("tool.error", "捕获到工具错误: {error}", error="division by zero")
+    shutdown()
+    print(buffer.getvalue(), end="")
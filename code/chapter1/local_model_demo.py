@@ -0,0 +1,433 @@
+# 本地模型后端示例（离线 / 低延迟兜底）
+# 本示例演示如何实现一个在本机CPU上运行的聊天模型，并像 ChatDeepSeek 一样传给 create_agent：
+# - LocalChatModel：实现 bind_tools，用“受约束的JSON输出”完成工具调用
+# - LlamaCppBackend：通过 llama-cpp-python 运行小型量化模型（可选依赖，按JSON Schema约束解码）
+# - RuleBackend：确定性的规则后端，不需要模型文件，适合测试和离线批处理
+# 本地模型既可以单独使用，也可以通过 ModelFallbackMiddleware 作为 DeepSeek 超时/出错时的兜底
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import ModelFallbackMiddleware  # 模型兜底中间件
+from langchain.tools import tool  # 用于定义工具
+from langchain_core.exceptions import OutputParserException  # 模型输出不满足Schema时抛出
+from langchain_core.language_models import BaseChatModel  # 聊天模型基类
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage  # 消息类型
+from langchain_core.outputs import ChatGeneration, ChatResult  # 模型输出类型
+from langchain_core.utils.function_calling import convert_to_openai_tool  # 工具 -> JSON Schema
+from dotenv import load_dotenv  # 用于加载环境变量
+from typing import Any  # 用于类型提示
+import json  # 用于解析受约束的JSON输出
+import os  # 用于访问环境变量
+import re  # 用于规则后端的参数抽取
+import time  # 用于计时
+import uuid  # 用于生成工具调用ID
+
+
+def build_decision_schema(tools: list[dict], tool_choice: Any = None) -> dict:
+    """
+    构造模型输出必须满足的JSON Schema：要么直接回答，要么调用某个工具（参数满足该工具的参数Schema）
+
+    参数：
+    - tools: OpenAI格式的工具定义列表
+    - tool_choice: "any" / "required" 表示必须调用工具
+
+    返回值：
+    - dict类型，JSON Schema
+    """
+    branches = []
+    if tool_choice not in ("any", "required") or not tools:
+        branches.append({
+            "type": "object",
+            "properties": {"type": {"const": "answer"}, "content": {"type": "string"}},
+            "required": ["type", "content"],
+        })
+    for t in tools:
+        function = t["function"]
+        branches.append({
+            "type": "object",
+            "properties": {
+                "type": {"const": "tool_call"},
+                "name": {"const": function["name"]},
+                "arguments": function.get("parameters", {"type": "object", "properties": {}}),
+            },
+            "required": ["type", "name", "arguments"],
+        })
+    return branches[0] if len(branches) == 1 else {"anyOf": branches}
+
+
+# JSON Schema 类型 -> Python 类型（bool 是 int 的子类，单独排除）
+_JSON_TYPES = {"object": dict, "array": list, "string": str, "integer": int, "number": (int, float),
+               "boolean": bool, "null": type(None)}
+
+
+def _is_type(value, name: str) -> bool:
+    if name in ("integer", "number") and isinstance(value, bool):
+        return False
+    return isinstance(value, _JSON_TYPES.get(name, object))
+
+
+def schema_errors(value, schema: dict, path: str = "$") -> list[str]:
+    """
+    按 build_decision_schema 生成的 JSON Schema 校验值（支持 anyOf / const / enum / type / required / properties / items，
+    其他关键字忽略）
+
+    返回值：
+    - list[str]类型，错误列表，为空表示通过
+    """
+    if "anyOf" in schema:
+        branches = [schema_errors(value, branch, path) for branch in schema["anyOf"]]
+        return [] if not all(branches) else [f"{path}: 不满足任何一个分支（{'；'.join(e[0] for e in branches)}）"]
+    if "const" in schema and value != schema["const"]:
+        return [f"{path}: 应为 {schema['const']!r}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: 应为 {schema['enum']!r} 之一"]
+    types = schema.get("type")
+    if types and not any(_is_type(value, t) for t in ([types] if isinstance(types, str) else types)):
+        return [f"{path}: 类型应为 {types}"]
+    errors = []
+    if isinstance(value, dict):
+        errors += [f"{path}.{name}: 缺少必填字段" for name in schema.get("required", []) if name not in value]
+        for name, spec in schema.get("properties", {}).items():
+            if name in value:
+                errors += schema_errors(value[name], spec, f"{path}.{name}")
+    elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(value):
+            errors += schema_errors(item, schema["items"], f"{path}[{i}]")
+    return errors
+
+
+def _tools_prompt(schema: dict) -> str:
+    """把可用工具和输出格式写成系统提示：约束解码只保证格式，模型还需要知道每个工具的用途"""
+    branches = schema.get("anyOf", [schema])
+    tools = [b for b in branches if b["properties"]["type"]["const"] == "tool_call"]
+    lines = ['只输出一个JSON对象：调用工具时为 {"type": "tool_call", "name": 工具名称, "arguments": 参数}']
+    if len(tools) < len(branches):
+        lines[0] += '，直接回答时为 {"type": "answer", "content": 回答}'
+    else:
+        lines.append("必须调用一个工具。")
+    if tools:
+        lines.append("可用工具：")
+    for branch in tools:
+        arguments = json.dumps(branch["properties"]["arguments"], ensure_ascii=False)
+        lines.append(f"- {branch['properties']['name']['const']}：{branch.get('description', '').strip()} 参数Schema：{arguments}")
+    return "\n".join(lines)
+
+
+def _to_chat_dicts(messages, schema: dict | None = None) -> list[dict]:
+    """
+    把 LangChain 消息转换为 llama.cpp 使用的 OpenAI 消息格式
+
+    - 助手消息保留 tool_calls，并把调用写成与输出格式相同的JSON内容（不渲染 tool_calls 的聊天模板也能看到）
+    - 工具消息保留 tool_call_id
+    - 给出 schema 时，把可用工具和输出格式加到系统提示中
+    """
+    roles = {"system": "system", "human": "user", "ai": "assistant", "tool": "tool"}
+    chat = []
+    for m in messages:
+        item = {"role": roles.get(m.type, "user"), "content": str(m.content)}
+        if isinstance(m, AIMessage) and m.tool_calls:
+            item["tool_calls"] = [
+                {"id": c["id"], "type": "function",
+                 "function": {"name": c["name"], "arguments": json.dumps(c["args"], ensure_ascii=False)}}
+                for c in m.tool_calls
+            ]
+            if not item["content"]:
+                item["content"] = "\n".join(
+                    json.dumps({"type": "tool_call", "name": c["name"], "arguments": c["args"]}, ensure_ascii=False)
+                    for c in m.tool_calls
+                )
+        elif isinstance(m, ToolMessage):
+            item["tool_call_id"] = m.tool_call_id
+        chat.append(item)
+    if schema is not None:
+        prompt = _tools_prompt(schema)
+        if chat and chat[0]["role"] == "system":
+            chat[0]["content"] = f"{chat[0]['content']}\n\n{prompt}"
+        else:
+            chat.insert(0, {"role": "system", "content": prompt})
+    return chat
+
+
+class LlamaCppBackend:
+    """
+    llama.cpp 后端：在CPU上运行 GGUF 量化模型，并用JSON Schema约束输出
+
+    需要安装：pip install llama-cpp-python
+    """
+
+    def __init__(self, model_path: str, n_ctx: int = 4096, n_threads: int | None = None):
+        """
+        参数：
+        - model_path: GGUF 模型文件路径（例如 Qwen2.5-0.5B-Instruct 的 Q4_K_M 量化版本）
+        - n_ctx: 上下文长度
+        - n_threads: CPU线程数，默认使用全部核心
+        """
+        try:
+            from llama_cpp import Llama  # 可选依赖，只在使用本后端时导入
+        except ImportError as e:
+            raise ImportError("LlamaCppBackend 需要 llama-cpp-python：pip install llama-cpp-python") from e
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+
+    def complete(self, messages, schema: dict) -> tuple[str, int]:
+        """
+        生成满足 schema 的JSON文本
+
+        返回值：
+        - (JSON文本, 生成的token数)
+        """
+        response = self.llm.create_chat_completion(
+            messages=_to_chat_dicts(messages, schema),
+            response_format={"type": "json_object", "schema": schema},  # 语法约束解码
+            temperature=0,
+        )
+        return response["choices"][0]["message"]["content"], response["usage"]["completion_tokens"]
+
+
+# 提取文本特征时忽略的常见字
+_STOP_CHARS = set("的了是在和与及或吗呢啊怎么样什么如何请帮我你一个些参数返回值类型")
+
+
+def text_features(text: str) -> set[str]:
+    """
+    文本特征：二元组 + 单个汉字（忽略常见字），用于按关键词重合度匹配工具
+
+    参数：
+    - text: 任意文本
+
+    返回值：
+    - set[str]类型，特征集合
+    """
+    text = re.sub(r"\W+", "", text.lower())
+    bigrams = {text[i:i + 2] for i in range(len(text) - 1)}
+    chars = {c for c in text if "\u4e00" <= c <= "\u9fff" and c not in _STOP_CHARS}
+    return bigrams | chars
+
+
+class RuleBackend:
+    """
+    确定性规则后端：按关键词选择工具，用正则抽取参数，输出与 LlamaCppBackend 相同格式的JSON
+
+    相同输入永远得到相同输出，适合测试、回放和离线批处理
+    """
+
+    # 参数名 -> 抽取规则
+    _EXTRACTORS = {
+        "email": re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+"),
+        "phone": re.compile(r"\(?\d{3}\)?[\s-]?\d{3}-\d{4}|1\d{10}"),
+    }
+
+    def _pick_tool(self, question: str, branches: list[dict]) -> dict | None:
+        """按问题与工具名/描述的特征重合度选择工具，没有任何重合时返回None"""
+        words = text_features(question)
+        best, best_score = None, 0
+        for branch in branches:
+            described = branch.get("description", "") + branch["properties"]["name"]["const"]
+            score = len(words & text_features(described))
+            if score > best_score:
+                best, best_score = branch, score
+        return best
+
+    def _arguments(self, question: str, parameters: dict) -> dict:
+        """根据参数类型从问题中抽取参数"""
+        numbers = iter(re.findall(r"-?\d+(?:\.\d+)?", question))
+        text = re.sub(r"[？?。！!]+$", "", question.strip())
+        arguments = {}
+        for name, spec in parameters.get("properties", {}).items():
+            if spec.get("type") in ("integer", "number"):
+                value = next(numbers, "0")
+                arguments[name] = int(float(value)) if spec["type"] == "integer" else float(value)
+            elif name in self._EXTRACTORS:
+                match = self._EXTRACTORS[name].search(question)
+                arguments[name] = match.group(0) if match else ""
+            elif name == "name":
+                # 取第一个逗号前的内容作为姓名，例如“John Doe, john@example.com”
+                arguments[name] = re.split(r"[，,]", text.split("：")[-1])[0].strip()
+            else:
+                arguments[name] = text
+        return arguments
+
+    def complete(self, messages, schema: dict) -> tuple[str, int]:
+        """
+        生成满足 schema 的JSON文本
+
+        返回值：
+        - (JSON文本, 生成的“token”数，按字符估算)
+        """
+        branches = schema.get("anyOf", [schema])
+        tool_branches = [b for b in branches if b["properties"]["type"]["const"] == "tool_call"]
+        can_answer = len(tool_branches) < len(branches)
+        last = messages[-1]
+
+        if isinstance(last, ToolMessage) and not can_answer:
+            # 必须调用工具且已拿到工具结果：调用最后一个工具（结构化输出工具总是排在最后）
+            question = next((str(m.content) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+            branch = tool_branches[-1]
+            decision = {
+                "type": "tool_call",
+                "name": branch["properties"]["name"]["const"],
+                "arguments": self._arguments(question, branch["properties"]["arguments"]),
+            }
+        elif isinstance(last, ToolMessage):
+            # 已拿到工具结果：整理成最终回答
+            results = []
+            for m in reversed(messages):
+                if not isinstance(m, ToolMessage):
+                    break
+                results.append(str(m.content))
+            decision = {"type": "answer", "content": "根据查询结果：" + "；".join(reversed(results))}
+        else:
+            question = next((str(m.content) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+            branch = self._pick_tool(question, tool_branches)
+            if branch is None and not can_answer:
+                branch = tool_branches[0]  # 必须调用工具时（如结构化输出），退回第一个工具
+            if branch is not None:
+                decision = {
+                    "type": "tool_call",
+                    "name": branch["properties"]["name"]["const"],
+                    "arguments": self._arguments(question, branch["properties"]["arguments"]),
+                }
+            else:
+                decision = {"type": "answer", "content": f"（本地模型）收到：{question}"}
+        text = json.dumps(decision, ensure_ascii=False)
+        return text, len(text)
+
+
+class LocalChatModel(BaseChatModel):
+    """
+    本地聊天模型：后端输出受JSON Schema约束的决策，再转换为 AIMessage（含 tool_calls）
+    """
+
+    backend: Any  # LlamaCppBackend 或 RuleBackend
+    tools: list[dict] = []  # bind_tools 绑定的工具（OpenAI格式）
+    tool_choice: Any = None  # bind_tools 传入的 tool_choice
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-chat"
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs) -> "LocalChatModel":
+        """绑定工具，返回新的模型实例（与 ChatDeepSeek.bind_tools 用法相同）"""
+        return self.model_copy(update={"tools": [convert_to_openai_tool(t) for t in tools], "tool_choice": tool_choice})
+
+    def _schema(self) -> dict:
+        schema = build_decision_schema(self.tools, self.tool_choice)
+        # 把工具描述附在分支上，供规则后端打分（llama.cpp 会忽略未知字段）
+        descriptions = {t["function"]["name"]: t["function"].get("description", "") for t in self.tools}
+        for branch in schema.get("anyOf", [schema]):
+            name = branch["properties"].get("name", {}).get("const")
+            if name:
+                branch["description"] = descriptions[name]
+        return schema
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        schema = self._schema()
+        text, tokens = self.backend.complete(messages, schema)
+        try:
+            decision = json.loads(text)
+        except ValueError as e:
+            raise OutputParserException(f"本地模型输出不是JSON：{text}", llm_output=text) from e
+        # 后端不一定支持约束解码（或模型截断了输出），转换为 AIMessage 前按决策Schema校验
+        errors = schema_errors(decision, schema)
+        if errors:
+            raise OutputParserException("本地模型输出不满足决策Schema：" + "；".join(errors), llm_output=text)
+        if decision["type"] == "tool_call":
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": decision["name"], "args": decision["arguments"], "id": f"call_{uuid.uuid4().hex[:12]}"}],
+            )
+        else:
+            message = AIMessage(content=decision["content"])
+        message.usage_metadata = {"input_tokens": 0, "output_tokens": tokens, "total_tokens": tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def create_local_model() -> LocalChatModel:
+    """
+    创建本地模型：设置了 LOCAL_MODEL_PATH 环境变量时使用 llama.cpp，否则使用规则后端
+    """
+    model_path = os.getenv("LOCAL_MODEL_PATH")
+    backend = LlamaCppBackend(model_path) if model_path else RuleBackend()
+    return LocalChatModel(backend=backend)
+
+
+# 定义工具（与 tools_demo.py、tool_error_handling.py 相同）
+@tool
+def search(query: str) -> str:
+    """
+    搜索信息
+
+    参数：
+    - query: str类型，搜索查询词
+
+    返回值：
+    - str类型，搜索结果
+    """
+    return f"结果：{query}"
+
+
+@tool
+def get_weather(location: str) -> str:
+    """
+    获取位置的天气信息
+
+    参数：
+    - location: str类型，位置名称
+
+    返回值：
+    - str类型，天气信息
+    """
+    return f"{location} 的天气：晴朗，72°F"
+
+
+@tool
+def divide(a: int, b: int) -> str:
+    """
+    执行除法运算
+
+    参数：
+    - a: int类型，被除数
+    - b: int类型，除数
+
+    返回值：
+    - str类型，除法结果
+    """
+    return str(a / b)
+
+
+# 测试本地模型
+if __name__ == "__main__":
+    load_dotenv()
+    local_model = create_local_model()
+    print(f"本地模型后端: {type(local_model.backend).__name__}")
+
+    print("\n=== 测试1：本地模型驱动的智能体 ===")
+    agent = create_agent(model=local_model, tools=[search, get_weather, divide])
+    for question in ["北京的天气怎么样？", "计算 10 除以 2", "你好"]:
+        result = agent.invoke({"messages": [{"role": "user", "content": question}]})
+        print(f"用户：{question}")
+        print(f"智能体：{result['messages'][-1].content}")
+
+    print("\n=== 测试2：CPU吞吐量 ===")
+    runs = 200
+    tokens = 0
+    start = time.perf_counter()
+    for i in range(runs):
+        result = agent.invoke({"messages": [{"role": "user", "content": f"第{i}个城市的天气怎么样？"}]})
+        tokens += sum(m.usage_metadata["output_tokens"] for m in result["messages"] if isinstance(m, AIMessage))
+    elapsed = time.perf_counter() - start
+    print(f"{runs} 次智能体运行: {runs / elapsed:.1f} 次/秒, {tokens / elapsed:.0f} 输出token/秒, 平均 {elapsed / runs * 1000:.2f} ms/次")
+
+    # 作为 DeepSeek 的兜底：DeepSeek 超时（2秒）或出错时改用本地模型
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if api_key:
+        from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+
+        print("\n=== 测试3：DeepSeek 超时兜底 ===")
+        model = ChatDeepSeek(model="deepseek-chat", api_key=api_key, timeout=2, max_retries=0)
+        agent = create_agent(
+            model=model,
+            tools=[search, get_weather],
+            middleware=[ModelFallbackMiddleware(local_model)],  # 主模型失败时使用本地模型
+        )
+        result = agent.invoke({"messages": [{"role": "user", "content": "上海的天气怎么样？"}]})
+        print("智能体回复:", result["messages"][-1].content)
@@ -8,6 +8,7 @@ from langchain.tools import tool  # 用于定义工具
 from langchain.agents.middleware import wrap_model_call, ModelRequest, ModelResponse  # 用于动态模型选择
 from langchain.agents.structured_output import ToolStrategy  # 用于结构化输出
 from pydantic import BaseModel  # 用于定义数据模型
+from lazy_logging_demo import configure_demo, get_logger  # 惰性日志
 from dotenv import load_dotenv  # 用于加载环境变量
 import os  # 用于访问环境变量
 from typing import TypedDict  # 用于类型化字典
@@ -21,6 +22,8 @@ if not api_key:
     print("错误：DEEPSEEK_API_KEY 环境变量未设置")
     exit(1)  # 如果API密钥未设置，退出程序
 
+log = get_logger("middleware_demo")
+
 # 1. 定义工具
 print("=== 1. 定义工具 ===")
 
@@ -99,7 +102,7 @@ def dynamic_model_selection(request: ModelRequest, handler) -> ModelResponse:
     - ModelResponse类型，模型响应
     """
     message_count = len(request.state["messages"])
-    print(f"消息数量: {message_count}")
+    log.debug("model.messages", "消息数量: {count}", count=message_count)
 
     # 这里可以根据需要选择不同的模型
     # 目前我们只有一个模型，所以直接使用
@@ -161,5 +164,6 @@ def test_agent():
 
 # 7. 运行测试
 if __name__ == "__main__":
+    configure_demo()  # 日志输出到 stdout，与 print 的顺序一致
     test_agent()
     print("\n所有测试完成！")
\ No newline at end of file
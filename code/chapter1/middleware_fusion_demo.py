@@ -0,0 +1,430 @@
+# 中间件链融合示例
+# 本示例演示如何在创建智能体前分析中间件列表，减少每一步的中间件开销：
+# 1. 去掉完全无操作的钩子（如只写了 return None 的 before_model、直接 return handler(request) 的 wrap_model_call）
+# 2. 把相邻的 before_model 钩子融合成一个图节点，多个状态更新在一次合并中完成
+# 3. 用微基准测试比较 1、5、20 个中间件时每一步的开销
+
+# 导入必要的库
+from langchain.agents import create_agent, AgentState  # 用于创建智能体和状态
+from langchain.agents.middleware import AgentMiddleware, wrap_model_call, ModelRequest, ModelResponse  # 中间件相关
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # 离线假模型，便于压测
+from langchain_core.messages import AIMessage  # 用于构造假模型的回复
+from langgraph.channels.binop import BinaryOperatorAggregate  # 带归并函数的状态通道
+from langgraph.graph import StateGraph  # 用于解析状态模式中的归并函数
+from langgraph.types import Overwrite  # 用于跳过图对融合结果的再次归并
+from typing import Any, Callable  # 用于类型提示
+import ast  # 用于静态分析钩子源码
+import inspect  # 用于获取钩子源码
+import itertools  # 用于让假模型循环回复
+import textwrap  # 用于去掉方法源码的缩进
+import time  # 用于计时
+
+# 需要检查的 before_model 钩子名称
+_HOOKS = ("before_model", "abefore_model")
+
+
+def _user_function(method) -> Any:
+    """
+    取出钩子背后真正的用户函数
+
+    @before_model / @wrap_model_call 等装饰器会把用户函数包在闭包里（变量名为func），
+    AgentMiddleware 子类则直接定义方法
+
+    参数：
+    - method: 中间件类上的钩子方法
+
+    返回值：
+    - 用户编写的函数
+    """
+    try:
+        return inspect.getclosurevars(method).nonlocals.get("func", method)
+    except TypeError:
+        return method
+
+
+def _function_ast(func) -> ast.FunctionDef | ast.AsyncFunctionDef | None:
+    """
+    解析函数源码，返回函数定义节点；拿不到源码时返回None（此时不做任何优化）
+    """
+    try:
+        source = textwrap.dedent(inspect.getsource(func))
+    except (OSError, TypeError):
+        return None
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            return node
+    return None
+
+
+def _own_nodes(func_node):
+    """遍历函数体内的节点，但不进入嵌套的函数和lambda"""
+    stack = list(func_node.body)
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        stack.extend(ast.iter_child_nodes(node))
+
+
+def _is_none(node) -> bool:
+    return node is None or (isinstance(node, ast.Constant) and node.value is None)
+
+
+def _body_without_docstring(func_node) -> list:
+    body = func_node.body
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+        body = body[1:]
+    return body
+
+
+def always_returns_none(func) -> bool:
+    """
+    判断钩子是否无条件返回None（即只观察状态、从不产生状态更新）
+
+    参数：
+    - func: 用户编写的钩子函数
+
+    返回值：
+    - bool类型，能证明始终返回None时为True
+    """
+    func_node = _function_ast(func)
+    if func_node is None:
+        return False
+    for node in _own_nodes(func_node):
+        if isinstance(node, (ast.Yield, ast.YieldFrom)):
+            return False
+        if isinstance(node, ast.Return) and not _is_none(node.value):
+            return False
+    return True
+
+
+def is_noop(func) -> bool:
+    """
+    判断钩子是否完全无操作：函数体只有 pass / return None / 文档字符串
+    """
+    func_node = _function_ast(func)
+    if func_node is None:
+        return False
+    return all(
+        isinstance(stmt, ast.Pass) or (isinstance(stmt, ast.Return) and _is_none(stmt.value))
+        for stmt in _body_without_docstring(func_node)
+    )
+
+
+def is_passthrough_wrapper(func) -> bool:
+    """
+    判断 wrap_model_call 是否只是原样转发：函数体只有 return handler(request)
+    """
+    func_node = _function_ast(func)
+    if func_node is None:
+        return False
+    params = [a.arg for a in func_node.args.args if a.arg != "self"]
+    body = _body_without_docstring(func_node)
+    if len(params) != 2 or len(body) != 1 or not isinstance(body[0], ast.Return):
+        return False
+    call = body[0].value
+    if isinstance(call, ast.Await):
+        call = call.value
+    return (
+        isinstance(call, ast.Call)
+        and isinstance(call.func, ast.Name) and call.func.id == params[1]
+        and len(call.args) == 1 and not call.keywords
+        and isinstance(call.args[0], ast.Name) and call.args[0].id == params[0]
+    )
+
+
+def _overridden(m: AgentMiddleware, hook: str) -> bool:
+    """判断中间件是否重写了某个钩子"""
+    return getattr(m.__class__, hook) is not getattr(AgentMiddleware, hook)
+
+
+def _without_hooks(m: AgentMiddleware, hooks: tuple[str, ...]) -> AgentMiddleware | None:
+    """
+    复制一个去掉指定钩子的中间件实例（工具、状态模式和其他钩子保持不变）
+
+    返回值：
+    - 新的中间件实例；如果去掉后中间件已经没有任何作用，返回None
+    """
+    cls = m.__class__
+    stripped_cls = type(cls.__name__, (cls,), {hook: getattr(AgentMiddleware, hook) for hook in hooks})
+    stripped = stripped_cls.__new__(stripped_cls)
+    stripped.__dict__.update(m.__dict__)
+
+    hook_names = [name for name in vars(AgentMiddleware) if name.startswith(("before_", "after_", "wrap_", "abefore_", "aafter_", "awrap_"))]
+    has_hooks = any(_overridden(stripped, name) for name in hook_names)
+    has_state = stripped.state_schema is not AgentState
+    if not has_hooks and not getattr(stripped, "tools", None) and not has_state:
+        return None
+    return stripped
+
+
+class FusedBeforeModelMiddleware(AgentMiddleware):
+    """
+    融合后的 before_model 中间件：在一个图节点内依次执行多个钩子，
+    并把它们的状态更新合并成一次返回
+    """
+
+    def __init__(self, members: list[AgentMiddleware], index: int, reducers: dict[str, Callable] | None = None):
+        super().__init__()
+        self.members = members  # 被融合的原始中间件（保持原顺序）
+        self.reducers = reducers or {}  # 状态键 -> 归并函数（如 messages 的 add_messages）
+        self._name = f"FusedBeforeModel{index}"
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def _merge(self, view, written: set, result) -> Any:
+        """
+        按图的通道归并规则把一个钩子的返回值应用到当前状态上，返回下一个钩子看到的状态
+
+        与图逐个节点执行时的行为一致：带归并函数的键（add_messages、Annotated[list, operator.add] 等）
+        调用归并函数，其余键直接覆盖
+        """
+        if result is None:
+            return view  # 观察型钩子：不产生更新，也不需要复制状态
+        if not isinstance(result, dict):
+            raise TypeError(f"融合的 before_model 钩子只能返回 dict 或 None，实际为 {type(result).__name__}")
+        view = dict(view)
+        for key, value in result.items():
+            reducer = self.reducers.get(key)
+            view[key] = reducer(view[key], value) if reducer is not None and key in view else value
+            written.add(key)
+        return view
+
+    def _update(self, view, written: set) -> dict[str, Any] | None:
+        """
+        生成本节点的状态更新：带归并函数的键已在 view 中归并完成，用 Overwrite 整体写入，避免图再归并一次
+        """
+        if not written:
+            return None
+        return {key: Overwrite(view[key]) if key in self.reducers else view[key] for key in written}
+
+    def before_model(self, state: AgentState, runtime) -> dict[str, Any] | None:
+        written: set[str] = set()
+        view = state
+        for m in self.members:
+            view = self._merge(view, written, m.before_model(view, runtime))
+        return self._update(view, written)
+
+    async def abefore_model(self, state: AgentState, runtime) -> dict[str, Any] | None:
+        written: set[str] = set()
+        view = state
+        for m in self.members:
+            if _overridden(m, "abefore_model"):
+                result = await m.abefore_model(view, runtime)
+            else:
+                result = m.before_model(view, runtime)
+            view = self._merge(view, written, result)
+        return self._update(view, written)
+
+
+def state_reducers(schemas) -> dict[str, Callable]:
+    """
+    收集状态模式中所有带归并函数的键（与 create_agent 合并状态模式后的通道一致）
+
+    参数：
+    - schemas: 状态模式列表，例如 AgentState、自定义 state_schema 和各中间件的 state_schema
+
+    返回值：
+    - dict类型，状态键 -> 归并函数
+    """
+    reducers: dict[str, Callable] = {}
+    for schema in schemas:
+        for key, channel in StateGraph(schema).channels.items():
+            if isinstance(channel, BinaryOperatorAggregate):
+                reducers[key] = channel.operator
+    return reducers
+
+
+def _can_jump(m: AgentMiddleware) -> bool:
+    """带 can_jump_to 的钩子会改变图的路由，不能融合"""
+    return any(getattr(getattr(m.__class__, hook), "__can_jump_to__", None) for hook in _HOOKS)
+
+
+def fuse_middleware(middleware: list[AgentMiddleware], verbose: bool = False,
+                    state_schema: type | None = None) -> list[AgentMiddleware]:
+    """
+    分析中间件列表并返回优化后的列表，执行顺序和语义保持不变
+
+    参数：
+    - middleware: 原始中间件列表
+    - verbose: 是否打印优化报告
+    - state_schema: 传给 create_agent 的自定义状态模式（用于确定各状态键的归并函数）
+
+    返回值：
+    - 优化后的中间件列表
+    """
+    report = []
+    result: list[AgentMiddleware] = []
+    run: list[tuple[AgentMiddleware, int]] = []  # 当前连续可融合的 before_model 钩子，以及它在 result 中的位置
+    fused_count = 0
+    schemas = [AgentState, *([state_schema] if state_schema else []), *(m.state_schema for m in middleware)]
+    reducers = state_reducers(schemas)
+
+    def flush_run():
+        nonlocal fused_count
+        if len(run) == 1:
+            # 只有一个钩子时无需融合，放回原始中间件
+            m, position = run[0]
+            result.insert(position, m)
+        elif run:
+            fused_count += 1
+            members = [m for m, _ in run]
+            fused = FusedBeforeModelMiddleware(members, fused_count, reducers)
+            report.append(f"融合 {len(members)} 个 before_model 钩子 -> {fused.name}: {[m.name for m in members]}")
+            # 其余钩子（wrap_model_call 等）仍由去掉 before_model 的副本在原位置提供，顺序不变；
+            # 倒序插入，保证前面记录的位置不受影响
+            for m, position in reversed(run):
+                stripped = _without_hooks(m, _HOOKS)
+                if stripped is not None:
+                    result.insert(position, stripped)
+            # 融合节点放在第一个成员的位置
+            result.insert(run[0][1], fused)
+        run.clear()
+
+    for m in middleware:
+        # 1. 去掉原样转发的 wrap_model_call
+        if _overridden(m, "wrap_model_call") and not _overridden(m, "awrap_model_call") \
+                and is_passthrough_wrapper(_user_function(m.__class__.wrap_model_call)):
+            report.append(f"移除原样转发的 wrap_model_call: {m.name}")
+            m = _without_hooks(m, ("wrap_model_call",))
+            if m is None:
+                continue
+
+        has_before = _overridden(m, "before_model") or _overridden(m, "abefore_model")
+        if not has_before:
+            result.append(m)
+            continue
+
+        # 2. 去掉完全无操作的 before_model
+        if not _overridden(m, "abefore_model") and is_noop(_user_function(m.__class__.before_model)):
+            report.append(f"移除无操作的 before_model: {m.name}")
+            m = _without_hooks(m, _HOOKS)
+            if m is not None:
+                result.append(m)
+            continue
+
+        # 3. 收集可融合的 before_model（会跳转的钩子改变路由，不能融合）
+        if _can_jump(m):
+            flush_run()
+            result.append(m)
+            continue
+        if always_returns_none(_user_function(m.__class__.before_model)):
+            report.append(f"观察型 before_model（无条件返回None）: {m.name}")
+        # 先记录位置（前面有多少个非融合中间件），等整段收集完后再决定放回原始中间件还是融合
+        run.append((m, len(result)))
+
+    flush_run()
+
+    if verbose:
+        print("=== 中间件融合报告 ===")
+        for line in report or ["没有可优化的钩子"]:
+            print(f"- {line}")
+    return result
+
+
+def create_fused_agent(*args, middleware=(), verbose: bool = False, **kwargs):
+    """
+    与 create_agent 用法相同，但会先融合中间件列表
+    """
+    fused = fuse_middleware(list(middleware), verbose=verbose, state_schema=kwargs.get("state_schema"))
+    return create_agent(*args, middleware=fused, **kwargs)
+
+
+# 定义测试用的中间件
+# 自定义状态（与 state_middleware_demo.py 相同）
+class CustomState(AgentState):
+    """自定义智能体状态"""
+    user_preferences: dict  # 用户偏好设置
+
+
+def make_observer_middleware(index: int) -> AgentMiddleware:
+    """
+    创建一个观察型中间件：读取用户偏好但不修改状态（类似 state_middleware_demo.py 中的 CustomMiddleware，去掉了打印）
+    """
+
+    class PreferenceObserver(AgentMiddleware):
+        state_schema = CustomState
+
+        def before_model(self, state: CustomState, runtime) -> dict[str, Any] | None:
+            preferences = state.get("user_preferences", {})
+            if preferences.get("verbosity") == "debug":
+                self.last_seen = len(state["messages"])
+            return None
+
+    PreferenceObserver.__name__ = f"PreferenceObserver{index}"
+    return PreferenceObserver()
+
+
+def make_noop_middleware(index: int) -> AgentMiddleware:
+    """创建一个 before_model 为空的中间件"""
+
+    class NoopMiddleware(AgentMiddleware):
+        def before_model(self, state, runtime) -> dict[str, Any] | None:
+            """预留的扩展点"""
+            return None
+
+    NoopMiddleware.__name__ = f"NoopMiddleware{index}"
+    return NoopMiddleware()
+
+
+def make_passthrough_middleware(index: int) -> AgentMiddleware:
+    """创建一个原样转发的 wrap_model_call 中间件"""
+
+    def passthrough(request: ModelRequest, handler) -> ModelResponse:
+        return handler(request)
+
+    passthrough.__name__ = f"passthrough{index}"
+    return wrap_model_call(passthrough)
+
+
+def build_middleware(count: int) -> list[AgentMiddleware]:
+    """按 观察型 / 空操作 / 转发 的比例 2:1:1 生成 count 个中间件"""
+    factories = [make_observer_middleware, make_observer_middleware, make_noop_middleware, make_passthrough_middleware]
+    return [factories[i % len(factories)](i) for i in range(count)]
+
+
+def step_latency(agent, steps: int = 300, repeats: int = 7) -> float:
+    """
+    测量每一步（一次 invoke）的耗时
+
+    单次测量容易受调度、GC 等噪声影响，这里重复 repeats 轮、取每轮平均值中的最小值
+
+    返回值：
+    - float类型，每步耗时（微秒）
+    """
+    payload = {
+        "messages": [{"role": "user", "content": "推荐一些电影"}],
+        "user_preferences": {"style": "technical", "verbosity": "detailed"},
+    }
+    for _ in range(20):  # 预热
+        agent.invoke(payload)
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(steps):
+            agent.invoke(payload)
+        best = min(best, (time.perf_counter() - start) / steps * 1e6)
+    return best
+
+
+def new_model():
+    """创建离线假模型"""
+    return GenericFakeChatModel(messages=itertools.cycle([AIMessage(content="为您推荐：《星际穿越》。")]))
+
+
+# 运行微基准测试
+if __name__ == "__main__":
+    print("=== 融合报告示例（5个中间件）===")
+    fuse_middleware(build_middleware(5), verbose=True)
+
+    print("\n=== 微基准测试：每步开销 ===")
+    baseline = step_latency(create_agent(new_model(), tools=[], state_schema=CustomState))
+    print(f"无中间件: {baseline:.0f} µs/步")
+    print(f"{'中间件数':>8} {'原始(µs)':>10} {'融合(µs)':>10} {'原始开销':>10} {'融合开销':>10}")
+    for count in (1, 5, 20):
+        plain = step_latency(create_agent(new_model(), tools=[], state_schema=CustomState, middleware=build_middleware(count)))
+        fused = step_latency(create_fused_agent(new_model(), tools=[], state_schema=CustomState, middleware=build_middleware(count)))
+        print(f"{count:>8} {plain:>10.0f} {fused:>10.0f} {plain - baseline:>10.0f} {fused - baseline:>10.0f}")
@@ -0,0 +1,494 @@
+# 智能体采样分析示例
+# 像 middleware_demo.py 这样的智能体变慢时，很难判断时间花在了 pydantic 校验、消息序列化、中间件还是 HTTP 客户端上。
+# 本示例为智能体调用增加可选的采样分析模式：
+# - SamplingProfiler：后台线程按固定间隔读取被分析线程的调用栈（不插桩，开销低）
+# - 样本带有标签：所在的图节点（model / tools / XXX.before_model）和中间件钩子
+# - ProfiledAgent：每个请求或每 N 个请求分析一次，输出 speedscope JSON 和火焰图折叠格式（flamegraph.pl）
+# - 命令行 aggregate 子命令：汇总一次压测产生的所有分析文件
+#
+# 用法：
+#   python profiling_demo.py bench --requests 300 --every 10 --output-dir profiles
+#   python profiling_demo.py aggregate profiles --top 15 --output merged.speedscope.json
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse, before_model, wrap_model_call  # 中间件相关
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager  # 用于跟踪当前图节点
+from collections import Counter, deque  # 用于统计调用栈、保留最近的分析结果
+from pathlib import Path  # 用于输出文件
+from typing import Any  # 用于类型提示
+import argparse  # 用于命令行
+import inspect  # 用于查找中间件的用户函数
+import json  # 用于输出 speedscope 格式
+import os  # 用于访问环境变量
+import sys  # 用于读取线程调用栈
+import tempfile  # 用于创建临时目录
+import threading  # 用于采样线程
+import time  # 用于计时
+
+# 中间件钩子名称（同步和异步）
+_HOOKS = ("before_agent", "before_model", "after_model", "after_agent", "wrap_model_call", "wrap_tool_call")
+_HOOKS = _HOOKS + tuple(f"a{hook}" for hook in _HOOKS)
+
+
+def middleware_labels(middleware: list[AgentMiddleware]) -> dict:
+    """
+    为中间件钩子建立 代码对象 -> 标签 的映射
+
+    装饰器生成的中间件（@wrap_model_call 等）还会映射闭包里的用户函数
+
+    返回值：
+    - dict类型，代码对象 -> "中间件名.钩子名"
+    """
+    labels = {}
+    for m in middleware:
+        for hook in _HOOKS:
+            func = getattr(type(m), hook, None)
+            if func is None or func is getattr(AgentMiddleware, hook, None):
+                continue
+            label = f"{m.name}.{hook}"
+            labels[func.__code__] = label
+            for cell in func.__closure__ or ():
+                if inspect.isfunction(cell.cell_contents):
+                    labels[cell.cell_contents.__code__] = label
+    return labels
+
+
+class NodeTracker(BaseCallbackHandler):
+    """
+    通过回调记录每个线程当前正在执行的图节点 / 工具，供采样线程给样本打标签
+    """
+
+    run_inline = True  # 在执行节点的线程中同步调用回调
+
+    def __init__(self):
+        self.stacks: dict[int, list[tuple[Any, str]]] = {}  # 线程ID -> [(run_id, 标签)]
+
+    def _push(self, run_id, label: str) -> None:
+        self.stacks.setdefault(threading.get_ident(), []).append((run_id, label))
+
+    def _pop(self, run_id) -> None:
+        stack = self.stacks.get(threading.get_ident())
+        if stack and stack[-1][0] == run_id:
+            stack.pop()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:  # 只记录节点本身，不记录节点内部的子链
+            self._push(run_id, f"[node] {node}")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs) -> None:
+        self._push(run_id, f"[tool] {(serialized or {}).get('name', '?')}")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        self._pop(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        self._pop(run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs) -> None:
+        self._pop(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs) -> None:
+        self._pop(run_id)
+
+    def active(self) -> dict[int, str]:
+        """返回 线程ID -> 当前标签（最内层）"""
+        return {tid: stack[-1][1] for tid, stack in list(self.stacks.items()) if stack}
+
+
+class Profile:
+    """
+    一次分析的结果：调用栈（从根到叶） -> 采样时间（秒，样本数 × 采样间隔）
+    """
+
+    def __init__(self, name: str, samples: Counter | None = None, duration: float = 0.0):
+        self.name = name
+        self.samples = samples or Counter()
+        self.duration = duration  # 墙钟时间（秒）
+
+    def to_folded(self) -> str:
+        """火焰图折叠格式：每行“帧1;帧2;帧3 微秒数”"""
+        return "".join(f"{';'.join(stack)} {round(seconds * 1e6)}\n" for stack, seconds in self.samples.most_common())
+
+    def to_speedscope(self) -> dict:
+        """speedscope 的 sampled 格式（https://www.speedscope.app）"""
+        frame_index: dict[str, int] = {}
+        samples, weights = [], []
+        for stack, seconds in self.samples.items():
+            samples.append([frame_index.setdefault(frame, len(frame_index)) for frame in stack])
+            weights.append(seconds)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": frame} for frame in frame_index]},
+            "profiles": [{
+                "type": "sampled", "name": self.name, "unit": "seconds",
+                "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+            }],
+            "name": self.name,
+            "exporter": "profiling_demo.py",
+        }
+
+    def save(self, path: Path) -> None:
+        """保存为 <path>.folded 和 <path>.speedscope.json"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Path(f"{path}.folded").write_text(self.to_folded(), encoding="utf-8")
+        Path(f"{path}.speedscope.json").write_text(json.dumps(self.to_speedscope(), ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load_folded(cls, path: Path) -> "Profile":
+        profile = cls(path.name)
+        for line in path.read_text(encoding="utf-8").splitlines():
+            stack, _, micros = line.rpartition(" ")
+            profile.samples[tuple(stack.split(";"))] += int(micros) / 1e6
+        return profile
+
+
+# 切换间隔是进程级设置，多个分析器同时运行时按引用计数管理：
+# 取所有运行中分析器要求的最小值，最后一个分析器停止时才恢复原值
+_switch_lock = threading.Lock()
+_switch_requests: Counter = Counter()  # 要求的切换间隔 -> 使用中的分析器数量
+_switch_original = sys.getswitchinterval()
+
+
+def _apply_switch_interval() -> None:
+    """按当前的引用设置切换间隔（需持有 _switch_lock）"""
+    sys.setswitchinterval(min(_switch_original, *_switch_requests) if _switch_requests else _switch_original)
+
+
+def _acquire_switch_interval(value: float) -> None:
+    global _switch_original
+    with _switch_lock:
+        if not _switch_requests:
+            _switch_original = sys.getswitchinterval()
+        _switch_requests[value] += 1
+        _apply_switch_interval()
+
+
+def _release_switch_interval(value: float) -> None:
+    with _switch_lock:
+        _switch_requests[value] -= 1
+        if _switch_requests[value] <= 0:
+            del _switch_requests[value]
+        _apply_switch_interval()
+
+
+class SamplingProfiler:
+    """
+    采样分析器：后台线程每隔 interval 秒读取一次目标线程（以及正在执行工具的线程）的调用栈
+    """
+
+    def __init__(self, interval: float = 0.002, tracker: NodeTracker | None = None,
+                 labels: dict | None = None, max_depth: int = 200):
+        """
+        参数：
+        - interval: 采样间隔（秒）
+        - tracker: 节点跟踪回调，用于给样本加上节点标签
+        - labels: 代码对象 -> 中间件标签（见 middleware_labels）
+        - max_depth: 调用栈最大深度
+        """
+        self.interval = interval
+        self.tracker = tracker
+        self.labels = labels or {}
+        self.max_depth = max_depth
+        self._names: dict = {}  # 代码对象 -> 帧名称（缓存，降低采样开销）
+        self._stop = threading.Event()
+        self._samples = Counter()
+
+    def _frame_name(self, code) -> str:
+        name = self._names.get(code)
+        if name is None:
+            label = self.labels.get(code)
+            if label:
+                name = f"[middleware] {label}"
+            else:
+                name = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._names[code] = name
+        return name
+
+    def _sample(self, frame, tag: str | None) -> None:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            if frame.f_code is _STOP_CODE:
+                return  # 正在停止分析，不计入样本
+            stack.append(self._frame_name(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        if tag:
+            stack.insert(0, tag)
+        self._samples[tuple(stack)] += self.interval
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            active = self.tracker.active() if self.tracker else {}
+            if self.thread_id not in active:
+                active[self.thread_id] = None
+            for tid, tag in active.items():
+                frame = frames.get(tid)
+                if frame is not None:
+                    self._sample(frame, tag)
+
+    def start(self, thread_id: int | None = None) -> "SamplingProfiler":
+        """开始采样 thread_id（默认为当前线程）"""
+        self.thread_id = thread_id or threading.get_ident()
+        # 被分析的线程是纯 Python 计算时，只有在切换间隔（默认 5ms）到期或进行 IO 时才释放 GIL，
+        # 采样线程只能在这些位置拿到调用栈，结果会偏向 IO 调用。分析期间缩短切换间隔，让采样点更均匀
+        _acquire_switch_interval(self.interval / 2)
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, name: str = "profile") -> Profile:
+        """停止采样并返回结果"""
+        self._stop.set()
+        self._thread.join()
+        _release_switch_interval(self.interval / 2)
+        return Profile(name, self._samples, time.perf_counter() - self._started)
+
+
+_STOP_CODE = SamplingProfiler.stop.__code__
+
+
+def _with_callback(config: dict | None, handler: BaseCallbackHandler) -> dict:
+    """在 config 的回调中加入 handler（兼容列表和回调管理器两种形式）"""
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    else:
+        callbacks = list(callbacks or []) + [handler]
+    config["callbacks"] = callbacks
+    return config
+
+
+class ProfiledAgent:
+    """
+    可选的分析模式：每 every 个请求分析一次（invoke / ainvoke / stream / astream），其余请求直接转发，没有额外开销
+
+    流式调用的分析覆盖整个迭代过程，包括调用方在两次产出之间的处理时间
+    """
+
+    def __init__(self, agent, middleware: list[AgentMiddleware] = (), every: int = 1,
+                 interval: float = 0.002, output_dir: Path | None = None, keep: int = 100):
+        """
+        参数：
+        - agent: 智能体
+        - middleware: 创建智能体时使用的中间件（用于给样本打上中间件标签）
+        - every: 每隔多少个请求分析一次，1 表示每个请求都分析
+        - interval: 采样间隔（秒）
+        - output_dir: 保存分析文件的目录，None 表示只保存在内存中（self.profiles）
+        - keep: self.profiles 只保留最近的多少份分析结果，长期运行时内存不会无限增长；
+          需要完整记录时设置 output_dir
+        """
+        self.agent = agent
+        self.labels = middleware_labels(list(middleware))
+        self.every = every
+        self.interval = interval
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.profiles: deque[Profile] = deque(maxlen=keep)
+        self.profiled = 0  # 已分析的请求总数（包括已经不在 self.profiles 中的）
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _next(self) -> int | None:
+        """请求计数加一，返回需要分析的请求序号，不需要分析时返回 None"""
+        with self._lock:
+            self._count += 1
+            n = self._count
+        return None if n % self.every else n
+
+    def _start(self) -> tuple[NodeTracker, SamplingProfiler]:
+        tracker = NodeTracker()
+        return tracker, SamplingProfiler(self.interval, tracker, self.labels).start()
+
+    def _finish(self, profiler: SamplingProfiler, n: int) -> None:
+        profile = profiler.stop(name=f"request-{n:05d}")
+        with self._lock:
+            self.profiles.append(profile)
+            self.profiled += 1
+        if self.output_dir:
+            profile.save(self.output_dir / profile.name)
+
+    def invoke(self, input, config: dict | None = None, **kwargs):
+        n = self._next()
+        if n is None:
+            return self.agent.invoke(input, config, **kwargs)
+        tracker, profiler = self._start()
+        try:
+            return self.agent.invoke(input, _with_callback(config, tracker), **kwargs)
+        finally:
+            self._finish(profiler, n)
+
+    async def ainvoke(self, input, config: dict | None = None, **kwargs):
+        n = self._next()
+        if n is None:
+            return await self.agent.ainvoke(input, config, **kwargs)
+        tracker, profiler = self._start()  # 采样事件循环所在的线程
+        try:
+            return await self.agent.ainvoke(input, _with_callback(config, tracker), **kwargs)
+        finally:
+            self._finish(profiler, n)
+
+    def stream(self, input, config: dict | None = None, **kwargs):
+        n = self._next()
+        if n is None:
+            yield from self.agent.stream(input, config, **kwargs)
+            return
+        tracker, profiler = self._start()
+        try:
+            yield from self.agent.stream(input, _with_callback(config, tracker), **kwargs)
+        finally:
+            self._finish(profiler, n)
+
+    async def astream(self, input, config: dict | None = None, **kwargs):
+        n = self._next()
+        if n is None:
+            async for chunk in self.agent.astream(input, config, **kwargs):
+                yield chunk
+            return
+        tracker, profiler = self._start()
+        try:
+            async for chunk in self.agent.astream(input, _with_callback(config, tracker), **kwargs):
+                yield chunk
+        finally:
+            self._finish(profiler, n)
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+
+def maybe_profile(agent, middleware: list[AgentMiddleware] = ()):
+    """
+    按环境变量决定是否开启分析：AGENT_PROFILE_EVERY=N 时每 N 个请求分析一次，
+    分析文件写入 AGENT_PROFILE_DIR（默认 ./profiles）；未设置时原样返回智能体
+    """
+    every = int(os.getenv("AGENT_PROFILE_EVERY", "0"))
+    if every <= 0:
+        return agent
+    return ProfiledAgent(agent, middleware, every=every, output_dir=Path(os.getenv("AGENT_PROFILE_DIR", "profiles")))
+
+
+def aggregate(directory: Path) -> Profile:
+    """汇总目录下所有 .folded 文件"""
+    total = Profile(f"aggregate:{directory}")
+    for path in sorted(Path(directory).glob("*.folded")):
+        total.samples.update(Profile.load_folded(path).samples)
+    return total
+
+
+def report(profile: Profile, top: int = 15) -> None:
+    """打印节点/中间件的时间占比，以及自身耗时最多的函数"""
+    total = sum(profile.samples.values())
+    if not total:
+        print("没有样本")
+        return
+    tags, self_time = Counter(), Counter()
+    for stack, seconds in profile.samples.items():
+        for tag in {frame for frame in stack if frame.startswith("[")}:
+            tags[tag] += seconds
+        self_time[stack[-1]] += seconds
+    print(f"采样时间: {total:.2f}s")
+    print(f"\n{'节点 / 工具 / 中间件':<56} {'占比':>6}")
+    for tag, seconds in sorted(tags.items(), key=lambda item: -item[1]):
+        print(f"{tag:<56} {seconds / total:>6.1%}")
+    print(f"\n{'自身耗时最多的函数':<80} {'占比':>6}")
+    for frame, seconds in self_time.most_common(top):
+        print(f"{frame[:80]:<80} {seconds / total:>6.1%}")
+
+
+# 示例中间件（与 middleware_demo.py 的动态模型选择相同，去掉了打印）
+@wrap_model_call
+def dynamic_model_selection(request: ModelRequest, handler) -> ModelResponse:
+    """根据对话复杂性选择模型（这里只有一个模型，直接使用）"""
+    return handler(request)
+
+
+@before_model
+def trim_history(state, runtime) -> dict[str, Any] | None:
+    """对话过长时只保留最近的消息（这里只做检查）"""
+    if len(state["messages"]) > 50:
+        return {"messages": state["messages"][-50:]}
+    return None
+
+
+def build_bench_agent(cassette_dir: Path):
+    """创建压测用的智能体：ChatDeepSeek + 离线回放传输层（见 transport_replay_demo.py）"""
+    from transport_replay_demo import Cassette, FakeDeepSeekUpstream, create_deepseek
+    import httpx
+    from local_model_demo import get_weather, search
+
+    middleware = [dynamic_model_selection, trim_history]
+    questions = ["上海今天天气怎么样？", "搜索人工智能最新进展"]
+    cassette = Cassette(cassette_dir / "bench.cassette")
+    if not len(cassette):
+        # 先录制一次（模拟上游，无延迟），之后全部离线回放
+        recorder = create_deepseek(cassette, mode="record", api_key="offline",
+                                   upstream=httpx.MockTransport(FakeDeepSeekUpstream(ttfb=0, chunk_interval=0)))
+        agent = create_agent(recorder, tools=[search, get_weather], middleware=middleware,
+                             system_prompt="你是一个有帮助的助手。请简洁准确地回答问题。")
+        for question in questions:
+            agent.invoke({"messages": [{"role": "user", "content": question}]})
+        cassette.close()
+    agent = create_agent(create_deepseek(cassette), tools=[search, get_weather], middleware=middleware,
+                         system_prompt="你是一个有帮助的助手。请简洁准确地回答问题。")
+    return agent, middleware, questions
+
+
+def bench(requests: int, every: int, output_dir: Path, interval: float) -> None:
+    """压测：比较不分析、每 N 个请求分析一次、每个请求都分析时的吞吐量，并汇总分析结果"""
+    agent, middleware, questions = build_bench_agent(Path(tempfile.mkdtemp(prefix="profile_bench_")))
+
+    def run(target, n: int) -> float:
+        start = time.perf_counter()
+        for i in range(n):
+            target.invoke({"messages": [{"role": "user", "content": questions[i % len(questions)]}]})
+        return time.perf_counter() - start
+
+    run(agent, 20)  # 预热
+    modes = {
+        "不分析": agent,
+        f"每 {every} 个请求分析一次": ProfiledAgent(agent, middleware, every=every, interval=interval, output_dir=output_dir),
+        "每个请求都分析": ProfiledAgent(agent, middleware, every=1, interval=interval),
+    }
+    # 多轮交替运行各模式，避免进程状态随时间变化造成的偏差
+    rounds = 5
+    elapsed = dict.fromkeys(modes, 0.0)
+    for _ in range(rounds):
+        for label, target in modes.items():
+            elapsed[label] += run(target, requests // rounds)
+    print(f"{'模式':<24} {'吞吐量(次/秒)':>14} {'相对开销':>8} {'分析次数':>8}")
+    for label, target in modes.items():
+        overhead = elapsed[label] / elapsed["不分析"] - 1
+        profiles = getattr(target, "profiled", 0)
+        print(f"{label:<24} {requests // rounds * rounds / elapsed[label]:>14.1f} {overhead:>8.1%} {profiles:>8}")
+    print(f"\n分析文件已写入: {output_dir}\n")
+    report(aggregate(output_dir))
+
+
+# 命令行入口
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="智能体采样分析")
+    subparsers = parser.add_subparsers(dest="command")
+    bench_parser = subparsers.add_parser("bench", help="运行压测并分析")
+    bench_parser.add_argument("--requests", type=int, default=300, help="请求数量")
+    bench_parser.add_argument("--every", type=int, default=10, help="每隔多少个请求分析一次")
+    bench_parser.add_argument("--interval", type=float, default=0.002, help="采样间隔（秒）")
+    bench_parser.add_argument("--output-dir", type=Path, default=None, help="分析文件目录（默认为临时目录）")
+    aggregate_parser = subparsers.add_parser("aggregate", help="汇总目录下的分析文件")
+    aggregate_parser.add_argument("directory", type=Path, help="包含 .folded 文件的目录")
+    aggregate_parser.add_argument("--top", type=int, default=15, help="显示自身耗时最多的前 N 个函数")
+    aggregate_parser.add_argument("--output", type=Path, default=None, help="合并后的 speedscope 文件")
+    args = parser.parse_args()
+
+    if args.command == "aggregate":
+        merged = aggregate(args.directory)
+        report(merged, args.top)
+        if args.output:
+            args.output.write_text(json.dumps(merged.to_speedscope(), ensure_ascii=False), encoding="utf-8")
+            print(f"\n合并后的 speedscope 文件: {args.output}")
+    else:
+        output_dir = getattr(args, "output_dir", None) or Path(tempfile.mkdtemp(prefix="profiles_"))
+        bench(getattr(args, "requests", 300), getattr(args, "every", 10), output_dir, getattr(args, "interval", 0.002))
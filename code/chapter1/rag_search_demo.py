@@ -0,0 +1,444 @@
+# 检索增强的搜索工具示例（文档入库流水线 + 内存映射向量索引）
+# 本示例演示如何让 search 工具基于自己的文档（例如 docs/chapter1 下的 markdown）回答问题：
+# 1. 流式读取文档，按标题和长度切块
+# 2. 用本地嵌入模型分批计算向量（默认是不需要下载模型的哈希嵌入，也可以换成任意 LangChain Embeddings）
+# 3. 向量写入磁盘文件，查询时通过内存映射读取；文件未变化时跳过，只重新索引变化的文件
+# 4. search 工具支持 top-k、按来源过滤和结果缓存
+# 最后的基准测试统计入库速度（文档/秒）和查询延迟
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.tools import tool  # 用于定义工具
+from langchain_core.embeddings import Embeddings  # 嵌入模型接口
+from dotenv import load_dotenv  # 用于加载环境变量
+from functools import lru_cache  # 用于缓存查询结果
+from pathlib import Path  # 用于遍历文档
+import hashlib  # 用于计算文件指纹
+import itertools  # 用于按行数读取元数据
+import json  # 用于读写索引元数据
+import numpy as np  # 用于向量计算
+import os  # 用于访问环境变量
+import re  # 用于切块和分词
+import shutil  # 用于复制测试文档
+import statistics  # 用于统计延迟
+import tempfile  # 用于创建临时目录
+import time  # 用于计时
+import zlib  # 用于特征哈希
+
+# 仓库中的文档目录
+DOCS_DIR = Path(__file__).resolve().parents[2] / "docs"
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    本地哈希嵌入：把字、二元组和英文单词哈希到固定维度，不需要下载模型
+
+    语义能力有限，但完全离线、确定、速度快；需要更好的效果时可替换为任意 LangChain Embeddings
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim  # 向量维度
+
+    @staticmethod
+    def _features(text: str) -> list[str]:
+        text = text.lower()
+        words = re.findall(r"[a-z0-9_]+", text)
+        chars = re.findall(r"[一-鿿]", text)
+        bigrams = [a + b for a, b in zip(chars, chars[1:])]
+        return words + chars + bigrams
+
+    def embed_array(self, texts: list[str]) -> np.ndarray:
+        """
+        批量计算归一化向量
+
+        参数：
+        - texts: 文本列表
+
+        返回值：
+        - np.ndarray类型，形状为 (len(texts), dim) 的 float32 矩阵
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_array([text])[0].tolist()
+
+
+def embed_batch(embeddings: Embeddings, texts: list[str]) -> np.ndarray:
+    """对任意嵌入模型批量计算 float32 归一化向量"""
+    if isinstance(embeddings, HashingEmbeddings):
+        return embeddings.embed_array(texts)
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def iter_documents(root: Path, pattern: str = "**/*.md"):
+    """
+    流式遍历文档，每次只读取一个文件
+
+    返回值：
+    - 生成器，产出 (相对路径, 文本)
+    """
+    for path in sorted(root.glob(pattern)):
+        if path.is_file():
+            yield path.relative_to(root).as_posix(), path.read_text(encoding="utf-8")
+
+
+def chunk_markdown(text: str, size: int = 600, overlap: int = 100):
+    """
+    按 markdown 标题切分段落，过长的段落再按固定长度滑动切块（代码块中的 # 不视为标题）
+
+    参数：
+    - text: 文档内容
+    - size: 每块最大字符数
+    - overlap: 相邻块的重叠字符数
+
+    返回值：
+    - 生成器，产出 (所属标题, 块文本)
+    """
+    heading, lines, in_code = "", [], False
+
+    def flush():
+        section = "\n".join(lines).strip()
+        start = 0
+        while section and start < len(section):
+            yield heading, section[start:start + size]
+            if start + size >= len(section):
+                break
+            start += size - overlap
+
+    for line in text.splitlines():
+        if line.startswith("```"):
+            in_code = not in_code
+        if not in_code and re.match(r"#{1,6} ", line):
+            yield from flush()
+            heading, lines = line.lstrip("#").strip(), []
+        lines.append(line)
+    yield from flush()
+
+
+class VectorIndex:
+    """
+    磁盘向量索引
+
+    目录结构：
+    - vectors.f32：所有向量（float32，逐行追加），查询时内存映射读取
+    - chunks.jsonl：每行一个块的元数据（来源、标题、文本）
+    - manifest.json：文件指纹 -> 行范围、已删除的行范围、版本号、数据文件的代号
+    压缩后数据文件带代号（vectors.1.f32、chunks.1.jsonl ……），新文件写完后再提交清单切换过去，
+    因此任何时刻崩溃，清单指向的都是完整的数据文件
+    """
+
+    def __init__(self, path: Path, dim: int):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        manifest_file = self.path / "manifest.json"
+        if manifest_file.exists():
+            self.manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+            if self.manifest["dim"] != dim:
+                raise ValueError(f"索引维度为 {self.manifest['dim']}，与嵌入模型维度 {dim} 不一致")
+        else:
+            self.manifest = {"dim": dim, "rows": 0, "version": 0, "files": {}, "deleted": []}
+        self._remove_stale_files()
+        self._truncate_uncommitted()
+        self._load()
+
+    def _files(self, generation: int | None = None) -> tuple[Path, Path]:
+        """某一代数据文件的路径 (向量文件, 元数据文件)，默认为清单当前指向的一代"""
+        if generation is None:
+            generation = self.manifest.get("generation", 0)
+        suffix = f".{generation}" if generation else ""
+        return self.path / f"vectors{suffix}.f32", self.path / f"chunks{suffix}.jsonl"
+
+    def _remove_stale_files(self) -> None:
+        """删除清单没有指向的数据文件（压缩中途崩溃留下的新文件，或压缩提交后没来得及删除的旧文件）"""
+        current = set(self._files())
+        for path in [*self.path.glob("vectors*.f32"), *self.path.glob("chunks*.jsonl")]:
+            if path not in current:
+                path.unlink(missing_ok=True)
+
+    def _truncate_uncommitted(self) -> None:
+        """截掉上次提交后追加的数据（例如入库中途崩溃），否则之后追加的行会排在残留数据后面，与清单的行号错开"""
+        rows = self.manifest["rows"]
+        vector_file, chunk_file = self._files()
+        if vector_file.exists() and vector_file.stat().st_size > rows * self.dim * 4:
+            os.truncate(vector_file, rows * self.dim * 4)
+        if chunk_file.exists():
+            with open(chunk_file, "rb") as f:
+                for _ in range(rows):
+                    f.readline()
+                size = f.tell()
+            if chunk_file.stat().st_size > size:
+                os.truncate(chunk_file, size)
+
+    def _load(self) -> None:
+        """重新打开内存映射和元数据"""
+        rows = self.manifest["rows"]
+        vector_file, chunk_file = self._files()
+        self.vectors = (
+            np.memmap(vector_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            if rows else np.zeros((0, self.dim), dtype=np.float32)
+        )
+        self.chunks = []
+        if chunk_file.exists():
+            with open(chunk_file, encoding="utf-8") as f:
+                # 只读取清单中记录的行数，提交前追加的行不可见
+                self.chunks = [json.loads(line) for line in itertools.islice(f, rows)]
+        self.alive = np.ones(rows, dtype=bool)
+        for start, end in self.manifest["deleted"]:
+            self.alive[start:end] = False
+
+    @property
+    def version(self) -> int:
+        return self.manifest["version"]
+
+    @staticmethod
+    def _write(files: tuple[Path, Path], vectors: np.ndarray, chunks: list[dict]) -> None:
+        vector_file, chunk_file = files
+        with open(vector_file, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(chunk_file, "a", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+    def append(self, vectors: np.ndarray, chunks: list[dict]) -> None:
+        """追加一批向量和对应的块元数据（提交前不可见）"""
+        self._write(self._files(), vectors, chunks)
+        self.manifest["rows"] += len(chunks)
+
+    def remove_source(self, source: str) -> None:
+        """把某个文件的所有行标记为已删除"""
+        entry = self.manifest["files"].pop(source, None)
+        if entry is not None and entry["rows"][1] > entry["rows"][0]:
+            self.manifest["deleted"].append(entry["rows"])
+
+    def commit(self) -> None:
+        """原子地写入清单并刷新内存映射，使新数据对查询可见"""
+        self.manifest["version"] += 1
+        tmp = self.path / "manifest.json.tmp"
+        tmp.write_text(json.dumps(self.manifest, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path / "manifest.json")
+        self._load()
+
+    def deleted_fraction(self) -> float:
+        rows = self.manifest["rows"]
+        return 0.0 if rows == 0 else 1 - self.alive.sum() / rows
+
+    def compact(self) -> None:
+        """
+        重写索引文件，去掉已删除的行
+
+        去掉已删除行的数据写到下一代文件中，提交清单后才切换过去并删除旧文件；
+        提交前崩溃时清单仍指向完整的旧文件，残留的新文件在下次打开时删除
+        """
+        keep = np.flatnonzero(self.alive)
+        new_rows = {int(old): new for new, old in enumerate(keep)}
+        generation = self.manifest.get("generation", 0) + 1
+        old_files, new_files = self._files(), self._files(generation)
+        for path in new_files:
+            path.unlink(missing_ok=True)
+        self._write(new_files, self.vectors[keep], [self.chunks[i] for i in keep])
+        files = {}
+        for source, entry in self.manifest["files"].items():
+            start, end = entry["rows"]
+            moved = [new_rows[i] for i in range(start, end)]
+            files[source] = {**entry, "rows": [moved[0], moved[-1] + 1] if moved else [0, 0]}
+        self.manifest.update(rows=len(keep), deleted=[], files=files, generation=generation)
+        self.commit()
+        for path in old_files:
+            try:
+                path.unlink(missing_ok=True)  # 其他进程已打开的内存映射在 Linux / macOS 上仍然可以读取旧数据
+            except OSError:
+                pass  # Windows 上仍被映射的文件无法删除，下次打开索引时再清理
+
+    def search(self, query: np.ndarray, k: int = 4, source: str = "") -> list[tuple[float, dict]]:
+        """
+        暴力余弦相似度检索
+
+        参数：
+        - query: 归一化的查询向量
+        - k: 返回结果数量
+        - source: 来源过滤，只返回路径中包含该字符串的块
+
+        返回值：
+        - list类型，[(相似度, 块元数据)]，按相似度降序
+        """
+        if k <= 0:
+            raise ValueError(f"k 必须为正整数，收到 {k}")
+        if len(self.chunks) == 0:
+            return []
+        scores = self.vectors @ query
+        mask = self.alive
+        if source:
+            mask = mask & np.fromiter((source in c["source"] for c in self.chunks), dtype=bool, count=len(self.chunks))
+        scores = np.where(mask, scores, -np.inf)
+        k = min(k, int(mask.sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.chunks[i]) for i in top]
+
+
+def ingest(root: Path, index: VectorIndex, embeddings: Embeddings, batch_size: int = 64) -> dict:
+    """
+    文档入库：只处理新增或变化的文件，删除已不存在的文件
+
+    参数：
+    - root: 文档根目录
+    - index: 向量索引
+    - embeddings: 嵌入模型
+    - batch_size: 每批计算嵌入的块数量
+
+    返回值：
+    - dict类型，统计信息
+    """
+    stats = {"files": 0, "skipped": 0, "chunks": 0}
+    texts, metas = [], []
+
+    def flush():
+        if texts:
+            index.append(embed_batch(embeddings, texts), metas)
+            stats["chunks"] += len(texts)
+            texts.clear()
+            metas.clear()
+
+    seen = set()
+    for source, text in iter_documents(root):
+        seen.add(source)
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        entry = index.manifest["files"].get(source)
+        if entry is not None and entry["hash"] == digest:
+            stats["skipped"] += 1
+            continue
+        index.remove_source(source)
+        start = index.manifest["rows"] + len(texts)
+        for heading, chunk in chunk_markdown(text):
+            texts.append(f"{heading}\n{chunk}")
+            metas.append({"source": source, "heading": heading, "text": chunk})
+            if len(texts) >= batch_size:
+                flush()
+        index.manifest["files"][source] = {"hash": digest, "rows": [start, index.manifest["rows"] + len(texts)]}
+        stats["files"] += 1
+    flush()
+
+    for source in set(index.manifest["files"]) - seen:
+        index.remove_source(source)
+    index.commit()
+    if index.deleted_fraction() > 0.3:
+        index.compact()
+    return stats
+
+
+def make_search_tool(index: VectorIndex, embeddings: Embeddings, cache_size: int = 1024):
+    """
+    创建基于向量索引的 search 工具
+
+    参数：
+    - index: 向量索引
+    - embeddings: 嵌入模型（必须与入库时相同）
+    - cache_size: 查询结果缓存条目数（按索引版本区分，重新入库后自动失效）
+
+    返回值：
+    - 工具
+    """
+
+    @lru_cache(maxsize=cache_size)
+    def cached_search(query: str, k: int, source: str, version: int) -> str:
+        vector = embed_batch(embeddings, [query])[0]
+        hits = index.search(vector, k=k, source=source)
+        if not hits:
+            return f"搜索结果：没有找到与 {query} 相关的内容"
+        return "\n\n".join(
+            f"[{i + 1}] {hit['source']} · {hit['heading']}（相似度 {score:.2f}）\n{hit['text']}"
+            for i, (score, hit) in enumerate(hits)
+        )
+
+    @tool
+    def search(query: str, k: int = 4, source: str = "") -> str:
+        """
+        在本地文档库中搜索信息
+
+        参数：
+        - query: str类型，搜索查询词
+        - k: int类型，返回的结果数量（正整数）
+        - source: str类型，只搜索路径中包含该字符串的文档，为空时搜索全部
+
+        返回值：
+        - str类型，搜索结果
+        """
+        return cached_search(query, k, source, index.version)
+
+    search.metadata = {"cache_info": cached_search.cache_info}  # 便于观察缓存命中情况
+    return search
+
+
+def build_corpus(target: Path, copies: int) -> None:
+    """把 docs 目录复制多份，生成用于压测的语料"""
+    for i in range(copies):
+        shutil.copytree(DOCS_DIR, target / f"copy{i:03d}")
+
+
+# 测试检索工具
+if __name__ == "__main__":
+    embeddings = HashingEmbeddings()
+    work_dir = Path(tempfile.mkdtemp(prefix="rag_demo_"))
+
+    print("=== 测试1：索引 docs 目录并检索 ===")
+    index = VectorIndex(work_dir / "docs_index", embeddings.dim)
+    stats = ingest(DOCS_DIR, index, embeddings)
+    print(f"入库统计: {stats}")
+    search = make_search_tool(index, embeddings)
+    print(search.invoke({"query": "如何处理工具执行错误", "k": 2}))
+
+    print("\n=== 测试2：入库速度与增量重建 ===")
+    corpus = work_dir / "corpus"
+    build_corpus(corpus, copies=100)
+    index = VectorIndex(work_dir / "corpus_index", embeddings.dim)
+    start = time.perf_counter()
+    stats = ingest(corpus, index, embeddings)
+    elapsed = time.perf_counter() - start
+    print(f"全量入库: {stats['files']} 个文档, {stats['chunks']} 个块, {stats['files'] / elapsed:.1f} 文档/秒")
+
+    for path in sorted(corpus.glob("**/*.md"))[:5]:
+        path.write_text(path.read_text(encoding="utf-8") + "\n## 补充\n新增的内容。\n", encoding="utf-8")
+    start = time.perf_counter()
+    stats = ingest(corpus, index, embeddings)
+    print(f"增量入库: 重建 {stats['files']} 个文档, 跳过 {stats['skipped']} 个, 耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    print("\n=== 测试3：查询延迟 ===")
+    search = make_search_tool(index, embeddings)
+    # 每个查询各不相同：第一轮全部未命中，第二轮全部命中缓存
+    queries = [f"{q} {i}" for i, q in enumerate(["动态模型选择", "结构化输出", "流式传输", "系统提示", "自定义状态"] * 20)]
+    for label in ("首次查询", "缓存命中"):
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            search.invoke({"query": q, "k": 4})
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"{label}: 平均 {statistics.mean(latencies):.2f} ms, 最大 {max(latencies):.2f} ms（{len(index.chunks)} 个块）")
+    print(f"缓存统计: {search.metadata['cache_info']()}")
+
+    # 有 API 密钥时，让 DeepSeek 智能体使用本地文档检索工具
+    load_dotenv()
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if api_key:
+        from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+
+        print("\n=== 测试4：智能体使用检索工具 ===")
+        index = VectorIndex(work_dir / "docs_index", embeddings.dim)
+        agent = create_agent(
+            model=ChatDeepSeek(model="deepseek-chat", api_key=api_key),
+            tools=[make_search_tool(index, embeddings)],
+        )
+        result = agent.invoke({"messages": [{"role": "user", "content": "根据文档，如何给智能体添加动态系统提示？"}]})
+        print("智能体回复:", result["messages"][-1].content)
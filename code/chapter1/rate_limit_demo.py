@@ -0,0 +1,610 @@
+# 自适应并发限制示例（上游模型接口限流）
+# 大量并发调用 agent.invoke 时，ChatDeepSeek 会遇到服务端的 429（限流）和延迟陡增。
+# 本示例实现一个共享的客户端限流器，挂在 ChatDeepSeek 的 httpx 传输层上：
+# - 每个模型后端（deepseek-chat、deepseek-reasoner，见 dynamic_model_demo.py）单独限流
+# - 并发上限按 AIMD 调整：成功且延迟正常时缓慢增加，遇到 429 或延迟超过最低延迟的若干倍时减半
+# - 每分钟token额度：令牌桶按响应头 x-ratelimit-limit-tokens / x-ratelimit-remaining-tokens 校准，429 时按 retry-after 暂停
+# - 等待中的调用按优先级排队（交互请求优先于批处理），遇到 429 自动在限流器内重试
+# - 限流器状态可以导出为指标（字典或 Prometheus 文本格式）
+# 最后用一个本地的配额模拟服务测试有无限流器时的成功率、吞吐量和延迟
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import wrap_model_call, ModelRequest, ModelResponse  # 用于创建中间件
+from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+from concurrent.futures import ThreadPoolExecutor  # 用于并发调用
+from typing import NamedTuple  # 用于定义配额
+import asyncio  # 用于异步等待
+import contextlib  # 用于优先级上下文
+import contextvars  # 用于传递调用优先级
+import heapq  # 用于优先级队列
+import itertools  # 用于排队序号
+import json  # 用于解析请求和响应
+import httpx  # DeepSeek 客户端使用的 HTTP 库
+import random  # 用于模拟延迟抖动
+import statistics  # 用于统计延迟
+import threading  # 用于线程安全
+import time  # 用于计时
+import uuid  # 用于生成响应ID
+
+# 当前调用的优先级：数字越小越优先（0 交互请求，1 批处理）
+_priority = contextvars.ContextVar("model_priority", default=1)
+
+
+@contextlib.contextmanager
+def priority(level: int):
+    """在该上下文中发起的模型调用使用指定优先级"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Waiter:
+    """排队中的一次调用：同步调用用 Event 唤醒，异步调用用 Future 唤醒"""
+
+    __slots__ = ("tokens", "granted", "cancelled", "_event", "_loop", "_future")
+
+    def __init__(self, tokens: int, loop: asyncio.AbstractEventLoop | None = None):
+        self.tokens = tokens
+        self.granted = False
+        self.cancelled = False
+        self._loop = loop
+        self._event = None if loop else threading.Event()
+        self._future = loop.create_future() if loop else None
+
+    def wake(self) -> None:
+        if self._event is not None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(lambda: self._future.done() or self._future.set_result(None))
+
+    def wait(self, timeout: float | None) -> None:
+        self._event.wait(timeout)
+        self._event.clear()
+
+    async def await_(self, timeout: float | None) -> None:
+        await asyncio.wait({self._future}, timeout=timeout)
+        if self._future.done():
+            self._future = self._loop.create_future()
+
+
+class BackendLimiter:
+    """
+    单个模型后端的限流器：AIMD 并发上限 + 令牌桶 + 优先级队列
+    """
+
+    def __init__(self, name: str, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 64,
+                 tokens_per_min: float | None = None, burst_seconds: float = 10, backoff: float = 0.5,
+                 latency_tolerance: float = 2.0):
+        """
+        参数：
+        - name: 后端名称（模型名）
+        - initial_limit / min_limit / max_limit: 并发上限的初始值和范围
+        - tokens_per_min: 每分钟token额度；None 表示先不限制，收到响应头后再校准
+        - burst_seconds: 令牌桶容量（按多少秒的额度计算）
+        - backoff: 遇到 429 或延迟陡增时并发上限乘以该系数
+        - latency_tolerance: 延迟超过最低延迟的该倍数时视为过载
+        """
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit, self.max_limit = min_limit, max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.burst_seconds = burst_seconds
+        self.tokens_per_min = tokens_per_min
+        self._tokens = self._capacity()
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters: list = []  # (优先级, 序号, _Waiter)
+        self._seq = itertools.count()
+        self.in_flight = 0
+        self.min_latency: float | None = None
+        self.latency_ewma: float | None = None
+        self.completion_estimate = 256.0  # 输出token数的估计（按实际用量平滑）
+        self.counters = {"admitted": 0, "succeeded": 0, "rate_limited": 0, "overloaded": 0, "decreases": 0, "errors": 0}
+
+    def _capacity(self) -> float:
+        return float("inf") if self.tokens_per_min is None else self.tokens_per_min / 60 * self.burst_seconds
+
+    def _refill(self, now: float) -> None:
+        if self.tokens_per_min is not None:
+            self._tokens = min(self._capacity(), self._tokens + (now - self._refilled) * self.tokens_per_min / 60)
+        self._refilled = now
+
+    def _admit(self) -> tuple[list[_Waiter], float | None]:
+        """
+        按优先级放行队首的调用（需持有锁）
+
+        返回值：
+        - (需要唤醒的调用, 队首需要再等待的秒数；None 表示等待其他调用结束)
+
+        队首因暂停或令牌不足而需要定时等待时，也会唤醒它，让它按返回的秒数定时重试
+        """
+        now = time.monotonic()
+        self._refill(now)
+        admitted = []
+        while self._waiters:
+            _, _, waiter = self._waiters[0]
+            if waiter.cancelled:
+                heapq.heappop(self._waiters)
+                continue
+            if now < self._paused_until:
+                return admitted + [waiter], self._paused_until - now
+            if self.in_flight >= max(1, int(self.limit)):
+                return admitted, None
+            need = min(waiter.tokens, self._capacity())  # 超过桶容量的请求在桶满时放行
+            if self._tokens < need:
+                return admitted + [waiter], (need - self._tokens) / (self.tokens_per_min / 60)
+            heapq.heappop(self._waiters)
+            self._tokens -= waiter.tokens
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+            waiter.granted = True
+            admitted.append(waiter)
+        return admitted, None
+
+    def _enqueue(self, waiter: _Waiter, level: int) -> float | None:
+        with self._lock:
+            heapq.heappush(self._waiters, (level, next(self._seq), waiter))
+            admitted, delay = self._admit()
+        for other in admitted:
+            if other is not waiter:
+                other.wake()
+        return delay
+
+    def _poll(self, waiter: _Waiter) -> float | None:
+        with self._lock:
+            if waiter.granted:
+                return None
+            admitted, delay = self._admit()
+        for other in admitted:
+            if other is not waiter:
+                other.wake()
+        return delay
+
+    def _cancel(self, waiter: _Waiter) -> None:
+        with self._lock:
+            granted, waiter.cancelled = waiter.granted, True
+        if granted:
+            self.release(waiter, status=None)
+
+    def acquire(self, tokens: int, level: int = 1) -> _Waiter:
+        """同步等待放行，返回的凭据在调用结束后传给 release"""
+        waiter = _Waiter(tokens)
+        delay = self._enqueue(waiter, level)
+        try:
+            while not waiter.granted:
+                waiter.wait(delay)
+                delay = self._poll(waiter)
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        return waiter
+
+    async def acquire_async(self, tokens: int, level: int = 1) -> _Waiter:
+        """异步等待放行"""
+        waiter = _Waiter(tokens, asyncio.get_running_loop())
+        delay = self._enqueue(waiter, level)
+        try:
+            while not waiter.granted:
+                await waiter.await_(delay)
+                delay = self._poll(waiter)
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        return waiter
+
+    def release(self, ticket: _Waiter, latency: float | None = None, status: int | None = None,
+                headers: httpx.Headers | None = None, used_tokens: int | None = None,
+                completion_tokens: int | None = None) -> None:
+        """
+        调用结束：归还并发名额，根据结果调整并发上限和令牌桶
+
+        参数：
+        - ticket: acquire 返回的凭据
+        - latency: 首字节延迟（秒）
+        - status: HTTP 状态码；None 表示请求未完成（异常或取消）
+        - headers: 响应头，用于校准token额度和 retry-after
+        - used_tokens / completion_tokens: 响应中的实际用量
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if headers is not None:
+                self._calibrate(headers, now)
+            if used_tokens is not None:
+                self._tokens += ticket.tokens - used_tokens  # 按实际用量退还或补扣
+            if completion_tokens is not None:
+                self.completion_estimate = 0.9 * self.completion_estimate + 0.1 * completion_tokens
+
+            if status == 429:
+                self.counters["rate_limited"] += 1
+                self._decrease(now)
+            elif status is None or status >= 500:
+                self.counters["errors"] += 1
+            elif latency is not None:
+                self.counters["succeeded"] += 1
+                self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                if latency > self.latency_tolerance * self.min_latency:
+                    self.counters["overloaded"] += 1
+                    self._decrease(now)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)  # 加性增加：每轮约 +1
+            admitted, _ = self._admit()
+        for waiter in admitted:
+            waiter.wake()
+
+    def _decrease(self, now: float) -> None:
+        """乘性减少；同一批并发中的多次过载信号只减少一次"""
+        if now - self._last_decrease >= (self.latency_ewma or 0):
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self._last_decrease = now
+            self.counters["decreases"] += 1
+
+    def _calibrate(self, headers: httpx.Headers, now: float) -> None:
+        """根据响应头校准token额度，并在 retry-after 期间暂停放行"""
+        if "x-ratelimit-limit-tokens" in headers:
+            self.tokens_per_min = float(headers["x-ratelimit-limit-tokens"])
+            self._refill(now)
+        if "x-ratelimit-remaining-tokens" in headers:
+            self._tokens = min(self._tokens, float(headers["x-ratelimit-remaining-tokens"]))
+        if "retry-after" in headers:
+            self._paused_until = max(self._paused_until, now + float(headers["retry-after"]))
+
+    def metrics(self) -> dict:
+        """当前状态"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": sum(not w.cancelled for _, _, w in self._waiters),
+                "tokens_per_min": self.tokens_per_min,
+                "tokens_available": None if self.tokens_per_min is None else round(self._tokens),
+                "latency_min_ms": None if self.min_latency is None else round(self.min_latency * 1000, 1),
+                "latency_ewma_ms": None if self.latency_ewma is None else round(self.latency_ewma * 1000, 1),
+                **self.counters,
+            }
+
+
+class AdaptiveLimiter:
+    """
+    共享的限流器：按模型名创建 BackendLimiter，多个 ChatDeepSeek 实例可以共用
+    """
+
+    def __init__(self, **defaults):
+        """
+        参数：
+        - defaults: 新建 BackendLimiter 时的默认参数
+        """
+        self.defaults = defaults
+        self.backends: dict[str, BackendLimiter] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, name: str, **options) -> BackendLimiter:
+        """为某个模型后端单独设置参数"""
+        with self._lock:
+            self.backends[name] = BackendLimiter(name, **{**self.defaults, **options})
+            return self.backends[name]
+
+    def backend(self, name: str) -> BackendLimiter:
+        with self._lock:
+            if name not in self.backends:
+                self.backends[name] = BackendLimiter(name, **self.defaults)
+            return self.backends[name]
+
+    def metrics(self) -> dict[str, dict]:
+        """所有后端的状态：后端名 -> 指标"""
+        return {name: backend.metrics() for name, backend in list(self.backends.items())}
+
+    def prometheus(self) -> str:
+        """以 Prometheus 文本格式导出指标"""
+        lines = []
+        for name, values in self.metrics().items():
+            for key, value in values.items():
+                if value is not None:
+                    lines.append(f'model_limiter_{key}{{backend="{name}"}} {value}')
+        return "\n".join(lines)
+
+
+class _ReleasingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """流式响应读完（或关闭）时归还并发名额，并带上最后一个 SSE 事件中的用量（usage）"""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close  # 以用量字典（没有收到用量时为空）为参数调用
+        self._buffer = b""
+        self._usage = {}
+
+    def _scan(self, chunk: bytes) -> None:
+        """按行解析 SSE，记录最后一个带 usage 的 data 事件（分块可能在任意位置切开）"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            if line.startswith(b"data:") and b'"usage"' in line:
+                with contextlib.suppress(ValueError, AttributeError):
+                    self._usage = json.loads(line[5:]).get("usage") or self._usage
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._scan(chunk)
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._scan(chunk)
+            yield chunk
+
+    def _finish(self) -> None:
+        if self._on_close is not None:
+            self._scan(b"\n")  # 最后一行可能没有换行
+            self._on_close(self._usage)
+            self._on_close = None
+
+    def close(self) -> None:
+        self._stream.close()
+        self._finish()
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+        self._finish()
+
+
+class LimitedTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    限流传输层：请求前在限流器中排队，响应后把状态码、延迟、用量和限流响应头反馈给限流器；遇到 429 自动重试
+    """
+
+    def __init__(self, limiter: AdaptiveLimiter, inner: httpx.BaseTransport | httpx.AsyncBaseTransport | None = None,
+                 max_retries: int = 5):
+        """
+        参数：
+        - limiter: 共享的限流器
+        - inner: 真正发送请求的传输层，默认为 httpx 的网络传输层（同步/异步分别创建）
+        - max_retries: 429 时最多重试的次数（重试前按 retry-after 暂停）
+        """
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self._sync_inner = inner if isinstance(inner, httpx.BaseTransport) else None
+        self._async_inner = inner if isinstance(inner, httpx.AsyncBaseTransport) else None
+
+    def _inspect(self, request: httpx.Request) -> tuple[BackendLimiter, int]:
+        """从请求体中取出模型名，估算本次调用的token数"""
+        body = json.loads(request.content or b"{}")
+        backend = self.limiter.backend(body.get("model", "default"))
+        tokens = len(request.content) // 4 + int(body.get("max_tokens") or backend.completion_estimate)
+        return backend, tokens
+
+    def _finish(self, backend: BackendLimiter, ticket: _Waiter, request: httpx.Request,
+                response: httpx.Response, latency: float) -> httpx.Response:
+        """成功的响应：非流式时读取用量后归还名额，流式时在流结束后按最后一个 SSE 事件中的用量归还"""
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            stream = _ReleasingStream(response.stream, lambda usage: backend.release(
+                ticket, latency, response.status_code, response.headers,
+                usage.get("total_tokens"), usage.get("completion_tokens")))
+            return httpx.Response(response.status_code, headers=response.headers, stream=stream,
+                                  request=request, extensions=response.extensions)
+        usage = {}
+        if response.status_code == 200:
+            with contextlib.suppress(ValueError):
+                usage = json.loads(response.content).get("usage") or {}
+        backend.release(ticket, latency, response.status_code, response.headers,
+                        usage.get("total_tokens"), usage.get("completion_tokens"))
+        return response
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self._sync_inner is None:
+            self._sync_inner = httpx.HTTPTransport()
+        request.read()
+        backend, tokens = self._inspect(request)
+        for attempt in range(self.max_retries + 1):
+            ticket = backend.acquire(tokens, _priority.get())
+            start = time.monotonic()
+            try:
+                response = self._sync_inner.handle_request(request)
+                if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                    response.read()
+            except BaseException:
+                backend.release(ticket)
+                raise
+            latency = time.monotonic() - start
+            if response.status_code == 429 and attempt < self.max_retries:
+                response.close()
+                backend.release(ticket, latency, 429, response.headers)
+                continue
+            return self._finish(backend, ticket, request, response, latency)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self._async_inner is None:
+            self._async_inner = httpx.AsyncHTTPTransport()
+        await request.aread()
+        backend, tokens = self._inspect(request)
+        for attempt in range(self.max_retries + 1):
+            ticket = await backend.acquire_async(tokens, _priority.get())
+            start = time.monotonic()
+            try:
+                response = await self._async_inner.handle_async_request(request)
+                if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                    await response.aread()
+            except BaseException:
+                backend.release(ticket)
+                raise
+            latency = time.monotonic() - start
+            if response.status_code == 429 and attempt < self.max_retries:
+                await response.aclose()
+                backend.release(ticket, latency, 429, response.headers)
+                continue
+            return self._finish(backend, ticket, request, response, latency)
+
+
+def create_limited_deepseek(limiter: AdaptiveLimiter, model: str = "deepseek-chat",
+                            upstream: httpx.BaseTransport | None = None, **kwargs) -> ChatDeepSeek:
+    """
+    创建挂载了共享限流器的 ChatDeepSeek（429 由限流器重试，客户端自身不再重试）
+    """
+    transport = LimitedTransport(limiter, upstream)
+    return ChatDeepSeek(
+        model=model,
+        http_client=httpx.Client(transport=transport, timeout=120),
+        http_async_client=httpx.AsyncClient(transport=transport, timeout=120),
+        max_retries=0,
+        **kwargs,
+    )
+
+
+class Quota(NamedTuple):
+    """模拟服务对一个模型的配额"""
+    concurrency: int  # 同时处理的请求数，超过后在服务端排队（延迟上升）
+    max_queue: int  # 服务端最多排队的请求数，再多直接返回 429
+    tokens_per_min: int  # 每分钟token额度
+    latency: float  # 单次请求的处理时间（秒）
+
+
+class QuotaMockUpstream:
+    """
+    模拟的 DeepSeek 接口：按模型执行并发和token配额，返回 OpenAI 风格的限流响应头
+    """
+
+    def __init__(self, quotas: dict[str, Quota], burst_seconds: float = 10, completion_tokens: int = 60):
+        self.quotas = quotas
+        self.burst_seconds = burst_seconds
+        self.completion_tokens = completion_tokens
+        self._lock = threading.Lock()
+        self._slots = {name: threading.Semaphore(q.concurrency) for name, q in quotas.items()}
+        self._waiting = dict.fromkeys(quotas, 0)
+        self._tokens = {name: q.tokens_per_min / 60 * burst_seconds for name, q in quotas.items()}
+        self._refilled = dict.fromkeys(quotas, time.monotonic())
+        self.stats = {name: {"served": 0, "rate_limited": 0, "overloaded": 0} for name in quotas}
+
+    def _headers(self, name: str) -> dict:
+        return {"x-ratelimit-limit-tokens": str(self.quotas[name].tokens_per_min),
+                "x-ratelimit-remaining-tokens": str(int(self._tokens[name]))}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        name = body["model"]
+        quota = self.quotas[name]
+        prompt_tokens = len(request.content) // 4
+        need = prompt_tokens + self.completion_tokens
+        with self._lock:
+            now = time.monotonic()
+            rate = quota.tokens_per_min / 60
+            self._tokens[name] = min(rate * self.burst_seconds, self._tokens[name] + (now - self._refilled[name]) * rate)
+            self._refilled[name] = now
+            if self._tokens[name] < need:
+                self.stats[name]["rate_limited"] += 1
+                retry_after = (need - self._tokens[name]) / rate
+                headers = {**self._headers(name), "retry-after": f"{retry_after:.3f}"}
+                return httpx.Response(429, headers=headers, json={"error": {"message": "Rate limit reached for tokens"}})
+            if self._waiting[name] >= quota.concurrency + quota.max_queue:
+                self.stats[name]["overloaded"] += 1
+                return httpx.Response(429, headers={"retry-after": "1"}, json={"error": {"message": "Server overloaded"}})
+            self._tokens[name] -= need
+            self._waiting[name] += 1
+            headers = self._headers(name)
+        try:
+            with self._slots[name]:  # 超过服务端并发能力的请求在这里排队
+                time.sleep(quota.latency * random.uniform(0.9, 1.1))
+        finally:
+            with self._lock:
+                self._waiting[name] -= 1
+                self.stats[name]["served"] += 1
+
+        question = body["messages"][-1].get("content", "")
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self.completion_tokens, "total_tokens": need}
+        message = {"role": "assistant", "content": f"（{name}）收到：{str(question)[:20]}"}
+        return httpx.Response(200, headers=headers, json={
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+            "model": name, "usage": usage, "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        })
+
+
+def build_agent(basic_model, advanced_model):
+    """与 dynamic_model_demo.py 相同：长对话使用 deepseek-reasoner，短对话使用 deepseek-chat"""
+
+    @wrap_model_call
+    def dynamic_model_selection(request: ModelRequest, handler) -> ModelResponse:
+        model = advanced_model if len(request.state["messages"]) > 10 else basic_model
+        return handler(request.override(model=model))
+
+    return create_agent(model=basic_model, tools=[], middleware=[dynamic_model_selection])
+
+
+def run_load(agent, calls: int, threads: int) -> dict:
+    """
+    并发调用智能体：每 5 次调用中有 1 次交互请求（优先级 0），每 5 次中有 1 次长对话
+
+    返回值：
+    - dict类型，成功数、失败数、吞吐量、各优先级的延迟
+    """
+    latencies = {0: [], 1: []}
+    failures = []
+
+    def call(i: int) -> None:
+        level = 0 if i % 5 == 0 else 1
+        count = 12 if i % 5 == 2 else 1
+        messages = [{"role": "user", "content": f"第{i}个请求的第{j + 1}条消息"} for j in range(count)]
+        start = time.perf_counter()
+        try:
+            with priority(level):
+                agent.invoke({"messages": messages})
+            latencies[level].append(time.perf_counter() - start)
+        except Exception as e:
+            failures.append(type(e).__name__)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(call, range(calls)))
+    elapsed = time.perf_counter() - start
+
+    def percentile(values, q):
+        return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else float("nan")
+
+    return {
+        "ok": sum(len(v) for v in latencies.values()), "failed": len(failures),
+        "throughput": sum(len(v) for v in latencies.values()) / elapsed,
+        "p50_interactive": percentile(latencies[0], 50), "p95_interactive": percentile(latencies[0], 95),
+        "p50_batch": percentile(latencies[1], 50), "p95_batch": percentile(latencies[1], 95),
+    }
+
+
+QUOTAS = {
+    "deepseek-chat": Quota(concurrency=8, max_queue=8, tokens_per_min=120_000, latency=0.1),
+    "deepseek-reasoner": Quota(concurrency=2, max_queue=2, tokens_per_min=30_000, latency=0.4),
+}
+
+
+# 测试限流器
+if __name__ == "__main__":
+    calls, threads = 300, 48
+
+    print("=== 测试1：没有限流器（ChatDeepSeek 自带重试 max_retries=2）===")
+    upstream = QuotaMockUpstream(QUOTAS)
+    mock = httpx.MockTransport(upstream)
+    models = [ChatDeepSeek(model=name, api_key="mock", http_client=httpx.Client(transport=mock), max_retries=2)
+              for name in QUOTAS]
+    baseline = run_load(build_agent(*models), calls, threads)
+    print(f"上游统计: {upstream.stats}")
+
+    print("\n=== 测试2：使用自适应限流器 ===")
+    upstream = QuotaMockUpstream(QUOTAS)
+    limiter = AdaptiveLimiter()
+    models = [create_limited_deepseek(limiter, name, upstream=httpx.MockTransport(upstream), api_key="mock")
+              for name in QUOTAS]
+    limited = run_load(build_agent(*models), calls, threads)
+    print(f"上游统计: {upstream.stats}")
+
+    print(f"\n{'':<12} {'成功':>6} {'失败':>6} {'吞吐量(次/秒)':>14} {'交互p50/p95(秒)':>18} {'批处理p50/p95(秒)':>20}")
+    for label, r in [("无限流器", baseline), ("自适应限流", limited)]:
+        print(f"{label:<12} {r['ok']:>6} {r['failed']:>6} {r['throughput']:>14.1f} "
+              f"{r['p50_interactive']:>9.2f}/{r['p95_interactive']:<8.2f} {r['p50_batch']:>10.2f}/{r['p95_batch']:<9.2f}")
+
+    print("\n=== 测试3：限流器指标 ===")
+    for name, values in limiter.metrics().items():
+        print(name, values)
+    print(limiter.prometheus().splitlines()[0], "...")
@@ -0,0 +1,305 @@
+# 相同请求合并（Single-Flight）示例
+# 本示例演示如何在 agent.invoke / ainvoke / stream 前面加一层“单飞”合并：
+# 并发到达的相同请求（相同消息 + 相同上下文）只真正执行一次，其余请求等待并共享结果
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware, dynamic_prompt, ModelRequest  # 用于创建中间件
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # 离线假模型，便于压测
+from langchain_core.messages import AIMessage  # 用于构造假模型的回复
+from concurrent.futures import Future, ThreadPoolExecutor  # 用于在线程间共享结果
+from typing import Any, Callable, TypedDict  # 用于类型提示
+import asyncio  # 用于异步调用
+import dataclasses  # 用于序列化数据类上下文
+import hashlib  # 用于计算请求指纹
+import itertools  # 用于让假模型循环回复
+import json  # 用于生成规范化的请求表示
+import threading  # 用于线程同步
+import time  # 用于计时
+
+
+# 定义上下文类型（与 dynamic_prompt_demo.py 相同）
+class Context(TypedDict):
+    user_role: str  # 用户角色
+
+
+def _to_jsonable(obj: Any) -> Any:
+    """
+    将消息对象等转换为可JSON序列化的结构
+
+    参数：
+    - obj: 任意对象
+
+    返回值：
+    - 可序列化的对象
+
+    异常：
+    - TypeError: 无法确定地序列化（例如 repr 中带有内存地址的对象，同样的请求每次指纹都不同），
+      这时请为 SingleFlightAgent 提供 key_func
+    """
+    # LangChain 消息和 Pydantic 模型都支持 model_dump
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    raise TypeError(f"无法为 {type(obj).__name__} 类型的值计算请求指纹，请为 SingleFlightAgent 提供 key_func")
+
+
+def default_request_key(input: Any, context: Any = None, config: dict | None = None) -> str:
+    """
+    默认的请求指纹：规范化后的输入 + 上下文 + 会话线程ID
+
+    参数：
+    - input: 智能体输入，如 {"messages": [...]}
+    - context: 运行时上下文
+    - config: 运行配置，不同 thread_id 的请求不会被合并
+
+    返回值：
+    - str类型，请求指纹（sha256）
+
+    异常：
+    - TypeError: 输入或上下文中有无法确定地序列化的值（见 _to_jsonable）
+    """
+    thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+    canonical = json.dumps(
+        {"input": input, "context": context, "thread_id": thread_id},
+        sort_keys=True,  # 键排序，保证相同内容得到相同字符串
+        ensure_ascii=False,
+        default=_to_jsonable,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _StreamCall:
+    """一次正在进行的流式执行，所有订阅者共享同一个块缓冲区"""
+
+    def __init__(self):
+        self.chunks = []  # 已产生的块（只追加）
+        self.done = False  # 上游是否结束
+        self.error = None  # 上游异常
+        self.cond = threading.Condition()  # 有新块时唤醒订阅者
+
+
+class SingleFlightAgent:
+    """
+    为智能体增加相同请求合并能力的包装器（按智能体显式启用）
+
+    注意：合并后的调用者拿到的是同一个结果对象，请把结果当作只读数据使用
+    """
+
+    def __init__(self, agent, key_func: Callable[..., str] = default_request_key):
+        """
+        参数：
+        - agent: create_agent 创建的智能体
+        - key_func: 请求指纹函数，签名为 (input, context, config) -> str
+        """
+        self.agent = agent
+        self.key_func = key_func
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}  # 同步调用：指纹 -> 共享的Future
+        self._streams: dict[str, _StreamCall] = {}  # 流式调用：指纹 -> 共享的缓冲区
+        self._tasks: dict[tuple[int, str], asyncio.Task] = {}  # 异步调用：(事件循环, 指纹) -> 共享的任务
+
+    def _key(self, input: Any, context: Any, config: dict | None, kwargs: dict) -> str:
+        """请求指纹：key_func 的结果 + 其他调用参数（stream_mode 等参数不同的请求结果不同，不能合并）"""
+        return self.key_func(input, context, config) + json.dumps(kwargs, sort_keys=True, default=_to_jsonable)
+
+    def invoke(self, input: Any, config: dict | None = None, *, context: Any = None, **kwargs) -> Any:
+        """同步调用，相同请求只执行一次"""
+        key = self._key(input, context, config, kwargs)
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        # 跟随者直接等待领导者的结果
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self.agent.invoke(input, config, context=context, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            # 执行结束后立即移除，之后到达的请求会重新执行（这里只合并“进行中”的请求，不做缓存）
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    async def ainvoke(self, input: Any, config: dict | None = None, *, context: Any = None, **kwargs) -> Any:
+        """异步调用，相同请求在同一事件循环内只执行一次"""
+        key = (id(asyncio.get_running_loop()), self._key(input, context, config, kwargs))
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.agent.ainvoke(input, config, context=context, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # shield：某个调用者被取消时，不影响其他共享同一任务的调用者
+        return await asyncio.shield(task)
+
+    def stream(self, input: Any, config: dict | None = None, *, context: Any = None, **kwargs):
+        """流式调用，相同请求共享一次上游执行，每个订阅者都能收到完整的块序列"""
+        key = self._key(input, context, config, kwargs)
+        with self._lock:
+            call = self._streams.get(key)
+            if call is None:
+                call = _StreamCall()
+                self._streams[key] = call
+                # 上游在后台线程中运行，避免某个订阅者提前退出导致其他订阅者卡住
+                threading.Thread(
+                    target=self._pump, args=(key, call, input, config, context, kwargs), daemon=True
+                ).start()
+
+        index = 0
+        while True:
+            with call.cond:
+                while index >= len(call.chunks) and not call.done:
+                    call.cond.wait()
+                pending = call.chunks[index:]
+                finished = call.done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(call.chunks):
+                break
+        if call.error is not None:
+            raise call.error
+
+    def _pump(self, key, call, input, config, context, kwargs):
+        """在后台读取上游流，并把块分发到共享缓冲区"""
+        try:
+            for chunk in self.agent.stream(input, config, context=context, **kwargs):
+                with call.cond:
+                    call.chunks.append(chunk)
+                    call.cond.notify_all()
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                del self._streams[key]
+            with call.cond:
+                call.done = True
+                call.cond.notify_all()
+
+
+# 创建中间件
+# 动态提示中间件（与 dynamic_prompt_demo.py 相同的逻辑）
+@dynamic_prompt
+def user_role_prompt(request: ModelRequest) -> str:
+    """根据用户角色生成系统提示"""
+    context = request.runtime.context
+    user_role = "user" if context is None else context.get("user_role", "user")
+    if user_role == "expert":
+        return "你是一个有帮助的助手。请提供详细的技术响应。"
+    elif user_role == "beginner":
+        return "你是一个有帮助的助手。请简单解释概念，避免使用行话。"
+    return "你是一个有帮助的助手。"
+
+
+# 统计真实的模型调用次数
+model_calls = 0
+model_calls_lock = threading.Lock()
+
+
+class LatencySimulationMiddleware(AgentMiddleware):
+    """模拟一次远程模型调用：计数并增加200ms延迟（同时提供同步和异步版本）"""
+
+    def wrap_model_call(self, request: ModelRequest, handler):
+        global model_calls
+        with model_calls_lock:
+            model_calls += 1
+        time.sleep(0.2)
+        return handler(request)
+
+    async def awrap_model_call(self, request: ModelRequest, handler):
+        global model_calls
+        with model_calls_lock:
+            model_calls += 1
+        await asyncio.sleep(0.2)
+        return await handler(request)
+
+
+# 创建离线假模型和智能体，便于在没有网络的情况下压测
+model = GenericFakeChatModel(messages=itertools.cycle([AIMessage(content="机器学习是让计算机从数据中学习规律的方法。")]))
+
+agent = create_agent(
+    model=model,  # 离线假模型
+    tools=[],  # 暂时为空工具列表
+    middleware=[user_role_prompt, LatencySimulationMiddleware()],  # 动态提示 + 延迟模拟
+    context_schema=Context  # 传入上下文模式
+)
+
+# 显式启用单飞合并；未包装的 agent 不受影响
+deduped_agent = SingleFlightAgent(agent)
+
+
+def run_burst(target, n: int) -> tuple[int, float]:
+    """
+    并发发送 n 个相同请求
+
+    参数：
+    - target: agent 或 SingleFlightAgent
+    - n: 并发请求数量
+
+    返回值：
+    - (真实模型调用次数, 总耗时秒数)
+    """
+    global model_calls
+    model_calls = 0
+    question = {"messages": [{"role": "user", "content": "解释机器学习的原理"}]}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        results = list(pool.map(lambda _: target.invoke(question, context={"user_role": "expert"}), range(n)))
+    elapsed = time.perf_counter() - start
+    assert all(r["messages"][-1].content for r in results)
+    return model_calls, elapsed
+
+
+# 测试相同请求合并
+if __name__ == "__main__":
+    print("=== 测试1：并发相同请求（20个）===")
+    calls, elapsed = run_burst(agent, 20)
+    print(f"不合并: 模型调用 {calls} 次, 耗时 {elapsed:.2f}s")
+    calls, elapsed = run_burst(deduped_agent, 20)
+    print(f"合并后: 模型调用 {calls} 次, 耗时 {elapsed:.2f}s")
+
+    print("\n=== 测试2：不同上下文不会被合并 ===")
+    model_calls = 0
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        list(pool.map(
+            lambda role: deduped_agent.invoke(
+                {"messages": [{"role": "user", "content": "解释机器学习的原理"}]},
+                context={"user_role": role},
+            ),
+            ["expert", "beginner", "expert"],
+        ))
+    print(f"3个请求（2种角色）: 模型调用 {model_calls} 次")
+
+    print("\n=== 测试3：异步调用合并 ===")
+
+    async def async_burst():
+        question = {"messages": [{"role": "user", "content": "解释机器学习的原理"}]}
+        return await asyncio.gather(*[deduped_agent.ainvoke(question, context={"user_role": "beginner"}) for _ in range(10)])
+
+    model_calls = 0
+    asyncio.run(async_burst())
+    print(f"10个异步请求: 模型调用 {model_calls} 次")
+
+    print("\n=== 测试4：流式订阅者扇出 ===")
+    model_calls = 0
+
+    def subscribe(_):
+        chunks = list(deduped_agent.stream(
+            {"messages": [{"role": "user", "content": "解释机器学习的原理"}]},
+            context={"user_role": "expert"},
+            stream_mode="values",
+        ))
+        return len(chunks)
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        counts = list(pool.map(subscribe, range(5)))
+    print(f"5个订阅者收到的块数: {counts}, 模型调用 {model_calls} 次")
@@ -7,6 +7,7 @@ from langchain.agents.middleware import AgentMiddleware  # 智能体中间件基
 from langchain.agents import create_agent  # 用于创建智能体
 from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
 from langchain.tools import tool  # 用于定义工具
+from lazy_logging_demo import configure_demo, get_logger  # 惰性日志
 from dotenv import load_dotenv  # 用于加载环境变量
 import os  # 用于访问环境变量
 from typing import Any  # 用于类型提示
@@ -20,6 +21,8 @@ if not api_key:
     print("错误：DEEPSEEK_API_KEY 环境变量未设置")
     exit(1)  # 如果API密钥未设置，退出程序
 
+log = get_logger("state_middleware_demo")
+
 
 # 定义自定义状态
 # 继承AgentState，添加user_preferences字段
@@ -63,8 +66,9 @@ class CustomMiddleware(AgentMiddleware):
         返回值：
         - 可选的状态更新
         """
-        # 打印用户偏好
-        print(f"用户偏好: {state.get('user_preferences', {})}")
+        # 记录用户偏好：传入当时的副本（日志在后台线程写出时状态可能已被修改），日志关闭时不复制
+        if log.enabled:
+            log.debug("prefs", "用户偏好: {prefs}", prefs=dict(state.get('user_preferences', {})))
         # 可以在这里修改状态或添加额外信息
         return None
 
@@ -88,6 +92,7 @@ print("智能体创建完成，开始测试自定义状态...")
 
 # 测试自定义状态
 if __name__ == "__main__":
+    configure_demo()  # 日志输出到 stdout，与 print 的顺序一致
     print("=== 测试：自定义状态 ===")
     # 调用智能体，传入自定义状态
     result = agent.invoke({
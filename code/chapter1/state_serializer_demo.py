@@ -0,0 +1,493 @@
+# 智能体状态序列化示例
+# 智能体的结果（result["messages"]、structured_response）是 pydantic / LangChain 对象，
+# 在进程之间、检查点或 HTTP 响应中传递时通常走通用的 JSON 序列化（dumpd + json），速度慢、体积大。
+# 本示例实现一个专用的状态序列化器：
+# - 紧凑二进制格式（msgpack）：消息按类型编码为定长数组，省略空字段，不重复写字段名
+# - 带版本号的格式：解码时按版本选择解码器，旧版本写入的数据仍然可以读取
+# - 大文本字段（例如很长的工具结果）单独存放在数据区，StateView 可以零拷贝地读取它们的字节
+# - 快速 JSON 路径：基于 orjson，适合直接作为 HTTP 响应，同样带版本号（外层信封 {"__v": 版本, "state": 状态}）
+# 最后的基准测试与现有的序列化方式比较编解码吞吐量和体积
+
+# 导入必要的库
+from langchain_core.load import dumpd, load  # LangChain 通用序列化
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage  # 消息类型
+from langchain_core.messages import message_to_dict, messages_from_dict  # 其他消息类型的通用编解码
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer  # LangGraph 检查点序列化
+from pydantic import BaseModel  # 用于结构化输出
+from typing import Any  # 用于类型提示
+from contact_schema import ContactInfo  # 联系信息模型（与 structured_output_tool.py 相同）
+import json  # 用于通用 JSON 对照
+import orjson  # 快速 JSON（langsmith 的依赖）
+import ormsgpack  # msgpack 编解码（langgraph-checkpoint 的依赖）
+import struct  # 用于二进制文件头
+import time  # 用于计时
+import warnings  # 用于屏蔽 load 的提示信息
+
+_MAGIC = b"AGS"  # 文件头
+_HEADER = struct.Struct("<3sBI")  # 魔数 + 版本号 + 结构区长度
+VERSION = 3  # 当前写入的版本
+JSON_VERSION = 2  # to_json 写入的版本（2：消息带 "__msg__" 标记；1：按字典形状识别消息，只读）
+
+# 常用消息类型 <-> 编号（按精确类型匹配；AIMessageChunk 等子类字段不同，走通用编码）
+_KINDS = {HumanMessage: 0, AIMessage: 1, SystemMessage: 2, ToolMessage: 3}
+_CLASSES = {kind: cls for cls, kind in _KINDS.items()}
+_OTHER = 4  # 其他消息类型（AIMessageChunk、ChatMessage、FunctionMessage、RemoveMessage 等）：用 message_to_dict 编码
+_TYPES = {cls.model_fields["type"].default: cls for cls in _KINDS}  # JSON 中的消息类型 -> 类
+_MSG = "__msg__"  # JSON 中标记消息的键，值为消息类型
+
+# 允许解码的结构化输出模型（"模块:类名" -> 类），避免解码任意类
+_MODELS: dict[str, type[BaseModel]] = {}
+
+
+def register_model(*models: type[BaseModel]) -> None:
+    """注册可以作为状态值解码的 pydantic 模型（例如结构化输出的 ContactInfo）"""
+    for model in models:
+        _MODELS[f"{model.__module__}:{model.__qualname__}"] = model
+
+
+def _model_class(path: str) -> type[BaseModel]:
+    if path not in _MODELS:
+        raise ValueError(f"未注册的模型类型: {path}（请先调用 register_model）")
+    return _MODELS[path]
+
+
+def _encode_message(m: BaseMessage, content) -> list:
+    """
+    把消息编码为数组：[类型, id, content, name, 扩展字段]
+
+    扩展字段只包含非空的值：tool_calls、invalid_tool_calls、usage_metadata、tool_call_id、status、artifact、
+    response_metadata、additional_kwargs；其他消息类型的扩展字段为 {"d": message_to_dict(m)}
+    """
+    kind = _KINDS.get(type(m))
+    if kind is None:
+        return [_OTHER, m.id, None, m.name, {"d": message_to_dict(m)}]
+    extra = {}
+    if kind == 1:
+        if m.tool_calls:
+            extra["tc"] = [[c["name"], c["args"], c["id"]] for c in m.tool_calls]
+        if m.invalid_tool_calls:
+            extra["itc"] = [dict(c) for c in m.invalid_tool_calls]
+        if m.usage_metadata:
+            extra["u"] = dict(m.usage_metadata)
+    elif kind == 3:
+        extra["tid"] = m.tool_call_id
+        if m.status != "success":
+            extra["st"] = m.status
+        if m.artifact is not None:
+            extra["art"] = m.artifact  # 需要能被 msgpack / JSON 编码
+    if m.response_metadata:
+        extra["rm"] = m.response_metadata
+    if m.additional_kwargs:
+        extra["ak"] = m.additional_kwargs
+    record = [kind, m.id, content, m.name]
+    if extra:
+        record.append(extra)
+    return record
+
+
+def _decode_message(record: list, content) -> BaseMessage:
+    """从数组还原消息（数据来自本模块编码，跳过 pydantic 校验）"""
+    kind, message_id, _, name = record[:4]
+    extra = record[4] if len(record) > 4 else {}
+    if kind == _OTHER:
+        return messages_from_dict([extra["d"]])[0]
+    cls = _CLASSES[kind]
+    fields = {
+        "content": content, "id": message_id, "name": name,
+        "response_metadata": extra.get("rm", {}), "additional_kwargs": extra.get("ak", {}),
+    }
+    if kind == 1:
+        fields["tool_calls"] = [{"name": n, "args": a, "id": i, "type": "tool_call"} for n, a, i in extra.get("tc", ())]
+        fields["invalid_tool_calls"] = [{**c, "type": "invalid_tool_call"} for c in extra.get("itc", ())]
+        fields["usage_metadata"] = extra.get("u")
+    elif kind == 3:
+        fields["tool_call_id"] = extra["tid"]
+        fields["status"] = extra.get("st", "success")
+        fields["artifact"] = extra.get("art")
+    return cls.model_construct(**fields)
+
+
+def _encode_value(value: Any, encode_message) -> list:
+    """编码一个状态值：["m", 消息列表] / ["p", 模型路径, 字段] / ["v", 原值]"""
+    if isinstance(value, list) and value and all(isinstance(v, BaseMessage) for v in value):
+        return ["m", [encode_message(m) for m in value]]
+    if isinstance(value, BaseModel):
+        cls = type(value)
+        return ["p", f"{cls.__module__}:{cls.__qualname__}", value.model_dump(mode="json")]
+    return ["v", value]
+
+
+def _decode_value(entry: list, decode_message) -> Any:
+    tag = entry[0]
+    if tag == "m":
+        return [decode_message(record) for record in entry[1]]
+    if tag == "p":
+        return _model_class(entry[1]).model_validate(entry[2])
+    return entry[1]
+
+
+def encode(state: dict, version: int = VERSION, large: int = 4096) -> bytes:
+    """
+    把智能体状态编码为二进制
+
+    参数：
+    - state: 智能体状态（例如 agent.invoke 的返回值）
+    - version: 写入的格式版本；1 为所有内容内联，2 及以上把大文本放到数据区
+      （3 与 2 布局相同，增加了 invalid_tool_calls、artifact 和其他消息类型，旧版本的读取方会明确报错而不是解码出错）
+    - large: 版本 2 及以上，长度达到该值（字符）的文本内容放到数据区
+
+    返回值：
+    - bytes类型，编码结果
+    """
+    if version == 1:
+        structure = {k: _encode_value(v, lambda m: _encode_message(m, m.content)) for k, v in state.items()}
+        body = ormsgpack.packb(structure)
+        return _HEADER.pack(_MAGIC, 1, len(body)) + body
+
+    blobs, spans = [], []
+    offset = 0
+
+    def encode_message(m):
+        nonlocal offset
+        content = m.content
+        if isinstance(content, str) and len(content) >= large:
+            data = content.encode("utf-8")
+            blobs.append(data)
+            spans.append((offset, len(data)))
+            offset += len(data)
+            content = len(spans) - 1  # 整数表示数据区中的第几段（正常的 content 不会是整数）
+        return _encode_message(m, content)
+
+    values = {k: _encode_value(v, encode_message) for k, v in state.items()}
+    body = ormsgpack.packb([spans, values])
+    return b"".join([_HEADER.pack(_MAGIC, version, len(body)), body, *blobs])
+
+
+def _parse(data) -> tuple[int, memoryview, memoryview]:
+    """解析文件头，返回 (版本号, 结构区, 数据区)，都不复制数据"""
+    view = memoryview(data)
+    magic, version, length = _HEADER.unpack_from(view, 0)
+    if magic != _MAGIC:
+        raise ValueError("不是智能体状态数据")
+    start = _HEADER.size
+    return version, view[start:start + length], view[start + length:]
+
+
+def _decode_v1(structure: memoryview, blobs: memoryview) -> dict:
+    values = ormsgpack.unpackb(structure)
+    return {k: _decode_value(v, lambda r: _decode_message(r, r[2])) for k, v in values.items()}
+
+
+def _decode_v2(structure: memoryview, blobs: memoryview) -> dict:
+    spans, values = ormsgpack.unpackb(structure)
+
+    def decode_message(record):
+        content = record[2]
+        if isinstance(content, int):
+            start, size = spans[content]
+            content = str(blobs[start:start + size], "utf-8")
+        return _decode_message(record, content)
+
+    return {k: _decode_value(v, decode_message) for k, v in values.items()}
+
+
+# 版本号 -> 解码器；修改格式时增加新版本和对应的解码器，旧数据仍按旧解码器读取
+DECODERS = {1: _decode_v1, 2: _decode_v2, 3: _decode_v2}
+
+
+def decode(data: bytes | bytearray | memoryview) -> dict:
+    """
+    把二进制还原为智能体状态（消息对象、已注册的 pydantic 模型等）
+    """
+    version, structure, blobs = _parse(data)
+    if version not in DECODERS:
+        raise ValueError(f"不支持的格式版本: {version}（当前支持 {sorted(DECODERS)}）")
+    return DECODERS[version](structure, blobs)
+
+
+class MessageView:
+    """消息的只读视图：不创建消息对象，大文本内容以 memoryview 形式零拷贝读取"""
+
+    __slots__ = ("_record", "_spans", "_blobs")
+
+    def __init__(self, record: list, spans: list, blobs: memoryview):
+        self._record = record
+        self._spans = spans
+        self._blobs = blobs
+
+    @property
+    def type(self) -> str:
+        if self._record[0] == _OTHER:
+            return self._record[4]["d"]["type"]
+        return _CLASSES[self._record[0]].model_fields["type"].default
+
+    @property
+    def content_bytes(self) -> memoryview | bytes:
+        """内容的 UTF-8 字节：大文本直接指向原始缓冲区（零拷贝）"""
+        content = self._record[2] if self._record[0] != _OTHER else self._record[4]["d"]["data"]["content"]
+        if isinstance(content, int):
+            start, size = self._spans[content]
+            return self._blobs[start:start + size]
+        return str(content).encode("utf-8")
+
+    @property
+    def content(self):
+        if self._record[0] == _OTHER:
+            return self._record[4]["d"]["data"]["content"]
+        content = self._record[2]
+        return str(self.content_bytes, "utf-8") if isinstance(content, int) else content
+
+    @property
+    def tool_calls(self) -> list[dict]:
+        extra = self._record[4] if len(self._record) > 4 else {}
+        if self._record[0] == _OTHER:
+            return [{"name": c["name"], "args": c["args"], "id": c["id"]} for c in extra["d"]["data"].get("tool_calls", ())]
+        return [{"name": n, "args": a, "id": i} for n, a, i in extra.get("tc", ())]
+
+    def to_message(self) -> BaseMessage:
+        return _decode_message(self._record, self.content)
+
+
+class StateView:
+    """
+    状态的只读视图：只解析结构区，不创建消息对象，也不复制大文本
+
+    适合只需要读取部分字段的场景，例如把最后一条消息的内容直接写入 HTTP 响应
+    """
+
+    def __init__(self, data: bytes | bytearray | memoryview):
+        version, structure, blobs = _parse(data)
+        if version == 1:
+            spans, values = [], ormsgpack.unpackb(structure)
+        elif version in DECODERS:
+            spans, values = ormsgpack.unpackb(structure)
+        else:
+            raise ValueError(f"不支持的格式版本: {version}")
+        self.version = version
+        self._spans, self._values, self._blobs = spans, values, blobs
+
+    def __getitem__(self, key: str):
+        tag, *rest = self._values[key]
+        if tag == "m":
+            return [MessageView(record, self._spans, self._blobs) for record in rest[0]]
+        return _decode_value(self._values[key], None)
+
+    def keys(self):
+        return self._values.keys()
+
+
+def _message_to_json(m: BaseMessage) -> dict:
+    """消息转为字典：常用类型只写非空字段，其他类型附带 message_to_dict 的完整数据"""
+    item = {_MSG: m.type, "content": m.content}
+    if type(m) not in _KINDS:
+        item["data"] = message_to_dict(m)["data"]
+        return item
+    if m.id:
+        item["id"] = m.id
+    if m.name:
+        item["name"] = m.name
+    if isinstance(m, AIMessage):
+        if m.tool_calls:
+            item["tool_calls"] = [{"name": c["name"], "args": c["args"], "id": c["id"]} for c in m.tool_calls]
+        if m.invalid_tool_calls:
+            item["invalid_tool_calls"] = [dict(c) for c in m.invalid_tool_calls]
+        if m.usage_metadata:
+            item["usage_metadata"] = m.usage_metadata
+    elif isinstance(m, ToolMessage):
+        item["tool_call_id"] = m.tool_call_id
+        if m.status != "success":
+            item["status"] = m.status
+        if m.artifact is not None:
+            item["artifact"] = m.artifact
+    if m.response_metadata:
+        item["response_metadata"] = m.response_metadata
+    if m.additional_kwargs:
+        item["additional_kwargs"] = m.additional_kwargs
+    return item
+
+
+def json_default(value):
+    """orjson 的 default 钩子：消息转为带 "__msg__" 标记的精简字典（省略空字段），pydantic 模型转为字段字典"""
+    if isinstance(value, BaseMessage):
+        return _message_to_json(value)
+    if isinstance(value, BaseModel):
+        return {"__model__": f"{type(value).__module__}:{type(value).__qualname__}", **value.model_dump(mode="json")}
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+# JSON 字段名 -> 二进制记录中扩展字段的键
+_JSON_EXTRA = {"tool_calls": "tc", "invalid_tool_calls": "itc", "usage_metadata": "u", "tool_call_id": "tid",
+               "status": "st", "artifact": "art", "response_metadata": "rm", "additional_kwargs": "ak"}
+
+
+def _message_from_json(item: dict, type_key: str = _MSG) -> BaseMessage:
+    if "data" in item:
+        return messages_from_dict([{"type": item[type_key], "data": item["data"]}])[0]
+    extra = {key: item[field] for field, key in _JSON_EXTRA.items() if field in item}
+    if "tc" in extra:
+        extra["tc"] = [[c["name"], c["args"], c["id"]] for c in extra["tc"]]
+    record = [_KINDS[_TYPES[item[type_key]]], item.get("id"), item["content"], item.get("name"), extra]
+    return _decode_message(record, item["content"])
+
+
+def _revive_item(value):
+    if isinstance(value, dict):
+        if _MSG in value:
+            return _message_from_json(value)
+        if "__model__" in value:
+            fields = dict(value)
+            return _model_class(fields.pop("__model__")).model_validate(fields)
+    return value
+
+
+def revive(value):
+    """
+    把 json_default 生成的值还原为消息或已注册的 pydantic 模型，其他值原样返回
+
+    只有带 "__msg__" 标记的字典才会还原为消息；列表逐个元素还原，
+    因此 [{"type": "todo", "content": ...}] 这类普通字典列表保持不变
+    """
+    if isinstance(value, list):
+        return [_revive_item(item) for item in value]
+    return _revive_item(value)
+
+
+def _is_v1_message(item) -> bool:
+    """版本 1 没有标记，只能按形状识别：消息类型已知（或带 message_to_dict 的完整数据）且有 content"""
+    return (isinstance(item, dict) and "content" in item
+            and ("data" in item and isinstance(item.get("type"), str) or item.get("type") in _TYPES))
+
+
+def _revive_v1(value):
+    if isinstance(value, dict) and "__model__" in value:
+        return _revive_item(value)
+    if isinstance(value, list) and value and all(_is_v1_message(item) for item in value):
+        return [_message_from_json(item, "type") for item in value]
+    return value
+
+
+def to_json(state: dict) -> bytes:
+    """
+    快速 JSON 路径：消息和 pydantic 模型按 json_default 转换，外层为 {"__v": 版本, "state": 状态}
+
+    返回值：
+    - bytes类型，UTF-8 JSON，可以直接作为 HTTP 响应体
+    """
+    return orjson.dumps({"__v": JSON_VERSION, "state": state}, default=json_default)
+
+
+def _from_json_v1(envelope: dict) -> dict:
+    return {k: _revive_v1(v) for k, v in envelope["state"].items()}
+
+
+def _from_json_v2(envelope: dict) -> dict:
+    return {k: revive(v) for k, v in envelope["state"].items()}
+
+
+# JSON 版本号 -> 解码器
+JSON_DECODERS = {1: _from_json_v1, 2: _from_json_v2}
+
+
+def from_json(data: bytes | str) -> dict:
+    """从 to_json 的结果还原状态（消息对象和已注册的 pydantic 模型），按信封中的版本号选择解码器"""
+    envelope = orjson.loads(data)
+    version = envelope.get("__v") if isinstance(envelope, dict) else None
+    if version not in JSON_DECODERS:
+        raise ValueError(f"不支持的 JSON 格式版本: {version}（当前支持 {sorted(JSON_DECODERS)}）")
+    return JSON_DECODERS[version](envelope)
+
+
+register_model(ContactInfo)  # 示例状态中的结构化输出
+
+
+def build_state(turns: int = 12, large_tool_output: int = 200_000) -> dict:
+    """
+    构造一个典型的智能体状态：多轮工具调用，其中一个工具返回很长的文本，最后带有结构化输出
+    """
+    messages = [SystemMessage("你是一个有帮助的助手。请简洁准确地回答问题。", id="sys")]
+    for i in range(turns):
+        call_id = f"call_{i:04d}"
+        messages.append(HumanMessage(f"第{i}个问题：北京的天气怎么样？请同时搜索相关新闻。", id=f"h{i}"))
+        messages.append(AIMessage(
+            "", id=f"a{i}", tool_calls=[{"name": "search", "args": {"query": f"北京 天气 新闻 {i}"}, "id": call_id}],
+            usage_metadata={"input_tokens": 120 + i, "output_tokens": 20, "total_tokens": 140 + i},
+            response_metadata={"model_name": "deepseek-chat", "finish_reason": "tool_calls"},
+        ))
+        output = "检索结果：" + ("北京今天晴朗，气温25°C。" * (large_tool_output // 14 if i == 0 else 8))
+        messages.append(ToolMessage(output, tool_call_id=call_id, name="search", id=f"t{i}"))
+        messages.append(AIMessage(f"根据查询结果，北京今天晴朗，25°C。（第{i}轮）", id=f"r{i}",
+                                  usage_metadata={"input_tokens": 300, "output_tokens": 30, "total_tokens": 330},
+                                  response_metadata={"model_name": "deepseek-chat", "finish_reason": "stop"}))
+    return {
+        "messages": messages,
+        "structured_response": ContactInfo(name="John Doe", email="john@example.com", phone="(555) 123-4567"),
+        "user_preferences": {"style": "technical", "verbosity": "detailed"},
+    }
+
+
+def baseline_dumps(state: dict) -> bytes:
+    """现有做法：消息用 dumpd 转为字典，pydantic 模型用 model_dump，再用标准库 json 编码"""
+    return json.dumps({
+        k: dumpd(v) if isinstance(v, list) else v.model_dump() if isinstance(v, BaseModel) else v
+        for k, v in state.items()
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def baseline_loads(data: bytes) -> dict:
+    state = load(json.loads(data))
+    state["structured_response"] = ContactInfo.model_validate(state["structured_response"])
+    return state
+
+
+def measure(func, min_time: float = 0.5) -> float:
+    """重复执行直到超过 min_time 秒，返回每次的平均耗时（微秒）"""
+    n, start = 0, time.perf_counter()
+    while True:
+        func()
+        n += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / n * 1e6
+
+
+# 运行基准测试
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore", message=".*(beta|allowed_objects).*")
+    state = build_state()
+
+    print("=== 测试1：编解码往返 ===")
+    restored = decode(encode(state))
+    assert [m.content for m in restored["messages"]] == [m.content for m in state["messages"]]
+    assert restored["messages"][2].tool_calls == state["messages"][2].tool_calls
+    assert restored["structured_response"] == state["structured_response"]
+    assert from_json(to_json(state))["structured_response"] == state["structured_response"]
+    print(f"版本 {VERSION} 往返一致；版本 1 数据仍可读取: {decode(encode(state, version=1))['messages'][-1].content}")
+
+    view = StateView(encode(state))
+    big = view["messages"][3]
+    print(f"零拷贝读取: 消息类型 {big.type}，内容 {len(big.content_bytes)} 字节，类型 {type(big.content_bytes).__name__}")
+
+    print("\n=== 测试2：与现有序列化方式对比 ===")
+    serde = JsonPlusSerializer(allowed_msgpack_modules=[("contact_schema", "ContactInfo")])
+    approaches = {
+        "dumpd + json（通用 JSON）": (baseline_dumps, baseline_loads),
+        "JsonPlusSerializer（检查点）": (lambda s: serde.dumps_typed(s)[1], lambda b: serde.loads_typed(("msgpack", b))),
+        "本示例：二进制": (encode, decode),
+        "本示例：二进制（只读视图）": (encode, lambda b: StateView(b)["messages"][-1].content),
+        "本示例：JSON": (to_json, from_json),
+    }
+    print(f"{'方式':<28} {'大小(KB)':>9} {'编码(µs)':>10} {'解码(µs)':>10} {'编码(MB/s)':>11} {'解码(MB/s)':>11}")
+    for label, (enc, dec) in approaches.items():
+        data = enc(state)
+        enc_us = measure(lambda: enc(state))
+        dec_us = measure(lambda: dec(data))
+        size = len(data)
+        print(f"{label:<28} {size / 1024:>9.1f} {enc_us:>10.0f} {dec_us:>10.0f} "
+              f"{size / enc_us:>11.0f} {size / dec_us:>11.0f}")
+
+    print("\n=== 测试3：不含大文本的状态（50条消息）===")
+    small = build_state(turns=12, large_tool_output=0)
+    print(f"{'方式':<28} {'大小(KB)':>9} {'编码(µs)':>10} {'解码(µs)':>10}")
+    for label, (enc, dec) in approaches.items():
+        data = enc(small)
+        print(f"{label:<28} {len(data) / 1024:>9.1f} {measure(lambda: enc(small)):>10.0f} {measure(lambda: dec(data)):>10.0f}")
@@ -0,0 +1,344 @@
+# 智能体静态执行计划示例
+# middleware_demo.py 这样的智能体组合了工具、中间件、system_prompt 和自定义 state_schema。
+# create_agent 的结果是一个 LangGraph 图，运行时每一步都由 Pregel 调度节点、写通道、按条件边路由。
+# 对于路由完全固定的智能体（没有 jump_to、没有检查点、没有工具包装中间件），这些工作每一步的结果都一样。
+# 本示例在 create_agent 之后增加一个“编译”步骤，预先算出静态执行计划：
+# - 有序的钩子列表：before_model（中间件顺序）、wrap_model_call（组合一次）、after_model（逆序）
+# - 工具调度表：工具名 -> (参数校验模型, 函数)
+# - 预先绑定好工具 schema 的模型和系统消息
+# - 状态归并函数（从图的通道中读取，例如 messages 的 add_messages）
+# 然后用一个简单的循环按计划执行，并打印每一步的工作报告；不满足条件时原样使用图执行
+# 最后用离线假模型比较每一步的延迟
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse, after_model, wrap_model_call  # 中间件
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel  # 离线假模型
+from langchain_core.messages import AIMessage, SystemMessage, ToolMessage  # 消息类型
+from langchain_core.runnables.config import DEFAULT_RECURSION_LIMIT  # 图的默认步数上限
+from langchain_core.tools import StructuredTool  # 用于判断能否直接调用工具函数
+from langchain_core.utils.function_calling import convert_to_openai_tool  # 用于计算 schema 大小
+from langgraph.channels import BinaryOperatorAggregate  # 带归并函数的状态通道
+from langgraph.errors import GraphRecursionError  # 超过步数上限时抛出，与图执行一致
+from langgraph.runtime import Runtime  # 钩子的运行时参数
+from langgraph.types import Overwrite  # 跳过归并函数、直接覆盖的更新
+from pydantic import BaseModel, ValidationError  # 用于工具参数校验
+from local_model_demo import get_weather, search  # 示例工具
+from middleware_fusion_demo import CustomState, make_observer_middleware  # 自定义状态和观察型中间件
+from typing import Any, Callable  # 用于类型提示
+import functools  # 用于组合包装中间件
+import inspect  # 用于检查工具函数的参数
+import itertools  # 用于让假模型循环回复
+import json  # 用于计算 schema 大小
+import time  # 用于计时
+
+# 静态计划支持的钩子；中间件重写了其他钩子时退回图执行
+_SUPPORTED = {"before_model", "after_model", "wrap_model_call"}
+_HOOK_PREFIXES = ("before_", "after_", "wrap_", "abefore_", "aafter_", "awrap_")
+
+
+def _overridden_hooks(m: AgentMiddleware) -> set[str]:
+    """中间件重写了的钩子名称"""
+    names = [name for name in vars(AgentMiddleware) if name.startswith(_HOOK_PREFIXES)]
+    return {name for name in names if getattr(m.__class__, name) is not getattr(AgentMiddleware, name)}
+
+
+def _direct_call(tool) -> tuple[type[BaseModel], Callable] | None:
+    """
+    能否跳过 tool.invoke 直接调用工具函数：只适用于参数模式为 pydantic 模型、返回纯文本内容（response_format="content"）、
+    没有注入参数（ToolRuntime、InjectedToolCallId 等）的同步 StructuredTool
+    """
+    schema = getattr(tool, "args_schema", None)
+    if not (isinstance(tool, StructuredTool) and tool.func is not None and tool.response_format == "content"
+            and isinstance(schema, type) and issubclass(schema, BaseModel)):
+        return None
+    # 模型可见的参数、参数模式和函数签名三者一致，才说明没有需要工具节点注入的参数
+    fields = set(schema.model_fields)
+    if fields != set(tool.tool_call_schema.model_fields) or fields != set(inspect.signature(tool.func).parameters):
+        return None
+    return schema, tool.func
+
+
+def _normalize(result) -> ModelResponse:
+    """包装中间件可以返回 AIMessage 或 ModelResponse，统一为 ModelResponse"""
+    return result if isinstance(result, ModelResponse) else ModelResponse(result=[result])
+
+
+def _call_wrapper(wrap: Callable, handler: Callable, request: ModelRequest) -> ModelResponse:
+    return _normalize(wrap(request, lambda r: _normalize(handler(r))))
+
+
+class ExecutionPlan:
+    """
+    静态执行计划：由 compile_agent 从 create_agent 的结果和中间件列表生成
+    """
+
+    def __init__(self, agent, model, middleware: list[AgentMiddleware], name: str | None = None):
+        self.agent = agent
+        self.model = model
+        self.name = name
+        self.fallback: list[str] = []  # 不能使用静态计划的原因
+
+        # 有序钩子列表（与 create_agent 的顺序相同：before 按中间件顺序，after 逆序，包装从外到内）
+        for m in middleware:
+            unsupported = _overridden_hooks(m) - _SUPPORTED - {f"a{h}" for h in _SUPPORTED}
+            if unsupported:
+                self.fallback.append(f"{m.name} 使用了 {', '.join(sorted(unsupported))}")
+            for hook in ("before_model", "after_model"):
+                if getattr(getattr(m.__class__, hook), "__can_jump_to__", None):
+                    self.fallback.append(f"{m.name}.{hook} 可以跳转（jump_to）")
+        hooks = {hook: [m for m in middleware if hook in _overridden_hooks(m)] for hook in _SUPPORTED}
+        self.before = [(f"{m.name}.before_model", m.before_model) for m in hooks["before_model"]]
+        self.after = [(f"{m.name}.after_model", m.after_model) for m in reversed(hooks["after_model"])]
+        self.wrappers = [f"{m.name}.wrap_model_call" for m in hooks["wrap_model_call"]]
+        self.call_model = self._execute
+        for m in reversed(hooks["wrap_model_call"]):
+            self.call_model = functools.partial(_call_wrapper, m.wrap_model_call, self.call_model)
+
+        # 工具调度表（取自图中的工具节点，包含中间件注册的工具）
+        tool_node = agent.builder.nodes.get("tools")
+        self.tools = list(tool_node.runnable.tools_by_name.values()) if tool_node else []
+        self.dispatch = {t.name: (t, _direct_call(t)) for t in self.tools}
+        for name, (_, direct) in self.dispatch.items():
+            if direct is None:
+                self.fallback.append(f"工具 {name} 不能直接调用（异步、带注入参数或非 content 响应格式）")
+
+        # 预先绑定工具 schema 的模型和系统消息（从图的模型节点里拿不到，由 compile_agent 传入）
+        self.bound = model.bind_tools(self.tools) if self.tools else model
+        self.schema_bytes = len(json.dumps([convert_to_openai_tool(t) for t in self.tools], ensure_ascii=False).encode())
+        self.system_message: SystemMessage | None = None
+
+        # 步数上限：与图的 recursion_limit 相同，每执行一个节点（钩子、模型、工具）计一步
+        self.recursion_limit = (agent.config or {}).get("recursion_limit", DEFAULT_RECURSION_LIMIT)
+
+        # 状态归并函数：有归并函数的通道（messages 以及自定义的 Annotated 字段）按函数合并，其余通道直接覆盖
+        self.channels = [k for k in agent.channels if not k.startswith(("__", "branch:")) and k != "jump_to"]
+        self.reducers: dict[str, BinaryOperatorAggregate] = {
+            k: ch for k, ch in agent.channels.items() if k in self.channels and isinstance(ch, BinaryOperatorAggregate)}
+
+    def _execute(self, request: ModelRequest) -> ModelResponse:
+        """最内层的模型调用：请求没有被中间件修改时使用预先绑定的模型"""
+        if request.model is self.model and request.tools == self.tools and request.tool_choice is None \
+                and not request.model_settings:
+            bound = self.bound
+        elif request.tools:
+            bound = request.model.bind_tools(request.tools, tool_choice=request.tool_choice, **request.model_settings)
+        else:
+            bound = request.model.bind(**request.model_settings)
+        messages = [request.system_message, *request.messages] if request.system_message else request.messages
+        output = bound.invoke(messages)
+        if self.name:
+            output.name = self.name
+        return ModelResponse(result=[output])
+
+    def _apply(self, state: dict, update: dict | None) -> None:
+        if not update:
+            return
+        for key, value in update.items():
+            if key not in self.channels:
+                raise ValueError(f"状态更新包含未声明的字段: {key}")
+            channel = self.reducers.get(key)
+            if channel is None or isinstance(value, Overwrite):
+                state[key] = value.value if isinstance(value, Overwrite) else value
+            elif key in state:
+                state[key] = channel.operator(state[key], value)
+            else:
+                # 第一次写入交给一个新的通道处理：从通道的初始值（类型的空值，例如 int 为 0）开始归并，
+                # 类型不能无参构造时直接保存这次的更新
+                fresh = type(channel)(channel.typ, channel.operator)
+                fresh.update([value])
+                state[key] = fresh.get()
+
+    def _run_tool(self, call: dict) -> ToolMessage:
+        """
+        按调度表执行一个工具调用，行为与工具节点的默认设置一致：参数错误返回错误消息，工具异常向上抛出
+
+        调度表中的工具都能直接调用（否则编译时已退回图执行）
+        """
+        entry = self.dispatch.get(call["name"])
+        if entry is None:
+            return ToolMessage(content=f"Error: {call['name']} is not a valid tool, try one of [{', '.join(self.dispatch)}].",
+                               name=call["name"], tool_call_id=call["id"], status="error")
+        tool, (schema, func) = entry
+        try:
+            arguments = schema.model_validate(call["args"])
+        except ValidationError as e:
+            return ToolMessage(content=f"Error invoking tool '{tool.name}' with kwargs {call['args']} with error:\n{e}\n"
+                                       " Please fix the error and try again.",
+                               name=tool.name, tool_call_id=call["id"], status="error")
+        output = func(**{field: getattr(arguments, field) for field in schema.model_fields})
+        content = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False, default=str)
+        return ToolMessage(content=content, name=tool.name, tool_call_id=call["id"])
+
+    def _count_steps(self, steps: int, nodes: int) -> int:
+        """累计执行的节点数，超过 recursion_limit 时与图执行一样抛出 GraphRecursionError"""
+        steps += nodes
+        if steps > self.recursion_limit:
+            raise GraphRecursionError(f"Recursion limit of {self.recursion_limit} reached without hitting a stop condition. "
+                                      "You can increase the limit by setting the `recursion_limit` config key.")
+        return steps
+
+    def run(self, input: dict, context=None) -> dict:
+        """
+        按计划执行：before_model → 模型（经包装中间件）→ after_model → 工具，直到模型不再调用工具
+
+        与图执行一样，执行的节点数超过 recursion_limit 时抛出 GraphRecursionError
+        """
+        state: dict[str, Any] = {}
+        self._apply(state, input)
+        runtime = Runtime(context=context)
+        steps = 0
+        while True:
+            # 本轮要执行的节点：每个钩子、模型、（有工具调用时的）工具节点各一步
+            steps = self._count_steps(steps, len(self.before) + 1 + len(self.after))
+            for _, hook in self.before:
+                self._apply(state, hook(state, runtime))
+            request = ModelRequest(model=self.model, messages=state["messages"], system_message=self.system_message,
+                                   tools=self.tools, state=state, runtime=runtime)
+            self._apply(state, {"messages": self.call_model(request).result})
+            for _, hook in self.after:
+                self._apply(state, hook(state, runtime))
+            last = state["messages"][-1]
+            if not isinstance(last, AIMessage) or not last.tool_calls:
+                return state
+            steps = self._count_steps(steps, 1)
+            self._apply(state, {"messages": [self._run_tool(call) for call in last.tool_calls]})
+            if any(getattr(self.dispatch.get(c["name"], (None,))[0], "return_direct", False) for c in last.tool_calls):
+                return state
+
+    def report(self) -> None:
+        """打印计划和每一步的工作"""
+        graph_nodes = [n for n in self.agent.nodes if n != "__start__"]
+        print(f"图节点（{len(graph_nodes)} 个）: {', '.join(graph_nodes)}")
+        print(f"状态字段: {', '.join(self.channels)}（有归并函数: {', '.join(self.reducers) or '无'}）")
+        if self.fallback:
+            print("不能使用静态计划，按图执行：")
+            for reason in self.fallback:
+                print(f"  - {reason}")
+            return
+        print("每一步的工作：")
+        print(f"  1. before_model 钩子 {len(self.before)} 个: {', '.join(n for n, _ in self.before) or '无'}")
+        print(f"  2. 模型调用，经过 {len(self.wrappers)} 层包装: {' → '.join(self.wrappers) or '无'}")
+        print(f"     预先绑定 {len(self.tools)} 个工具（schema {self.schema_bytes} 字节），"
+              f"系统消息 {len(self.system_message.content) if self.system_message else 0} 字")
+        print(f"  3. after_model 钩子 {len(self.after)} 个: {', '.join(n for n, _ in self.after) or '无'}")
+        print(f"  4. 有工具调用时查表直接调用函数: {', '.join(self.dispatch) or '无'}")
+        print(f"  步数上限: {self.recursion_limit}（与图的 recursion_limit 相同）")
+
+
+class CompiledAgent:
+    """
+    编译后的智能体：invoke 能用静态计划时按计划执行，否则（或传入了 config）使用原来的图；
+    stream、ainvoke 等其他方法直接交给图
+    """
+
+    def __init__(self, agent, plan: ExecutionPlan):
+        self.agent = agent
+        self.plan = plan
+
+    def invoke(self, input: dict, config=None, context=None) -> dict:
+        if self.plan.fallback or config is not None or self.agent.checkpointer is not None:
+            return self.agent.invoke(input, config, context=context)
+        return self.plan.run(input, context)
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+
+def compile_agent(model, tools=None, *, middleware=(), system_prompt: str | None = None, name: str | None = None,
+                  **kwargs) -> CompiledAgent:
+    """
+    创建智能体并生成静态执行计划，参数与 create_agent 相同
+
+    返回值：
+    - CompiledAgent，plan.report() 打印计划
+    """
+    middleware = list(middleware)
+    agent = create_agent(model, tools=tools, middleware=middleware, system_prompt=system_prompt, name=name, **kwargs)
+    plan = ExecutionPlan(agent, model, middleware, name=name)
+    if system_prompt:
+        plan.system_message = SystemMessage(content=system_prompt)
+    if kwargs.get("response_format") is not None:
+        plan.fallback.append("使用了结构化输出（response_format）")
+    if kwargs.get("interrupt_before") or kwargs.get("interrupt_after"):
+        plan.fallback.append("设置了中断点")
+    return CompiledAgent(agent, plan)
+
+
+# 与 middleware_demo.py 相同结构的测试智能体：工具 + 动态模型选择 + 观察用户偏好 + 自定义状态 + 系统提示
+class ToolCallingFakeModel(GenericFakeChatModel):
+    """离线假模型：支持 bind_tools，按顺序循环回复"""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def new_model() -> ToolCallingFakeModel:
+    """每次调用先查天气，再给出回答"""
+    return ToolCallingFakeModel(messages=itertools.cycle([
+        AIMessage(content="", tool_calls=[{"name": "get_weather", "args": {"location": "上海"}, "id": "call_1"}]),
+        AIMessage(content="上海今天晴朗，25°C。"),
+    ]))
+
+
+def build_middleware(model) -> list[AgentMiddleware]:
+    @wrap_model_call
+    def dynamic_model_selection(request: ModelRequest, handler) -> ModelResponse:
+        return handler(request.override(model=model))
+
+    @after_model
+    def count_steps(state, runtime) -> dict[str, Any] | None:
+        return None if state.get("user_preferences", {}).get("verbosity") != "debug" else {"user_preferences": {}}
+
+    return [make_observer_middleware(0), dynamic_model_selection, count_steps]
+
+
+def step_latency(agent, runs: int = 300) -> tuple[float, dict]:
+    """
+    测量每一步（一次模型调用 + 之后的工具调用）的平均耗时
+
+    返回值：
+    - (微秒/步, 最后一次运行的结果)
+    """
+    payload = {"messages": [{"role": "user", "content": "上海今天天气怎么样？"}],
+               "user_preferences": {"style": "technical", "verbosity": "detailed"}}
+    for _ in range(10):  # 预热
+        result = agent.invoke(payload)
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = agent.invoke(payload)
+    steps = sum(isinstance(m, AIMessage) for m in result["messages"])
+    return (time.perf_counter() - start) / runs / steps * 1e6, result
+
+
+def create_demo(factory, model=None):
+    model = model or new_model()
+    return factory(model, tools=[search, get_weather], middleware=build_middleware(model),
+                   state_schema=CustomState, system_prompt="你是一个有帮助的助手。请简洁准确地回答问题。")
+
+
+# 运行编译和基准测试
+if __name__ == "__main__":
+    print("=== 测试1：执行计划报告 ===")
+    compiled = create_demo(compile_agent)
+    compiled.plan.report()
+
+    print("\n=== 测试2：每一步的延迟（离线假模型）===")
+    graph_latency, graph_result = step_latency(create_demo(create_agent))
+    plan_latency, plan_result = step_latency(create_demo(compile_agent))
+    print(f"图执行:     {graph_latency:>8.0f} µs/步")
+    print(f"静态计划:   {plan_latency:>8.0f} µs/步（{graph_latency / plan_latency:.1f}x）")
+
+    def summary(result):
+        return [(type(m).__name__, m.content, [c["name"] for c in getattr(m, "tool_calls", [])]) for m in result["messages"]]
+    same = summary(graph_result) == summary(plan_result) and graph_result["user_preferences"] == plan_result["user_preferences"]
+    print(f"结果与图执行一致: {same}")
+
+    print("\n=== 测试3：不满足条件时按图执行 ===")
+
+    class AuditTools(AgentMiddleware):
+        def wrap_tool_call(self, request, handler):
+            return handler(request)
+
+    fallback = compile_agent(new_model(), tools=[search, get_weather], middleware=[AuditTools()])
+    fallback.plan.report()
@@ -0,0 +1,344 @@
+# 增量流式传输示例
+# streaming_demo.py 使用 stream_mode="values"，每一步都发送完整的消息列表，数据量随对话长度按平方增长。
+# 本示例在 values 模式之上实现增量传输：
+# - DiffEncoder：只发送新追加的消息和发生变化的状态键，每个事件带有递增的序号
+# - DiffClient：按序号应用事件还原完整状态；发现序号不连续时要求从断点重连
+# - StreamHub：多个订阅者共享同一次上游运行；断线的订阅者可以从某个序号继续接收，
+#   如果该序号已经不在事件日志中，先收到一个完整快照
+# 最后用一个固定脚本的模型测试 50 步运行时两种模式的传输字节数和CPU开销
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.tools import tool  # 用于定义工具
+from langchain_core.language_models import BaseChatModel  # 聊天模型基类
+from langchain_core.messages import AIMessage, ToolMessage  # 消息类型
+from langchain_core.outputs import ChatGeneration, ChatResult  # 模型输出类型
+from collections import deque  # 用于保存最近的事件
+from typing import Iterator  # 用于类型提示
+from state_serializer_demo import from_json, json_default, revive, to_json  # 快速 JSON 编解码
+import orjson  # 快速 JSON
+import threading  # 用于后台运行和通知订阅者
+import time  # 用于计时
+
+_MISSING = object()
+
+
+def _extends(old: list, new: list) -> bool:
+    """
+    new 是否是在 old 末尾追加得到的
+
+    values 模式下未变化的消息是同一个对象，因此逐个比较前缀的对象身份；
+    中间任何一条被按 id 替换或删除，都不算追加（改为发送完整的新值）
+    """
+    return len(new) >= len(old) and all(a is b for a, b in zip(old, new))
+
+
+class DiffEncoder:
+    """
+    把 values 模式输出的完整状态序列转换为增量事件
+
+    事件格式：
+    - {"seq": n, "append": {键: 新追加的元素}, "set": {键: 新值}, "unset": [键]}
+    - {"seq": n, "snapshot": 完整状态}（第一个事件，或重连时的快照）
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self._prev: dict | None = None
+
+    def diff(self, state: dict) -> dict:
+        """计算与上一个状态相比的增量事件"""
+        self.seq += 1
+        prev, self._prev = self._prev, state
+        if prev is None:
+            return {"seq": self.seq, "snapshot": state}
+        event, append, changed = {"seq": self.seq}, {}, {}
+        for key, value in state.items():
+            old = prev.get(key, _MISSING)
+            if old is value:
+                continue
+            if isinstance(value, list) and isinstance(old, list) and _extends(old, value):
+                if len(value) > len(old):
+                    append[key] = value[len(old):]
+            elif old is _MISSING or old != value:
+                changed[key] = value  # 列表被截断或替换（例如裁剪历史）时发送完整的新值
+        if append:
+            event["append"] = append
+        if changed:
+            event["set"] = changed
+        removed = [key for key in prev if key not in state]
+        if removed:
+            event["unset"] = removed
+        return event
+
+
+def encode_event(event: dict) -> bytes:
+    """把事件编码为 JSON（消息和 pydantic 模型见 state_serializer_demo.json_default）"""
+    return orjson.dumps(event, default=json_default)
+
+
+class SequenceGapError(RuntimeError):
+    """收到的事件序号不连续，需要从 DiffClient.seq 重新订阅"""
+
+
+class DiffClient:
+    """
+    客户端：按序号应用增量事件，维护完整状态
+    """
+
+    def __init__(self):
+        self.state: dict = {}
+        self.seq = 0
+        self.finished = False
+        self.error: str | None = None
+
+    def apply(self, data: bytes) -> dict:
+        """
+        应用一个事件
+
+        参数：
+        - data: 编码后的事件
+
+        返回值：
+        - dict类型，应用后的完整状态
+        """
+        event = orjson.loads(data)
+        seq = event["seq"]
+        if "snapshot" in event:
+            self.state = {key: revive(value) for key, value in event["snapshot"].items()}
+        elif seq != self.seq + 1:
+            raise SequenceGapError(f"期望序号 {self.seq + 1}，收到 {seq}")
+        else:
+            for key, items in event.get("append", {}).items():
+                self.state.setdefault(key, []).extend(revive(items))
+            for key, value in event.get("set", {}).items():
+                self.state[key] = revive(value)
+            for key in event.get("unset", ()):
+                self.state.pop(key, None)
+        self.finished = event.get("end", False)
+        self.error = event.get("error")
+        self.seq = seq
+        return self.state
+
+
+class StreamRun:
+    """
+    一次上游运行：后台线程消费 agent.stream(stream_mode="values")，把增量事件广播给所有订阅者
+    """
+
+    def __init__(self, run_id: str, history: int = 1024):
+        """
+        参数：
+        - run_id: 运行ID
+        - history: 保留的最近事件数，用于断线重连
+        """
+        self.run_id = run_id
+        self._encoder = DiffEncoder()
+        self._events: deque[bytes] = deque(maxlen=history)  # 序号连续，最后一个的序号为 self.seq
+        self._state: dict = {}
+        self._end: dict = {}  # 结束事件中的 end / error，附加到结束后的快照中
+        self._cond = threading.Condition()
+        self.seq = 0
+        self.done = False
+
+    def _publish(self, event: dict, state: dict | None) -> None:
+        data = encode_event(event)
+        with self._cond:
+            self._events.append(data)
+            self.seq = event["seq"]
+            if state is not None:
+                self._state = state
+            else:
+                self._end = {key: event[key] for key in ("end", "error") if key in event}
+            self._cond.notify_all()
+
+    def _produce(self, agent, inputs: dict, config: dict | None) -> None:
+        try:
+            for state in agent.stream(inputs, config, stream_mode="values"):
+                self._publish(self._encoder.diff(state), state)
+            self._publish({"seq": self._encoder.seq + 1, "end": True}, None)
+        except Exception as e:
+            self._publish({"seq": self._encoder.seq + 1, "end": True, "error": f"{type(e).__name__}: {e}"}, None)
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def subscribe(self, after: int = 0) -> Iterator[bytes]:
+        """
+        订阅事件
+
+        参数：
+        - after: 已经收到的最后一个序号（0 表示从头开始）；断线重连时传入 DiffClient.seq
+
+        返回值：
+        - 迭代器，依次产出编码后的事件，运行结束后停止
+        """
+        next_seq = after + 1
+        while True:
+            with self._cond:
+                while self.seq < next_seq and not self.done:
+                    self._cond.wait()
+                if self.seq < next_seq:
+                    return
+                first = self.seq - len(self._events) + 1
+                if next_seq < first:
+                    # 需要的事件已经不在日志中：先发送当前状态的快照
+                    snapshot = {"seq": self.seq, "snapshot": self._state, **self._end}
+                    batch = []
+                else:
+                    snapshot = None
+                    batch = [self._events[i] for i in range(next_seq - first, len(self._events))]
+                next_seq = self.seq + 1
+            if snapshot is not None:
+                yield encode_event(snapshot)
+            yield from batch
+
+
+class StreamHub:
+    """
+    按运行ID管理上游运行：相同ID的多个请求共享同一次运行
+    """
+
+    def __init__(self, history: int = 1024):
+        self.history = history
+        self.runs: dict[str, StreamRun] = {}
+        self._lock = threading.Lock()
+
+    def start(self, run_id: str, agent, inputs: dict, config: dict | None = None) -> StreamRun:
+        """启动一次运行；该ID的运行已经存在时直接返回它"""
+        with self._lock:
+            run = self.runs.get(run_id)
+            if run is None:
+                run = self.runs[run_id] = StreamRun(run_id, self.history)
+                threading.Thread(target=run._produce, args=(agent, inputs, config),
+                                 name=f"stream-{run_id}", daemon=True).start()
+            return run
+
+    def subscribe(self, run_id: str, after: int = 0) -> Iterator[bytes]:
+        """订阅某次运行的事件（见 StreamRun.subscribe）"""
+        return self.runs[run_id].subscribe(after)
+
+    def discard(self, run_id: str) -> None:
+        """丢弃已结束的运行"""
+        with self._lock:
+            self.runs.pop(run_id, None)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """固定脚本的模型：先调用 rounds 次搜索工具，再给出回答（没有网络请求，延迟可控）"""
+
+    rounds: int = 25
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs) -> "ScriptedChatModel":
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        done = sum(isinstance(m, ToolMessage) for m in messages)
+        if done < self.rounds:
+            message = AIMessage(content=f"第{done + 1}轮：继续搜索相关资料。", tool_calls=[
+                {"name": "search", "args": {"query": f"人工智能最新进展 第{done + 1}部分"}, "id": f"call_{done}"}])
+        else:
+            message = AIMessage(content="总结：" + "人工智能在多个领域取得了进展。" * 10)
+        message.usage_metadata = {"input_tokens": 100 * len(messages), "output_tokens": 30, "total_tokens": 100 * len(messages) + 30}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+@tool
+def search(query: str) -> str:
+    """
+    搜索信息
+
+    参数：
+    - query: str类型，搜索查询词
+
+    返回值：
+    - str类型，搜索结果
+    """
+    return f"搜索结果：{query} - " + "这是模拟的搜索结果，包含若干段落的摘要文本。" * 10
+
+
+def compare(states: list[dict]) -> dict:
+    """对同一组状态分别按 values 模式和增量模式编码、解码，返回字节数和CPU时间"""
+    start = time.process_time()
+    values = [to_json(state) for state in states]
+    values_server = time.process_time() - start
+    start = time.process_time()
+    for data in values:
+        from_json(data)
+    values_client = time.process_time() - start
+
+    start = time.process_time()
+    encoder = DiffEncoder()
+    diffs = [encode_event(encoder.diff(state)) for state in states]
+    diff_server = time.process_time() - start
+    start = time.process_time()
+    client = DiffClient()
+    for data in diffs:
+        client.apply(data)
+    diff_client = time.process_time() - start
+    assert [m.content for m in client.state["messages"]] == [m.content for m in states[-1]["messages"]]
+    return {
+        "values_bytes": sum(map(len, values)), "diff_bytes": sum(map(len, diffs)),
+        "values_server": values_server, "values_client": values_client,
+        "diff_server": diff_server, "diff_client": diff_client,
+    }
+
+
+# 测试增量流式传输
+if __name__ == "__main__":
+    inputs = {"messages": [{"role": "user", "content": "搜索人工智能最新进展并总结发现"}]}
+
+    print("=== 测试1：传输字节数和CPU开销 ===")
+    print(f"{'步数':>6} {'values(KB)':>12} {'增量(KB)':>10} {'比例':>8} {'values 服务端/客户端(ms)':>26} {'增量 服务端/客户端(ms)':>24}")
+    for rounds in (5, 12, 25):
+        agent = create_agent(ScriptedChatModel(rounds=rounds), tools=[search])
+        states = list(agent.stream(inputs, stream_mode="values"))
+        r = compare(states)
+        print(f"{len(states):>6} {r['values_bytes'] / 1024:>12.1f} {r['diff_bytes'] / 1024:>10.1f} "
+              f"{r['values_bytes'] / r['diff_bytes']:>7.1f}x "
+              f"{r['values_server'] * 1000:>14.1f}/{r['values_client'] * 1000:<11.1f}"
+              f"{r['diff_server'] * 1000:>12.1f}/{r['diff_client'] * 1000:<11.1f}")
+
+    print("\n=== 测试2：多个订阅者共享一次运行，断线后从序号继续 ===")
+    model = ScriptedChatModel(rounds=25, latency=0.01)
+    agent = create_agent(model, tools=[search])
+    hub = StreamHub(history=16)
+    run = hub.start("run-1", agent, inputs)
+    hub.start("run-1", agent, inputs)  # 相同ID：复用已有的运行
+    results = {}
+
+    def subscriber(name: str, disconnect_after: int | None = None, pause: float = 0) -> None:
+        client = DiffClient()
+        received = 0
+        for data in hub.subscribe("run-1"):
+            client.apply(data)
+            received += 1
+            if received == disconnect_after:
+                break  # 模拟断线
+        if disconnect_after is not None:
+            time.sleep(pause)
+            for data in hub.subscribe("run-1", after=client.seq):  # 从断点继续
+                client.apply(data)
+                received += 1
+        results[name] = (received, client.seq, len(client.state["messages"]), client.finished)
+
+    threads = [threading.Thread(target=subscriber, args=(f"订阅者{i}",)) for i in range(3)]
+    threads.append(threading.Thread(target=subscriber, args=("短暂断线", 10, 0.05)))
+    threads.append(threading.Thread(target=subscriber, args=("长时间断线", 5, 0.6)))  # 超过日志长度，先收到快照
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for name, (received, seq, count, finished) in results.items():
+        print(f"{name}: 收到 {received} 个事件，最后序号 {seq}，消息 {count} 条，结束={finished}")
+    print(f"上游模型调用次数: {model.calls}（5 个订阅者共享一次运行）")
@@ -0,0 +1,328 @@
+# 结构化输出快速路径示例
+# structured_output_tool.py 使用 ToolStrategy(ContactInfo)：模型必须通过一个额外的“结构化输出工具”给出最终答案，
+# 请求中要携带该工具的Schema，并且 tool_choice 被强制为必须调用工具。
+# 本示例实现两条不经过结构化输出工具的路径：
+# - NativeStructuredOutputMiddleware：模型支持原生结构化输出时（JSON Schema 约束，或 DeepSeek 的 JSON 模式）
+#   直接让模型输出JSON作为最终答案；模型不支持或输出无法通过校验时，自动退回 ToolStrategy
+# - extract / StructuredOutputRouter：不需要其他工具的请求不经过智能体循环，一次模型调用完成抽取
+# 最后用模拟的 DeepSeek 接口比较各方式的模型调用次数、请求大小和延迟
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse  # 中间件基类
+from langchain.agents.structured_output import ProviderStrategy, ToolStrategy  # 结构化输出策略
+from langchain.tools import tool  # 用于定义工具
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage  # 消息类型
+from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+from pydantic import BaseModel, ValidationError  # 用于定义和校验数据模型
+from local_model_demo import create_local_model, text_features  # 本地模型和文本特征（特征打分）
+from contact_schema import ContactInfo  # 联系信息模型（与 structured_output_tool.py 相同）
+from transport_replay_demo import FakeDeepSeekUpstream  # 模拟的 DeepSeek 接口
+import httpx  # 用于挂载模拟接口
+import json  # 用于生成Schema说明
+import re  # 用于从提示词中取出Schema
+import statistics  # 用于统计延迟
+import threading  # 用于计数
+import time  # 用于计时
+
+JSON_OBJECT = {"type": "json_object"}  # DeepSeek / OpenAI 的 JSON 模式
+
+# 支持 JSON 模式（response_format={"type": "json_object"}）的模型名前缀
+JSON_MODE_MODELS = ("deepseek-chat", "gpt-4", "gpt-3.5", "qwen")
+
+SCHEMA_INSTRUCTION = """请以 JSON 格式给出最终答案：只输出一个满足以下 JSON Schema 的对象，不要输出其他文字。
+```json
+{schema}
+```"""
+
+
+def native_mode(model) -> str | None:
+    """
+    判断模型支持的原生结构化输出方式
+
+    返回值：
+    - "json_schema"：支持按 JSON Schema 约束输出（ProviderStrategy）
+    - "json_object"：支持 JSON 模式，Schema 通过提示词说明
+    - None：不支持，只能使用 ToolStrategy
+    """
+    profile = getattr(model, "profile", None) or {}
+    if profile.get("structured_output"):
+        return "json_schema"
+    name = str(getattr(model, "model_name", None) or getattr(model, "model", None) or "")
+    if isinstance(model, ChatDeepSeek) or hasattr(model, "openai_api_base"):
+        if name.startswith(JSON_MODE_MODELS):
+            return "json_object"
+    return None
+
+
+def schema_instruction(schema: type[BaseModel]) -> str:
+    return SCHEMA_INSTRUCTION.format(schema=json.dumps(schema.model_json_schema(), ensure_ascii=False, separators=(",", ":")))
+
+
+def parse_json(schema: type[BaseModel], output: AIMessage) -> BaseModel | None:
+    """把模型的JSON输出校验为 schema，失败时返回 None"""
+    try:
+        return schema.model_validate_json(str(output.content))
+    except (ValidationError, ValueError):
+        return None
+
+
+class NativeStructuredOutputMiddleware(AgentMiddleware):
+    """
+    原生结构化输出中间件：与 ToolStrategy(schema) 一起使用，能用原生方式时跳过结构化输出工具
+
+    - json_schema：把请求的 response_format 换成 ProviderStrategy(schema)
+    - json_object：经由 handler 发送只含用户工具、开启 JSON 模式的请求（内层中间件、tool_choice、model_settings 照常生效）；
+      模型调用工具时智能体继续循环，输出JSON时直接作为结构化结果
+    - 不支持、或JSON无法通过校验：交给原来的 ToolStrategy 处理（JSON 无效时这一步多花一次模型调用）
+
+    注意：ToolStrategy 本身在结构化输出工具调用后就结束，JSON 模式并不减少模型调用次数，
+    而且Schema放在提示词里，请求反而略大；它适合工具调用方式不可靠、而 JSON 模式可靠的模型
+    """
+
+    def __init__(self, schema: type[BaseModel]):
+        super().__init__()
+        self.schema = schema
+        self.instruction = schema_instruction(schema)
+        self.native = 0  # 原生方式得到结构化结果的次数
+        self.fallbacks = 0  # 退回 ToolStrategy 的次数
+
+    def _json_request(self, request: ModelRequest) -> ModelRequest:
+        """
+        改写请求：去掉结构化输出工具（response_format=None），通过 model_settings 开启 JSON 模式，
+        把Schema说明追加到系统提示；模型、工具、tool_choice 和其他设置保持不变，仍由内层中间件和模型节点处理
+        """
+        settings = dict(request.model_settings)
+        if request.tools:
+            # 同时传 tools 和 response_format 时 openai 客户端会走 parse 接口并要求工具为 strict，
+            # 这里通过 extra_body 直接发送 JSON 模式参数
+            settings["extra_body"] = {**settings.get("extra_body", {}), "response_format": JSON_OBJECT}
+        else:
+            settings["response_format"] = JSON_OBJECT
+        system = f"{request.system_prompt}\n\n{self.instruction}" if request.system_prompt else self.instruction
+        return request.override(response_format=None, model_settings=settings, system_message=SystemMessage(system))
+
+    def _response(self, response: ModelResponse) -> ModelResponse | None:
+        output = next((m for m in reversed(response.result) if isinstance(m, AIMessage)), None)
+        if output is None or output.tool_calls:
+            return response  # 调用普通工具，智能体继续循环
+        parsed = parse_json(self.schema, output)
+        if parsed is None:
+            return None
+        self.native += 1
+        return ModelResponse(result=response.result, structured_response=parsed)
+
+    def wrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        mode = native_mode(request.model)
+        if mode == "json_schema":
+            return handler(request.override(response_format=ProviderStrategy(self.schema)))
+        if mode == "json_object":
+            response = self._response(handler(self._json_request(request)))
+            if response is not None:
+                return response
+        self.fallbacks += 1
+        return handler(request)
+
+    async def awrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        mode = native_mode(request.model)
+        if mode == "json_schema":
+            return await handler(request.override(response_format=ProviderStrategy(self.schema)))
+        if mode == "json_object":
+            response = self._response(await handler(self._json_request(request)))
+            if response is not None:
+                return response
+        self.fallbacks += 1
+        return await handler(request)
+
+
+def extract(model, schema: type[BaseModel], text: str, system_prompt: str | None = None) -> BaseModel:
+    """
+    单次抽取：不经过智能体循环，一次模型调用得到结构化结果（JSON 模式失败时退回函数调用方式）
+
+    参数：
+    - model: 聊天模型
+    - schema: 结构化输出模型
+    - text: 待抽取的文本
+    - system_prompt: 可选的系统提示
+
+    返回值：
+    - schema 的实例
+    """
+    messages = [SystemMessage(system_prompt)] if system_prompt else []
+    messages.append(HumanMessage(text))
+    mode = native_mode(model)
+    if mode == "json_schema":
+        return model.with_structured_output(schema, method="json_schema").invoke(messages)
+    if mode == "json_object":
+        instruction = schema_instruction(schema)
+        system = f"{system_prompt}\n\n{instruction}" if system_prompt else instruction
+        parsed = parse_json(schema, model.bind(response_format=JSON_OBJECT).invoke([SystemMessage(system), HumanMessage(text)]))
+        if parsed is not None:
+            return parsed
+    return model.with_structured_output(schema).invoke(messages)
+
+
+class StructuredOutputRouter:
+    """
+    按请求选择路径：与工具无关的请求走单次抽取，需要工具的请求走智能体（带原生结构化输出中间件）
+    """
+
+    def __init__(self, model, schema: type[BaseModel], tools: list, min_overlap: int = 2):
+        """
+        参数：
+        - model: 聊天模型
+        - schema: 结构化输出模型
+        - tools: 智能体可以使用的工具
+        - min_overlap: 请求与工具描述的特征重合数至少达到该值，才可能需要工具
+        """
+        self.model = model
+        self.schema = schema
+        self.tools = tools
+        self.min_overlap = min_overlap
+        self.middleware = NativeStructuredOutputMiddleware(schema)
+        self.agent = create_agent(model, tools=tools, response_format=ToolStrategy(schema), middleware=[self.middleware])
+        self._tool_features = [text_features(t.name + t.description) for t in tools]
+        self._schema_features = text_features(schema.__name__ + (schema.__doc__ or ""))
+        self.direct = 0
+
+    def needs_tools(self, text: str) -> bool:
+        """请求与某个工具的相关度达到 min_overlap，且高于与输出Schema的相关度时，认为需要工具"""
+        words = text_features(text)
+        best = max((len(words & features) for features in self._tool_features), default=0)
+        return best >= self.min_overlap and best > len(words & self._schema_features)
+
+    def invoke(self, text: str) -> BaseModel:
+        if not self.needs_tools(text):
+            self.direct += 1
+            return extract(self.model, self.schema, text)
+        result = self.agent.invoke({"messages": [{"role": "user", "content": text}]})
+        return result["structured_response"]
+
+
+class JsonModeUpstream(FakeDeepSeekUpstream):
+    """
+    支持 JSON 模式和 tool_choice 的模拟 DeepSeek 接口
+
+    - JSON 模式：需要工具时先调用工具，否则按系统提示中的 JSON Schema 从最后的用户消息（或工具结果）中抽取字段
+    - tool_choice 为 required 且已有工具结果时，调用最后一个工具（结构化输出工具）
+    - broken_every：每隔若干次 JSON 输出返回一次不完整的JSON，用于测试退回逻辑
+    """
+
+    def __init__(self, ttfb: float = 0.05, broken_every: int = 0):
+        super().__init__(ttfb=ttfb, chunk_interval=0)
+        self.broken_every = broken_every
+        self.requests = 0
+        self.request_bytes = 0
+        self._json_outputs = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+            self.request_bytes += len(request.content)
+        return super().__call__(request)
+
+    def _decide(self, body: dict) -> tuple[str, list[dict]]:
+        messages = body["messages"]
+        last = messages[-1]
+        text = str(last.get("content", ""))
+        if body.get("response_format", {}).get("type") == "json_object":
+            system = next((str(m["content"]) for m in messages if m["role"] == "system"), "")
+            match = re.search(r"```json\n(.*?)\n```", system, re.S)
+            schema = json.loads(match.group(1)) if match else {}
+            if last["role"] != "tool" and body.get("tools"):
+                # 问题与某个工具的相关度高于与输出Schema的相关度时，先调用工具
+                words = text_features(text)
+                answer_score = len(words & text_features(schema.get("title", "") + schema.get("description", "")))
+                content, calls = super()._decide(body)
+                tool = next((t["function"] for t in body["tools"] if calls and t["function"]["name"] == calls[0]["function"]["name"]), None)
+                if tool and len(words & text_features(tool["name"] + tool.get("description", ""))) > answer_score:
+                    return content, calls
+            with self._lock:
+                self._json_outputs += 1
+                broken = self.broken_every and self._json_outputs % self.broken_every == 0
+            output = json.dumps(self.rules._arguments(text, schema), ensure_ascii=False)
+            return (output[:len(output) // 2] if broken else output), []
+        if body.get("tool_choice") == "required" and last["role"] == "tool":
+            function = body["tools"][-1]["function"]
+            arguments = self.rules._arguments(text, function.get("parameters", {}))
+            return "", [{"id": f"call_{self.requests}", "type": "function",
+                         "function": {"name": function["name"], "arguments": json.dumps(arguments, ensure_ascii=False)}}]
+        return super()._decide(body)
+
+
+@tool
+def lookup_employee(name: str) -> str:
+    """
+    按姓名查询员工通讯录，返回员工的联系方式
+
+    参数：
+    - name: str类型，员工姓名
+
+    返回值：
+    - str类型，联系方式
+    """
+    return f"{name}, {name.lower()}@example.com, (555) 987-6543"
+
+
+def run_mode(mode: str, model, texts: list[str]) -> tuple[list, list[float], float]:
+    """按指定方式抽取每段文本，返回 (结果, 每次的延迟, 平均每次的CPU时间)"""
+    if mode == "tool":
+        agent = create_agent(model, tools=[lookup_employee], response_format=ToolStrategy(ContactInfo))
+        run = lambda text: agent.invoke({"messages": [{"role": "user", "content": text}]})["structured_response"]
+    elif mode == "native":
+        agent = create_agent(model, tools=[lookup_employee], response_format=ToolStrategy(ContactInfo),
+                             middleware=[NativeStructuredOutputMiddleware(ContactInfo)])
+        run = lambda text: agent.invoke({"messages": [{"role": "user", "content": text}]})["structured_response"]
+    else:
+        run = StructuredOutputRouter(model, ContactInfo, [lookup_employee]).invoke
+    results, latencies = [], []
+    cpu = time.process_time()
+    for text in texts:
+        start = time.perf_counter()
+        results.append(run(text))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies, (time.process_time() - cpu) / len(texts)
+
+
+def deepseek(upstream: JsonModeUpstream) -> ChatDeepSeek:
+    return ChatDeepSeek(model="deepseek-chat", api_key="mock", max_retries=0,
+                        http_client=httpx.Client(transport=httpx.MockTransport(upstream)))
+
+
+# 测试结构化输出快速路径
+if __name__ == "__main__":
+    plain = [f"从以下内容提取联系信息：用户{i}, user{i}@example.com, (555) 123-{i:04d}" for i in range(20)]
+    lookups = [f"查询员工通讯录：员工{i}" for i in range(10)]
+    expected = {text: ContactInfo(name=f"用户{i}", email=f"user{i}@example.com", phone=f"(555) 123-{i:04d}")
+                for i, text in enumerate(plain)}
+    expected.update({text: ContactInfo(name=f"员工{i}", email=f"员工{i}@example.com", phone="(555) 987-6543")
+                     for i, text in enumerate(lookups)})
+
+    print("=== 测试1：各方式的模型调用次数和延迟（模拟接口，每次请求 50ms）===")
+    print(f"{'请求类型':<10} {'方式':<28} {'正确率':>6} {'调用/次':>8} {'请求KB/次':>10} {'平均延迟(ms)':>12} {'CPU(ms/次)':>10}")
+    labels = {"tool": "ToolStrategy", "native": "原生 JSON 模式", "direct": "路由（单次抽取 + 智能体）"}
+    for kind, texts in [("直接抽取", plain), ("需要工具", lookups)]:
+        for mode in ("tool", "native", "direct"):
+            upstream = JsonModeUpstream(ttfb=0.05)
+            results, latencies, cpu = run_mode(mode, deepseek(upstream), texts)
+            accuracy = sum(r == expected[t] for r, t in zip(results, texts)) / len(texts)
+            print(f"{kind:<10} {labels[mode]:<28} {accuracy:>6.0%} {upstream.requests / len(texts):>8.1f} "
+                  f"{upstream.request_bytes / len(texts) / 1024:>10.2f} {statistics.mean(latencies) * 1000:>12.1f} {cpu * 1000:>10.2f}")
+
+    print("\n=== 测试2：JSON 输出无效时自动退回 ToolStrategy ===")
+    upstream = JsonModeUpstream(ttfb=0, broken_every=3)
+    middleware = NativeStructuredOutputMiddleware(ContactInfo)
+    agent = create_agent(deepseek(upstream), tools=[lookup_employee], response_format=ToolStrategy(ContactInfo),
+                         middleware=[middleware])
+    results = [agent.invoke({"messages": [{"role": "user", "content": t}]})["structured_response"] for t in plain]
+    print(f"正确率 {sum(r == expected[t] for r, t in zip(results, plain)) / len(plain):.0%}，"
+          f"原生 {middleware.native} 次，退回 {middleware.fallbacks} 次（每次退回多一次模型调用，共 {upstream.requests} 次调用）")
+
+    print("\n=== 测试3：不支持原生结构化输出的模型（本地模型）===")
+    local = create_local_model()
+    print(f"native_mode(本地模型) = {native_mode(local)}，native_mode(deepseek-chat) = {native_mode(deepseek(upstream))}")
+    middleware = NativeStructuredOutputMiddleware(ContactInfo)
+    agent = create_agent(local, tools=[lookup_employee], response_format=ToolStrategy(ContactInfo), middleware=[middleware])
+    result = agent.invoke({"messages": [{"role": "user", "content": plain[0]}]})
+    print(f"结构化响应: {result['structured_response']}（退回 ToolStrategy {middleware.fallbacks} 次）")
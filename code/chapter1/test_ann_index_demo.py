@@ -0,0 +1,56 @@
+# ann_index_demo 的测试：小规模合成数据上的召回和ID映射，增量插入 -> 合并 -> 保存 -> 加载往返
+import numpy as np
+import pytest
+
+from ann_index_demo import IVFPQIndex, exact_search, synthetic_vectors
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    vectors = np.asarray(synthetic_vectors(tmp_path_factory.mktemp("ann") / "vectors.npy", 3000, 32, clusters=40))
+    index = IVFPQIndex.build(vectors[:2500], nlist=16, m=8, sample_size=2500)
+    return vectors, index
+
+
+def test_recall_and_id_mapping(data):
+    vectors, index = data
+    queries = vectors[:50]
+    truth = exact_search(vectors[:2500], queries, k=10)
+    hits = sum(len(set(index.search(q, k=10, nprobe=16, rerank=200)[0].tolist()) & set(t.tolist()))
+               for q, t in zip(queries, truth))
+    assert hits / truth.size >= 0.9
+    # 精排后每个向量检索到的第一个结果是它自己的ID
+    for i in (0, 7, 1234, 2499):
+        assert index.search(vectors[i], k=1, nprobe=16, rerank=50)[0][0] == i
+
+
+def test_add_compact_save_load_round_trip(data, tmp_path):
+    vectors, base = data
+    base.save(tmp_path / "base")
+    index = IVFPQIndex.load(tmp_path / "base", mmap=False)  # 副本，不修改共享的索引
+    new_ids = index.add(vectors[2500:])
+    assert new_ids.tolist() == list(range(2500, 3000))
+    assert index.search(vectors[2800], k=1, nprobe=16, rerank=50)[0][0] == 2800  # 增量段立即可查
+    index.compact()
+    index.save(tmp_path / "grown")
+    loaded = IVFPQIndex.load(tmp_path / "grown")
+    assert len(loaded) == 3000
+    for i in (3, 2600, 2999):
+        assert loaded.search(vectors[i], k=1, nprobe=16, rerank=50)[0][0] == i
+    ids, distances = index.search(vectors[42], k=10, nprobe=4)
+    loaded_ids, loaded_distances = loaded.search(vectors[42], k=10, nprobe=4)
+    assert ids.tolist() == loaded_ids.tolist() and np.allclose(distances, loaded_distances)
+
+
+def test_save_does_not_touch_mapped_files(data, tmp_path):
+    vectors, index = data
+    index.save(tmp_path)
+    reader = IVFPQIndex.load(tmp_path, mmap=True)
+    before = reader.search(vectors[5], k=10, nprobe=16, rerank=50)[0].tolist()
+    grown = IVFPQIndex.load(tmp_path, mmap=False)
+    grown.add(vectors[:100])
+    grown.save(tmp_path)
+    # 旧的读取方仍然读到完整的旧数据，新加载的是新的一代，旧文件已删除
+    assert reader.search(vectors[5], k=10, nprobe=16, rerank=50)[0].tolist() == before
+    assert len(IVFPQIndex.load(tmp_path)) == len(reader) + 100
+    assert sorted(p.name for p in tmp_path.glob("raw*.npy")) == ["raw.2.npy"]
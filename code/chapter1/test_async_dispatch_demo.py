@@ -0,0 +1,88 @@
+# async_dispatch_demo 的测试：同步/异步自动分派
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+
+from langchain.agents import create_agent
+
+import async_dispatch_demo
+from async_dispatch_demo import (CHAPTER1_ASYNC_TOOLS, WeatherFakeModel, aget_weather, ahandle_tool_errors,
+                                 dual_tool, dual_wrap_tool_call, get_weather, handle_tool_errors, run_sync)
+
+QUESTION = {"messages": [{"role": "user", "content": "北京的天气怎么样？"}]}
+
+
+def test_run_sync_inside_running_loop():
+    async def inner():
+        return run_sync(asyncio.sleep(0, result="完成"))
+
+    assert run_sync(asyncio.sleep(0, result="完成")) == "完成"
+    assert asyncio.run(inner()) == "完成"
+
+
+def test_async_tool_and_middleware_invoked_synchronously_inside_a_loop():
+    agent = create_agent(WeatherFakeModel(tool_name="aget_weather"), tools=[dual_tool(aget_weather)],
+                         middleware=[dual_wrap_tool_call(ahandle_tool_errors)])
+
+    async def call():
+        return agent.invoke(QUESTION)
+
+    assert asyncio.run(call())["messages"][-1].content.startswith("查询完成")
+
+
+def _threads(prefix):
+    return [t for t in threading.enumerate() if t.name.startswith(prefix)]
+
+
+def test_importing_creates_no_executors():
+    code = ("import gc, concurrent.futures as cf, async_dispatch_demo; "
+            "print([o._thread_name_prefix for o in gc.get_objects() if isinstance(o, cf.ThreadPoolExecutor)])")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(async_dispatch_demo.__file__))
+    assert result.returncode == 0, result.stderr
+    assert "agent-" not in result.stdout
+
+
+def test_sync_middleware_runs_in_its_own_closable_pool():
+    seen = []
+
+    def record_thread(request, handler):
+        seen.append(threading.current_thread().name)
+        return handle_tool_errors(request, handler)
+
+    middleware = dual_wrap_tool_call(record_thread)
+    agent = create_agent(WeatherFakeModel(), tools=[dual_tool(get_weather)], middleware=[middleware])
+    assert not _threads("agent-record_thread")  # 第一次异步调用之前不创建线程
+    assert asyncio.run(agent.ainvoke(QUESTION))["messages"][-1].content.startswith("查询完成")
+    assert seen[-1].startswith("agent-record_thread")  # 异步路径中同步函数在中间件自己的线程池里执行
+    middleware.close()
+    for thread in _threads("agent-record_thread"):
+        thread.join(5)
+    assert not _threads("agent-record_thread")
+    assert agent.invoke(QUESTION)["messages"][-1].content.startswith("查询完成")
+    assert not seen[-1].startswith("agent-record_thread")  # 同步路径不经过中间件的线程池
+    assert asyncio.run(agent.ainvoke(QUESTION))["messages"][-1].content.startswith("查询完成")  # 关闭后重新创建
+    assert seen[-1].startswith("agent-record_thread")
+    middleware.close()
+
+
+def test_sync_tool_runs_on_shared_tool_pool():
+    seen = []
+
+    def where(location: str) -> str:
+        """返回执行工具的线程名"""
+        seen.append(threading.current_thread().name)
+        return location
+
+    assert asyncio.run(dual_tool(where).ainvoke({"location": "北京"})) == "北京"
+    assert seen[0].startswith("agent-tool")
+
+
+def test_chapter1_async_tools_keep_name_and_schema():
+    names = [t.name for t in CHAPTER1_ASYNC_TOOLS]
+    assert names == ["search", "get_weather", "divide", "get_recommendation"]
+    divide = CHAPTER1_ASYNC_TOOLS[2]
+    assert asyncio.run(divide.ainvoke({"a": 10, "b": 4})) == divide.invoke({"a": 10, "b": 4})
+    assert divide.coroutine is not None
@@ -0,0 +1,107 @@
+# batch_window_demo 的测试：按数量或等待时间提交批次、逐条的异常、调用方取消，以及事件循环绑定
+import asyncio
+import threading
+import time
+
+import pytest
+
+from batch_window_demo import BatchScheduler
+
+
+class Executor:
+    """记录每个批次；结果为 item * 10，item 为异常时原样返回该异常"""
+
+    def __init__(self, gate: asyncio.Event | None = None, error: Exception | None = None):
+        self.batches = []
+        self.gate = gate
+        self.error = error
+
+    async def __call__(self, key, items):
+        self.batches.append((key, list(items)))
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return [item if isinstance(item, Exception) else item * 10 for item in items]
+
+
+def test_flush_on_max_batch():
+    execute = Executor()
+    scheduler = BatchScheduler(execute, max_batch=3, max_wait=10)
+
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(*[scheduler.submit("k", i) for i in range(3)]), 1)
+
+    assert asyncio.run(main()) == [0, 10, 20]
+    assert scheduler.batch_sizes == [3]
+
+
+def test_flush_on_max_wait():
+    execute = Executor()
+    scheduler = BatchScheduler(execute, max_batch=100, max_wait=0.05)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await asyncio.gather(scheduler.submit("a", 1), scheduler.submit("a", 2), scheduler.submit("b", 3))
+        return results, loop.time() - start
+
+    results, elapsed = asyncio.run(main())
+    assert results == [10, 20, 30] and elapsed >= 0.04
+    assert sorted(execute.batches) == [("a", [1, 2]), ("b", [3])]  # 不同的键分开提交
+
+
+def test_per_item_exceptions():
+    scheduler = BatchScheduler(Executor(), max_batch=3, max_wait=10)
+
+    async def main():
+        return await asyncio.gather(*[scheduler.submit("k", item) for item in (1, ValueError("坏"), 3)],
+                                    return_exceptions=True)
+
+    first, error, third = asyncio.run(main())
+    assert (first, third) == (10, 30) and isinstance(error, ValueError)
+
+
+def test_executor_error_fails_whole_batch():
+    scheduler = BatchScheduler(Executor(error=ConnectionError("批量接口不可用")), max_batch=2, max_wait=10)
+
+    async def main():
+        return await asyncio.gather(scheduler.submit("k", 1), scheduler.submit("k", 2), return_exceptions=True)
+
+    assert all(isinstance(r, ConnectionError) for r in asyncio.run(main()))
+
+
+def test_cancelled_caller_does_not_affect_others():
+    async def main():
+        gate = asyncio.Event()
+        scheduler = BatchScheduler(Executor(gate=gate), max_batch=3, max_wait=10)
+        tasks = [asyncio.create_task(scheduler.submit("k", i)) for i in range(3)]
+        await asyncio.sleep(0)  # 三个调用凑满一批，执行器停在 gate 上
+        tasks[1].cancel()
+        gate.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    first, cancelled, third = asyncio.run(main())
+    assert (first, third) == (0, 20) and isinstance(cancelled, asyncio.CancelledError)
+
+
+def test_bound_to_one_running_loop():
+    scheduler = BatchScheduler(Executor(), max_batch=100, max_wait=10)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        pending = asyncio.run_coroutine_threadsafe(scheduler.submit("k", 1), loop)
+        while not scheduler._pending:  # 等另一个循环中的调用进入窗口
+            time.sleep(0.001)
+        with pytest.raises(RuntimeError):
+            asyncio.run(scheduler.submit("k", 2))
+    finally:
+        pending.cancel()
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), loop).result()  # 让取消生效
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    # 原来的循环关闭后，调度器可以在新的循环中继续使用
+    scheduler.max_batch = 1
+    assert asyncio.run(scheduler.submit("k", 3)) == 30
@@ -0,0 +1,117 @@
+# cascade_demo 的测试：置信度足够时接受、不足时升级、最后一级的异常向上抛出，以及各个打分器
+import asyncio
+import math
+
+import pytest
+from langchain.agents.middleware import ModelRequest, ModelResponse
+from langchain_core.messages import AIMessage, HumanMessage
+
+from cascade_demo import (ArgumentGrounding, CascadeMiddleware, LogprobConfidence, SchemaValidator, StrictContactInfo,
+                          Tier)
+from contact_schema import ContactInfo
+
+
+def _request(question="计算 7 除以 2"):
+    return ModelRequest(model=None, messages=[HumanMessage(question)])
+
+
+def _call(args, usage=None):
+    message = AIMessage("", tool_calls=[{"name": "divide", "args": args, "id": "c1"}], usage_metadata=usage)
+    return ModelResponse(result=[message])
+
+
+GROUNDED = _call({"a": 7, "b": 2}, {"input_tokens": 1000, "output_tokens": 100, "total_tokens": 1100})
+UNGROUNDED = _call({"a": 0, "b": 2})
+
+
+class Handler:
+    """按请求中的模型（这里是级别名称）返回预设的回复或异常，并记录调用顺序"""
+
+    def __init__(self, **outcomes):
+        self.outcomes = outcomes
+        self.models = []
+
+    def __call__(self, request):
+        self.models.append(request.model)
+        outcome = self.outcomes[request.model]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _cascade():
+    return CascadeMiddleware([Tier("small", "small"), Tier("large", "large", 1.0, 2.0)], [ArgumentGrounding()])
+
+
+def test_confident_answer_is_accepted():
+    cascade, handler = _cascade(), Handler(small=GROUNDED, large=GROUNDED)
+    assert cascade.wrap_model_call(_request(), handler) is GROUNDED
+    assert handler.models == ["small"]
+    assert cascade.stats["small"]["accepted"] == 1 and cascade.stats["large"]["calls"] == 0
+
+
+def test_low_confidence_escalates():
+    cascade, handler = _cascade(), Handler(small=UNGROUNDED, large=GROUNDED)
+    assert cascade.wrap_model_call(_request(), handler) is GROUNDED
+    assert handler.models == ["small", "large"]
+    assert cascade.stats["small"]["escalated"] == 1 and cascade.stats["large"]["accepted"] == 1
+    assert cascade.stats["large"]["cost"] == pytest.approx((1000 * 1.0 + 100 * 2.0) / 1e6)
+
+
+def test_last_tier_answer_is_always_accepted():
+    cascade, handler = _cascade(), Handler(small=UNGROUNDED, large=UNGROUNDED)
+    assert cascade.wrap_model_call(_request(), handler) is UNGROUNDED
+    assert cascade.stats["large"]["accepted"] == 1
+
+
+def test_errors_escalate_and_last_tier_error_is_raised():
+    cascade, handler = _cascade(), Handler(small=TimeoutError("超时"), large=GROUNDED)
+    assert cascade.wrap_model_call(_request(), handler) is GROUNDED
+    assert cascade.stats["small"]["errors"] == 1
+
+    cascade, handler = _cascade(), Handler(small=UNGROUNDED, large=ConnectionError("上游不可用"))
+    with pytest.raises(ConnectionError, match="上游不可用"):
+        cascade.wrap_model_call(_request(), handler)
+    assert cascade.stats["small"]["escalated"] == 1 and cascade.stats["large"]["errors"] == 1
+
+
+def test_async_cascade():
+    cascade, handler = _cascade(), Handler(small=UNGROUNDED, large=GROUNDED)
+
+    async def ahandler(request):
+        return handler(request)
+
+    assert asyncio.run(cascade.awrap_model_call(_request(), ahandler)) is GROUNDED
+    assert handler.models == ["small", "large"]
+
+
+def test_argument_grounding():
+    score = ArgumentGrounding()
+    assert score(_request(), GROUNDED) == 1.0
+    assert score(_request(), UNGROUNDED) == 0.0
+    assert score(_request("搜索 北京 天气"), _call({"query": "北京", "exact": True})) == 1.0
+    assert score(_request("搜索 北京 天气"), _call({"query": "上海"})) == 0.0
+    assert score(_request(), _call({"query": " "})) == 0.0
+    assert score(_request(), ModelResponse(result=[AIMessage("7 除以 2 等于 3.5")])) is None
+
+
+def test_schema_validator():
+    score = SchemaValidator(ContactInfo, StrictContactInfo)
+    good = ContactInfo(name="John", email="john@example.com", phone="(555) 123-4567")
+    bad = ContactInfo(name="John", email="john@example.com", phone="123")
+    assert score(_request(), ModelResponse(result=[], structured_response=good)) == 1.0
+    assert score(_request(), ModelResponse(result=[], structured_response=bad)) == 0.0
+    # 结构化输出工具调用没能生成结果时，按工具调用的参数校验
+    failed = AIMessage("", tool_calls=[{"name": "ContactInfo", "args": {"name": "John"}, "id": "c1"}])
+    assert score(_request(), ModelResponse(result=[failed])) == 0.0
+    assert score(_request(), GROUNDED) is None
+
+
+def test_logprob_confidence_and_minimum():
+    message = AIMessage("3.5", response_metadata={"logprobs": {"content": [{"logprob": -0.1}, {"logprob": -0.3}]}})
+    response = ModelResponse(result=[message])
+    assert LogprobConfidence()(_request(), response) == pytest.approx(math.exp(-0.2))
+    assert LogprobConfidence()(_request(), GROUNDED) is None
+    cascade = CascadeMiddleware([Tier("small", "small")], [ArgumentGrounding(), LogprobConfidence()])
+    assert cascade.confidence(_request(), GROUNDED) == 1.0  # 不适用的打分器不参与
+    assert cascade.confidence(_request(), ModelResponse(result=[message])) == pytest.approx(math.exp(-0.2))
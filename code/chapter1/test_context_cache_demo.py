@@ -0,0 +1,107 @@
+# context_cache_demo 的测试：TTL 过期、显式失效、批量窗口内的合并，以及查询失败时唤醒所有等待者
+import threading
+import time
+
+from context_cache_demo import PreferenceStore, UserContextProvider, build_agent
+
+
+class RecordingStore(PreferenceStore):
+    """记录每次批量查询的用户，可以让查询失败或停住直到放行"""
+
+    def __init__(self, error: Exception | None = None):
+        super().__init__(latency=0)
+        self.batches = []
+        self.error = error
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_many(self, user_ids):
+        self.batches.append(list(user_ids))
+        assert self.release.wait(5)
+        if self.error is not None:
+            self.round_trips += 1
+            raise self.error
+        return super().get_many(user_ids)
+
+
+def _concurrent_get(provider, user_ids):
+    """并发读取，返回每个请求的结果或异常"""
+    results = [None] * len(user_ids)
+
+    def get(i):
+        try:
+            results[i] = provider.get(user_ids[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(len(user_ids))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_ttl_expiry():
+    store = RecordingStore()
+    provider = UserContextProvider(store, ttl=0.05, batch_window=0)
+    first = provider.get("user1")
+    assert provider.get("user1") is first and store.round_trips == 1
+    time.sleep(0.06)
+    assert provider.get("user1") == first and store.round_trips == 2
+
+
+def test_update_and_invalidate():
+    store = RecordingStore()
+    provider = UserContextProvider(store, batch_window=0)
+    provider.get("user1")
+    provider.update("user1", {"user_role": "beginner"})
+    assert provider.get("user1") == {"user_role": "beginner"}
+    provider.invalidate("user1")
+    provider.get("user1")
+    assert store.batches == [["user1"], ["user1"], ["user1"]]
+
+
+def test_invalidate_during_load_is_not_cached():
+    store = RecordingStore()
+    store.release.clear()
+    provider = UserContextProvider(store, batch_window=0)
+    reader = threading.Thread(target=provider.get, args=("user1",))
+    reader.start()
+    while not store.batches:
+        time.sleep(0.001)
+    provider.invalidate("user1")  # 加载过程中失效：结果可能是旧数据
+    store.release.set()
+    reader.join(5)
+    provider.get("user1")
+    assert len(store.batches) == 2
+
+
+def test_batch_window_merges_misses():
+    store = RecordingStore()
+    provider = UserContextProvider(store, batch_window=0.1)
+    results = _concurrent_get(provider, ["user1", "user2", "user1", "user3"])
+    assert store.round_trips == 1 and sorted(store.batches[0]) == ["user1", "user2", "user3"]
+    assert results[0] is results[2]  # 跟随者拿到领导者加载的同一个结果
+    assert results[1]["user_role"] == "beginner"
+    provider.get("user2")
+    assert store.round_trips == 1
+
+
+def test_errors_reach_every_waiter():
+    store = RecordingStore(error=ConnectionError("数据库不可用"))
+    provider = UserContextProvider(store, batch_window=0.1)
+    results = _concurrent_get(provider, ["user1", "user2", "user1"])
+    assert all(isinstance(r, ConnectionError) for r in results)
+    store.error = None
+    assert provider.get("user1")["user_role"] == "expert"  # 失败不留下卡住的加载，也不缓存
+
+
+def test_middleware_loads_preferences():
+    provider = UserContextProvider(RecordingStore(), batch_window=0)
+    agent = build_agent(provider)
+    result = agent.invoke({"messages": [{"role": "user", "content": "你好"}]}, context={"user_id": "user1"})
+    assert result["user_preferences"]["user_role"] == "expert"
+    provider.update("user1", {"user_role": "beginner"})
+    result = agent.invoke({"messages": [{"role": "user", "content": "你好"}]}, context={"user_id": "user1"})
+    assert result["user_preferences"] == {"user_role": "beginner"}
@@ -0,0 +1,61 @@
+# cow_state_demo 的测试：user_preferences 与普通 dict 字段一样整体替换，且不复制
+import itertools
+
+import pytest
+from langchain.agents import create_agent
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+from cow_state_demo import (CowSerializer, CowState, CustomState, FrozenDict, MessageLog, PreferenceReader, append_messages,
+                            replace_dict)
+
+
+class DropStyle(AgentMiddleware):
+    def before_model(self, state, runtime):
+        return {"user_preferences": {"verbosity": "brief"}}
+
+
+def _run(state_schema):
+    model = GenericFakeChatModel(messages=(AIMessage(content="好的") for _ in itertools.count()))
+    agent = create_agent(model, state_schema=state_schema, middleware=[DropStyle()])
+    return agent.invoke({"messages": [{"role": "user", "content": "你好"}],
+                         "user_preferences": {"style": "technical", "verbosity": "detailed"}})
+
+
+def test_preferences_are_replaced_like_plain_state():
+    assert dict(_run(CowState)["user_preferences"]) == dict(_run(CustomState)["user_preferences"]) == {"verbosity": "brief"}
+
+
+def test_replace_dict_shares_the_written_dict():
+    written = {"style": "technical"}
+    assert replace_dict(None, written)._data is written
+    frozen = FrozenDict({"style": "technical"})
+    assert replace_dict(None, frozen) is frozen
+
+
+def test_in_place_mutation_is_rejected():
+    state = {"messages": append_messages([], [HumanMessage("你好")]),
+             "user_preferences": replace_dict(None, {"style": "technical"})}
+    with pytest.raises(AttributeError):
+        state["messages"].append(AIMessage("好的"))
+    with pytest.raises(TypeError):
+        state["user_preferences"]["style"] = "casual"
+
+
+def test_multi_turn_with_checkpointer():
+    model = GenericFakeChatModel(messages=(AIMessage(content="好的") for _ in itertools.count()))
+    reader = PreferenceReader()
+    agent = create_agent(model, state_schema=CowState, middleware=[reader],
+                         checkpointer=InMemorySaver(serde=CowSerializer()))
+    config = {"configurable": {"thread_id": "t1"}}
+    agent.invoke({"messages": [HumanMessage("推荐一些书籍")], "user_preferences": {"style": "technical"}}, config)
+    result = agent.invoke({"messages": [HumanMessage("再推荐一本")]}, config)
+    assert [m.content for m in result["messages"]] == ["推荐一些书籍", "好的", "再推荐一本", "好的"]
+    assert isinstance(result["messages"], MessageLog)
+    assert dict(result["user_preferences"]) == {"style": "technical"}
+    assert reader.last_style == "technical" and reader.last_message.content == "再推荐一本"
+    # 另一个会话互不影响
+    other = agent.invoke({"messages": [HumanMessage("你好")]}, {"configurable": {"thread_id": "t2"}})
+    assert len(other["messages"]) == 2 and dict(other["user_preferences"]) == {}
@@ -0,0 +1,45 @@
+# eval_runner_demo 的测试：按用例的 schema / 评分函数评分，回放缺失按失败计分
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import BaseModel
+
+from eval_runner_demo import (EvalRunner, ReplayChatModel, build_agents, compare_to_baseline, replay_misses,
+                              score_case)
+
+
+class City(BaseModel):
+    name: str
+    country: str
+
+
+SCHEMAS = {"City": City}
+
+
+def _result(structured):
+    return {"messages": [HumanMessage("问题"), AIMessage("完成")], "structured_response": structured}
+
+
+def test_structured_scoring_uses_case_schema_and_scorer():
+    case = {"schema": "City", "scorer": "fields", "expected_structured": {"name": "paris"}}
+    scores = score_case(case, _result({"name": "Paris ", "country": "France"}), schemas=SCHEMAS)
+    assert scores["structured_valid"] and scores["structured_match"]
+    scores = score_case({**case, "scorer": "exact"}, _result({"name": "Paris", "country": "France"}), schemas=SCHEMAS)
+    assert scores["structured_valid"] and scores["structured_match"] is False
+    scores = score_case(case, _result({"name": "Paris"}), schemas=SCHEMAS)
+    assert scores["structured_valid"] is False and scores["structured_match"] is False
+
+
+def test_replay_miss_counts_as_failure():
+    cases = [{"id": "greeting", "agent": "tools", "question": "你好", "expected_answer": "你好"},
+             {"id": "new", "agent": "tools", "question": "新问题", "expected_answer": "好"}]
+    baseline = {"build": "v1", "summary": {"pass_rate": 1.0, "tool_call_accuracy": None, "structured_validity": None,
+                                           "structured_match": None, "answer_match": 1.0, "errors": 0},
+                "cases": {"greeting": {"passed": True, "latency_ms": 1.0, "tokens": 10}}}
+    report = EvalRunner(build_agents(ReplayChatModel(recordings={}))).run(cases, build="v2")
+    summary = report["summary"]
+    assert summary["replay_misses"] == 2 and summary["errors"] == 0
+    assert summary["pass_rate"] == 0.0 and summary["answer_match"] == 0.0
+    regressions = compare_to_baseline(report, baseline)
+    assert any(line.startswith("pass_rate") for line in regressions)
+    assert any(line.startswith("case greeting:") for line in regressions)
+    assert not any(line.startswith("case new:") for line in regressions)  # 基线中没有的用例只报告为回放缺失
+    assert len(replay_misses(report)) == 2
@@ -0,0 +1,75 @@
+# lazy_logging_demo 的测试：级别解析、同步/队列输出，以及中间件记录的是当时的状态
+import importlib
+import io
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+import lazy_logging_demo
+from lazy_logging_demo import configure, configure_demo, get_logger, parse_level, shutdown
+
+
+@pytest.fixture(autouse=True)
+def _logging_off():
+    yield
+    configure(None)
+
+
+def test_parse_level():
+    assert parse_level("debug") == logging.DEBUG
+    assert parse_level(" INFO ") == logging.INFO
+    assert parse_level(logging.WARNING) == logging.WARNING
+    assert parse_level("off") is None and parse_level(None) is None
+    with pytest.raises(ValueError):
+        parse_level("1")
+
+
+@pytest.mark.parametrize("value, level", [("1", logging.INFO), ("true", logging.INFO), ("debug", logging.DEBUG),
+                                          ("verbose", logging.INFO), ("off", None)])
+def test_env_values_never_fail_at_import(value, level):
+    code = "import lazy_logging_demo as l; print(l._config['level'])"
+    env = {**os.environ, "AGENT_LOG": value}
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(lazy_logging_demo.__file__))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == str(level)
+
+
+def test_sync_message_only_output_keeps_print_order(capsys, monkeypatch):
+    monkeypatch.delenv("AGENT_LOG", raising=False)
+    configure_demo()
+    log = get_logger("test")
+    print("之前")
+    log.info("event", "消息数量: {count}", count=3)
+    print("之后")
+    assert capsys.readouterr().out == "之前\n消息数量: 3\n之后\n"
+
+
+def test_configure_demo_keeps_env_configuration(monkeypatch):
+    configure("WARNING")
+    monkeypatch.setenv("AGENT_LOG", "warning")
+    configure_demo()
+    assert lazy_logging_demo._config["level"] == logging.WARNING
+
+
+def test_queued_output_is_flushed_on_shutdown():
+    buffer = io.StringIO()
+    configure("INFO", stream=buffer, fmt="%(message)s")
+    get_logger("test").info("event", "你好 {name}", name="世界")
+    shutdown()
+    assert buffer.getvalue() == "你好 世界\n"
+
+
+def test_state_middleware_logs_a_snapshot(monkeypatch):
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "test-key")
+    demo = importlib.import_module("state_middleware_demo")
+    buffer = io.StringIO()
+    configure("DEBUG", stream=buffer, fmt="%(message)s")
+    state = {"messages": [], "user_preferences": {"style": "technical"}}
+    demo.CustomMiddleware().before_model(state, None)
+    state["user_preferences"]["style"] = "casual"  # 日志写出前修改状态
+    shutdown()
+    assert buffer.getvalue() == "用户偏好: {'style': 'technical'}\n"
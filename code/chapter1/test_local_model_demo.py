@@ -0,0 +1,48 @@
+# local_model_demo 的测试：工具调用历史和可用工具传给后端，后端输出按决策Schema校验
+import json
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from local_model_demo import LocalChatModel, RuleBackend, _to_chat_dicts, divide, get_weather
+
+
+class FixedBackend:
+    def __init__(self, text):
+        self.text = text
+
+    def complete(self, messages, schema):
+        return self.text, 1
+
+
+def test_chat_dicts_keep_tool_calls_and_tools():
+    schema = LocalChatModel(backend=RuleBackend()).bind_tools([get_weather])._schema()
+    chat = _to_chat_dicts([
+        SystemMessage("你是助手"),
+        HumanMessage("北京天气"),
+        AIMessage("", tool_calls=[{"name": "get_weather", "args": {"location": "北京"}, "id": "call_1"}]),
+        ToolMessage("晴朗", tool_call_id="call_1"),
+    ], schema)
+    assert chat[0]["role"] == "system" and "get_weather" in chat[0]["content"] and "获取位置的天气信息" in chat[0]["content"]
+    assert chat[2]["tool_calls"][0]["function"] == {"name": "get_weather", "arguments": '{"location": "北京"}'}
+    assert json.loads(chat[2]["content"])["name"] == "get_weather"
+    assert chat[3] == {"role": "tool", "content": "晴朗", "tool_call_id": "call_1"}
+
+
+@pytest.mark.parametrize("text", [
+    '{"type": "tool_call", "name": "divide", "arguments": {"a": "十", "b": 2}}',
+    '{"type": "tool_call", "name": "search", "arguments": {}}',
+    '{"type": "answer"}',
+    "不是JSON",
+])
+def test_invalid_decisions_are_rejected(text):
+    model = LocalChatModel(backend=FixedBackend(text)).bind_tools([divide])
+    with pytest.raises(OutputParserException):
+        model.invoke("计算")
+
+
+def test_valid_decision_becomes_tool_call():
+    text = '{"type": "tool_call", "name": "divide", "arguments": {"a": 10, "b": 2}}'
+    message = LocalChatModel(backend=FixedBackend(text)).bind_tools([divide]).invoke("计算")
+    assert message.tool_calls[0]["args"] == {"a": 10, "b": 2}
@@ -0,0 +1,82 @@
+# middleware_fusion_demo 的测试：融合后的 before_model 必须与逐个节点执行得到相同的状态
+import itertools
+import operator
+from typing import Annotated, Any
+
+from langchain.agents import AgentState, create_agent
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+
+from middleware_fusion_demo import FusedBeforeModelMiddleware, create_fused_agent, fuse_middleware
+
+
+class LogState(AgentState):
+    log: Annotated[list, operator.add]
+
+
+def _hook(update_func, index):
+    """用一个函数 state -> update 创建只有 before_model 的中间件"""
+
+    class Hook(AgentMiddleware):
+        state_schema = LogState
+
+        def before_model(self, state, runtime) -> dict[str, Any] | None:
+            return update_func(state)
+
+    Hook.__name__ = f"Hook{index}"
+    return Hook()
+
+
+def _hooks(funcs):
+    return [_hook(f, i) for i, f in enumerate(funcs)]
+
+
+def _model():
+    return GenericFakeChatModel(messages=itertools.cycle([AIMessage(content="好的")]))
+
+
+def _run_both(hooks, inputs):
+    plain = create_agent(_model(), tools=[], middleware=_hooks(hooks))
+    fused = create_fused_agent(_model(), tools=[], middleware=_hooks(hooks))
+    assert any(isinstance(m, FusedBeforeModelMiddleware) for m in fuse_middleware(_hooks(hooks)))
+    return plain.invoke(inputs), fused.invoke(inputs)
+
+
+def _contents(state):
+    return [m.content for m in state["messages"]]
+
+
+def test_annotated_reducer_is_applied():
+    plain, fused = _run_both([lambda s: {"log": ["A"]}, lambda s: {"log": ["B"]}], {"messages": [HumanMessage("你好")]})
+    assert plain["log"] == ["A", "B"]
+    assert fused["log"] == plain["log"]
+
+
+def test_later_hook_sees_reduced_state():
+    seen = []
+    hooks = [lambda s: {"log": ["A"]}, lambda s: seen.append(list(s["log"]))]
+    _run_both(hooks, {"messages": [HumanMessage("你好")], "log": ["0"]})
+    assert seen == [["0", "A"], ["0", "A"]]
+
+
+def test_remove_message_and_replace_by_id():
+    inputs = {"messages": [HumanMessage("第一条", id="1"), HumanMessage("第二条", id="2")]}
+    hooks = [
+        lambda s: {"messages": [RemoveMessage(id="1")]},
+        lambda s: {"messages": [HumanMessage("第二条（改写）", id="2"), HumanMessage("追加", id="3")]},
+    ]
+    plain, fused = _run_both(hooks, inputs)
+    assert _contents(plain) == ["第二条（改写）", "追加", "好的"]
+    assert _contents(fused) == _contents(plain)
+
+
+def test_plain_keys_are_last_write_wins():
+    class PrefState(AgentState):
+        user_preferences: dict
+
+    hooks = [lambda s: {"user_preferences": {"a": 1}}, lambda s: {"user_preferences": {"b": 2}}]
+    plain = create_agent(_model(), tools=[], state_schema=PrefState, middleware=_hooks(hooks))
+    fused = create_fused_agent(_model(), tools=[], state_schema=PrefState, middleware=_hooks(hooks))
+    inputs = {"messages": [HumanMessage("你好")]}
+    assert fused.invoke(inputs)["user_preferences"] == plain.invoke(inputs)["user_preferences"] == {"b": 2}
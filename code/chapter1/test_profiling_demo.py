@@ -0,0 +1,46 @@
+# profiling_demo 的测试：切换间隔按引用计数恢复，异步和流式调用同样会被分析，内存中只保留最近的分析结果
+import asyncio
+import itertools
+import sys
+
+from langchain.agents import create_agent
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from profiling_demo import ProfiledAgent, SamplingProfiler
+
+QUESTION = {"messages": [{"role": "user", "content": "你好"}]}
+
+
+def test_overlapping_profilers_restore_switch_interval():
+    original = sys.getswitchinterval()
+    first = SamplingProfiler(interval=0.002).start()
+    second = SamplingProfiler(interval=0.001).start()
+    assert sys.getswitchinterval() == 0.0005
+    first.stop()
+    assert sys.getswitchinterval() == 0.0005  # 第二个分析器仍在运行
+    second.stop()
+    assert sys.getswitchinterval() == original
+
+
+def test_async_and_stream_calls_are_profiled():
+    model = GenericFakeChatModel(messages=(AIMessage(content="你好") for _ in itertools.count()))
+    agent = ProfiledAgent(create_agent(model), every=1)
+    asyncio.run(agent.ainvoke(QUESTION))
+    list(agent.stream(QUESTION))
+
+    async def consume():
+        return [chunk async for chunk in agent.astream(QUESTION)]
+
+    asyncio.run(consume())
+    assert [p.name for p in agent.profiles] == ["request-00001", "request-00002", "request-00003"]
+
+
+def test_only_recent_profiles_are_kept(tmp_path):
+    model = GenericFakeChatModel(messages=(AIMessage(content="你好") for _ in itertools.count()))
+    agent = ProfiledAgent(create_agent(model), every=1, output_dir=tmp_path, keep=2)
+    for _ in range(5):
+        agent.invoke(QUESTION)
+    assert [p.name for p in agent.profiles] == ["request-00004", "request-00005"]
+    assert agent.profiled == 5
+    assert len(list(tmp_path.glob("request-*.folded"))) == 5  # 磁盘上的分析文件不受影响
@@ -0,0 +1,68 @@
+# rag_search_demo 的测试：未提交的追加在重新打开时被截掉，压缩中途崩溃不破坏索引，k 必须为正
+import numpy as np
+import pytest
+
+from rag_search_demo import VectorIndex
+
+
+def _unit(dim, i):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[i] = 1
+    return vector
+
+
+def test_reopen_truncates_uncommitted_rows(tmp_path):
+    index = VectorIndex(tmp_path, dim=4)
+    index.append(np.stack([_unit(4, 0)]), [{"source": "a.md", "heading": "", "text": "a"}])
+    index.commit()
+    index.append(np.stack([_unit(4, 1)]), [{"source": "crashed.md", "heading": "", "text": "残留"}])  # 未提交
+
+    index = VectorIndex(tmp_path, dim=4)
+    assert (tmp_path / "vectors.f32").stat().st_size == 4 * 4
+    index.append(np.stack([_unit(4, 2)]), [{"source": "b.md", "heading": "", "text": "b"}])
+    index.commit()
+    hits = index.search(_unit(4, 2), k=1)
+    assert hits[0][1]["source"] == "b.md" and hits[0][0] == pytest.approx(1.0)
+    assert [c["source"] for c in index.chunks] == ["a.md", "b.md"]
+
+
+def test_search_rejects_non_positive_k(tmp_path):
+    index = VectorIndex(tmp_path, dim=4)
+    with pytest.raises(ValueError):
+        index.search(_unit(4, 0), k=0)
+
+
+def _index_with_deletions(path):
+    index = VectorIndex(path, dim=4)
+    for i, source in enumerate(["a.md", "b.md", "c.md"]):
+        start = index.manifest["rows"]
+        index.append(np.stack([_unit(4, i)]), [{"source": source, "heading": "", "text": source}])
+        index.manifest["files"][source] = {"hash": source, "rows": [start, start + 1]}
+    index.remove_source("a.md")
+    index.commit()
+    return index
+
+
+def test_compact_switches_files_on_commit(tmp_path):
+    index = _index_with_deletions(tmp_path)
+    index.compact()
+    assert index.manifest["files"]["b.md"]["rows"] == [0, 1] and index.manifest["rows"] == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["chunks.1.jsonl", "manifest.json", "vectors.1.f32"]
+    index = VectorIndex(tmp_path, dim=4)
+    assert [c["source"] for c in index.chunks] == ["b.md", "c.md"]
+    assert index.search(_unit(4, 2), k=1)[0][1]["source"] == "c.md"
+
+
+def test_crash_during_compact_keeps_old_index(tmp_path, monkeypatch):
+    index = _index_with_deletions(tmp_path)
+
+    def crash():
+        raise OSError("模拟崩溃")
+
+    monkeypatch.setattr(index, "commit", crash)
+    with pytest.raises(OSError):
+        index.compact()
+    index = VectorIndex(tmp_path, dim=4)
+    assert [c["source"] for c in index.chunks] == ["a.md", "b.md", "c.md"]
+    assert index.search(_unit(4, 1), k=1)[0][1]["source"] == "b.md"
+    assert not (tmp_path / "vectors.1.f32").exists()  # 残留的新文件在打开时删除
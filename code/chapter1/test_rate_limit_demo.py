@@ -0,0 +1,40 @@
+# rate_limit_demo 的测试：流式响应结束时按最后一个 SSE 事件中的实际用量归还令牌
+import json
+
+import httpx
+import pytest
+
+from rate_limit_demo import AdaptiveLimiter, LimitedTransport
+
+USAGE = {"prompt_tokens": 30, "completion_tokens": 10, "total_tokens": 40}
+
+
+class ChunkedStream(httpx.SyncByteStream):
+    """按 7 字节切块，usage 所在的行会被切开"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __iter__(self):
+        for i in range(0, len(self.data), 7):
+            yield self.data[i:i + 7]
+
+
+def sse_upstream(request: httpx.Request) -> httpx.Response:
+    events = [{"choices": [{"delta": {"content": "你好"}}], "usage": None},
+              {"choices": [], "usage": USAGE}]
+    body = b"".join(b"data: " + json.dumps(e).encode() + b"\n\n" for e in events) + b"data: [DONE]\n\n"
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=ChunkedStream(body))
+
+
+def test_stream_releases_with_reported_usage():
+    limiter = AdaptiveLimiter()
+    backend = limiter.configure("deepseek-chat", tokens_per_min=6000, burst_seconds=10)
+    client = httpx.Client(transport=LimitedTransport(limiter, httpx.MockTransport(sse_upstream)))
+    request = {"model": "deepseek-chat", "max_tokens": 500, "stream": True, "messages": []}
+    with client.stream("POST", "https://api.example.com/chat/completions", json=request) as response:
+        assert backend.in_flight == 1
+        assert b"[DONE]" in response.read()
+    assert backend.in_flight == 0
+    assert backend.completion_estimate == pytest.approx(0.9 * 256 + 0.1 * 10)
+    assert backend.metrics()["tokens_available"] == pytest.approx(1000 - 40, abs=5)
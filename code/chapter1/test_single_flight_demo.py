@@ -0,0 +1,129 @@
+# single_flight_demo 的测试：请求指纹必须确定，并发的相同请求只执行一次
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from single_flight_demo import SingleFlightAgent, default_request_key
+
+
+@dataclass
+class Settings:
+    user_role: str
+
+
+def test_same_request_same_key():
+    def key(role="expert", thread_id="t1"):
+        return default_request_key({"messages": [HumanMessage("你好", id="1")]}, Settings(role),
+                                   {"configurable": {"thread_id": thread_id}})
+
+    assert key() == key()
+    assert key() != key(role="beginner")
+    assert key() != key(thread_id="t2")
+
+
+def test_unserializable_values_raise():
+    with pytest.raises(TypeError):
+        default_request_key({"messages": []}, context=object())
+
+
+class GatedAgent:
+    """记录调用次数的智能体：同步调用停在 release 上，直到测试放行"""
+
+    def __init__(self, error: Exception | None = None):
+        self.calls = 0
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _result(self, kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {"calls": self.calls, "kwargs": kwargs}
+
+    def invoke(self, input, config=None, *, context=None, **kwargs):
+        self.started.set()
+        assert self.release.wait(5)
+        return self._result(kwargs)
+
+    async def ainvoke(self, input, config=None, *, context=None, **kwargs):
+        await asyncio.sleep(0.05)
+        return self._result(kwargs)
+
+
+QUESTION = {"messages": [{"role": "user", "content": "你好"}]}
+
+
+def _burst(deduped, agent, n=8, kwargs_for=lambda i: {}):
+    """先让第一个请求进入智能体，再发出其余请求，放行后收集每个调用者的结果或异常"""
+    results = [None] * n
+
+    def call(i):
+        try:
+            results[i] = deduped.invoke(QUESTION, **kwargs_for(i))
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    threads[0].start()
+    assert agent.started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.2)  # 让其余请求都挂到进行中的调用上
+    agent.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_invokes_share_one_call():
+    agent = GatedAgent()
+    results = _burst(SingleFlightAgent(agent), agent)
+    assert agent.calls == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_error_reaches_every_follower():
+    agent = GatedAgent(error=ValueError("上游失败"))
+    results = _burst(SingleFlightAgent(agent), agent)
+    assert agent.calls == 1
+    assert all(isinstance(r, ValueError) and str(r) == "上游失败" for r in results)
+
+
+def test_different_kwargs_are_not_merged():
+    agent = GatedAgent()
+    results = _burst(SingleFlightAgent(agent), agent, n=4,
+                     kwargs_for=lambda i: {"stream_mode": "values"} if i % 2 else {})
+    assert agent.calls == 2
+    assert sorted(str(r["kwargs"]) for r in results) == ["{'stream_mode': 'values'}"] * 2 + ["{}"] * 2
+
+
+def test_concurrent_ainvokes_share_one_call():
+    agent = GatedAgent()
+    deduped = SingleFlightAgent(agent)
+
+    async def main():
+        same = await asyncio.gather(*[deduped.ainvoke(QUESTION) for _ in range(8)])
+        other = await asyncio.gather(deduped.ainvoke(QUESTION, stream_mode="values"), deduped.ainvoke(QUESTION))
+        return same, other
+
+    same, other = asyncio.run(main())
+    assert all(r is same[0] for r in same)
+    assert agent.calls == 3
+    assert other[0]["kwargs"] == {"stream_mode": "values"} and other[1]["kwargs"] == {}
+
+
+def test_async_error_reaches_every_caller():
+    agent = GatedAgent(error=ValueError("上游失败"))
+    deduped = SingleFlightAgent(agent)
+
+    async def main():
+        return await asyncio.gather(*[deduped.ainvoke(QUESTION) for _ in range(4)], return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert agent.calls == 1
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,81 @@
+# state_serializer_demo 的测试：二进制 / JSON 往返、只读视图，以及普通字典不会被误认为消息
+import orjson
+import pytest
+from langchain_core.messages import AIMessageChunk, ChatMessage, RemoveMessage
+
+from contact_schema import ContactInfo
+from state_serializer_demo import JSON_VERSION, StateView, build_state, decode, encode, from_json, to_json
+
+
+def _fields(messages):
+    return [(m.type, m.id, m.content, getattr(m, "tool_calls", None), getattr(m, "tool_call_id", None))
+            for m in messages]
+
+
+@pytest.fixture
+def state():
+    return build_state(turns=2, large_tool_output=10_000)
+
+
+@pytest.mark.parametrize("version", [1, 3])
+def test_binary_round_trip(state, version):
+    restored = decode(encode(state, version=version))
+    assert _fields(restored["messages"]) == _fields(state["messages"])
+    assert restored["messages"][2].usage_metadata == state["messages"][2].usage_metadata
+    assert restored["structured_response"] == state["structured_response"]
+    assert restored["user_preferences"] == state["user_preferences"]
+
+
+def test_state_view_reads_large_content_without_copy(state):
+    data = encode(state, large=4096)
+    view = StateView(data)
+    big = view["messages"][3]
+    assert big.type == "tool" and isinstance(big.content_bytes, memoryview)
+    assert big.content_bytes.obj is data  # 指向原始缓冲区
+    assert big.content == state["messages"][3].content
+    assert view["messages"][2].tool_calls == [{k: c[k] for k in ("name", "args", "id")}
+                                              for c in state["messages"][2].tool_calls]
+    assert view["structured_response"] == state["structured_response"]
+    assert _fields([view["messages"][1].to_message()]) == _fields([state["messages"][1]])
+
+
+def test_other_message_types(state):
+    others = [AIMessageChunk("部分", id="c1"), ChatMessage("自定义", role="critic", id="m1"), RemoveMessage(id="h0")]
+    state = {**state, "messages": state["messages"] + others}
+    for restored in (decode(encode(state))["messages"], from_json(to_json(state))["messages"]):
+        assert [type(m) for m in restored[-3:]] == [AIMessageChunk, ChatMessage, RemoveMessage]
+        assert restored[-2].role == "critic" and restored[-1].id == "h0"
+    view = StateView(encode(state))["messages"]
+    assert [m.type for m in view[-3:]] == ["AIMessageChunk", "chat", "remove"]
+    assert view[-3].content == "部分"
+
+
+def test_json_envelope(state):
+    envelope = orjson.loads(to_json(state))
+    assert envelope["__v"] == JSON_VERSION
+    assert all("__msg__" in item for item in envelope["state"]["messages"])
+    restored = from_json(to_json(state))
+    assert _fields(restored["messages"]) == _fields(state["messages"])
+    assert isinstance(restored["structured_response"], ContactInfo)
+    with pytest.raises(ValueError, match="不支持的 JSON 格式版本"):
+        from_json(orjson.dumps({"__v": 99, "state": {}}))
+    with pytest.raises(ValueError, match="不支持的 JSON 格式版本"):
+        from_json(b"[]")
+
+
+def test_plain_dicts_are_not_messages():
+    state = {"notes": [{"type": "todo", "content": "x"}, {"type": "human", "content": "y"}],
+             "mixed": [{"type": "human", "content": "z"}, 1]}
+    assert from_json(to_json(state)) == state
+
+
+def test_reads_version_1_json(state):
+    legacy = {"__v": 1, "state": {
+        "messages": [{"type": "human", "content": "你好", "id": "h"},
+                     {"type": "ai", "content": "", "tool_calls": [{"name": "search", "args": {}, "id": "c"}]}],
+        "notes": [{"type": "todo", "content": "x"}],
+    }}
+    restored = from_json(orjson.dumps(legacy))
+    assert [m.type for m in restored["messages"]] == ["human", "ai"]
+    assert restored["messages"][1].tool_calls[0]["name"] == "search"
+    assert restored["notes"] == [{"type": "todo", "content": "x"}]
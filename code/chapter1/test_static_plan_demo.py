@@ -0,0 +1,90 @@
+# static_plan_demo 的测试：只在能与图执行一致时才使用静态计划
+import itertools
+import operator
+from typing import Annotated
+
+import pytest
+from langchain.agents import AgentState, create_agent
+from langchain.agents.middleware import after_model
+from langchain.tools import ToolRuntime, tool
+from langchain_core.messages import AIMessage
+from langgraph.errors import GraphRecursionError
+
+from local_model_demo import get_weather, search
+from static_plan_demo import ToolCallingFakeModel, _direct_call, compile_agent, create_demo
+
+
+@tool
+def whoami(runtime: ToolRuntime) -> str:
+    """返回当前用户"""
+    return str(runtime.context)
+
+
+@tool(response_format="content_and_artifact")
+def lookup(query: str):
+    """返回内容和附件"""
+    return f"结果: {query}", {"rows": [query]}
+
+
+def _calls(name, args):
+    return ToolCallingFakeModel(messages=itertools.cycle([
+        AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": "call_1"}]),
+        AIMessage(content="完成"),
+    ]))
+
+
+def test_direct_call_only_for_plain_content_tools():
+    assert _direct_call(get_weather) is not None
+    assert _direct_call(whoami) is None
+    assert _direct_call(lookup) is None
+
+
+@pytest.mark.parametrize("tool_, args", [(whoami, {}), (lookup, {"query": "上海"})])
+def test_tools_needing_the_tool_node_fall_back_to_graph(tool_, args):
+    compiled = compile_agent(_calls(tool_.name, args), tools=[tool_])
+    assert compiled.plan.fallback
+    expected = create_agent(_calls(tool_.name, args), tools=[tool_]).invoke(
+        {"messages": [{"role": "user", "content": "开始"}]})
+    result = compiled.invoke({"messages": [{"role": "user", "content": "开始"}]})
+    assert [m.content for m in result["messages"]] == [m.content for m in expected["messages"]]
+    assert result["messages"][2].artifact == expected["messages"][2].artifact
+
+
+def test_plan_matches_graph():
+    payload = {"messages": [{"role": "user", "content": "上海今天天气怎么样？"}],
+               "user_preferences": {"verbosity": "detailed"}}
+    compiled = create_demo(compile_agent)
+    assert not compiled.plan.fallback
+    plan_result = compiled.invoke(payload)
+    graph_result = create_demo(create_agent).invoke(payload)
+    assert [m.content for m in plan_result["messages"]] == [m.content for m in graph_result["messages"]]
+
+
+def test_run_stops_at_recursion_limit():
+    looping = ToolCallingFakeModel(messages=(
+        AIMessage(content="", tool_calls=[{"name": "search", "args": {"query": "再查一次"}, "id": f"call_{i}"}])
+        for i in itertools.count()))
+    compiled = compile_agent(looping, tools=[search])
+    assert compiled.plan.recursion_limit == compiled.agent.config["recursion_limit"]
+    compiled.plan.recursion_limit = 10
+    with pytest.raises(GraphRecursionError):
+        compiled.invoke({"messages": [{"role": "user", "content": "开始"}]})
+    with pytest.raises(GraphRecursionError):
+        compiled.agent.invoke({"messages": [{"role": "user", "content": "开始"}]}, {"recursion_limit": 10})
+
+
+class CountingState(AgentState):
+    model_calls: Annotated[int, operator.add]
+
+
+@after_model(state_schema=CountingState)
+def count_model_calls(state, runtime):
+    return {"model_calls": 1}
+
+
+def test_custom_non_list_reducer_matches_graph():
+    payload = {"messages": [{"role": "user", "content": "开始"}]}
+    compiled = compile_agent(_calls("search", {"query": "上海"}), tools=[search], middleware=[count_model_calls])
+    assert not compiled.plan.fallback
+    expected = create_agent(_calls("search", {"query": "上海"}), tools=[search], middleware=[count_model_calls])
+    assert compiled.invoke(payload)["model_calls"] == expected.invoke(payload)["model_calls"] == 2
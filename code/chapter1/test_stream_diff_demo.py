@@ -0,0 +1,49 @@
+# stream_diff_demo 的测试：客户端按增量事件还原的状态必须与完整状态一致
+from langchain_core.messages import AIMessage, HumanMessage
+
+from stream_diff_demo import DiffClient, DiffEncoder, _extends, encode_event
+
+
+def _replay(states):
+    encoder, client = DiffEncoder(), DiffClient()
+    events = []
+    for state in states:
+        event = encoder.diff(state)
+        events.append(event)
+        restored = client.apply(encode_event(event))
+        assert [(type(m), m.id, m.content) for m in restored["messages"]] == \
+               [(type(m), m.id, m.content) for m in state["messages"]]
+    return events
+
+
+def test_extends_checks_every_prefix_element():
+    a, b, c = HumanMessage("a", id="1"), AIMessage("b", id="2"), HumanMessage("c", id="3")
+    assert _extends([], [a])
+    assert _extends([a, b], [a, b, c])
+    assert not _extends([a, b, c], [a, AIMessage("b2", id="2"), c])
+    assert not _extends([a, b], [a])
+
+
+def test_append_only_sends_new_messages():
+    a, b = HumanMessage("a", id="1"), AIMessage("b", id="2")
+    events = _replay([{"messages": [a]}, {"messages": [a, b]}])
+    assert [m.id for m in events[1]["append"]["messages"]] == ["2"]
+
+
+def test_middle_replace_by_id_sends_full_value():
+    a, b, c = HumanMessage("a", id="1"), AIMessage("b", id="2"), HumanMessage("c", id="3")
+    replaced = AIMessage("b（改写）", id="2")
+    events = _replay([{"messages": [a, b, c]}, {"messages": [a, replaced, c, AIMessage("d", id="4")]}])
+    assert "append" not in events[1]
+    assert len(events[1]["set"]["messages"]) == 4
+
+
+def test_plain_dict_lists_stay_dicts():
+    a = HumanMessage("a", id="1")
+    notes = [{"type": "todo", "content": "x"}]
+    events = _replay([{"messages": [a], "notes": notes},
+                      {"messages": [a], "notes": notes + [{"type": "human", "content": "y"}]}])
+    client = DiffClient()
+    for event in events:
+        state = client.apply(encode_event(event))
+    assert state["notes"] == [{"type": "todo", "content": "x"}, {"type": "human", "content": "y"}]
@@ -0,0 +1,57 @@
+# structured_fastpath_demo 的测试：原生方式检测、JSON 无效时退回 ToolStrategy、单次抽取和路由判断
+from types import SimpleNamespace
+
+import pytest
+from langchain.agents import create_agent
+from langchain.agents.structured_output import ToolStrategy
+from langchain_deepseek import ChatDeepSeek
+
+from contact_schema import ContactInfo
+from local_model_demo import create_local_model
+from structured_fastpath_demo import (JsonModeUpstream, NativeStructuredOutputMiddleware, StructuredOutputRouter,
+                                      deepseek, extract, lookup_employee, native_mode)
+
+PLAIN = [f"从以下内容提取联系信息：用户{i}, user{i}@example.com, (555) 123-{i:04d}" for i in range(3)]
+EXPECTED = [ContactInfo(name=f"用户{i}", email=f"user{i}@example.com", phone=f"(555) 123-{i:04d}") for i in range(3)]
+
+
+def test_native_mode_detection():
+    assert native_mode(deepseek(JsonModeUpstream(ttfb=0))) == "json_object"
+    assert native_mode(ChatDeepSeek(model="deepseek-reasoner", api_key="mock")) is None
+    assert native_mode(create_local_model()) is None
+    assert native_mode(SimpleNamespace(profile={"structured_output": True})) == "json_schema"
+
+
+@pytest.mark.parametrize("broken_every, native, fallbacks", [(0, 3, 0), (3, 2, 1), (1, 0, 3)])
+def test_invalid_json_falls_back_to_tool_strategy(broken_every, native, fallbacks):
+    upstream = JsonModeUpstream(ttfb=0, broken_every=broken_every)
+    middleware = NativeStructuredOutputMiddleware(ContactInfo)
+    agent = create_agent(deepseek(upstream), tools=[lookup_employee], response_format=ToolStrategy(ContactInfo),
+                         middleware=[middleware])
+    results = [agent.invoke({"messages": [{"role": "user", "content": text}]})["structured_response"] for text in PLAIN]
+    assert results == EXPECTED
+    assert (middleware.native, middleware.fallbacks) == (native, fallbacks)
+    assert upstream.requests == 3 + fallbacks  # 每次退回多一次模型调用
+
+
+def test_extract_uses_json_mode():
+    upstream = JsonModeUpstream(ttfb=0)
+    assert extract(deepseek(upstream), ContactInfo, PLAIN[0]) == EXPECTED[0]
+    assert upstream.requests == 1 and upstream._json_outputs == 1
+
+
+def test_extract_falls_back_when_json_is_invalid():
+    upstream = JsonModeUpstream(ttfb=0, broken_every=1)
+    assert extract(deepseek(upstream), ContactInfo, PLAIN[0]) == EXPECTED[0]
+    assert upstream.requests == 2
+
+
+def test_router_needs_tools():
+    upstream = JsonModeUpstream(ttfb=0)
+    router = StructuredOutputRouter(deepseek(upstream), ContactInfo, [lookup_employee])
+    assert router.needs_tools("查询员工通讯录：员工1")
+    assert not router.needs_tools(PLAIN[0])
+    assert router.invoke(PLAIN[0]) == EXPECTED[0] and router.direct == 1
+    result = router.invoke("查询员工通讯录：员工1")
+    assert result == ContactInfo(name="员工1", email="员工1@example.com", phone="(555) 987-6543")
+    assert router.direct == 1
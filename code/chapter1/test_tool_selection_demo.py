@@ -0,0 +1,57 @@
+# tool_selection_demo 的测试：筛选只作用于索引中的工具
+from langchain.agents.middleware import ModelRequest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+
+from local_model_demo import text_features
+from tool_selection_demo import ToolSelectorMiddleware, build_tool_catalog
+
+
+@tool
+def middleware_tool(query: str) -> str:
+    """由其他中间件通过 AgentMiddleware.tools 注册的工具"""
+    return query
+
+
+def _request(tools, messages):
+    model = GenericFakeChatModel(messages=iter([]))
+    return ModelRequest(model=model, messages=messages, tools=tools)
+
+
+def _names(request):
+    return [t["name"] if isinstance(t, dict) else t.name for t in request.tools]
+
+
+def test_keeps_tools_outside_the_index():
+    catalog = build_tool_catalog()
+    selector = ToolSelectorMiddleware(catalog, top_k=3)
+    builtin = {"type": "web_search", "name": "web_search"}
+    request = _request(catalog + [middleware_tool, builtin], [HumanMessage("北京的天气怎么样？")])
+    names = _names(selector.select(request))
+    assert "middleware_tool" in names
+    assert "web_search" in names
+    assert "get_weather" in names
+    assert len(names) == 3 + 2
+
+
+def test_sticky_tools_and_order_preserved():
+    catalog = build_tool_catalog()
+    selector = ToolSelectorMiddleware(catalog, top_k=2)
+    messages = [HumanMessage("计算 10 除以 2"), AIMessage("", tool_calls=[{"name": "divide", "args": {}, "id": "1"}]),
+                HumanMessage("北京的天气怎么样？")]
+    names = _names(selector.select(_request(catalog, messages)))
+    assert "divide" in names and "get_weather" in names
+    assert names == [t.name for t in catalog if t.name in names]
+
+
+def test_small_tool_sets_pass_through():
+    catalog = build_tool_catalog()[:3]
+    selector = ToolSelectorMiddleware(catalog, top_k=5)
+    request = _request(catalog, [HumanMessage("你好")])
+    assert selector.select(request) is request
+
+
+def test_text_features():
+    assert text_features("天气") >= {"天气", "天", "气"}
+    assert "的" not in text_features("我的天气")
@@ -0,0 +1,38 @@
+# transport_replay_demo 的测试：向已有录制文件追加时，新旧记录都能回放；解码结果的缓存有上限
+from transport_replay_demo import Cassette
+
+
+def _add(cassette, key, text):
+    cassette.add(key, 200, 0.01, [("content-type", "text/plain")], [(0.0, text.encode())])
+
+
+def test_append_to_existing_cassette(tmp_path):
+    path = tmp_path / "cassette.bin"
+    cassette = Cassette(path)
+    _add(cassette, b"a" * 16, "旧记录")
+    cassette.close()
+
+    cassette = Cassette(path)
+    assert cassette.get(b"a" * 16)[3][0][1] == "旧记录".encode()
+    _add(cassette, b"b" * 16, "新记录")
+    assert cassette.get(b"b" * 16)[3][0][1] == "新记录".encode()  # 写入索引前就能回放
+    assert cassette.get(b"a" * 16)[3][0][1] == "旧记录".encode()
+    cassette.close()
+
+    cassette = Cassette(path)
+    assert len(cassette) == 2
+    assert cassette.get(b"b" * 16)[3][0][1] == "新记录".encode()
+
+
+def test_decoded_records_are_bounded(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.bin", cache_size=2)
+    keys = [bytes([i]) * 16 for i in range(3)]
+    for i, key in enumerate(keys):
+        _add(cassette, key, f"记录{i}")
+    first, second = cassette.get(keys[0]), cassette.get(keys[1])
+    assert cassette.get(keys[0]) is first  # 命中缓存
+    third = cassette.get(keys[2])  # 淘汰最久未使用的 keys[1]
+    assert cassette.get(keys[0]) is first and cassette.get(keys[2]) is third
+    again = cassette.get(keys[1])
+    assert again is not second and again == second  # 重新解码
+    assert cassette.get(b"x" * 16) is None
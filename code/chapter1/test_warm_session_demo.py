@@ -0,0 +1,67 @@
+# warm_session_demo 的测试：会话写出存储与并发取出之间不能丢历史
+import itertools
+import threading
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from warm_session_demo import CheckpointStore, ProfileStore, SessionPool
+
+
+class SlowStore(CheckpointStore):
+    """保存时停住，直到测试放行"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.saving = threading.Event()
+        self.release = threading.Event()
+
+    def save(self, session_id, data):
+        self.saving.set()
+        self.release.wait(5)
+        super().save(session_id, data)
+
+
+def _pool(store):
+    model = GenericFakeChatModel(messages=(AIMessage(content="好的") for _ in itertools.count()))
+    return SessionPool(model, [], ProfileStore(latency=0), store)
+
+
+def test_checkout_waits_for_eviction(tmp_path):
+    store = SlowStore(tmp_path)
+    store.release.set()
+    pool = _pool(store)
+    pool.turn("a", "第一轮")
+    store.release.clear()
+    store.saving.clear()
+    evicting = threading.Thread(target=pool._evict, args=("a",))
+    evicting.start()
+    assert store.saving.wait(5)
+    result = {}
+    second = threading.Thread(target=lambda: result.update(tier=pool.turn("a", "第二轮")[1]))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()  # 检查点写完之前不能从存储恢复
+    store.release.set()
+    evicting.join()
+    second.join()
+    assert result["tier"] == "warm"
+    session, _ = pool._checkout("a")
+    assert [m.content for m in session.history] == ["第一轮", "好的", "第二轮", "好的"]
+
+
+def test_save_replaces_atomically(tmp_path):
+    store = CheckpointStore(tmp_path)
+    store.save("a", b"old")
+    store.save("a", b"new")
+    assert store.load("a") == b"new"
+    assert len(list(tmp_path.iterdir())) == 1  # 没有残留的临时文件
+
+
+def test_session_id_cannot_escape_store(tmp_path):
+    store = CheckpointStore(tmp_path / "store")
+    for session_id in ("../x", "/tmp/x", "a/../../b", "..", ""):
+        store.save(session_id, session_id.encode())
+        assert store.load(session_id) == session_id.encode()
+    assert [p.parent for p in (tmp_path / "store").iterdir()] == [tmp_path / "store"] * 5
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["store"]
@@ -0,0 +1,97 @@
+# worker_pool_demo 的测试：启动失败立即报错、异常传回、崩溃重启、粘性路由、共享内存传递结果
+import time
+
+import pytest
+from langchain.agents import create_agent
+from langchain.tools import tool
+
+from local_model_demo import create_local_model
+from worker_pool_demo import (WorkerCrashedError, WorkerPool, WorkerStartupError, build_contact_agent,
+                              build_crash_agent, build_tools_agent)
+
+
+class UpstreamError(Exception):
+    """pickle 后无法还原：还原时只传入 message，缺少 status"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+@tool
+def call_upstream(request: str) -> str:
+    """
+    调用上游服务
+
+    参数：
+    - request: str类型，请求内容
+    """
+    raise UpstreamError("boom", 503)
+
+
+def build_upstream_agent():
+    return create_agent(model=create_local_model(), tools=[call_upstream])
+
+
+def build_broken_agent():
+    raise ValueError("缺少配置")
+
+
+FACTORIES = {"tools": build_tools_agent, "crash": build_crash_agent, "upstream": build_upstream_agent}
+
+
+def _ask(question):
+    return {"messages": [{"role": "user", "content": question}]}
+
+
+def _thread(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with WorkerPool(FACTORIES, processes=2) as pool:
+        yield pool
+
+
+def test_factory_error_fails_fast():
+    start = time.perf_counter()
+    with pytest.raises(WorkerStartupError) as info:
+        WorkerPool({"broken": build_broken_agent}, processes=2, startup_timeout=60)
+    assert time.perf_counter() - start < 30
+    assert isinstance(info.value.__cause__, ValueError)
+    assert str(info.value.__cause__) == "缺少配置"
+
+
+def test_exception_that_cannot_be_unpickled_reaches_caller(pool):
+    with pytest.raises(RuntimeError, match="UpstreamError: boom"):
+        pool.submit("upstream", _ask("调用上游服务")).result(timeout=30)
+    assert pool._collector.is_alive()
+    result = pool.submit("tools", _ask("北京的天气怎么样？"), _thread("after-error")).result(timeout=30)
+    assert "北京" in result["messages"][-1].content
+
+
+def test_sticky_routing_keeps_conversation(pool):
+    config = _thread("sticky-1")
+    first = pool.invoke("tools", _ask("北京的天气怎么样？"), config)
+    second = pool.invoke("tools", _ask("计算 10 除以 2"), config)
+    assert len(second["messages"]) == 2 * len(first["messages"])  # 同一工作进程里的检查点保留了第一轮
+
+
+def test_crash_restarts_worker(pool):
+    restarts = pool.restarts
+    pool.max_retries = 0
+    try:
+        with pytest.raises(WorkerCrashedError):
+            pool.submit("crash", _ask("崩溃")).result(timeout=60)
+    finally:
+        pool.max_retries = 1
+    result = pool.submit("tools", _ask("上海的天气怎么样？"), _thread("after-crash")).result(timeout=60)
+    assert "上海" in result["messages"][-1].content
+    assert pool.restarts == restarts + 1
+
+
+def test_large_results_use_shared_memory():
+    with WorkerPool({"contact": build_contact_agent}, processes=1, shm_threshold=1) as pool:
+        result = pool.invoke("contact", _ask("提取联系信息：John Doe, john@example.com, (555) 123-4567"))
+    assert result["structured_response"].email == "john@example.com"
@@ -7,6 +7,7 @@ from langchain.agents.middleware import wrap_tool_call  # 用于创建工具调
 from langchain_core.messages import ToolMessage  # 用于创建工具消息
 from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
 from langchain.tools import tool  # 用于定义工具
+from lazy_logging_demo import configure_demo, get_logger  # 惰性日志
 from dotenv import load_dotenv  # 用于加载环境变量
 import os  # 用于访问环境变量
 
@@ -19,6 +20,8 @@ if not api_key:
     print("错误：DEEPSEEK_API_KEY 环境变量未设置")
     exit(1)  # 如果API密钥未设置，退出程序
 
+log = get_logger("tool_error_handling")
+
 # 定义一个会出错的工具
 # 使用@tool装饰器定义一个除法工具
 @tool
@@ -55,7 +58,7 @@ def handle_tool_errors(request, handler):
         return handler(request)
     except Exception as e:
         # 捕获异常，创建自定义错误消息
-        print(f"捕获到工具错误: {str(e)}")
+        log.warning("tool.error", "捕获到工具错误: {error}", error=str(e), tool=request.tool_call["name"])
         # 创建ToolMessage，包含错误信息
         return ToolMessage(
             content=f"工具错误：请检查您的输入并重试。({str(e)})",
@@ -81,6 +84,7 @@ print("智能体创建完成，开始测试错误处理...")
 
 # 测试智能体
 if __name__ == "__main__":
+    configure_demo()  # 日志输出到 stdout，与 print 的顺序一致
     # 测试错误情况
     print("=== 测试：除零错误处理 ===")
     result = agent.invoke(
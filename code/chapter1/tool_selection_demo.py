@@ -0,0 +1,290 @@
+# 工具筛选中间件示例
+# tools_demo.py 中 create_agent(tools=[search, get_weather]) 会在每次模型调用时发送全部工具的 JSON Schema。
+# 当注册了几百个工具时，这些 Schema 会显著增加提示词 token 和延迟。
+# 本示例实现一个 wrap_model_call 中间件，每次调用只把最相关的 top-k 个工具发给模型：
+# - ToolIndex：创建智能体时对工具名和文档字符串预先建立索引（哈希嵌入 + 关键词倒排）
+# - ToolSelectorMiddleware：按最近的用户消息检索工具；本会话中调用过的工具保持“粘性”，始终保留
+# 最后在一组回放对话上统计提示词 token 的减少量和工具选择的准确率
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse  # 中间件相关
+from langchain_core.messages import AIMessage, HumanMessage  # 消息类型
+from langchain_core.messages.utils import count_tokens_approximately  # 估算提示词 token
+from langchain_core.tools import BaseTool, StructuredTool  # 工具类型
+from langgraph.checkpoint.memory import InMemorySaver  # 用于保存多轮对话
+from pydantic import Field, create_model  # 用于生成工具参数模式
+from collections import defaultdict  # 用于关键词倒排索引
+from typing import Callable  # 用于类型提示
+import math  # 用于计算IDF
+import numpy as np  # 用于向量计算
+import time  # 用于计时
+
+from local_model_demo import LocalChatModel, RuleBackend, divide, get_weather, search, text_features  # 离线模型、示例工具和文本特征
+from rag_search_demo import HashingEmbeddings  # 本地哈希嵌入
+
+
+class ToolIndex:
+    """
+    工具检索索引：对“工具名 + 描述”预先计算哈希嵌入和关键词倒排表
+
+    打分 = alpha * 余弦相似度 + (1 - alpha) * 关键词得分（按 IDF 加权的命中比例）
+    """
+
+    def __init__(self, tools: list[BaseTool], embeddings: HashingEmbeddings | None = None, alpha: float = 0.5):
+        """
+        参数：
+        - tools: 全部工具
+        - embeddings: 嵌入模型，默认使用本地哈希嵌入
+        - alpha: 嵌入得分的权重
+        """
+        self.names = [t.name for t in tools]
+        self.name_set = set(self.names)
+        self.embeddings = embeddings or HashingEmbeddings()
+        self.alpha = alpha
+        texts = [f"{t.name.replace('_', ' ')} {t.description}" for t in tools]
+        self.vectors = self.embeddings.embed_array(texts)
+        # 关键词倒排表：特征 -> 包含该特征的工具序号
+        self.postings: dict[str, list[int]] = defaultdict(list)
+        for i, text in enumerate(texts):
+            for feature in text_features(text):
+                self.postings[feature].append(i)
+        self.idf = {f: math.log(1 + len(tools) / len(ids)) for f, ids in self.postings.items()}
+
+    def scores(self, query: str) -> np.ndarray:
+        """计算查询与每个工具的相关性得分"""
+        scores = self.alpha * (self.vectors @ self.embeddings.embed_array([query])[0])
+        features = [f for f in text_features(query) if f in self.idf]
+        total = sum(self.idf[f] for f in features)
+        if total:
+            keyword = np.zeros(len(self.names), dtype=np.float32)
+            for f in features:
+                keyword[self.postings[f]] += self.idf[f]
+            scores += (1 - self.alpha) * keyword / total
+        return scores
+
+    def top_k(self, query: str, k: int) -> list[str]:
+        """
+        返回最相关的 k 个工具名
+
+        参数：
+        - query: 查询文本（通常是最近的用户消息）
+        - k: 数量
+
+        返回值：
+        - list[str]类型，按相关性降序的工具名
+        """
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [self.names[i] for i in top[np.argsort(-scores[top])]]
+
+
+class ToolSelectorMiddleware(AgentMiddleware):
+    """
+    每次模型调用只发送 top-k 个相关工具
+
+    - 查询文本：最近 query_messages 条用户消息
+    - 粘性：本会话中已经调用过的工具始终保留（多轮对话中的追问通常不再提到工具关键词）
+    - always_include：始终保留的工具名
+    """
+
+    def __init__(self, tools: list[BaseTool], top_k: int = 5, always_include: tuple[str, ...] = (),
+                 query_messages: int = 1, sticky: bool = True, index: ToolIndex | None = None):
+        """
+        参数：
+        - tools: 传给 create_agent 的全部工具，用于预先建立索引
+        - top_k: 每次检索的工具数量（不含粘性工具）
+        - always_include: 始终保留的工具名
+        - query_messages: 拼接最近几条用户消息作为查询
+        - sticky: 是否保留本会话中调用过的工具
+        - index: 已建立的索引（多个智能体共享时传入）
+        """
+        super().__init__()
+        self.index = index or ToolIndex(tools)
+        self.top_k = top_k
+        self.always_include = set(always_include)
+        self.query_messages = query_messages
+        self.sticky = sticky
+
+    def select(self, request: ModelRequest) -> ModelRequest:
+        """返回只包含选中工具的新请求"""
+        if len(request.tools) <= self.top_k:
+            return request
+        questions = [str(m.content) for m in request.messages if isinstance(m, HumanMessage)]
+        selected = set(self.index.top_k(" ".join(questions[-self.query_messages:]), self.top_k))
+        selected |= self.always_include
+        if self.sticky:
+            selected |= {c["name"] for m in request.messages if isinstance(m, AIMessage) for c in m.tool_calls}
+        # 保持原有顺序，并保留不在索引中的工具（例如以字典形式传入的内置工具、其他中间件注册的工具）
+        indexed = self.index.name_set
+        tools = [t for t in request.tools if not isinstance(t, BaseTool) or t.name not in indexed or t.name in selected]
+        return request.override(tools=tools)
+
+    def wrap_model_call(self, request: ModelRequest, handler: Callable) -> ModelResponse:
+        return handler(self.select(request))
+
+    async def awrap_model_call(self, request: ModelRequest, handler: Callable) -> ModelResponse:
+        return await handler(self.select(request))
+
+
+class PromptSizeRecorder(AgentMiddleware):
+    """
+    记录每次模型调用实际发送的工具和估算的提示词 token（放在中间件列表最后，最靠近模型）
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls: list[dict] = []
+
+    def wrap_model_call(self, request: ModelRequest, handler: Callable) -> ModelResponse:
+        messages = ([request.system_message] if request.system_message else []) + request.messages
+        tokens = count_tokens_approximately(messages, tools=request.tools)
+        self.calls.append({
+            "tools": [t.name for t in request.tools if isinstance(t, BaseTool)],
+            "tokens": tokens,
+            "tool_tokens": tokens - count_tokens_approximately(messages),
+        })
+        return handler(request)
+
+
+# 模拟的企业工具目录：系统 × 操作，加上通用工具，共约 200 个
+SYSTEMS = {
+    "crm": "客户", "hr": "员工档案", "expense": "报销单", "inventory": "商品库存", "ticket": "工单",
+    "calendar": "会议日程", "mail": "邮件", "wiki": "知识库文档", "deploy": "发布记录", "alert": "监控告警",
+    "order": "销售订单", "invoice": "发票", "contract": "合同", "project": "项目", "asset": "固定资产",
+    "vendor": "供应商", "recruit": "招聘职位", "training": "培训课程", "vpn": "VPN账号", "printer": "打印任务",
+    "survey": "问卷调查", "coupon": "优惠券",
+}
+ACTIONS = {
+    "search": ("按关键词搜索{obj}", "query", "搜索关键词"),
+    "get": ("根据编号查询{obj}的详细信息", "item_id", "{obj}编号"),
+    "create": ("新建一条{obj}记录", "title", "{obj}标题或名称"),
+    "update": ("修改已有{obj}的内容", "item_id", "{obj}编号"),
+    "delete": ("删除指定的{obj}", "item_id", "{obj}编号"),
+    "export": ("导出{obj}报表为Excel", "period", "时间范围，例如“本月”"),
+    "count": ("统计{obj}的数量", "period", "时间范围，例如“本月”"),
+    "approve": ("审批待处理的{obj}", "item_id", "{obj}编号"),
+    "assign": ("把{obj}分配给负责人", "owner", "负责人姓名"),
+}
+GENERAL_TOOLS = {
+    "translate_text": ("把文本翻译成目标语言", "text", "要翻译的文本"),
+    "convert_currency": ("按实时汇率进行货币换算", "amount", "金额和币种"),
+    "get_stock_price": ("查询股票的最新股价", "symbol", "股票代码"),
+    "book_flight": ("预订机票航班", "route", "出发地和目的地"),
+    "query_train": ("查询火车票余票和车次", "route", "出发地和目的地"),
+    "book_hotel": ("预订酒店房间", "city", "城市"),
+    "get_news": ("获取最新新闻头条", "topic", "新闻主题"),
+    "set_reminder": ("设置提醒闹钟", "time", "提醒时间"),
+    "shorten_url": ("生成短链接", "url", "原始网址"),
+    "get_holidays": ("查询法定节假日安排", "year", "年份"),
+}
+
+
+def _make_tool(name: str, description: str, param: str, param_description: str) -> StructuredTool:
+    """生成一个只有一个字符串参数的模拟工具"""
+    args_schema = create_model(f"{name}_args", **{param: (str, Field(description=param_description))})
+
+    def run(**kwargs) -> str:
+        return f"{name} 执行完成：{kwargs}"
+
+    return StructuredTool.from_function(func=run, name=name, description=description, args_schema=args_schema)
+
+
+def build_tool_catalog() -> list[BaseTool]:
+    """生成工具目录：示例中的 search / get_weather / divide 加上约 200 个模拟工具"""
+    tools = [search, get_weather, divide]
+    for system, obj in SYSTEMS.items():
+        for action, (description, param, param_description) in ACTIONS.items():
+            tools.append(_make_tool(f"{system}_{action}", description.format(obj=obj),
+                                    param, param_description.format(obj=obj)))
+    for name, (description, param, param_description) in GENERAL_TOOLS.items():
+        tools.append(_make_tool(name, description, param, param_description))
+    return tools
+
+
+# 回放集：多轮对话，每一轮记录用户问题和期望调用的工具
+# 追问（例如“那上海呢？”）本身不含工具关键词，依赖粘性保留上一轮用过的工具
+REPLAY_SET = [
+    [("北京的天气怎么样？", "get_weather"), ("那上海呢？", "get_weather")],
+    [("计算 10 除以 2", "divide"), ("再算一下 99 除以 3", "divide")],
+    [("搜索客户张三", "crm_search"), ("导出本月的客户报表", "crm_export")],
+    [("统计本月工单的数量", "ticket_count"), ("把工单 T-1024 分配给李四", "ticket_assign")],
+    [("帮我新建一个会议日程：周会", "calendar_create"), ("改到下午三点", "calendar_create")],
+    [("审批报销单 E-2001", "expense_approve"), ("还有 E-2002", "expense_approve")],
+    [("查询员工档案 H-007 的详细信息", "hr_get")],
+    [("按关键词搜索知识库文档：发布流程", "wiki_search")],
+    [("删除发布记录 D-88", "deploy_delete")],
+    [("统计本周的监控告警数量", "alert_count"), ("导出成报表", "alert_export")],
+    [("把这段话翻译成英文：你好世界", "translate_text")],
+    [("100美元换算成人民币是多少", "convert_currency")],
+    [("查询股票 600519 的最新股价", "get_stock_price")],
+    [("查询明天北京到上海的火车票", "query_train")],
+    [("预订杭州的酒店房间", "book_hotel")],
+    [("新建供应商记录：华为", "vendor_create")],
+    [("搜索2024年奥运会在哪里举行", "search")],
+    [("审批合同 C-17", "contract_approve"), ("再审批 C-18", "contract_approve")],
+]
+
+
+def replay(agent, recorder: PromptSizeRecorder) -> dict:
+    """
+    在回放集上运行智能体
+
+    返回值：
+    - dict类型，包含平均每次调用的 token、选择召回率、端到端工具命中率和平均延迟
+    """
+    recorder.calls.clear()
+    turns = selected_hits = called_hits = 0
+    latencies = []
+    for n, conversation in enumerate(REPLAY_SET):
+        config = {"configurable": {"thread_id": f"replay-{n}"}}
+        seen = 0  # 会话中已有的消息数
+        for question, expected in conversation:
+            first_call = len(recorder.calls)
+            start = time.perf_counter()
+            result = agent.invoke({"messages": [{"role": "user", "content": question}]}, config)
+            latencies.append(time.perf_counter() - start)
+            turns += 1
+            selected_hits += expected in recorder.calls[first_call]["tools"]
+            # 本轮模型发出的工具调用
+            called = {c["name"] for m in result["messages"][seen:] if isinstance(m, AIMessage) for c in m.tool_calls}
+            seen = len(result["messages"])
+            called_hits += expected in called
+    return {
+        "tokens": sum(c["tokens"] for c in recorder.calls) / len(recorder.calls),
+        "tool_tokens": sum(c["tool_tokens"] for c in recorder.calls) / len(recorder.calls),
+        "selection_recall": selected_hits / turns,
+        "called_accuracy": called_hits / turns,
+        "latency_ms": sum(latencies) / len(latencies) * 1000,
+    }
+
+
+# 测试工具筛选
+if __name__ == "__main__":
+    tools = build_tool_catalog()
+    print(f"工具总数: {len(tools)}")
+
+    print("\n=== 测试1：单次检索 ===")
+    index = ToolIndex(tools)
+    for question in ["北京的天气怎么样？", "统计本月工单的数量", "100美元换算成人民币是多少"]:
+        print(f"{question} -> {index.top_k(question, 5)}")
+
+    print("\n=== 测试2：回放集对比 ===")
+    print(f"{'方案':<16} {'token/调用':>10} {'工具token':>10} {'选择召回':>8} {'调用命中':>8} {'延迟(ms)':>9}")
+    scenarios = {"全部工具": None, "top-3": (3, True), "top-5": (5, True), "top-10": (10, True), "top-5（无粘性）": (5, False)}
+    for label, options in scenarios.items():
+        recorder = PromptSizeRecorder()
+        middleware = []
+        if options:
+            k, sticky = options
+            middleware = [ToolSelectorMiddleware(tools, top_k=k, sticky=sticky, index=index)]
+        agent = create_agent(
+            model=LocalChatModel(backend=RuleBackend()),  # 离线模型，按工具描述选择工具
+            tools=tools,
+            middleware=middleware + [recorder],
+            checkpointer=InMemorySaver(),  # 保存多轮对话，粘性工具依赖历史消息
+        )
+        stats = replay(agent, recorder)
+        print(f"{label:<16} {stats['tokens']:>10.0f} {stats['tool_tokens']:>10.0f} "
+              f"{stats['selection_recall']:>8.0%} {stats['called_accuracy']:>8.0%} {stats['latency_ms']:>9.1f}")
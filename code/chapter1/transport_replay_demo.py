@@ -0,0 +1,538 @@
+# ChatDeepSeek 传输层录制与回放示例
+# 压测 code/chapter1 中的智能体时不想访问 DeepSeek：本示例在 ChatDeepSeek 使用的 httpx 传输层上增加录制/回放：
+# - RecordingTransport：转发请求并录制响应（包括流式响应的每个分块及其到达时间）
+# - Cassette：紧凑的带索引文件格式（每条记录 zlib 压缩，文件末尾是 请求键 -> 偏移 的索引）
+# - ReplayTransport：按规范化请求查找录制的响应，可以按真实节奏或以最快速度回放
+# 模型、智能体和 openai 客户端的代码都不需要修改，只是换了 http_client，因此测到的就是框架本身的开销
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+from collections import OrderedDict  # 用于实现解码结果的LRU缓存
+from dotenv import load_dotenv  # 用于加载环境变量
+from pathlib import Path  # 用于录制文件路径
+import asyncio  # 用于异步回放
+import hashlib  # 用于生成请求键
+import httpx  # openai 客户端使用的HTTP库
+import json  # 用于规范化请求体
+import mmap  # 用于内存映射录制文件
+import os  # 用于访问环境变量
+import struct  # 用于二进制文件格式
+import tempfile  # 用于创建临时目录
+import threading  # 用于保护录制文件写入
+import time  # 用于计时和模拟延迟
+import uuid  # 用于生成模拟响应的ID
+import zlib  # 用于压缩记录
+
+from local_model_demo import RuleBackend, get_weather, search, text_features  # 规则后端（模拟上游）、示例工具和文本特征
+
+_MAGIC = b"CSST"  # 文件头
+_INDEX_MAGIC = b"CIDX"  # 文件尾：索引起始位置 + 魔数
+_RECORD = struct.Struct("<16sI")  # 请求键(16字节) + 压缩后的记录长度
+_FOOTER = struct.Struct("<Q4s")  # 索引偏移 + 魔数
+
+
+def request_key(request: httpx.Request) -> bytes:
+    """
+    计算规范化请求键：方法 + 路径 + 规范化的JSON请求体（键排序、去掉空白）
+
+    不包含主机名和请求头（例如 API 密钥），因此录制文件可以在不同环境和密钥之间共享
+
+    返回值：
+    - bytes类型，16字节的请求键
+    """
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    except ValueError:
+        pass  # 不是JSON，按原始字节计算
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{request.method} {request.url.path}\n".encode())
+    digest.update(body)
+    return digest.digest()
+
+
+class Cassette:
+    """
+    录制文件
+
+    文件布局：
+    - 文件头 CSST
+    - 记录：请求键(16) + 长度(4) + zlib(状态码, 首字节延迟, 响应头JSON, 分块[(延迟, 数据)...])
+    - 索引：记录数(4) + [请求键(16) + 偏移(8)] * 记录数
+    - 文件尾：索引偏移(8) + CIDX
+    同一个请求可以录制多次（例如多次采样），回放时按顺序轮流返回。
+    没有写入索引（进程异常退出）时，打开文件会顺序扫描记录重建索引
+    """
+
+    def __init__(self, path: Path, cache_size: int = 256):
+        """
+        参数：
+        - path: 录制文件路径
+        - cache_size: 最多缓存多少条解码后的记录，超出时淘汰最久未使用的
+        """
+        self.path = Path(path)
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._index: dict[bytes, list[int]] = {}  # 请求键 -> 记录偏移列表
+        self._decoded: OrderedDict[int, tuple] = OrderedDict()  # 偏移 -> 解码后的记录（LRU）
+        self._cursor: dict[bytes, int] = {}  # 请求键 -> 下一次回放的序号
+        self._unflushed: dict[int, bytes] = {}  # 打开写入后追加的记录（不在内存映射范围内）：偏移 -> 压缩数据
+        self._data = b""
+        self._writer = None
+        if self.path.exists():
+            self._load()
+
+    def _map(self) -> None:
+        """按文件当前大小重新建立内存映射"""
+        self._unmap()
+        with open(self.path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.path) else b""
+
+    def _unmap(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b""
+
+    def _load(self) -> None:
+        self._map()
+        if self._data[:4] != _MAGIC:
+            raise ValueError(f"不是录制文件: {self.path}")
+        end = len(self._data)
+        if end >= 4 + _FOOTER.size and self._data[end - 4:end] == _INDEX_MAGIC:
+            index_offset, _ = _FOOTER.unpack_from(self._data, end - _FOOTER.size)
+            (count,) = struct.unpack_from("<I", self._data, index_offset)
+            for i in range(count):
+                key, offset = struct.unpack_from("<16sQ", self._data, index_offset + 4 + i * 24)
+                self._index.setdefault(key, []).append(offset)
+            self._records_end = index_offset
+        else:
+            offset = 4
+            while offset + _RECORD.size <= end:
+                key, length = _RECORD.unpack_from(self._data, offset)
+                if offset + _RECORD.size + length > end:
+                    break  # 最后一条记录没有写完整
+                self._index.setdefault(key, []).append(offset)
+                offset += _RECORD.size + length
+            self._records_end = offset
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(offsets) for offsets in self._index.values())
+
+    def __contains__(self, key: bytes) -> bool:
+        with self._lock:
+            return key in self._index
+
+    def add(self, key: bytes, status: int, ttfb: float, headers: list[tuple[str, str]], chunks: list[tuple[float, bytes]]) -> None:
+        """
+        追加一条录制记录
+
+        参数：
+        - key: 请求键
+        - status: 状态码
+        - ttfb: 首字节延迟（秒）
+        - headers: 响应头
+        - chunks: [(距上一个分块的间隔秒数, 数据)]
+        """
+        parts = [struct.pack("<HI", status, int(ttfb * 1e6))]
+        header_bytes = json.dumps(headers).encode("utf-8")
+        parts.append(struct.pack("<I", len(header_bytes)) + header_bytes)
+        parts.append(struct.pack("<I", len(chunks)))
+        for delay, data in chunks:
+            parts.append(struct.pack("<II", int(delay * 1e6), len(data)) + data)
+        payload = zlib.compress(b"".join(parts))
+        with self._lock:
+            if self._writer is None:
+                self._open_writer()
+            offset = self._writer.tell()
+            self._writer.write(_RECORD.pack(key, len(payload)) + payload)
+            self._writer.flush()  # 每条记录立即落盘，异常退出时可以通过扫描恢复
+            self._unflushed[offset] = payload  # 超出内存映射的范围，回放时从内存读取
+            self._index.setdefault(key, []).append(offset)
+
+    def _open_writer(self) -> None:
+        """打开写入（需持有锁）"""
+        if self.path.exists():
+            # 去掉旧索引，在最后一条记录后继续追加；
+            # 截断前先解除内存映射，截断后只映射保留下来的记录
+            self._unmap()
+            self._writer = open(self.path, "r+b")
+            self._writer.truncate(self._records_end)
+            self._writer.seek(self._records_end)
+            self._map()
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = open(self.path, "wb")
+            self._writer.write(_MAGIC)
+
+    def close(self) -> None:
+        """写入索引并关闭（只在录制过后需要调用）"""
+        with self._lock:
+            if self._writer is None:
+                return
+            index_offset = self._writer.tell()
+            entries = [(key, offset) for key, offsets in self._index.items() for offset in offsets]
+            self._writer.write(struct.pack("<I", len(entries)))
+            self._writer.write(b"".join(struct.pack("<16sQ", key, offset) for key, offset in entries))
+            self._writer.write(_FOOTER.pack(index_offset, _INDEX_MAGIC))
+            self._writer.close()
+            self._writer = None
+            self._decoded.clear()
+            self._index.clear()
+            self._unflushed.clear()
+            self._load()
+
+    def _decode(self, offset: int) -> tuple:
+        """解码一条记录：(状态码, 首字节延迟, 响应头, 分块列表)（需持有锁）"""
+        compressed = self._unflushed.get(offset)
+        if compressed is None:
+            _, length = _RECORD.unpack_from(self._data, offset)
+            start = offset + _RECORD.size
+            compressed = self._data[start:start + length]
+        payload = zlib.decompress(compressed)
+        status, ttfb_us = struct.unpack_from("<HI", payload, 0)
+        (header_len,) = struct.unpack_from("<I", payload, 6)
+        headers = [tuple(h) for h in json.loads(payload[10:10 + header_len])]
+        pos = 10 + header_len
+        (count,) = struct.unpack_from("<I", payload, pos)
+        pos += 4
+        chunks = []
+        for _ in range(count):
+            delay_us, size = struct.unpack_from("<II", payload, pos)
+            pos += 8
+            chunks.append((delay_us / 1e6, payload[pos:pos + size]))
+            pos += size
+        return status, ttfb_us / 1e6, headers, chunks
+
+    def get(self, key: bytes) -> tuple | None:
+        """取出一条录制记录（同一请求有多条时轮流返回），最近使用的解码结果会被缓存"""
+        with self._lock:
+            # 与写入共用锁：写入会修改索引，打开写入和关闭时会重建索引和内存映射
+            offsets = self._index.get(key)
+            if not offsets:
+                return None
+            n = self._cursor.get(key, 0)
+            self._cursor[key] = n + 1
+            offset = offsets[n % len(offsets)]
+            record = self._decoded.get(offset)
+            if record is not None:
+                self._decoded.move_to_end(offset)  # 最近使用
+                return record
+            record = self._decoded[offset] = self._decode(offset)
+            if len(self._decoded) > self.cache_size:
+                self._decoded.popitem(last=False)  # 淘汰最久未使用的记录
+        return record
+
+
+class _RecordingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """边转发边录制响应分块；响应读完（或关闭）时写入录制文件"""
+
+    def __init__(self, stream, on_done):
+        self._stream = stream
+        self._on_done = on_done
+        self._chunks = []
+        self._last = time.perf_counter()
+
+    def _record(self, chunk: bytes) -> None:
+        now = time.perf_counter()
+        self._chunks.append((now - self._last, chunk))
+        self._last = now
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+
+    def _finish(self) -> None:
+        if self._on_done is not None:
+            self._on_done(self._chunks)
+            self._on_done = None
+
+    def close(self) -> None:
+        self._stream.close()
+        self._finish()
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+        self._finish()
+
+
+class RecordingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    录制传输层：把请求交给 inner 传输层，并把响应写入录制文件
+    """
+
+    def __init__(self, cassette: Cassette, inner: httpx.BaseTransport | httpx.AsyncBaseTransport | None = None):
+        """
+        参数：
+        - cassette: 录制文件
+        - inner: 真正发送请求的传输层，默认为 httpx 的网络传输层（同步/异步分别创建）
+        """
+        self.cassette = cassette
+        self._sync_inner = inner if isinstance(inner, httpx.BaseTransport) else None
+        self._async_inner = inner if isinstance(inner, httpx.AsyncBaseTransport) else None
+
+    def _wrap(self, request: httpx.Request, response: httpx.Response, start: float) -> httpx.Response:
+        key, ttfb = request_key(request), time.perf_counter() - start
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in ("content-length", "content-encoding")]
+
+        def on_done(chunks):
+            self.cassette.add(key, response.status_code, ttfb, headers, chunks)
+
+        # 录制解压后的数据，回放时不需要再处理 content-encoding
+        return httpx.Response(response.status_code, headers=headers, stream=_RecordingStream(response.stream, on_done),
+                              request=request, extensions=response.extensions)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self._sync_inner is None:
+            self._sync_inner = httpx.HTTPTransport()
+        request.read()
+        start = time.perf_counter()
+        return self._wrap(request, self._sync_inner.handle_request(request), start)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self._async_inner is None:
+            self._async_inner = httpx.AsyncHTTPTransport()
+        await request.aread()
+        start = time.perf_counter()
+        return self._wrap(request, await self._async_inner.handle_async_request(request), start)
+
+
+class ReplayMissError(LookupError):
+    """回放时找不到请求对应的录制"""
+
+
+class _ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """按录制的间隔（乘以 1/speed）输出分块；speed 为 None 时不等待"""
+
+    def __init__(self, chunks: list[tuple[float, bytes]], speed: float | None):
+        self._chunks = chunks
+        self._speed = speed
+
+    def __iter__(self):
+        for delay, data in self._chunks:
+            if self._speed and delay:
+                time.sleep(delay / self._speed)
+            yield data
+
+    async def __aiter__(self):
+        for delay, data in self._chunks:
+            if self._speed and delay:
+                await asyncio.sleep(delay / self._speed)
+            yield data
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    回放传输层：按规范化请求返回录制的响应，不访问网络
+    """
+
+    def __init__(self, cassette: Cassette, speed: float | None = None):
+        """
+        参数：
+        - cassette: 录制文件
+        - speed: 回放速度；1.0 为真实节奏，2.0 为两倍速，None 为最快速度（不等待）
+        """
+        self.cassette = cassette
+        self.speed = speed
+
+    def _response(self, request: httpx.Request) -> tuple[httpx.Response, float]:
+        record = self.cassette.get(request_key(request))
+        if record is None:
+            raise ReplayMissError(f"录制文件中没有该请求: {request.method} {request.url.path}")
+        status, ttfb, headers, chunks = record
+        response = httpx.Response(status, headers=headers, stream=_ReplayStream(chunks, self.speed), request=request)
+        return response, (ttfb / self.speed if self.speed else 0.0)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        response, wait = self._response(request)
+        if wait:
+            time.sleep(wait)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        response, wait = self._response(request)
+        if wait:
+            await asyncio.sleep(wait)
+        return response
+
+
+def create_deepseek(cassette: Cassette, mode: str = "replay", speed: float | None = None,
+                    upstream: httpx.BaseTransport | None = None, **kwargs) -> ChatDeepSeek:
+    """
+    创建挂载了录制/回放传输层的 ChatDeepSeek
+
+    参数：
+    - cassette: 录制文件
+    - mode: "record" 录制，"replay" 回放
+    - speed: 回放速度（见 ReplayTransport）
+    - upstream: 录制时使用的上游传输层，默认访问真实的 DeepSeek
+    - kwargs: 传给 ChatDeepSeek 的其他参数（例如 model、api_key）
+
+    返回值：
+    - ChatDeepSeek类型，模型实例
+    """
+    if mode == "record":
+        transport = RecordingTransport(cassette, upstream)
+    else:
+        transport = ReplayTransport(cassette, speed)
+        kwargs.setdefault("api_key", "replay")  # 回放不发送请求，密钥只用于通过参数校验
+    kwargs.setdefault("model", "deepseek-chat")
+    return ChatDeepSeek(
+        http_client=httpx.Client(transport=transport),
+        http_async_client=httpx.AsyncClient(transport=transport),
+        max_retries=0,  # 回放缺失时直接报错，不重试
+        **kwargs,
+    )
+
+
+class FakeDeepSeekUpstream:
+    """
+    模拟的 DeepSeek 接口（OpenAI 兼容格式，支持流式），没有 API 密钥时作为录制的上游
+
+    用 RuleBackend 的规则决定调用哪个工具；每次请求有固定的首字节延迟，流式响应的分块之间也有间隔
+    """
+
+    def __init__(self, ttfb: float = 0.3, chunk_interval: float = 0.02):
+        self.ttfb = ttfb
+        self.chunk_interval = chunk_interval
+        self.rules = RuleBackend()
+
+    def _decide(self, body: dict) -> tuple[str, list[dict]]:
+        """返回 (回答文本, 工具调用列表)"""
+        messages = body["messages"]
+        last = messages[-1]
+        if last["role"] == "tool":
+            return f"根据查询结果：{last['content']}", []
+        question = str(last.get("content", ""))
+        features = text_features(question)
+        best, best_score = None, 0
+        for spec in body.get("tools", []):
+            function = spec["function"]
+            score = len(features & text_features(function["name"] + function.get("description", "")))
+            if score > best_score:
+                best, best_score = function, score
+        if best is None:
+            return f"收到：{question}", []
+        arguments = self.rules._arguments(question, best.get("parameters", {}))
+        return "", [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                     "function": {"name": best["name"], "arguments": json.dumps(arguments, ensure_ascii=False)}}]
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        content, tool_calls = self._decide(body)
+        usage = {"prompt_tokens": len(request.content) // 4, "completion_tokens": len(content) + 10}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body["model"]}
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        time.sleep(self.ttfb)
+
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            payload = {**base, "object": "chat.completion", "usage": usage,
+                       "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}]}
+            return httpx.Response(200, json=payload)
+
+        def events():
+            deltas = [{"role": "assistant", "content": ""}]
+            deltas += [{"content": content[i:i + 4]} for i in range(0, len(content), 4)]
+            deltas += [{"tool_calls": [{"index": i, **call}]} for i, call in enumerate(tool_calls)]
+            for n, delta in enumerate(deltas):
+                last = n == len(deltas) - 1
+                choice = {"index": 0, "delta": delta, "finish_reason": finish_reason if last else None}
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [choice]})}\n\n".encode()
+                time.sleep(self.chunk_interval)
+            if body.get("stream_options", {}).get("include_usage"):
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events())
+
+
+def measure(label: str, func, n: int) -> None:
+    """执行 n 次并打印每秒次数"""
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {n / elapsed:>10.0f} 次/秒 {elapsed / n * 1e6:>10.1f} µs/次")
+
+
+# 测试录制与回放
+if __name__ == "__main__":
+    load_dotenv()
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    cassette_path = Path(tempfile.mkdtemp(prefix="replay_demo_")) / "deepseek.cassette"
+    questions = ["北京的天气怎么样？", "搜索2024年奥运会在哪里举行", "你好"]
+
+    print("=== 步骤1：录制 ===")
+    cassette = Cassette(cassette_path)
+    if api_key:
+        model = create_deepseek(cassette, mode="record", api_key=api_key)
+        print("上游: DeepSeek API")
+    else:
+        model = create_deepseek(cassette, mode="record", api_key="offline", upstream=httpx.MockTransport(FakeDeepSeekUpstream()))
+        print("上游: 模拟的 DeepSeek 接口（未设置 DEEPSEEK_API_KEY）")
+    agent = create_agent(model, tools=[search, get_weather])
+    start = time.perf_counter()
+    for question in questions:
+        agent.invoke({"messages": [{"role": "user", "content": question}]})  # 非流式请求
+        for _ in agent.stream({"messages": [{"role": "user", "content": question}]}, stream_mode="messages"):
+            pass  # 流式请求（按分块录制）
+    record_elapsed = time.perf_counter() - start
+    cassette.close()
+    print(f"录制 {len(cassette)} 个响应，耗时 {record_elapsed:.2f}s，文件大小 {cassette_path.stat().st_size} 字节")
+
+    print("\n=== 步骤2：按真实节奏回放 ===")
+    cassette = Cassette(cassette_path)
+    agent = create_agent(create_deepseek(cassette, speed=1.0), tools=[search, get_weather])
+    start = time.perf_counter()
+    for question in questions:
+        agent.invoke({"messages": [{"role": "user", "content": question}]})
+        for _ in agent.stream({"messages": [{"role": "user", "content": question}]}, stream_mode="messages"):
+            pass
+    print(f"回放耗时 {time.perf_counter() - start:.2f}s（录制时 {record_elapsed:.2f}s）")
+
+    print("\n=== 步骤3：最快速度回放 ===")
+    transport = ReplayTransport(cassette)
+    model = create_deepseek(cassette)
+    agent = create_agent(model, tools=[search, get_weather])
+    result = agent.invoke({"messages": [{"role": "user", "content": questions[0]}]})
+    print("回放结果:", result["messages"][-1].content)
+    streamed = [m.content for m, _ in agent.stream({"messages": [{"role": "user", "content": questions[0]}]}, stream_mode="messages")]
+    print(f"流式回放: {len(streamed)} 个分块")
+
+    # 取出智能体第一次模型调用的请求，用于测量各层的开销
+    first_request = {}
+
+    def capture(request: httpx.Request) -> httpx.Response:
+        first_request.setdefault("request", request)
+        return transport.handle_request(request)
+
+    capture_model = ChatDeepSeek(model="deepseek-chat", api_key="replay", http_client=httpx.Client(transport=httpx.MockTransport(capture)))
+    create_agent(capture_model, tools=[search, get_weather]).invoke({"messages": [{"role": "user", "content": questions[0]}]})
+    request = first_request["request"]
+    client = httpx.Client(transport=transport)
+    bound = model.bind_tools([search, get_weather])
+    print(f"\n{'层级':<36} {'吞吐量':>14} {'单次耗时':>14}")
+    measure("传输层（查找录制 + 构造响应）", lambda: transport.handle_request(request).read(), 20000)
+    measure("httpx 客户端", lambda: client.send(request).read(), 5000)
+    measure("ChatDeepSeek.invoke（含 openai 客户端）", lambda: bound.invoke(questions[0]), 500)
+    measure("智能体完整运行（2次模型调用 + 1次工具）", lambda: agent.invoke({"messages": [{"role": "user", "content": questions[0]}]}), 200)
+
+    async def concurrent_runs(n: int) -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*[agent.ainvoke({"messages": [{"role": "user", "content": questions[0]}]}) for _ in range(n)])
+        return n / (time.perf_counter() - start)
+
+    print(f"智能体 ainvoke 并发 500 次: {asyncio.run(concurrent_runs(500)):.0f} 次/秒")
@@ -0,0 +1,318 @@
+# 常驻会话池示例
+# system_prompt_demo.py 这样的智能体用于交互式聊天时，如果每一轮都重新准备：
+# 读取历史、拼系统提示、序列化工具 schema、新建 HTTP 连接（TLS 握手），这些开销都会算进每一轮的延迟。
+# 本示例实现一个会话池：
+# - 热会话：对话历史和预先拼好的系统提示前缀常驻内存，智能体、模型和 HTTP 连接池在所有会话间共享
+# - SchemaCachingDeepSeek：相同工具的 bind_tools 结果（已序列化的工具 schema）只计算一次
+# - 空闲或超出容量的会话写入检查点存储（state_serializer_demo.py 的二进制格式），再次访问时快速恢复（温会话）
+# - 从未见过的会话需要查询用户资料、拼系统提示（冷会话）
+# 最后比较每轮重建、冷、温、热四种情况的单轮延迟
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage  # 消息类型
+from langchain_core.messages import messages_from_dict, messages_to_dict  # 通用 JSON 序列化（对照组）
+from langchain_deepseek import ChatDeepSeek  # DeepSeek模型集成
+from pydantic import PrivateAttr  # 用于模型上的缓存字段
+from collections import OrderedDict  # 用于按最近使用顺序保存热会话
+from pathlib import Path  # 用于检查点目录
+from local_model_demo import get_weather, search  # 示例工具
+from state_serializer_demo import decode, encode  # 状态序列化
+from transport_replay_demo import FakeDeepSeekUpstream  # 模拟的 DeepSeek 接口
+import hashlib  # 用于由会话ID生成文件名
+import httpx  # 用于共享连接池
+import json  # 用于对照组读写历史
+import os  # 用于原子替换检查点文件
+import statistics  # 用于统计
+import tempfile  # 用于临时检查点目录
+import threading  # 用于会话锁
+import time  # 用于计时
+
+
+class SchemaCachingDeepSeek(ChatDeepSeek):
+    """
+    缓存 bind_tools 结果的 ChatDeepSeek
+
+    create_agent 在每次模型调用前都会 bind_tools，把每个工具重新转换为 JSON schema；
+    工具和参数相同时直接返回之前绑定好的模型
+    """
+
+    _bound: dict = PrivateAttr(default_factory=dict)
+
+    def bind_tools(self, tools, **kwargs):
+        key = (tuple(id(t) for t in tools), repr(sorted(kwargs.items())))
+        entry = self._bound.get(key)
+        if entry is None:
+            # 同时保存工具列表，保证工具对象存活、id 不会被复用
+            entry = self._bound[key] = (list(tools), super().bind_tools(tools, **kwargs))
+        return entry[1]
+
+
+class HandshakeTransport(httpx.BaseTransport):
+    """模拟新连接的建立开销：每个传输对象的第一个请求额外等待 handshake 秒（TCP + TLS 握手）"""
+
+    def __init__(self, inner: httpx.BaseTransport, handshake: float = 0.08):
+        self.inner = inner
+        self.handshake = handshake
+        self._connected = False
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not self._connected:
+            time.sleep(self.handshake)
+            self._connected = True
+        return self.inner.handle_request(request)
+
+
+class ProfileStore:
+    """模拟的用户资料服务，每次查询有固定延迟"""
+
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+
+    def get(self, user_id: str) -> dict:
+        time.sleep(self.latency)
+        return {"name": f"用户{user_id}", "style": "简洁", "language": "中文"}
+
+
+def build_system_prompt(profile: dict) -> str:
+    """根据用户资料拼系统提示（与 system_prompt_demo.py 的系统提示相同，再加上用户信息）"""
+    return (f"你是一个有帮助的助手。请简洁准确地回答问题，不要添加多余的信息。\n"
+            f"当前用户：{profile['name']}，偏好{profile['style']}的回答，使用{profile['language']}。")
+
+
+class CheckpointStore:
+    """检查点存储：每个会话一个文件"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, session_id: str) -> Path:
+        """会话ID可能来自外部请求（例如含有 ../ 或 /），文件名取它的哈希，保证留在存储目录内"""
+        return self.path / f"{hashlib.sha256(session_id.encode('utf-8')).hexdigest()}.bin"
+
+    def save(self, session_id: str, data: bytes) -> None:
+        """先写临时文件再原子替换，读者要么看到旧检查点，要么看到完整的新检查点"""
+        file = self._file(session_id)
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=f"{file.stem}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, file)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def load(self, session_id: str) -> bytes | None:
+        file = self._file(session_id)
+        return file.read_bytes() if file.exists() else None
+
+
+class Session:
+    """一个对话：系统提示前缀 + 对话历史"""
+
+    __slots__ = ("session_id", "prefix", "history", "last_used", "lock", "evicted")
+
+    def __init__(self, session_id: str, prefix: list[BaseMessage], history: list[BaseMessage]):
+        self.session_id = session_id
+        self.prefix = prefix  # 预先拼好的系统提示，每一轮都原样放在最前面
+        self.history = history
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()  # 同一会话的多轮按顺序执行
+        self.evicted = False  # 已写入存储并移出内存，持有旧引用的调用方需要重新取出
+
+
+class SessionPool:
+    """
+    会话池：热会话常驻内存，超出容量或空闲过久的会话写入检查点存储
+    """
+
+    def __init__(self, model: ChatDeepSeek, tools: list, profiles: ProfileStore, store: CheckpointStore,
+                 max_hot: int = 100, idle_seconds: float = 600):
+        """
+        参数：
+        - model: 所有会话共享的模型（建议为 SchemaCachingDeepSeek，并使用共享的 HTTP 客户端）
+        - tools: 工具列表
+        - profiles: 用户资料服务，冷会话用它拼系统提示
+        - store: 检查点存储
+        - max_hot: 内存中最多保留的会话数
+        - idle_seconds: 空闲超过该时间的会话在下一次清理时写入存储
+        """
+        # 系统提示按会话放在消息最前面，所以智能体本身不设置 system_prompt，只需创建一次
+        self.agent = create_agent(model, tools=tools)
+        self.profiles = profiles
+        self.store = store
+        self.max_hot = max_hot
+        self.idle_seconds = idle_seconds
+        self._hot: OrderedDict[str, Session] = OrderedDict()
+        self._evicting: dict[str, threading.Event] = {}  # 正在写入存储的会话，写完前不能从存储恢复
+        self._lock = threading.Lock()
+
+    def _checkout(self, session_id: str) -> tuple[Session, str]:
+        """取出会话，返回 (会话, "hot" / "warm" / "cold")"""
+        while True:
+            with self._lock:
+                session = self._hot.get(session_id)
+                if session is not None:
+                    self._hot.move_to_end(session_id)
+                    return session, "hot"
+                pending = self._evicting.get(session_id)
+            if pending is None:
+                break
+            pending.wait()  # 等检查点写完，否则会读到旧的历史
+        data = self.store.load(session_id)
+        if data is not None:
+            messages = decode(data)["messages"]
+            session, tier = Session(session_id, messages[:1], messages[1:]), "warm"
+        else:
+            prompt = build_system_prompt(self.profiles.get(session_id))
+            session, tier = Session(session_id, [SystemMessage(content=prompt)], []), "cold"
+        with self._lock:
+            # 并发恢复同一个会话时，以先放入的为准
+            session = self._hot.setdefault(session_id, session)
+        return session, tier
+
+    def _evict(self, session_id: str) -> None:
+        with self._lock:
+            session = self._hot.pop(session_id, None)
+            if session is None:
+                return
+            done = self._evicting[session_id] = threading.Event()
+        try:
+            with session.lock:
+                self.store.save(session_id, encode({"messages": session.prefix + session.history}))
+                session.evicted = True
+        finally:
+            with self._lock:
+                del self._evicting[session_id]
+            done.set()
+
+    def evict_idle(self) -> int:
+        """把超出容量和空闲过久的会话写入存储，返回写出的会话数"""
+        deadline = time.monotonic() - self.idle_seconds
+        with self._lock:
+            overflow = max(0, len(self._hot) - self.max_hot)
+            victims = [sid for i, (sid, s) in enumerate(self._hot.items()) if i < overflow or s.last_used < deadline]
+        for session_id in victims:
+            self._evict(session_id)
+        return len(victims)
+
+    def turn(self, session_id: str, text: str) -> tuple[AIMessage, str]:
+        """
+        执行一轮对话
+
+        返回值：
+        - (智能体的回复, 会话在本轮开始时的状态 "hot" / "warm" / "cold")
+        """
+        while True:
+            session, tier = self._checkout(session_id)
+            with session.lock:
+                if session.evicted:
+                    continue  # 取出后、加锁前会话被写出，从存储重新取出
+                result = self.agent.invoke({"messages": [*session.prefix, *session.history, HumanMessage(content=text)]})
+                session.history = result["messages"][len(session.prefix):]
+                session.last_used = time.monotonic()
+                break
+        self.evict_idle()
+        return result["messages"][-1], tier
+
+    def close(self) -> None:
+        """把所有热会话写入存储"""
+        for session_id in list(self._hot):
+            self._evict(session_id)
+
+
+def create_model(upstream, handshake: float) -> SchemaCachingDeepSeek:
+    """创建一个带新连接池的模型（第一个请求需要“握手”）"""
+    client = httpx.Client(transport=HandshakeTransport(httpx.MockTransport(upstream), handshake))
+    return SchemaCachingDeepSeek(model="deepseek-chat", api_key="mock", max_retries=0, http_client=client)
+
+
+def rebuild_turn(session_id: str, text: str, upstream, handshake: float, profiles: ProfileStore, path: Path) -> AIMessage:
+    """
+    对照组：每一轮都从头准备（新连接、拼系统提示、创建智能体、用通用 JSON 读写历史）
+    """
+    file = path / f"{hashlib.sha256(session_id.encode('utf-8')).hexdigest()}.json"  # 同 CheckpointStore._file
+    history = messages_from_dict(json.loads(file.read_bytes())) if file.exists() else []
+    model = ChatDeepSeek(model="deepseek-chat", api_key="mock", max_retries=0,
+                         http_client=httpx.Client(transport=HandshakeTransport(httpx.MockTransport(upstream), handshake)))
+    agent = create_agent(model, tools=[search, get_weather], system_prompt=build_system_prompt(profiles.get(session_id)))
+    result = agent.invoke({"messages": [*history, HumanMessage(content=text)]})
+    file.write_text(json.dumps(messages_to_dict(result["messages"]), ensure_ascii=False), encoding="utf-8")
+    return result["messages"][-1]
+
+
+def summarize(latencies: dict[str, list[float]]) -> None:
+    print(f"  {'会话状态':<12} {'轮数':>6} {'p50(ms)':>9} {'p95(ms)':>9} {'平均(ms)':>9}")
+    for tier, values in latencies.items():
+        values = sorted(values)
+        print(f"  {tier:<12} {len(values):>6} {values[len(values) // 2]:>9.1f} "
+              f"{values[min(len(values) - 1, int(len(values) * 0.95))]:>9.1f} {statistics.mean(values):>9.1f}")
+
+
+# 比较各种会话状态下的单轮延迟
+if __name__ == "__main__":
+    upstream = FakeDeepSeekUpstream(ttfb=0.02, chunk_interval=0)
+    handshake = 0.08
+    profiles = ProfileStore()
+    # 每轮只有一次模型调用（不触发工具），各种会话状态之间只差准备工作的开销
+    questions = ["你好", "谢谢", "再见", "你好"]
+    work_dir = Path(tempfile.mkdtemp(prefix="session_demo_"))
+
+    print(f"=== 测试1：每轮重建（模拟接口首字节 {upstream.ttfb * 1000:.0f}ms，新连接握手 {handshake * 1000:.0f}ms）===")
+    latencies = {"每轮重建": []}
+    for turn in range(4):
+        for user in range(10):
+            start = time.perf_counter()
+            rebuild_turn(f"u{user}", questions[turn], upstream, handshake, profiles, work_dir)
+            latencies["每轮重建"].append((time.perf_counter() - start) * 1000)
+    summarize(latencies)
+
+    print("\n=== 测试2：会话池（最多 5 个热会话）===")
+    pool = SessionPool(create_model(upstream, handshake), [search, get_weather], profiles,
+                       CheckpointStore(work_dir / "checkpoints"), max_hot=5)
+    pool.turn("warmup", "你好")  # 建立共享连接
+    latencies = {"cold": [], "warm": [], "hot": []}
+
+    def timed_turn(user: str, text: str) -> None:
+        start = time.perf_counter()
+        _, tier = pool.turn(user, text)
+        latencies[tier].append((time.perf_counter() - start) * 1000)
+
+    # 30 个用户轮流说话：第一轮是冷会话，之后每轮都已被挤出内存（温会话）
+    for turn in range(4):
+        for user in range(30):
+            timed_turn(f"s{user}", questions[turn])
+    # 5 个用户各自连续对话：除第一轮外都是热会话
+    for user in range(5):
+        for turn in range(4):
+            timed_turn(f"s{user}", questions[turn])
+    summarize(latencies)
+    pool.close()
+
+    print("\n=== 测试3：扣除模拟接口等待后的本地开销 ===")
+    # "你好" 不触发工具调用，每轮只有一次模型调用
+    for label, make_turn in {
+        "每轮重建": lambda i: rebuild_turn(f"x{i}", "你好", upstream, 0, profiles, work_dir),
+        "会话池（热）": lambda i: pool.turn(f"h{i % 5}", "你好"),
+    }.items():
+        start = time.perf_counter()
+        for i in range(50):
+            make_turn(i)
+        local = (time.perf_counter() - start) / 50 - upstream.ttfb
+        print(f"  {label:<12} 每轮本地开销 {local * 1000:.2f}ms")
+
+    print("\n=== 测试4：准备工作的单项开销 ===")
+    cached = create_model(upstream, 0)
+    plain = ChatDeepSeek(model="deepseek-chat", api_key="mock")
+    history = pool.store.load("s0")
+    for label, func in {
+        "bind_tools（每次重新生成 schema）": lambda: plain.bind_tools([search, get_weather], tool_choice=None),
+        "bind_tools（SchemaCachingDeepSeek）": lambda: cached.bind_tools([search, get_weather], tool_choice=None),
+        f"从检查点恢复会话（{len(history)} 字节）": lambda: decode(history),
+        "创建智能体（create_agent）": lambda: create_agent(cached, tools=[search, get_weather]),
+    }.items():
+        start = time.perf_counter()
+        for _ in range(100):
+            func()
+        print(f"  {label:<36} {(time.perf_counter() - start) / 100 * 1000:>8.3f}ms")
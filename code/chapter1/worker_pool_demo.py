@@ -0,0 +1,426 @@
+# 多进程工作池示例
+# 在一个进程里并发运行很多智能体时，结构化输出校验、工具执行、消息处理都是CPU计算，会被GIL串行化。
+# 本示例实现一个多进程工作池，把智能体调用分发到N个工作进程：
+# - 每个工作进程在启动（fork 或 spawn）之后只创建一次已注册的智能体
+# - 输入通过进程队列发送；结果用 state_serializer_demo 的二进制格式编码，较大的结果放在共享内存中，队列里只传名称
+# - 按 thread_id 粘性路由：同一会话总是由同一个工作进程处理，该进程内的检查点（InMemorySaver）保持可用
+# - 监督与重启：工作进程意外退出时自动重启，并重新提交它未完成的任务
+# 最后用本地规则模型（local_model_demo.py）测试 1~16 个进程的扩展性
+
+# 导入必要的库
+from langchain.agents import create_agent  # 用于创建智能体
+from langchain.agents.structured_output import ToolStrategy  # 用于结构化输出
+from langchain.tools import tool  # 用于定义工具
+from langgraph.checkpoint.memory import InMemorySaver  # 工作进程内的检查点
+from concurrent.futures import Future  # 用于返回任务结果
+from multiprocessing import shared_memory  # 用于传递较大的结果
+from typing import Any, Callable  # 用于类型提示
+from local_model_demo import create_local_model, divide, get_weather, search  # 本地规则模型和工具
+from contact_schema import ContactInfo  # 联系信息模型（与 structured_output_tool.py 相同）
+from state_serializer_demo import decode, encode  # 状态序列化
+import argparse  # 用于命令行参数
+import itertools  # 用于生成任务ID
+import multiprocessing  # 用于创建工作进程
+import os  # 用于获取进程ID和CPU数量
+import pickle  # 用于检查异常能否跨进程传递
+import queue  # 用于队列超时异常
+import sys  # 用于输出收集线程的错误
+import threading  # 用于结果收集线程
+import time  # 用于计时
+import zlib  # 用于稳定的哈希
+
+_READY = "ready"  # 工作进程启动完成的消息
+_FAILED = "failed"  # 工作进程创建智能体失败的消息
+
+
+class WorkerCrashedError(RuntimeError):
+    """工作进程在执行任务时退出，且重试次数已用完"""
+
+
+class WorkerStartupError(RuntimeError):
+    """工作进程创建智能体失败（重启也无法恢复），原始异常保存在 __cause__ 中"""
+
+
+def _pack(data: bytes, threshold: int):
+    """较小的结果直接放进队列；较大的结果写入共享内存，只传 (名称, 长度)"""
+    if len(data) < threshold:
+        return data
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    block.buf[:len(data)] = data
+    name = block.name
+    block.close()
+    return (name, len(data))
+
+
+def _unpack(payload) -> dict:
+    """还原结果状态；共享内存中的结果直接从共享内存解码，然后释放"""
+    if isinstance(payload, bytes):
+        return decode(payload)
+    name, size = payload
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        with block.buf[:size] as view:
+            return decode(view)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _picklable(e: Exception) -> Exception:
+    """
+    异常要通过队列传回主进程：不能 pickle 或 pickle 后无法还原的异常换成 RuntimeError
+    （例如 __init__(self, message, status) 只把 message 传给父类的异常，还原时会缺少参数）
+    """
+    try:
+        pickle.loads(pickle.dumps(e))
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+    return e
+
+
+def _settle(future: Future, result: Any = None, error: BaseException | None = None) -> None:
+    """设置任务结果；调用方已取消 Future 时忽略（否则会抛出 InvalidStateError）"""
+    if not future.set_running_or_notify_cancel():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _worker_main(slot: int, factories: dict, inbox, outbox, shm_threshold: int) -> None:
+    """工作进程：创建一次智能体，然后循环处理任务，直到收到 None"""
+    try:
+        agents = {name: factory() for name, factory in factories.items()}
+    except Exception as e:
+        # 把异常交给主进程，由主进程决定失败，而不是退出后被不断重启
+        outbox.put((_FAILED, slot, _picklable(e)))
+        return
+    outbox.put((_READY, slot, os.getpid()))
+    while True:
+        task = inbox.get()
+        if task is None:
+            break
+        task_id, name, inputs, config = task
+        try:
+            result = agents[name].invoke(inputs, config)
+            outbox.put((task_id, True, _pack(encode(result), shm_threshold)))
+        except Exception as e:
+            outbox.put((task_id, False, _picklable(e)))
+
+
+class WorkerPool:
+    """
+    多进程智能体工作池
+
+    用法：
+        with WorkerPool({"tools": build_tools_agent}, processes=4) as pool:
+            future = pool.submit("tools", {"messages": [...]}, {"configurable": {"thread_id": "t1"}})
+            result = future.result()
+    """
+
+    def __init__(self, factories: dict[str, Callable[[], Any]], processes: int | None = None,
+                 start_method: str = "spawn", max_retries: int = 1, shm_threshold: int = 64 * 1024,
+                 startup_timeout: float = 120):
+        """
+        参数：
+        - factories: 智能体名称 -> 创建函数（必须是模块级函数，以便传给 spawn 启动的进程）
+        - processes: 工作进程数，默认为 CPU 数量
+        - start_method: "spawn"、"forkserver" 或 "fork"
+        - max_retries: 工作进程退出时，一个任务最多重新提交的次数
+        - shm_threshold: 编码后达到该字节数的结果通过共享内存传递
+        - startup_timeout: 等待所有工作进程启动完成的秒数
+
+        异常：
+        - WorkerStartupError: 工作进程中的 factory 抛出异常
+        - TimeoutError: 工作进程没有在 startup_timeout 内启动完成
+        """
+        self.factories = factories
+        self.processes = processes or os.cpu_count() or 1
+        self.max_retries = max_retries
+        self.shm_threshold = shm_threshold
+        self._ctx = multiprocessing.get_context(start_method)
+        self._outbox = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._workers: list = [None] * self.processes
+        self._inboxes: list = [None] * self.processes
+        self._pending: list[dict] = [{} for _ in range(self.processes)]  # 每个工作进程未完成的任务
+        self._ready = threading.Semaphore(0)
+        self._closing = False
+        self._startup_error: Exception | None = None  # 工作进程创建智能体时的异常，出现后不再重启
+        self.restarts = 0
+        self.completed = [0] * self.processes
+
+        for slot in range(self.processes):
+            self._start_worker(slot)
+        self._collector = threading.Thread(target=self._collect, name="worker-pool-collector", daemon=True)
+        self._collector.start()
+        for _ in range(self.processes):
+            if not self._ready.acquire(timeout=startup_timeout):
+                self.close()
+                raise TimeoutError("工作进程启动超时")
+            if self._startup_error is not None:
+                self.close()
+                raise WorkerStartupError("工作进程创建智能体失败") from self._startup_error
+
+    def _start_worker(self, slot: int) -> None:
+        # 每次（重新）启动都使用新的输入队列：进程在读取队列时被杀死可能留下未释放的锁
+        inbox = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main, args=(slot, self.factories, inbox, self._outbox, self.shm_threshold),
+            name=f"agent-worker-{slot}", daemon=True,
+        )
+        process.start()
+        self._workers[slot], self._inboxes[slot] = process, inbox
+
+    def _route(self, config: dict | None) -> int:
+        """有 thread_id 时按哈希固定到一个工作进程，否则选择未完成任务最少的工作进程"""
+        thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+        if thread_id is not None:
+            return zlib.crc32(str(thread_id).encode("utf-8")) % self.processes
+        return min(range(self.processes), key=lambda slot: len(self._pending[slot]))
+
+    def submit(self, agent: str, inputs: dict, config: dict | None = None) -> Future:
+        """
+        提交一次智能体调用
+
+        参数：
+        - agent: 智能体名称（factories 中的键）
+        - inputs: 传给 agent.invoke 的输入
+        - config: 传给 agent.invoke 的配置，其中的 thread_id 用于粘性路由
+
+        返回值：
+        - Future，结果为 agent.invoke 的返回值
+        """
+        if agent not in self.factories:
+            raise KeyError(f"未注册的智能体: {agent}")
+        future = Future()
+        task = (next(self._ids), agent, inputs, config)
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("工作池已关闭")
+            if self._startup_error is not None:
+                raise WorkerStartupError("工作进程创建智能体失败") from self._startup_error
+            slot = self._route(config)
+            self._pending[slot][task[0]] = [future, task, 0]
+            self._inboxes[slot].put(task)
+        return future
+
+    def invoke(self, agent: str, inputs: dict, config: dict | None = None) -> dict:
+        """提交一次调用并等待结果"""
+        return self.submit(agent, inputs, config).result()
+
+    def map(self, agent: str, inputs: list[dict], configs: list[dict | None] | None = None) -> list[dict]:
+        """批量提交调用，按输入顺序返回结果"""
+        configs = configs or [None] * len(inputs)
+        futures = [self.submit(agent, item, config) for item, config in zip(inputs, configs)]
+        return [future.result() for future in futures]
+
+    def _collect(self) -> None:
+        """结果收集线程：分发结果，并检查工作进程是否存活"""
+        while True:
+            try:
+                message = self._outbox.get(timeout=0.1)
+                if message is not None:
+                    self._handle(message)
+            except queue.Empty:
+                pass
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                # 收集线程退出后所有任务都会卡住：单条消息出错（例如无法还原）只丢弃这一条
+                print(f"工作池收集线程丢弃一条消息: {type(e).__name__}: {e}", file=sys.stderr)
+            with self._lock:
+                for slot, process in enumerate(self._workers):
+                    if self._startup_error is not None:
+                        break
+                    if not process.is_alive() and (self._pending[slot] or not self._closing):
+                        self._restart(slot)
+                if self._closing and not any(self._pending):
+                    return
+
+    def _handle(self, message: tuple) -> None:
+        task_id, ok, payload = message
+        if task_id == _READY:
+            self._ready.release()
+            return
+        if task_id == _FAILED:
+            # 重启后 factory 仍会失败：停止重启，让未完成和之后提交的任务立即失败
+            error = WorkerStartupError("工作进程创建智能体失败")
+            error.__cause__ = payload
+            with self._lock:
+                self._startup_error = payload
+                for pending in self._pending:
+                    for future, _, _ in pending.values():
+                        _settle(future, error=error)
+                    pending.clear()
+            self._ready.release()
+            return
+        with self._lock:
+            for slot, pending in enumerate(self._pending):
+                if task_id in pending:
+                    future = pending.pop(task_id)[0]
+                    self.completed[slot] += 1
+                    break
+            else:
+                future = None  # 任务已被重新提交并由另一次执行完成
+        if not ok:
+            if future is not None:
+                _settle(future, error=payload)
+            return
+        try:
+            result = _unpack(payload)
+        except Exception as e:
+            if future is not None:
+                _settle(future, error=e)
+            return
+        if future is not None:
+            _settle(future, result)
+
+    def _restart(self, slot: int) -> None:
+        """重启退出的工作进程，重新提交它未完成的任务（需持有锁）"""
+        exitcode = self._workers[slot].exitcode
+        self.restarts += 1
+        self._start_worker(slot)
+        for task_id, entry in list(self._pending[slot].items()):
+            future, task, attempts = entry
+            if attempts >= self.max_retries:
+                del self._pending[slot][task_id]
+                _settle(future, error=WorkerCrashedError(f"工作进程 {slot} 退出（exitcode={exitcode}）"))
+            else:
+                entry[2] += 1
+                self._inboxes[slot].put(task)
+        if self._closing:
+            self._inboxes[slot].put(None)
+
+    def stats(self) -> dict:
+        """工作池状态：每个工作进程的 pid、完成数、未完成数，以及重启次数"""
+        with self._lock:
+            return {
+                "workers": [
+                    {"pid": p.pid, "alive": p.is_alive(), "completed": c, "pending": len(pending)}
+                    for p, c, pending in zip(self._workers, self.completed, self._pending)
+                ],
+                "restarts": self.restarts,
+            }
+
+    def close(self, timeout: float = 10) -> None:
+        """等待未完成的任务，然后停止所有工作进程"""
+        with self._lock:
+            self._closing = True
+            for inbox in self._inboxes:
+                inbox.put(None)
+        if self._collector.is_alive():
+            self._collector.join(timeout)
+        for process in self._workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# 注册的智能体（模块级函数，工作进程中各调用一次）
+def build_tools_agent():
+    return create_agent(model=create_local_model(), tools=[search, get_weather, divide], checkpointer=InMemorySaver())
+
+
+def build_contact_agent():
+    return create_agent(model=create_local_model(), tools=[search], response_format=ToolStrategy(ContactInfo))
+
+
+@tool
+def crash(reason: str) -> str:
+    """
+    模拟工作进程崩溃（用于测试监督与重启）
+
+    参数：
+    - reason: str类型，崩溃原因
+
+    返回值：
+    - str类型，不会返回
+    """
+    os._exit(1)
+
+
+def build_crash_agent():
+    return create_agent(model=create_local_model(), tools=[crash])
+
+
+FACTORIES = {"tools": build_tools_agent, "contact": build_contact_agent, "crash": build_crash_agent}
+
+
+def workload(i: int) -> tuple[str, dict, dict | None]:
+    """第 i 个基准测试任务：一半天气/计算问题（带 thread_id），一半联系信息提取"""
+    if i % 2:
+        question = f"提取联系信息：用户{i}, user{i}@example.com, (555) 123-{i % 10000:04d}"
+        return "contact", {"messages": [{"role": "user", "content": question}]}, None
+    question = f"第{i}个城市的天气怎么样？" if i % 4 else f"计算 {i + 10} 除以 2"
+    return "tools", {"messages": [{"role": "user", "content": question}]}, {"configurable": {"thread_id": f"bench-{i}"}}
+
+
+def run_inline(tasks: int) -> float:
+    """不使用工作池，在当前进程中串行运行，返回每秒完成的任务数"""
+    agents = {name: factory() for name, factory in FACTORIES.items()}
+    start = time.perf_counter()
+    for i in range(tasks):
+        name, inputs, config = workload(i)
+        encode(agents[name].invoke(inputs, config))
+    return tasks / (time.perf_counter() - start)
+
+
+def run_pool(processes: int, tasks: int, start_method: str) -> float:
+    """使用工作池运行，返回每秒完成的任务数（不含进程启动时间）"""
+    with WorkerPool(FACTORIES, processes=processes, start_method=start_method) as pool:
+        for i in range(processes * 4):  # 预热
+            pool.submit(*workload(i)).result()
+        start = time.perf_counter()
+        futures = [pool.submit(*workload(i)) for i in range(tasks)]
+        for future in futures:
+            future.result()
+        return tasks / (time.perf_counter() - start)
+
+
+# 测试工作池
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多进程智能体工作池")
+    parser.add_argument("--processes", default="1,2,4,8,16", help="扩展性测试的进程数列表")
+    parser.add_argument("--tasks", type=int, default=800, help="每组测试的任务数")
+    parser.add_argument("--start-method", default="spawn", choices=["spawn", "forkserver", "fork"])
+    args = parser.parse_args()
+
+    with WorkerPool(FACTORIES, processes=2, start_method=args.start_method) as pool:
+        print("=== 测试1：粘性路由（同一 thread_id 的多轮对话）===")
+        config = {"configurable": {"thread_id": "user-42"}}
+        for question in ["北京的天气怎么样？", "计算 10 除以 2"]:
+            result = pool.invoke("tools", {"messages": [{"role": "user", "content": question}]}, config)
+            print(f"用户：{question} -> 智能体：{result['messages'][-1].content}（会话共 {len(result['messages'])} 条消息）")
+
+        print("\n=== 测试2：结构化输出 ===")
+        result = pool.invoke("contact", {"messages": [{"role": "user", "content": "提取联系信息：John Doe, john@example.com, (555) 123-4567"}]})
+        print(result["structured_response"])
+
+        print("\n=== 测试3：工作进程崩溃与重启 ===")
+        pool.max_retries = 0
+        crashed = pool.submit("crash", {"messages": [{"role": "user", "content": "崩溃"}]})
+        try:
+            crashed.result(timeout=60)
+        except WorkerCrashedError as e:
+            print(f"任务失败: {e}")
+        result = pool.invoke("tools", {"messages": [{"role": "user", "content": "上海的天气怎么样？"}]},
+                             {"configurable": {"thread_id": "user-7"}})
+        print(f"重启后继续处理: {result['messages'][-1].content}")
+        print(f"工作池状态: {pool.stats()}")
+
+    print(f"\n=== 测试4：扩展性（CPU 数量: {os.cpu_count()}）===")
+    baseline = run_inline(args.tasks // 4)
+    print(f"{'进程数':<8} {'吞吐量(次/秒)':>14} {'加速比':>8} {'效率':>8}")
+    print(f"{'单进程':<8} {baseline:>14.1f} {1.0:>8.2f} {'-':>8}")
+    for n in [int(x) for x in args.processes.split(",")]:
+        throughput = run_pool(n, args.tasks, args.start_method)
+        print(f"{n:<8} {throughput:>14.1f} {throughput / baseline:>8.2f} {throughput / baseline / min(n, os.cpu_count() or 1):>8.0%}")